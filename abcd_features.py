@@ -0,0 +1,201 @@
+"""ABCD dermoscopy proxies (asymmetry, border, colour, diameter) from a lesion mask.
+
+Everything is computed with whole-array operations over a batch of padded
+thumbnails, so scoring N lesions costs a handful of numpy calls rather than
+N Python loops. Values are proxies on segmentation thumbnails, not calibrated
+clinical measurements: there is no physical scale, so the diameter is relative
+to the frame.
+"""
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+# Reference colours of the dermoscopic ABCD rule: white, red, light brown,
+# dark brown, blue-grey and black.
+PALETTE = np.array([
+    [235, 225, 220],
+    [190, 60, 60],
+    [180, 125, 85],
+    [105, 65, 45],
+    [105, 115, 140],
+    [35, 30, 30],
+], dtype=np.float32)
+COLOUR_NAMES = ("white", "red", "light_brown", "dark_brown", "blue_grey", "black")
+# A colour counts as present when it covers at least this share of the lesion.
+COLOUR_MIN_SHARE = 0.05
+# Mirror mismatch (share of lesion area) above which an axis counts as asymmetric.
+ASYMMETRY_THRESHOLD = 0.2
+BORDER_SEGMENTS = 8
+# A border segment is abrupt when its luminance gradient reaches this share of
+# the lesion/skin contrast per pixel.
+ABRUPT_BORDER = 0.35
+# Major-axis share of the frame's long side at which the diameter score steps up.
+DIAMETER_STEPS = (0.2, 0.35, 0.5, 0.65)
+# Weights and cut-offs of the total dermoscopy score (Stolz et al.).
+ABCD_WEIGHTS = (1.3, 0.1, 0.5, 0.5)
+ABCD_SUSPICIOUS = 4.75
+ABCD_MALIGNANT = 5.45
+
+_LUMA = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+
+def stack_padded(masks: Sequence[np.ndarray], images: Sequence[np.ndarray]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Zero-pad masks of different sizes into one (N, H, W) batch.
+
+    Returns the mask batch, the matching (N, H, W, 3) float32 image batch and
+    the (N, 2) original heights and widths.
+    """
+    shapes = np.array([m.shape[:2] for m in masks], dtype=np.int64).reshape(-1, 2)
+    height, width = shapes.max(axis=0) if len(shapes) else (0, 0)
+    mask_batch = np.zeros((len(masks), height, width), dtype=bool)
+    image_batch = np.zeros((len(masks), height, width, 3), dtype=np.float32)
+    for i, (mask, image) in enumerate(zip(masks, images)):
+        h, w = mask.shape
+        mask_batch[i, :h, :w] = mask
+        image_batch[i, :h, :w] = image[:h, :w, :3]
+    return mask_batch, image_batch, shapes
+
+
+def _erode(masks: np.ndarray) -> np.ndarray:
+    padded = np.pad(masks, ((0, 0), (1, 1), (1, 1)), constant_values=False)
+    h, w = masks.shape[1:]
+    out = masks.copy()
+    for dy, dx in ((0, 1), (2, 1), (1, 0), (1, 2)):
+        out &= padded[:, dy:dy + h, dx:dx + w]
+    return out
+
+
+def _mirror_mismatch(masks: np.ndarray, x: np.ndarray, y: np.ndarray, area: np.ndarray) -> np.ndarray:
+    """Share of each lesion that does not overlap its mirror image sampled at (x, y)."""
+    n, h, w = masks.shape
+    xi = np.rint(x).astype(np.intp)
+    yi = np.rint(y).astype(np.intp)
+    inside = (xi >= 0) & (xi < w) & (yi >= 0) & (yi < h)
+    batch = np.arange(n)[:, None, None]
+    mirrored = masks[batch, np.clip(yi, 0, h - 1), np.clip(xi, 0, w - 1)] & inside
+    return (masks & ~mirrored).sum(axis=(1, 2)) / area
+
+
+def abcd_batch(masks: np.ndarray, images: np.ndarray, shapes: np.ndarray = None) -> Dict[str, np.ndarray]:
+    """ABCD proxies for a batch of (N, H, W) masks over (N, H, W, 3) RGB images.
+
+    `shapes` gives each frame's unpadded (height, width) for the diameter
+    proxy; it defaults to the full batch extent. Every value in the result is
+    an (N,) array.
+    """
+    masks = np.asarray(masks, dtype=bool)
+    images = np.asarray(images, dtype=np.float32)
+    n, h, w = masks.shape
+    if shapes is None:
+        shapes = np.tile([h, w], (n, 1))
+    weights = masks.astype(np.float32)
+    area = np.maximum(weights.sum(axis=(1, 2)), 1.0)
+
+    # A: centroid and orientation from second-order central moments, then the
+    # lesion reflected across its major and minor axes.
+    ys, xs = np.mgrid[0:h, 0:w].astype(np.float32)
+    cx = (weights * xs).sum(axis=(1, 2)) / area
+    cy = (weights * ys).sum(axis=(1, 2)) / area
+    dx = xs - cx[:, None, None]
+    dy = ys - cy[:, None, None]
+    mu20 = (weights * dx * dx).sum(axis=(1, 2)) / area
+    mu02 = (weights * dy * dy).sum(axis=(1, 2)) / area
+    mu11 = (weights * dx * dy).sum(axis=(1, 2)) / area
+    theta = 0.5 * np.arctan2(2 * mu11, mu20 - mu02)
+    spread = np.sqrt(((mu20 - mu02) / 2) ** 2 + mu11 ** 2)
+    major = 4 * np.sqrt(np.maximum((mu20 + mu02) / 2 + spread, 0))
+    minor = 4 * np.sqrt(np.maximum((mu20 + mu02) / 2 - spread, 0))
+
+    cos = np.cos(theta)[:, None, None]
+    sin = np.sin(theta)[:, None, None]
+    along = dx * cos + dy * sin
+    across = dy * cos - dx * sin
+    # Reflecting across the major axis negates `across`; across the minor axis, `along`.
+    asym_major = _mirror_mismatch(masks, cx[:, None, None] + along * cos + across * sin,
+                                  cy[:, None, None] + along * sin - across * cos, area)
+    asym_minor = _mirror_mismatch(masks, cx[:, None, None] - along * cos - across * sin,
+                                  cy[:, None, None] - along * sin + across * cos, area)
+    asymmetric_axes = (asym_major > ASYMMETRY_THRESHOLD).astype(np.int64) + (asym_minor > ASYMMETRY_THRESHOLD)
+
+    # B: boundary pixels from the mask minus its erosion; compactness is 1 for a
+    # disc and grows with a ragged outline. Abruptness is the luminance gradient
+    # on the boundary, averaged per angular segment around the centroid.
+    boundary = masks & ~_erode(masks)
+    perimeter = boundary.sum(axis=(1, 2)).astype(np.float32)
+    compactness = perimeter ** 2 / (4 * np.pi * area)
+    luminance = images @ _LUMA
+    grad_y, grad_x = np.gradient(luminance, axis=(1, 2))
+    gradient = np.hypot(grad_x, grad_y)
+    frame = (np.arange(h) < shapes[:, :1])[:, :, None] & (np.arange(w) < shapes[:, 1:])[:, None, :]
+    outside = frame & ~masks
+    inside_lum = (luminance * weights).sum(axis=(1, 2)) / area
+    outside_lum = (luminance * outside).sum(axis=(1, 2)) / np.maximum(outside.sum(axis=(1, 2)), 1)
+    contrast = np.maximum(np.abs(outside_lum - inside_lum), 1.0)
+
+    b_idx, y_idx, x_idx = np.nonzero(boundary)
+    angle = np.arctan2(ys[y_idx, x_idx] - cy[b_idx], xs[y_idx, x_idx] - cx[b_idx])
+    segment = np.minimum(((angle + np.pi) / (2 * np.pi) * BORDER_SEGMENTS).astype(np.intp), BORDER_SEGMENTS - 1)
+    cells = b_idx * BORDER_SEGMENTS + segment
+    seg_count = np.bincount(cells, minlength=n * BORDER_SEGMENTS).reshape(n, BORDER_SEGMENTS)
+    seg_grad = np.bincount(cells, weights=gradient[b_idx, y_idx, x_idx],
+                           minlength=n * BORDER_SEGMENTS).reshape(n, BORDER_SEGMENTS)
+    seg_sharpness = seg_grad / np.maximum(seg_count, 1) / contrast[:, None]
+    abrupt_segments = ((seg_sharpness >= ABRUPT_BORDER) & (seg_count > 0)).sum(axis=1)
+
+    # C: every lesion pixel snapped to the nearest reference colour, counted
+    # with one bincount over (image, colour) cells.
+    distance = ((images[..., None, :] - PALETTE) ** 2).sum(axis=-1)
+    nearest = distance.argmin(axis=-1)
+    img_idx = np.broadcast_to(np.arange(n)[:, None, None], masks.shape)[masks]
+    shares = np.bincount(img_idx * len(PALETTE) + nearest[masks],
+                         minlength=n * len(PALETTE)).reshape(n, len(PALETTE)) / area[:, None]
+    colour_count = np.maximum((shares >= COLOUR_MIN_SHARE).sum(axis=1), 1)
+
+    # D: major-axis length relative to the frame, bucketed into a 1-5 score.
+    diameter = major / np.maximum(shapes.max(axis=1), 1)
+    diameter_score = 1 + np.searchsorted(np.array(DIAMETER_STEPS), diameter)
+
+    wa, wb, wc, wd = ABCD_WEIGHTS
+    score = wa * asymmetric_axes + wb * abrupt_segments + wc * colour_count + wd * diameter_score
+    return {
+        "asymmetry_major": asym_major,
+        "asymmetry_minor": asym_minor,
+        "asymmetric_axes": asymmetric_axes,
+        "border_compactness": compactness,
+        "abrupt_segments": abrupt_segments,
+        "colour_count": colour_count,
+        "colour_shares": shares,
+        "diameter": diameter,
+        "eccentricity": np.sqrt(np.maximum(0, 1 - (minor / np.maximum(major, 1e-6)) ** 2)),
+        "diameter_score": diameter_score,
+        "abcd_score": score,
+    }
+
+
+def abcd_features(mask: np.ndarray, image: np.ndarray) -> Dict:
+    """ABCD proxies for one lesion, as plain Python values."""
+    batch = abcd_batch(mask[None], np.asarray(image, dtype=np.float32)[None, :, :, :3])
+    return _unbatch(batch, 0)
+
+
+def abcd_from_segmentations(segmentations: List[Dict]) -> List[Dict]:
+    """ABCD proxies for several `segment_lesion` results in one batch."""
+    if not segmentations:
+        return []
+    masks, images, shapes = stack_padded([s["thumbnail_mask"] for s in segmentations],
+                                         [s["thumbnail"] for s in segmentations])
+    batch = abcd_batch(masks, images, shapes)
+    return [_unbatch(batch, i) for i in range(len(segmentations))]
+
+
+def _unbatch(batch: Dict[str, np.ndarray], i: int) -> Dict:
+    out = {}
+    for key, values in batch.items():
+        value = values[i]
+        if key == "colour_shares":
+            out[key] = {name: round(float(v), 4) for name, v in zip(COLOUR_NAMES, value)}
+        elif np.issubdtype(values.dtype, np.integer):
+            out[key] = int(value)
+        else:
+            out[key] = float(value)
+    return out
@@ -0,0 +1,356 @@
+import os
+import json
+import time
+import uuid
+import queue
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import instrumentation
+import cpu_tuning
+from instrumentation import span
+import image_worker
+import image_hashing
+import case_index
+import shared_cache
+from image_ingest import ImageError, ImageTimeoutError
+from skin_disease_model import image_model_tag
+
+THREADS = int(os.environ.get("SKIN_ANALYSIS_THREADS") or cpu_tuning.plan()["analysis_threads"])
+MAX_ATTEMPTS = int(os.environ.get("SKIN_ANALYSIS_ATTEMPTS", "3"))
+RETRY_BACKOFF = 1.0
+# Finished jobs are kept this long so a reloaded session can still collect its result.
+JOB_RETENTION = 24 * 3600
+IMAGE_ANALYSIS_TTL = 24 * 3600
+SIMILAR_CASES = int(os.environ.get("SKIN_SIMILAR_CASES", "5"))
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+
+
+class JobStore:
+    """Job table in the shared SQLite file, so job state survives reruns and restarts."""
+
+    def __init__(self, path: str = shared_cache.DEFAULT_PATH):
+        self.path = shared_cache.secure_path(path)
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id TEXT PRIMARY KEY, session_key TEXT, image_key TEXT NOT NULL,"
+                " status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0,"
+                " payload BLOB, result TEXT, error TEXT, owner_pid INTEGER,"
+                " created_at REAL NOT NULL, started_at REAL, finished_at REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status)")
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if "conversation_id" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN conversation_id TEXT")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def create(self, job_id: str, session_key: Optional[str], image_key: str, payload: bytes,
+               conversation_id: Optional[str] = None):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, session_key, conversation_id, image_key, status, payload, owner_pid,"
+                " created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, session_key, conversation_id, image_key, QUEUED, payload, os.getpid(), time.time())
+            )
+
+    def claim(self, job_id: str) -> Optional[Tuple[bytes, str, Optional[str], Optional[str], int, float]]:
+        """Mark a queued job running.
+
+        Returns (payload, image_key, session_key, conversation_id, attempts, created_at).
+        """
+        with self._connect() as conn:
+            claimed = conn.execute(
+                "UPDATE jobs SET status = ?, attempts = attempts + 1, started_at = ?, owner_pid = ?"
+                " WHERE id = ? AND status = ?",
+                (RUNNING, time.time(), os.getpid(), job_id, QUEUED)
+            ).rowcount
+            if not claimed:
+                return None
+            row = conn.execute(
+                "SELECT payload, image_key, session_key, conversation_id, attempts, created_at"
+                " FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return bytes(row[0]), row[1], row[2], row[3], row[4], row[5]
+
+    def requeue(self, job_id: str, error: str) -> bool:
+        with self._connect() as conn:
+            return conn.execute(
+                "UPDATE jobs SET status = ?, error = ? WHERE id = ? AND status = ?",
+                (QUEUED, error, job_id, RUNNING)
+            ).rowcount > 0
+
+    def finish(self, job_id: str, status: str, result: Optional[Dict] = None,
+               error: Optional[str] = None) -> bool:
+        """Record the outcome unless the job was cancelled while it ran."""
+        with self._connect() as conn:
+            return conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, payload = NULL, finished_at = ?"
+                " WHERE id = ? AND status = ?",
+                (status, json.dumps(result) if result is not None else None, error,
+                 time.time(), job_id, RUNNING)
+            ).rowcount > 0
+
+    def cancel(self, job_id: str) -> bool:
+        with self._connect() as conn:
+            return conn.execute(
+                "UPDATE jobs SET status = ?, payload = NULL, finished_at = ?"
+                " WHERE id = ? AND status IN (?, ?)",
+                (CANCELLED, time.time(), job_id, QUEUED, RUNNING)
+            ).rowcount > 0
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        row = self._connect().execute(
+            "SELECT status, attempts, result, error, owner_pid FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {
+            "status": row[0],
+            "attempts": row[1],
+            "result": json.loads(row[2]) if row[2] else None,
+            "error": row[3],
+            "owner_pid": row[4],
+        }
+
+    def adopt_orphans(self, job_id: Optional[str] = None) -> List[str]:
+        """Requeue unfinished jobs whose owning process has died and take them over."""
+        query = "SELECT id, owner_pid FROM jobs WHERE status IN (?, ?)"
+        params = [QUEUED, RUNNING]
+        if job_id is not None:
+            query += " AND id = ?"
+            params.append(job_id)
+        rows = self._connect().execute(query, params).fetchall()
+        adopted = []
+        with self._connect() as conn:
+            for orphan_id, pid in rows:
+                if pid == os.getpid() or shared_cache.pid_alive(pid):
+                    continue
+                if conn.execute(
+                    "UPDATE jobs SET status = ?, owner_pid = ? WHERE id = ? AND owner_pid IS ?",
+                    (QUEUED, os.getpid(), orphan_id, pid)
+                ).rowcount:
+                    adopted.append(orphan_id)
+        return adopted
+
+    def purge_finished(self, older_than: float = JOB_RETENTION) -> int:
+        with self._connect() as conn:
+            return conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?, ?) AND finished_at < ?",
+                (*FINISHED, time.time() - older_than)
+            ).rowcount
+
+    def counts(self) -> Dict[str, int]:
+        rows = self._connect().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+
+class AnalysisQueue:
+    """Background image analysis: uploads are queued, decoded and scored off the script thread.
+
+    Timeouts and unexpected failures are retried with backoff; rejected or
+    undecodable images fail immediately. Results are written to the job table
+    for the session to pick up on a later rerun.
+    """
+
+    def __init__(self, store: JobStore, threads: int = THREADS, max_attempts: int = MAX_ATTEMPTS):
+        self.store = store
+        self.max_attempts = max_attempts
+        self.analysis_cache = shared_cache.get_cache(
+            f"image_analysis_{image_model_tag()}", ttl=IMAGE_ANALYSIS_TTL
+        )
+        self._queue: "queue.Queue[str]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._running = 0
+        self._outcomes: Dict[str, int] = {}
+        for i in range(threads):
+            threading.Thread(target=self._loop, name=f"analysis-job-{i}", daemon=True).start()
+
+    def submit(self, payload: bytes, image_key: str, session_key: Optional[str] = None,
+               conversation_id: Optional[str] = None) -> str:
+        job_id = uuid.uuid4().hex
+        self.store.create(job_id, session_key, image_key, payload, conversation_id)
+        self._queue.put(job_id)
+        return job_id
+
+    def cancel(self, job_id: str) -> bool:
+        cancelled = self.store.cancel(job_id)
+        if cancelled:
+            self._count(CANCELLED)
+        return cancelled
+
+    def status(self, job_id: str) -> Optional[Dict]:
+        """The job's row; an unfinished job whose worker process died is taken over and rerun here."""
+        job = self.store.get(job_id)
+        if job is not None and job["status"] not in FINISHED and job["owner_pid"] != os.getpid():
+            for adopted in self.store.adopt_orphans(job_id):
+                self._count("adopted")
+                self._queue.put(adopted)
+                job = self.store.get(job_id)
+        return job
+
+    def recover(self):
+        for job_id in self.store.adopt_orphans():
+            self._queue.put(job_id)
+        self.store.purge_finished()
+
+    def _count(self, outcome: str):
+        with self._lock:
+            self._outcomes[outcome] = self._outcomes.get(outcome, 0) + 1
+
+    def _loop(self):
+        while True:
+            job_id = self._queue.get()
+            try:
+                self._run(job_id)
+            except Exception:
+                # The job table must never stop the worker thread.
+                self._count("internal_error")
+
+    def _analyse(self, payload: bytes, image_key: str, session_key: Optional[str],
+                 conversation_id: Optional[str] = None) -> Dict:
+        cached = self.analysis_cache.get(image_key)
+        asset, fresh = image_worker.process_upload(payload, score=cached is None)
+        if fresh is not None:
+            self.analysis_cache.set(image_key, fresh)
+        result = {
+            "image_data": asset.b64,
+            "image_mime": asset.mime,
+            "image_id": asset.digest,
+            "image_stats": asset.ingest_stats,
+            "analysis": cached or fresh,
+            "lesion": asset.lesion,
+        }
+        if session_key and asset.hashes:
+            # Any earlier upload by this user counts, in whichever conversation.
+            index = image_hashing.get_index()
+            with span("duplicate_lookup"):
+                match = index.find(session_key, asset.hashes)
+            if match is not None:
+                distance, earlier = match
+                # Re-shot or re-compressed photos of the same lesion keep the
+                # first analysis instead of drifting between uploads.
+                if earlier["analysis"]:
+                    result["analysis"] = earlier["analysis"]
+                result["duplicate_of"] = {
+                    "image_id": earlier["image_id"],
+                    "conversation_id": earlier["conversation_id"],
+                    "distance": distance,
+                    "uploaded_at": earlier["created_at"],
+                }
+                self._count("duplicate")
+            index.add(session_key, image_key, asset.digest, asset.hashes, result["analysis"], conversation_id)
+        if asset.vector is not None and SIMILAR_CASES > 0:
+            self._add_case(result, asset.vector, session_key)
+        return result
+
+    def _add_case(self, result: Dict, vector, session_key: Optional[str]):
+        """Attach the nearest reference cases and this user's own past uploads, then index this one."""
+        cases = case_index.get_index()
+        with span("similar_cases"):
+            scopes = [case_index.REFERENCE_SCOPE] + ([session_key] if session_key else [])
+            similar = cases.search(vector, SIMILAR_CASES, scopes=scopes)
+        result["similar_cases"] = [
+            dict({k: v for k, v in case.items() if k != "session_key"}, distance=round(distance, 4))
+            for distance, case in similar
+        ]
+        # A re-upload of the same lesion would only crowd out other neighbours.
+        if "duplicate_of" not in result and result["analysis"]:
+            condition, confidence, name = result["analysis"]
+            cases.add(vector, {
+                "source": "upload",
+                "session_key": session_key,
+                "image_id": result["image_id"],
+                "condition": condition,
+                "name": name,
+                "confidence": confidence,
+                "created_at": time.time(),
+            })
+
+    def _run(self, job_id: str):
+        claimed = self.store.claim(job_id)
+        if claimed is None:
+            return
+        payload, image_key, session_key, conversation_id, attempts, created_at = claimed
+        instrumentation.observe("analysis_job_wait", time.time() - created_at)
+        with self._lock:
+            self._running += 1
+        try:
+            with span("analysis_job"):
+                result = self._analyse(payload, image_key, session_key, conversation_id)
+        except Exception as e:
+            retryable = isinstance(e, ImageTimeoutError) or not isinstance(e, ImageError)
+            if retryable and attempts < self.max_attempts and self.store.requeue(job_id, str(e)):
+                self._count("retried")
+                timer = threading.Timer(RETRY_BACKOFF * 2 ** (attempts - 1), self._queue.put, (job_id,))
+                timer.daemon = True
+                timer.start()
+            elif self.store.finish(job_id, FAILED, error=str(e)):
+                self._count(FAILED)
+            return
+        finally:
+            with self._lock:
+                self._running -= 1
+        if self.store.finish(job_id, DONE, result=result):
+            self._count(DONE)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            outcomes = dict(self._outcomes)
+            running = self._running
+        return {"queued": self._queue.qsize(), "running": running, "outcomes": outcomes}
+
+
+_queue: Optional[AnalysisQueue] = None
+_queue_lock = threading.Lock()
+
+
+def get_queue() -> AnalysisQueue:
+    """Return the analysis queue shared by every session in this process."""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = AnalysisQueue(JobStore())
+            _queue.recover()
+        return _queue
+
+
+def _prometheus_lines() -> List[str]:
+    if _queue is None:
+        return []
+    stats = _queue.stats()
+    lines = [
+        "# HELP skin_analysis_jobs Image analysis jobs in the shared job table, by status.",
+        "# TYPE skin_analysis_jobs gauge",
+    ]
+    for status, count in sorted(_queue.store.counts().items()):
+        lines.append(f'skin_analysis_jobs{{status="{status}"}} {count}')
+    lines += [
+        "# HELP skin_analysis_jobs_running Image analysis jobs running in this process.",
+        "# TYPE skin_analysis_jobs_running gauge",
+        f"skin_analysis_jobs_running {stats['running']}",
+        "# HELP skin_analysis_job_outcomes_total Image analysis job outcomes in this process.",
+        "# TYPE skin_analysis_job_outcomes_total counter",
+    ]
+    for outcome, count in sorted(stats["outcomes"].items()):
+        lines.append(f'skin_analysis_job_outcomes_total{{outcome="{outcome}"}} {count}')
+    return lines
+
+
+instrumentation.register_collector(_prometheus_lines)
@@ -1,196 +1,225 @@
 import streamlit as st
-from google import genai
+import cpu_tuning
+# Before anything imports NumPy, so its BLAS pool and the image workers' are sized to the CPU budget.
+cpu_tuning.configure()
 import json
 import os
 import re
-import base64
 import uuid
 import html
+import time
+import hashlib
 from typing import List, Dict, Optional
 from datetime import datetime
-from skin_disease_model import get_image_based_analysis
-
-disease_keywords = {
-    "akiec": [
-        "scaly", "rough", "dry patch", "crust", "crusty", "sun damaged",
-        "pink patch", "red patch", "sandpaper", "photo damage", "thin plate",
-        "precancer", "precancerous"
-    ],
-    "bcc": [
-        "pearly", "translucent", "shiny bump", "rolled edges", "rolled border",
-        "bleeds", "bleeding", "sore that doesn't heal", "open sore",
-        "small bump", "pink bump", "waxy", "ulcer", "rodent ulcer",
-        "visible blood vessels", "telangiectasia"
-    ],
-    "bkl": [
-        "stuck on", "warty", "wart like", "seborrheic", "brown spot", "flat brown",
-        "age spot", "sun spot", "liver spot", "rough spot", "well defined",
-        "light brown", "dark brown", "keratosis", "non cancerous growth"
-    ],
-    "df": [
-        "firm bump", "hard bump", "dimple", "dimple sign",
-        "small nodule", "brown nodule", "round bump",
-        "insect bite like", "itchy nodule", "smooth dome",
-        "fibrous bump"
-    ],
-    "mel": [
-        "irregular", "asymmetry", "uneven border", "changing", "evolving",
-        "multiple colors", "dark brown", "black patch", "bleeds", "enlarging",
-        "growing quickly", "itchy mole", "new mole", "abnormal mole",
-        "abcde", "color variation", "spreading", "large spot"
-    ],
-    "nv": [
-        "mole", "brown mole", "flat mole", "raised mole", "uniform color",
-        "symmetrical mole", "birthmark", "benign mole", "tan spot",
-        "small brown spot", "regular borders", "smooth edges", 
-        "harmless mole"
-    ],
-    "vasc": [
-        "red spot", "purple spot", "blood spot", "cherry", "angioma",
-        "bright red bump", "bleeds easily", "hemorrhage", "red papule",
-        "angiokeratoma", "vascular lesion", "blue spot", "red nodule",
-        "pyogenic granuloma"
-    ]
-}
-
-disease_names = {
-    "akiec": "Actinic Keratosis (Pre-cancerous)",
-    "bcc": "Basal Cell Carcinoma",
-    "bkl": "Benign Keratosis",
-    "df": "Dermatofibroma",
-    "mel": "Melanoma",
-    "nv": "Melanocytic Nevus (Mole)",
-    "vasc": "Vascular Lesion",
-    "unknown": "Unknown - Please consult a dermatologist"
-}
-
-disease_treatments = {
-    "akiec": {
-        "severity": "High - Pre-cancerous",
-        "treatments": [
-            "Topical creams: Imiquimod, 5-fluorouracil (5-FU)",
-            "Cryotherapy (freezing with liquid nitrogen)",
-            "Photodynamic therapy (PDT)",
-            "Chemical peels",
-            "Surgical excision for advanced cases",
-            "Sun protection and preventive measures"
-        ],
-        "urgent": True
-    },
-    "bcc": {
-        "severity": "High - Skin Cancer",
-        "treatments": [
-            "Mohs micrographic surgery (most effective)",
-            "Surgical excision",
-            "Curettage and electrodesiccation",
-            "Cryotherapy",
-            "Radiation therapy",
-            "Topical imiquimod or 5-FU for small lesions"
-        ],
-        "urgent": True
-    },
-    "bkl": {
-        "severity": "Low - Benign",
-        "treatments": [
-            "Observation (no treatment needed if not bothersome)",
-            "Cryotherapy (freezing)",
-            "Surgical removal for cosmetic reasons",
-            "Laser treatment",
-            "Chemical peels",
-            "Topical tretinoin may help"
-        ],
-        "urgent": False
-    },
-    "df": {
-        "severity": "Low - Benign",
-        "treatments": [
-            "Observation (usually no treatment needed)",
-            "Surgical excision for cosmetic concerns",
-            "Cryotherapy",
-            "Laser treatment",
-            "Intralesional steroid injections"
-        ],
-        "urgent": False
-    },
-    "mel": {
-        "severity": "Critical - Melanoma",
-        "treatments": [
-            "URGENT: Surgical excision with wide margins",
-            "Sentinel lymph node biopsy",
-            "Immunotherapy (pembrolizumab, nivolumab)",
-            "Targeted therapy for BRAF mutations",
-            "Chemotherapy if advanced",
-            "Radiation therapy for metastatic disease"
-        ],
-        "urgent": True
-    },
-    "nv": {
-        "severity": "Low - Benign",
-        "treatments": [
-            "Observation (no treatment needed)",
-            "Surgical removal for cosmetic reasons",
-            "Laser treatment",
-            "Cryotherapy",
-            "Dermabrasion"
-        ],
-        "urgent": False
-    },
-    "vasc": {
-        "severity": "Low to Moderate",
-        "treatments": [
-            "Observation for small lesions",
-            "Laser therapy (most effective)",
-            "Cryotherapy",
-            "Sclerotherapy (injection)",
-            "Surgical removal",
-            "Topical treatments"
-        ],
-        "urgent": False
-    },
-    "unknown": {
-        "severity": "Unknown",
-        "treatments": [
-            "Consult a dermatologist for proper diagnosis",
-            "Provide detailed description and photos",
-            "Professional medical evaluation recommended"
-        ],
-        "urgent": False
-    }
-}
+import instrumentation
+from instrumentation import span
+import shared_cache
+import llm_scheduler
+import model_router
+import response_cache
+import response_streams
+from gemini_backend import get_gemini_client
+from image_ingest import ImageError, asset_for_message, check_upload, describe_savings, has_image
+import analysis_jobs
+import case_index
+import session_memory
+import session_tokens
+import symptom_classifier
+from disease_tables import disease_treatments, condition_colors
+from app_styles import APP_CSS
+
+run_started = time.perf_counter()
+
+CONVERSATION_TTL = 7 * 24 * 3600
+
+# Shared across every worker on the host. Conversations skip the in-process L1
+# because session_state already is the per-process copy.
+conversation_store = shared_cache.get_cache("conversations", ttl=CONVERSATION_TTL, l1_size=0)
 
 def match_disease_from_text(user_text: str) -> Dict:
-    """Match skin condition based on symptom keywords in text."""
-    text = user_text.lower()
-    scores = {disease: 0 for disease in disease_keywords}
-    matched_keywords = {disease: [] for disease in disease_keywords}
-
-    for disease, keywords in disease_keywords.items():
-        for keyword in keywords:
-            if keyword in text:
-                scores[disease] += 1
-                matched_keywords[disease].append(keyword)
-
-    if max(scores.values()) == 0:
-        return {
-            "condition": "unknown",
-            "name": disease_names["unknown"],
-            "score": 0,
-            "matched_keywords": [],
-            "all_scores": scores
-        }
-
-    best_match = max(scores, key=scores.get)
+    """Match skin condition from a symptom description (stemmed, negation-aware TF-IDF)."""
+    with span("text_matching"):
+        return symptom_classifier.get_classifier().classify([user_text])[0]
+
+def browser_id() -> str:
+    if not session_tokens.BROWSER_COOKIE:
+        return ""
+    return st.context.cookies.get(session_tokens.BROWSER_COOKIE, "")
+
+def get_session_key() -> str:
+    """Per-browser key, carried in the URL only as a signed, expiring token any worker can verify."""
+    session_key = session_tokens.verify(st.query_params.get("sid"), browser_id())
+    if session_key is None:
+        session_key = uuid.uuid4().hex
+    refresh_session_token(session_key)
+    return session_key
+
+def refresh_session_token(session_key: str):
+    st.query_params["sid"] = session_tokens.issue(session_key, browser_id())
+    st.session_state.session_token_issued = time.time()
+
+def pending_image_jobs() -> set:
+    return {
+        m["image_job"]
+        for conv in st.session_state.conversations.values()
+        for m in conv["messages"]
+        if "image_job" in m
+    }
+
+def pending_streams() -> set:
     return {
-        "condition": best_match,
-        "name": disease_names[best_match],
-        "score": scores[best_match],
-        "matched_keywords": matched_keywords[best_match],
-        "all_scores": scores
+        m["stream_id"]
+        for conv in st.session_state.conversations.values()
+        for m in conv["messages"]
+        if "stream_id" in m
     }
 
+def conversation_key(conv_id: str) -> str:
+    return f"{st.session_state.session_key}/{conv_id}"
+
+def save_conversations(*conv_ids: str):
+    """Store the conversation index and the given conversations (default: the open one).
+
+    Each conversation is its own entry, so a message only re-serialises the
+    conversation it was added to; ids no longer in session_state are deleted.
+    """
+    for conv_id in conv_ids or (st.session_state.get("current_conversation_id"),):
+        conv = st.session_state.conversations.get(conv_id)
+        if conv is not None:
+            conversation_store.set(conversation_key(conv_id), conv)
+        elif conv_id is not None:
+            conversation_store.delete(conversation_key(conv_id))
+    conversation_store.set(st.session_state.session_key, {
+        "conversation_ids": list(st.session_state.conversations),
+        "current_conversation_id": st.session_state.get("current_conversation_id"),
+    })
+    # Jobs whose message was deleted, edited away or reset are no longer wanted.
+    still_pending = pending_image_jobs()
+    for job_id in st.session_state.get("image_jobs", set()) - still_pending:
+        analysis_jobs.get_queue().cancel(job_id)
+    st.session_state.image_jobs = still_pending
+    # Likewise replies still streaming into a message that was regenerated or deleted.
+    still_streaming = pending_streams()
+    for stream_id in st.session_state.get("response_streams", set()) - still_streaming:
+        response_streams.get_streams().cancel(stream_id)
+    st.session_state.response_streams = still_streaming
+
+def apply_finished_jobs(messages: List[Dict]) -> bool:
+    """Copy finished background analyses into their messages; True if any changed."""
+    changed = False
+    for m in messages:
+        job_id = m.get("image_job")
+        if not job_id:
+            continue
+        job = analysis_jobs.get_queue().status(job_id)
+        if job is not None and job["status"] not in analysis_jobs.FINISHED:
+            continue
+        del m["image_job"]
+        changed = True
+        if job is None:
+            m["image_error"] = "Image analysis result expired"
+        elif job["status"] == analysis_jobs.FAILED:
+            m["image_error"] = job["error"]
+        elif job["status"] == analysis_jobs.DONE:
+            result = job["result"]
+            for field in ("image_data", "image_mime", "image_id", "image_stats"):
+                m[field] = result[field]
+            if result.get("duplicate_of"):
+                m["duplicate_of"] = result["duplicate_of"]
+            if result.get("similar_cases"):
+                m["similar_cases"] = result["similar_cases"]
+            if result.get("lesion"):
+                m["lesion"] = result["lesion"]
+            condition, confidence, name = result["analysis"]
+            if condition != "unknown":
+                m["analysis"] = {
+                    "condition": condition,
+                    "name": name,
+                    "score": confidence,
+                    "matched_keywords": [],
+                    "all_scores": {}
+                }
+    return changed
+
+def apply_finished_streams(messages: List[Dict]) -> bool:
+    """Commit finished reply streams into their messages in one step; True if any changed."""
+    changed = False
+    for m in messages:
+        stream_id = m.get("stream_id")
+        if not stream_id:
+            continue
+        stream = response_streams.get_streams().status(stream_id)
+        if stream is not None and stream["status"] not in response_streams.FINISHED:
+            continue
+        del m["stream_id"]
+        changed = True
+        if stream is None:
+            m["content"] = "Error: this reply expired before it was saved"
+            continue
+        text = stream["text"].strip()
+        if stream["status"] == response_streams.FAILED:
+            text = (text + "\n\n" if text else "") + f"Error: {stream['error']}"
+        m["content"] = text
+        if stream["model"]:
+            m["model"] = stream["model"]
+        if stream["cached"]:
+            m["cached"] = True
+        if stream["status"] == response_streams.CANCELLED:
+            m["stopped"] = True
+    return changed
+
+def chat_bubble(role: str, content: str) -> str:
+    """HTML for one chat bubble (handles code blocks and escaping)."""
+    clean_content = content.strip()
+    if clean_content.endswith("</div>"):
+        clean_content = clean_content[:-6].strip()
+    formatted_content = format_code_blocks(clean_content)
+    if role == "assistant":
+        return f'<div style="text-align: left; margin: 10px 0; clear: both;"><div style="background: #0f1724; color: #e6eef8; padding: 12px 16px; border-radius: 18px; border-bottom-left-radius: 4px; border: 1px solid rgba(255,255,255,0.04); word-wrap: break-word; overflow-wrap: break-word; white-space: pre-wrap; line-height: 1.5;">{formatted_content}</div></div>'
+    return f'<div style="text-align: right; margin: 10px 0; clear: both;"><div style="background: #6c9ef8; color: #02214d; padding: 12px 16px; border-radius: 18px; border-bottom-right-radius: 4px; word-wrap: break-word; overflow-wrap: break-word; white-space: pre-wrap; line-height: 1.5;">{formatted_content}</div></div>'
+
+def describe_abcd(abcd: Dict) -> str:
+    """One-line summary of the ABCD shape proxies for a lesion caption."""
+    return (
+        f"ABCD proxies: {abcd['asymmetric_axes']} asymmetric axes, "
+        f"{abcd['abrupt_segments']}/8 abrupt border segments, {abcd['colour_count']} colours, "
+        f"diameter {abcd['diameter']:.0%} of frame (score {abcd['abcd_score']:.2f})"
+    )
+
+def describe_duplicate(duplicate: Dict) -> str:
+    """Where the user sent the earlier copy of a near-duplicate image."""
+    uploaded = datetime.fromtimestamp(duplicate["uploaded_at"]).strftime("%Y-%m-%d %H:%M")
+    conv = st.session_state.conversations.get(duplicate.get("conversation_id"))
+    place = f' in "{conv.get("title", "New Chat")}"' if conv else ""
+    return f"Looks like the same lesion you uploaded on {uploaded}{place}; reusing that analysis."
+
+def load_conversations() -> Dict:
+    stored = conversation_store.get(st.session_state.session_key)
+    if not stored:
+        return {}
+    if "conversations" in stored:
+        # Written before conversations were stored one per entry; re-saved below in the new layout.
+        conversations = stored["conversations"]
+        st.session_state.conversations = conversations
+        save_conversations(*conversations)
+    else:
+        conversations = {}
+        for conv_id in stored.get("conversation_ids", []):
+            conv = conversation_store.get(conversation_key(conv_id))
+            if conv is not None:
+                conversations[conv_id] = conv
+    if conversations:
+        current_id = stored.get("current_conversation_id")
+        st.session_state.current_conversation_id = current_id if current_id in conversations else next(iter(conversations))
+    return conversations
+
 def init_session_state():
+    if "session_key" not in st.session_state:
+        st.session_state.session_key = get_session_key()
+    elif time.time() - st.session_state.session_token_issued > session_tokens.REFRESH_AFTER:
+        refresh_session_token(st.session_state.session_key)
     if "conversations" not in st.session_state:
-        st.session_state.conversations = {}
+        st.session_state.conversations = load_conversations()
     if "current_conversation_id" not in st.session_state:
         new_id = create_new_conversation()
         st.session_state.current_conversation_id = new_id
@@ -200,6 +229,10 @@ def init_session_state():
         st.session_state.editing_message_idx = None
     if "search_query" not in st.session_state:
         st.session_state.search_query = ""
+    if "image_jobs" not in st.session_state:
+        st.session_state.image_jobs = pending_image_jobs()
+    if "response_streams" not in st.session_state:
+        st.session_state.response_streams = pending_streams()
 
 def create_new_conversation() -> str:
     conv_id = str(uuid.uuid4())[:8]
@@ -209,6 +242,7 @@ def create_new_conversation() -> str:
         "created_at": datetime.now().isoformat(),
         "messages": [{"role": "system", "content": "You are a helpful assistant."}]
     }
+    save_conversations(conv_id)
     return conv_id
 
 def get_current_messages() -> List[Dict]:
@@ -221,10 +255,12 @@ def set_current_messages(messages: List[Dict]):
     conv_id = st.session_state.current_conversation_id
     if conv_id in st.session_state.conversations:
         st.session_state.conversations[conv_id]["messages"] = messages
+        save_conversations()
 
 def update_conversation_title(conv_id: str, first_message: str):
     title = first_message[:40] + "..." if len(first_message) > 40 else first_message
     st.session_state.conversations[conv_id]["title"] = title
+    save_conversations(conv_id)
 
 def format_code_blocks(text: str) -> str:
     """Convert markdown code blocks to syntax-highlighted HTML."""
@@ -266,149 +302,13 @@ def format_code_blocks(text: str) -> str:
     return text
 
 init_session_state()
+# A conversation picked in the sidebar may have been spilled to disk while it was cold.
+if session_memory.ensure_loaded(st.session_state.session_key,
+                                st.session_state.conversations[st.session_state.current_conversation_id]):
+    save_conversations()
 
 st.set_page_config(page_title="Streamlit ChatGPT-like UI", layout="wide")
-st.markdown(
-    """
-    <style>
-    * { box-sizing: border-box; }
-    .stApp { background: linear-gradient(135deg, #0a0f1f 0%, #0b1020 100%); color: #dbe7ff; font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif; }
-    
-    .chat-container {
-        max-width: 100%;
-        padding: 24px;
-        display: flex;
-        flex-direction: column;
-        gap: 14px;
-    }
-    
-    .message-wrapper {
-        display: flex;
-        margin: 8px 0;
-        width: 100%;
-    }
-    
-    .message-wrapper.user {
-        justify-content: flex-end;
-    }
-    
-    .message-wrapper.assistant {
-        justify-content: flex-start;
-    }
-    
-    .bubble {
-        padding: 12px 16px;
-        border-radius: 14px;
-        line-height: 1.6;
-        font-size: 14px;
-        width: fit-content;
-        max-width: 70%;
-        min-width: 60px;
-        word-wrap: break-word;
-        overflow-wrap: break-word;
-        white-space: pre-wrap;
-    }
-    
-    .bubble.user {
-        background: #000000;
-        color: #ffffff;
-        border-bottom-right-radius: 2px;
-        box-shadow: 0 3px 12px rgba(0, 0, 0, 0.3);
-        border: 1px solid rgba(255, 255, 255, 0.15);
-    }
-    
-    .bubble.assistant {
-        background: #1a2332;
-        color: #e6eef8;
-        border-bottom-left-radius: 2px;
-        border: 1.5px solid rgba(108, 158, 248, 0.3);
-        box-shadow: 0 3px 12px rgba(0, 0, 0, 0.15);
-    }
-    
-    .code-block {
-        background: #0f1620;
-        border-radius: 8px;
-        margin: 12px 0;
-        overflow: hidden;
-        border: 1px solid rgba(108, 158, 248, 0.1);
-    }
-    
-    .code-header {
-        background: #1a2332;
-        padding: 8px 12px;
-        font-size: 11px;
-        color: #6c9ef8;
-        border-bottom: 1px solid rgba(108, 158, 248, 0.2);
-        font-weight: 600;
-        text-transform: uppercase;
-    }
-    
-    .code-block pre {
-        margin: 0;
-        padding: 12px;
-        overflow-x: auto;
-        font-size: 12px;
-    }
-    
-    .code-block code {
-        font-family: 'SF Mono', Monaco, 'Cascadia Code', 'Roboto Mono', Consolas, monospace;
-        color: #e6eef8;
-        white-space: pre;
-    }
-    
-    .inline-code {
-        background: #1a2332;
-        padding: 3px 8px;
-        border-radius: 4px;
-        font-family: 'SF Mono', Monaco, monospace;
-        font-size: 13px;
-        color: #f8b86c;
-        border: 1px solid rgba(108, 158, 248, 0.1);
-    }
-    
-    .conversation-item {
-        padding: 10px 12px;
-        margin: 4px 0;
-        border-radius: 8px;
-        cursor: pointer;
-        background: #1a2332;
-        border: 1px solid rgba(108, 158, 248, 0.1);
-        font-size: 13px;
-    }
-    
-    .conversation-item:hover {
-        background: #232d3d;
-        border-color: rgba(108, 158, 248, 0.3);
-    }
-    
-    .conversation-item.active {
-        background: #2d3d52;
-        border-color: #6c9ef8;
-        box-shadow: 0 0 12px rgba(108, 158, 248, 0.2);
-    }
-    
-    .image-preview {
-        max-width: 300px;
-        max-height: 300px;
-        border-radius: 12px;
-        margin: 10px 0;
-        border: 1px solid rgba(108, 158, 248, 0.2);
-    }
-    
-    [data-testid="stForm"] {
-        border-top: 1px solid rgba(108, 158, 248, 0.1);
-        padding-top: 20px;
-        margin-top: 20px;
-    }
-    
-    .stButton button {
-        border-radius: 6px;
-        font-weight: 500;
-    }
-    </style>
-    """,
-    unsafe_allow_html=True,
-)
+st.markdown(APP_CSS, unsafe_allow_html=True)
 
 with st.sidebar:
     st.title("Chat Controls")
@@ -420,6 +320,7 @@ with st.sidebar:
     if st.button("New Chat", use_container_width=True):
         new_id = create_new_conversation()
         st.session_state.current_conversation_id = new_id
+        save_conversations()
         st.rerun()
     
     sorted_convs = sorted(
@@ -431,7 +332,7 @@ with st.sidebar:
     for conv_id, conv in sorted_convs:
         title = conv.get("title", "New Chat")
         if search_query:
-            messages_text = " ".join([m.get("content", "") for m in conv.get("messages", [])])
+            messages_text = conv.get("search_text") or " ".join([m.get("content", "") for m in conv.get("messages", [])])
             if search_query.lower() not in title.lower() and search_query.lower() not in messages_text.lower():
                 continue
         
@@ -439,16 +340,20 @@ with st.sidebar:
         btn_type = "primary" if is_active else "secondary"
         col1, col2 = st.columns([4, 1])
         with col1:
-            if st.button(title[:30], key=f"conv_{conv_id}", use_container_width=True, type=btn_type):
+            label = f"💾 {title[:28]}" if conv.get("spilled") else title[:30]
+            if st.button(label, key=f"conv_{conv_id}", use_container_width=True, type=btn_type):
                 st.session_state.current_conversation_id = conv_id
                 st.session_state.editing_message_idx = None
+                save_conversations()
                 st.rerun()
         with col2:
             if st.button("X", key=f"del_{conv_id}"):
                 if len(st.session_state.conversations) > 1:
                     del st.session_state.conversations[conv_id]
+                    session_memory.discard(st.session_state.session_key, conv_id)
                     if st.session_state.current_conversation_id == conv_id:
                         st.session_state.current_conversation_id = list(st.session_state.conversations.keys())[0]
+                    save_conversations(conv_id)
                     st.rerun()
     
     st.markdown("---")
@@ -463,7 +368,14 @@ with st.sidebar:
     )
     # The newest Gemini model is gemini-2.5-pro or gemini-2.5-flash
     # do not change this unless explicitly requested by the user
-    model = st.selectbox("Model", options=["gemini-2.5-pro", "gemini-2.5-flash", "gemini-1.5-pro", "gemini-1.5-flash"], index=0)
+    model = st.selectbox(
+        "Model",
+        options=[model_router.AUTO_MODEL, "gemini-2.5-pro", "gemini-2.5-flash", "gemini-1.5-pro", "gemini-1.5-flash"],
+        index=0,
+        format_func=lambda name: "Auto (flash, escalate to pro)" if name == model_router.AUTO_MODEL else name
+    )
+    cache_responses = st.checkbox("Reuse cached answers", value=False, help="Replay a stored answer when the same conversation and settings were sent before. Always on at temperature 0.")
+    hedge_requests = st.checkbox("Hedge slow requests", value=True, help="Send a second request if the first token is unusually slow and keep whichever answers first")
     temperature = st.slider("Temperature", 0.0, 2.0, 1.0)
     max_tokens = st.slider("Max tokens (response)", 256, 8192, 2048)
     
@@ -474,6 +386,7 @@ with st.sidebar:
     if st.button("Reset current conversation"):
         set_current_messages([{"role": "system", "content": system_prompt or "You are a helpful assistant."}])
         st.session_state.conversations[st.session_state.current_conversation_id]["title"] = "New Chat"
+        save_conversations()
         st.rerun()
 
     st.markdown("---")
@@ -497,11 +410,80 @@ with st.sidebar:
         except Exception as e:
             st.error(f"Failed to load: {e}")
 
+    if instrumentation.enabled():
+        st.markdown("---")
+        with st.expander("Performance metrics"):
+            stage_stats = instrumentation.snapshot()
+            if stage_stats:
+                st.table({
+                    stage: {
+                        "count": stats["count"],
+                        "p50 (ms)": round(stats["p50_s"] * 1000, 1),
+                        "p95 (ms)": round(stats["p95_s"] * 1000, 1),
+                    }
+                    for stage, stats in stage_stats.items()
+                })
+            model_stats = model_router.get_router().stats.summary()
+            if model_stats:
+                st.markdown("**Model latency**")
+                st.table(model_stats)
+            cache_stats = shared_cache.cluster_stats()
+            if cache_stats:
+                st.markdown("**Shared cache (all workers)**")
+                st.table({
+                    namespace: {
+                        "workers": stats["workers"],
+                        "hit rate (%)": round(stats["hit_rate"] * 100, 1),
+                        "L1 hits": stats["l1_hits"],
+                        "L2 hits": stats["l2_hits"],
+                        "misses": stats["misses"],
+                    }
+                    for namespace, stats in cache_stats.items()
+                })
+            st.download_button(
+                "Download Prometheus metrics",
+                data=instrumentation.render_prometheus(),
+                file_name="metrics.prom",
+                mime="text/plain"
+            )
+
 current_messages = get_current_messages()
-if current_messages:
-    current_messages[0]["content"] = system_prompt or current_messages[0]["content"]
+if current_messages and system_prompt and current_messages[0]["content"] != system_prompt:
+    current_messages[0]["content"] = system_prompt
     set_current_messages(current_messages)
 
+if apply_finished_jobs(get_current_messages()):
+    save_conversations()
+if apply_finished_streams(get_current_messages()):
+    save_conversations()
+st.session_state.response_in_progress = any("stream_id" in m for m in get_current_messages())
+
+memory_usage = session_memory.enforce(
+    st.session_state.session_key, st.session_state.conversations, st.session_state.current_conversation_id
+)
+if memory_usage["changed"]:
+    # Enforcement may spill any of the session's conversations.
+    save_conversations(*st.session_state.conversations)
+
+@st.fragment(run_every=1.0)
+def watch_image_jobs(job_ids: List[str]):
+    """Poll pending analyses and redraw the whole page once any of them finishes."""
+    for job_id in job_ids:
+        job = analysis_jobs.get_queue().status(job_id)
+        if job is None or job["status"] in analysis_jobs.FINISHED:
+            st.rerun()
+
+@st.fragment(run_every=0.5)
+def show_stream(stream_id: str):
+    """Draw a reply from its stream buffer as it grows; rerun the page to commit it once finished."""
+    stream = response_streams.get_streams().status(stream_id)
+    if stream is None or stream["status"] in response_streams.FINISHED:
+        st.rerun()
+    if stream["status"] == response_streams.QUEUED and stream["queue_position"]:
+        st.info(f"⏳ Queued: position {stream['queue_position']} of {stream['queue_depth']}, "
+                f"waiting {stream['queue_waited']:.1f}s for a model slot...")
+    st.markdown(chat_bubble("assistant", stream["text"] + " ▌"), unsafe_allow_html=True)
+
 left_col, right_col = st.columns([3, 1])
 
 with left_col:
@@ -545,21 +527,34 @@ with left_col:
                         st.session_state.editing_message_idx = None
                         st.rerun()
             else:
-                if "image_data" in msg:
-                    img_mime = msg.get("image_mime", "image/png")
-                    st.markdown(f'<img src="data:{img_mime};base64,{msg["image_data"]}" class="image-preview"/>', unsafe_allow_html=True)
-                
-                # Format content (handles code blocks and escaping)
-                clean_content = content.strip()
-                if clean_content.endswith("</div>"):
-                    clean_content = clean_content[:-6].strip()
-                formatted_content = format_code_blocks(clean_content)
-                
+                if has_image(msg):
+                    try:
+                        st.markdown(f'<img src="{asset_for_message(msg).data_uri}" class="image-preview"/>', unsafe_allow_html=True)
+                    except ImageError as e:
+                        st.caption(f"Image unavailable: {e}")
+                    if "image_stats" in msg:
+                        st.caption(f"Image normalised: {describe_savings(msg['image_stats'])}")
+                    if msg.get("lesion", {}).get("segmented"):
+                        st.caption(f"Lesion region: {msg['lesion']['area_fraction']:.0%} of the frame; colour features use only these pixels")
+                        if msg["lesion"].get("abcd"):
+                            st.caption(describe_abcd(msg["lesion"]["abcd"]))
+                    if "duplicate_of" in msg:
+                        st.caption(f"♻️ {describe_duplicate(msg['duplicate_of'])}")
+                if "image_job" in msg:
+                    st.info("🔬 Analysing image...")
+                if "image_error" in msg:
+                    st.warning(f"Image not analysed: {msg['image_error']}")
+
+                if "stream_id" in msg:
+                    # Still generating, possibly since an earlier run or another tab: reattach to its buffer.
+                    show_stream(msg["stream_id"])
+                    if st.button("Stop", key=f"stop_btn_{idx}", help="Stop generating and keep the text so far"):
+                        response_streams.get_streams().cancel(msg["stream_id"])
+                        st.rerun()
+                    continue
+
                 # Create chat bubble with proper alignment
-                if role == "assistant":
-                    st.markdown(f'<div style="text-align: left; margin: 10px 0; clear: both;"><div style="background: #0f1724; color: #e6eef8; padding: 12px 16px; border-radius: 18px; border-bottom-left-radius: 4px; border: 1px solid rgba(255,255,255,0.04); word-wrap: break-word; overflow-wrap: break-word; white-space: pre-wrap; line-height: 1.5;">{formatted_content}</div></div>', unsafe_allow_html=True)
-                else:
-                    st.markdown(f'<div style="text-align: right; margin: 10px 0; clear: both;"><div style="background: #6c9ef8; color: #02214d; padding: 12px 16px; border-radius: 18px; border-bottom-right-radius: 4px; word-wrap: break-word; overflow-wrap: break-word; white-space: pre-wrap; line-height: 1.5;">{formatted_content}</div></div>', unsafe_allow_html=True)
+                st.markdown(chat_bubble(role, content), unsafe_allow_html=True)
                 
                 # Display skin analysis if available for this user message
                 if role == "user" and "analysis" in msg:
@@ -567,15 +562,6 @@ with left_col:
                     condition = analysis.get("condition", "unknown")
                     if condition != "unknown":
                         treatment_info = disease_treatments.get(condition, {})
-                        condition_colors = {
-                            "mel": "#ff4b4b",
-                            "bcc": "#ffa500",
-                            "akiec": "#ffa500",
-                            "bkl": "#4CAF50",
-                            "df": "#4CAF50",
-                            "nv": "#4CAF50",
-                            "vasc": "#2196F3"
-                        }
                         color = condition_colors.get(condition, "#888")
                         
                         st.markdown(f"""
@@ -596,6 +582,24 @@ with left_col:
                         if treatment_info.get("urgent"):
                             st.error("⚠️ URGENT: Consult a dermatologist immediately!")
                 
+                if role == "user" and msg.get("similar_cases"):
+                    with st.expander(f"Similar past cases ({len(msg['similar_cases'])})"):
+                        for case in msg["similar_cases"]:
+                            case_cols = st.columns([1, 4])
+                            if case["source"] == "reference":
+                                case_cols[0].image(os.path.join(case_index.SAMPLE_DIR, case["file"]), width=72)
+                                case_cols[1].markdown(
+                                    f"**{case['name']}** — reference case {case['case_id']} "
+                                    f"({case['confirmed_by']}, {case['localization']})"
+                                )
+                            else:
+                                uploaded_on = datetime.fromtimestamp(case["created_at"]).strftime("%Y-%m-%d")
+                                case_cols[1].markdown(
+                                    f"**{case['name']}** — your upload from {uploaded_on} "
+                                    f"(model confidence {case['confidence']:.0%})"
+                                )
+                            case_cols[1].caption(f"Feature distance {case['distance']:.3f}")
+                
                 action_cols = st.columns([1, 1, 1, 3])
                 with action_cols[0]:
                     if st.button("Edit", key=f"edit_btn_{idx}", help="Edit this message"):
@@ -612,12 +616,33 @@ with left_col:
                         set_current_messages(current_messages)
                         st.rerun()
 
+    waiting_jobs = [m["image_job"] for m in get_current_messages() if "image_job" in m]
+    if waiting_jobs:
+        watch_image_jobs(waiting_jobs)
+
     st.markdown("</div>", unsafe_allow_html=True)
 
 with right_col:
     st.markdown("### Conversation")
     user_msg_count = len([m for m in get_current_messages() if m['role'] != 'system'])
     st.write(f"Messages: {user_msg_count}")
+    queue_stats = llm_scheduler.get_scheduler().stats()
+    st.caption(
+        f"Model queue: {queue_stats['waiting']} waiting "
+        f"({queue_stats['urgent_waiting']} urgent), "
+        f"{queue_stats['active']}/{queue_stats['max_concurrency']} active, "
+        f"p95 wait {queue_stats['p95_wait_s']:.1f}s"
+    )
+    job_stats = analysis_jobs.get_queue().stats()
+    st.caption(f"Image analysis: {job_stats['queued']} queued, {job_stats['running']} running")
+    conversation_usage = memory_usage["conversations"].get(st.session_state.current_conversation_id, {})
+    st.caption(
+        f"Session memory: {session_memory.format_bytes(memory_usage['bytes'])} "
+        f"of {session_memory.format_bytes(memory_usage['session_cap'])}; "
+        f"this conversation {session_memory.format_bytes(conversation_usage.get('bytes', 0))} with "
+        f"{conversation_usage.get('images', 0)} images ({conversation_usage.get('images_on_disk', 0)} on disk); "
+        f"{memory_usage['spilled_conversations']} conversations on disk"
+    )
     st.markdown("---")
     st.markdown("Quick prompts")
     if st.button("Explain my code"):
@@ -664,15 +689,6 @@ with right_col:
         else:
             treatment_info = disease_treatments.get(condition, {})
             
-            condition_colors = {
-                "mel": "#ff4b4b",
-                "bcc": "#ffa500",
-                "akiec": "#ffa500",
-                "bkl": "#4CAF50",
-                "df": "#4CAF50",
-                "nv": "#4CAF50",
-                "vasc": "#2196F3"
-            }
             color = condition_colors.get(condition, "#888")
             
             st.markdown(f"""
@@ -713,89 +729,7 @@ with st.form(key="input_form", clear_on_submit=True):
 if clear:
     st.rerun()
 
-def get_gemini_client(api_key: str):
-    return genai.Client(api_key=api_key)
-
-def gemini_stream_chat(client, messages: List[Dict], model: str, temperature: float, max_tokens: int):
-    try:
-        from google.genai import types
-        system_text = None
-        api_messages = []
-        
-        for m in messages:
-            if m["role"] == "system":
-                system_text = m["content"]
-                continue
-            
-            role = "user" if m["role"] == "user" else "model"
-            parts = []
-            
-            if "image_data" in m and m["role"] == "user":
-                img_mime = m.get("image_mime", "image/png")
-                parts.append(types.Part(text=m["content"]))
-                parts.append(types.Part(inline_data=types.Blob(mime_type=img_mime, data=base64.b64decode(m["image_data"]))))
-            else:
-                parts.append(types.Part(text=m["content"]))
-            
-            api_messages.append(types.Content(role=role, parts=parts))
-        
-        config_dict = {
-            "temperature": temperature,
-            "max_output_tokens": max_tokens,
-        }
-        if system_text:
-            config_dict["system_instruction"] = system_text
-        
-        response = client.models.generate_content_stream(
-            model=model,
-            contents=api_messages,
-            config=types.GenerateContentConfig(**config_dict),
-        )
-        
-        for chunk in response:
-            if chunk.text:
-                yield chunk.text
-    except Exception as e:
-        yield f"\n\n[Error while streaming response: {e}]"
-
-def gemini_chat_complete(client, messages: List[Dict], model: str, temperature: float, max_tokens: int) -> str:
-    try:
-        from google.genai import types
-        system_text = None
-        api_messages = []
-        
-        for m in messages:
-            if m["role"] == "system":
-                system_text = m["content"]
-                continue
-            
-            role = "user" if m["role"] == "user" else "model"
-            parts = []
-            
-            if "image_data" in m and m["role"] == "user":
-                img_mime = m.get("image_mime", "image/png")
-                parts.append(types.Part(text=m["content"]))
-                parts.append(types.Part(inline_data=types.Blob(mime_type=img_mime, data=base64.b64decode(m["image_data"]))))
-            else:
-                parts.append(types.Part(text=m["content"]))
-            
-            api_messages.append(types.Content(role=role, parts=parts))
-        
-        config_dict = {
-            "temperature": temperature,
-            "max_output_tokens": max_tokens,
-        }
-        if system_text:
-            config_dict["system_instruction"] = system_text
-        
-        response = client.models.generate_content(
-            model=model,
-            contents=api_messages,
-            config=types.GenerateContentConfig(**config_dict)
-        )
-        return response.text if response.text else "[No response generated]"
-    except Exception as e:
-        return f"[Error generating response: {e}]"
+instrumentation.observe("page_render", time.perf_counter() - run_started)
 
 if send and user_input:
     msgs = get_current_messages()
@@ -803,24 +737,17 @@ if send and user_input:
     
     if uploaded_image is not None:
         image_bytes = uploaded_image.read()
-        image_b64 = base64.b64encode(image_bytes).decode("utf-8")
-        mime_type = uploaded_image.type or "image/png"
-        new_msg["image_data"] = image_b64
-        new_msg["image_mime"] = mime_type
-        
         try:
-            condition, confidence, name = get_image_based_analysis(image_bytes)
-            if condition != "unknown":
-                analysis = {
-                    "condition": condition,
-                    "name": name,
-                    "score": confidence,
-                    "matched_keywords": [],
-                    "all_scores": {}
-                }
-                new_msg["analysis"] = analysis
-        except Exception as e:
-            pass
+            # The header check is instant; decoding and scoring happen in a
+            # background job and the analysis card fills in when it finishes.
+            check_upload(image_bytes)
+            new_msg["image_job"] = analysis_jobs.get_queue().submit(
+                image_bytes, hashlib.sha256(image_bytes).hexdigest(), st.session_state.session_key,
+                st.session_state.current_conversation_id
+            )
+        except ImageError as e:
+            # The message still goes out; the user sees why the image was dropped.
+            new_msg["image_error"] = str(e)
     
     # Auto-analyze for skin conditions from text
     text_analysis = match_disease_from_text(user_input)
@@ -843,40 +770,34 @@ def last_non_system_role():
             return m["role"]
     return None
 
-if last_non_system_role() == "user":
+# The model answers once the image is analysed, so it sees the normalised
+# image and urgent findings are routed accordingly.
+awaiting_image = any("image_job" in m for m in get_current_messages())
+
+if last_non_system_role() == "user" and not awaiting_image:
     if api_key:
-        st.session_state.response_in_progress = True
+        messages_to_send = list(get_current_messages())
+
+        last_user_msg = next((m for m in reversed(messages_to_send) if m["role"] == "user"), {})
+        urgent = disease_treatments.get(
+            last_user_msg.get("analysis", {}).get("condition", "unknown"), {}
+        ).get("urgent", False)
+
+        cache_key = None
+        if response_cache.should_cache(temperature, cache_responses):
+            cache_key = response_cache.make_key(model, messages_to_send, temperature, max_tokens)
+
+        # The reply is generated on a background thread into a stream buffer that
+        # outlives this run; the message only points at it until it is complete,
+        # so reruns and reconnects reattach instead of asking the model again.
+        stream_id = response_streams.get_streams().start(
+            st.session_state.session_key, get_gemini_client(api_key), messages_to_send, model,
+            temperature, max_tokens, api_key=api_key, urgent=urgent, hedge=hedge_requests, cache_key=cache_key
+        )
         msgs = get_current_messages()
-        assistant_msg = {"role": "assistant", "content": ""}
-        msgs.append(assistant_msg)
+        msgs.append({"role": "assistant", "content": "", "stream_id": stream_id})
         set_current_messages(msgs)
-
-        placeholder = st.empty()
-        text_so_far = ""
-        
-        client = get_gemini_client(api_key)
-        messages_to_send = [m for m in get_current_messages()[:-1]]
-
-        try:
-            for chunk in gemini_stream_chat(client, messages_to_send, model, temperature, max_tokens):
-                text_so_far += chunk
-                msgs = get_current_messages()
-                msgs[-1]["content"] = text_so_far.strip()
-                set_current_messages(msgs)
-        except Exception as stream_error:
-            try:
-                full = gemini_chat_complete(client, messages_to_send, model, temperature, max_tokens)
-                full_trimmed = full.strip()
-                msgs = get_current_messages()
-                msgs[-1]["content"] = full_trimmed
-                set_current_messages(msgs)
-            except Exception as e:
-                msgs = get_current_messages()
-                msgs[-1]["content"] = f"Error: {str(e)[:100]}"
-                set_current_messages(msgs)
-        finally:
-            st.session_state.response_in_progress = False
-            st.rerun()
+        st.rerun()
     else:
         st.warning("No Google AI API key provided. Get one free at https://aistudio.google.com/apikey")
 
@@ -888,3 +809,6 @@ st.markdown(
     """,
     unsafe_allow_html=True,
 )
+
+if instrumentation.enabled() and os.environ.get("SKIN_METRICS_PROM_PATH"):
+    instrumentation.write_prometheus(os.environ["SKIN_METRICS_PROM_PATH"])
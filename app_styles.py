@@ -0,0 +1,139 @@
+# Page stylesheet, kept out of app.py so reruns reuse the already-built string.
+APP_CSS = """
+    <style>
+    * { box-sizing: border-box; }
+    .stApp { background: linear-gradient(135deg, #0a0f1f 0%, #0b1020 100%); color: #dbe7ff; font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif; }
+    
+    .chat-container {
+        max-width: 100%;
+        padding: 24px;
+        display: flex;
+        flex-direction: column;
+        gap: 14px;
+    }
+    
+    .message-wrapper {
+        display: flex;
+        margin: 8px 0;
+        width: 100%;
+    }
+    
+    .message-wrapper.user {
+        justify-content: flex-end;
+    }
+    
+    .message-wrapper.assistant {
+        justify-content: flex-start;
+    }
+    
+    .bubble {
+        padding: 12px 16px;
+        border-radius: 14px;
+        line-height: 1.6;
+        font-size: 14px;
+        width: fit-content;
+        max-width: 70%;
+        min-width: 60px;
+        word-wrap: break-word;
+        overflow-wrap: break-word;
+        white-space: pre-wrap;
+    }
+    
+    .bubble.user {
+        background: #000000;
+        color: #ffffff;
+        border-bottom-right-radius: 2px;
+        box-shadow: 0 3px 12px rgba(0, 0, 0, 0.3);
+        border: 1px solid rgba(255, 255, 255, 0.15);
+    }
+    
+    .bubble.assistant {
+        background: #1a2332;
+        color: #e6eef8;
+        border-bottom-left-radius: 2px;
+        border: 1.5px solid rgba(108, 158, 248, 0.3);
+        box-shadow: 0 3px 12px rgba(0, 0, 0, 0.15);
+    }
+    
+    .code-block {
+        background: #0f1620;
+        border-radius: 8px;
+        margin: 12px 0;
+        overflow: hidden;
+        border: 1px solid rgba(108, 158, 248, 0.1);
+    }
+    
+    .code-header {
+        background: #1a2332;
+        padding: 8px 12px;
+        font-size: 11px;
+        color: #6c9ef8;
+        border-bottom: 1px solid rgba(108, 158, 248, 0.2);
+        font-weight: 600;
+        text-transform: uppercase;
+    }
+    
+    .code-block pre {
+        margin: 0;
+        padding: 12px;
+        overflow-x: auto;
+        font-size: 12px;
+    }
+    
+    .code-block code {
+        font-family: 'SF Mono', Monaco, 'Cascadia Code', 'Roboto Mono', Consolas, monospace;
+        color: #e6eef8;
+        white-space: pre;
+    }
+    
+    .inline-code {
+        background: #1a2332;
+        padding: 3px 8px;
+        border-radius: 4px;
+        font-family: 'SF Mono', Monaco, monospace;
+        font-size: 13px;
+        color: #f8b86c;
+        border: 1px solid rgba(108, 158, 248, 0.1);
+    }
+    
+    .conversation-item {
+        padding: 10px 12px;
+        margin: 4px 0;
+        border-radius: 8px;
+        cursor: pointer;
+        background: #1a2332;
+        border: 1px solid rgba(108, 158, 248, 0.1);
+        font-size: 13px;
+    }
+    
+    .conversation-item:hover {
+        background: #232d3d;
+        border-color: rgba(108, 158, 248, 0.3);
+    }
+    
+    .conversation-item.active {
+        background: #2d3d52;
+        border-color: #6c9ef8;
+        box-shadow: 0 0 12px rgba(108, 158, 248, 0.2);
+    }
+    
+    .image-preview {
+        max-width: 300px;
+        max-height: 300px;
+        border-radius: 12px;
+        margin: 10px 0;
+        border: 1px solid rgba(108, 158, 248, 0.2);
+    }
+    
+    [data-testid="stForm"] {
+        border-top: 1px solid rgba(108, 158, 248, 0.1);
+        padding-top: 20px;
+        margin-top: 20px;
+    }
+    
+    .stButton button {
+        border-radius: 6px;
+        font-weight: 500;
+    }
+    </style>
+    """
@@ -0,0 +1,421 @@
+"""Similar-case retrieval over image feature vectors.
+
+Vectors live in an append-only float32 file that every worker memory-maps;
+case metadata sits next to it as JSON lines. Queries are exact, vectorised
+squared-L2 scans until the index passes SKIN_CASE_IVF_THRESHOLD rows, after
+which an IVF-PQ index (coarse k-means lists plus product-quantised residuals,
+re-ranked exactly) is trained in memory and kept up to date incrementally.
+
+    python case_index.py --seed     # add the bundled HAM10000 sample images
+"""
+import os
+import csv
+import json
+import time
+import argparse
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+import shared_cache
+from skin_disease_model import FEATURE_VERSION, extract_image_features
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+# Vectors from different feature versions are not comparable, so each gets its own directory.
+DEFAULT_DIR = os.path.join(
+    os.environ.get("SKIN_CASE_INDEX_DIR", os.path.join(shared_cache.APP_DIR, "case_index")),
+    f"v{FEATURE_VERSION}"
+)
+IVF_THRESHOLD = int(os.environ.get("SKIN_CASE_IVF_THRESHOLD", "200000"))
+SAMPLE_DIR = os.path.join(ROOT, "Data", "Sample_Skin_Disease_Images")
+METADATA_PATH = os.path.join(ROOT, "Data", "HAM10000_metadata.csv")
+
+STAT_KEYS = ("avg_r", "avg_g", "avg_b", "std_r", "std_g", "std_b")
+# Channel statistics are few next to 64 histogram cells; weight them so both count.
+STATS_WEIGHT = 2.0
+VECTOR_DIM = len(STAT_KEYS) + 1 + 64
+SCAN_CHUNK = 65536
+PQ_TRAIN_SIZE = 20_000
+REFERENCE_SCOPE = "reference"
+
+
+def case_scope(meta: Dict) -> Optional[str]:
+    """Reference cases are visible to everyone, uploads only to the session that sent them."""
+    if meta.get("source") == "reference":
+        return REFERENCE_SCOPE
+    return meta.get("session_key")
+
+
+def feature_vector(features: Dict) -> np.ndarray:
+    """Fixed-length float32 embedding of `extract_image_features` output."""
+    stats = [features[key] / 255.0 for key in STAT_KEYS]
+    stats.append(np.sqrt(features["variance"]) / 255.0)
+    # Square-rooted histograms make squared L2 a Hellinger distance.
+    hist = np.sqrt(np.asarray(features["color_hist"], dtype=np.float32))
+    return np.concatenate([np.asarray(stats, dtype=np.float32) * STATS_WEIGHT, hist]).astype(np.float32)
+
+
+def _top_k(distances: np.ndarray, k: int) -> np.ndarray:
+    if len(distances) <= k:
+        return np.argsort(distances)
+    part = np.argpartition(distances, k)[:k]
+    return part[np.argsort(distances[part])]
+
+
+def _sq_distances(x: np.ndarray, x_norms: np.ndarray, q: np.ndarray) -> np.ndarray:
+    return x_norms - 2.0 * (x @ q) + float(q @ q)
+
+
+def kmeans(x: np.ndarray, k: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+    """Plain Lloyd's k-means; returns the centroids."""
+    rng = np.random.default_rng(seed)
+    k = min(k, len(x))
+    centroids = x[rng.choice(len(x), k, replace=False)].copy()
+    for _ in range(iterations):
+        assign = _assign(x, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, x)
+        counts = np.bincount(assign, minlength=k)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        # Re-seed empty clusters from random points instead of letting them die.
+        centroids[empty] = x[rng.choice(len(x), int(empty.sum()))]
+    return centroids
+
+
+def _assign(x: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    c_norms = (centroids ** 2).sum(1)
+    out = np.empty(len(x), dtype=np.int32)
+    for start in range(0, len(x), SCAN_CHUNK):
+        block = x[start:start + SCAN_CHUNK]
+        out[start:start + len(block)] = np.argmin(c_norms[None, :] - 2.0 * block @ centroids.T, axis=1)
+    return out
+
+
+class IVFPQ:
+    """Inverted file with product-quantised residuals (8-bit codes per subspace)."""
+
+    def __init__(self, dim: int, nlist: int, m: int = 12, nprobe: int = 8):
+        self.dim = dim
+        self.m = m
+        self.padded = -(-dim // m) * m
+        self.sub = self.padded // m
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.coarse: Optional[np.ndarray] = None
+        self.codebooks: Optional[np.ndarray] = None
+        self._ids: List[List[np.ndarray]] = []
+        self._codes: List[List[np.ndarray]] = []
+
+    def _pad(self, x: np.ndarray) -> np.ndarray:
+        if self.padded == self.dim:
+            return x
+        return np.pad(x, ((0, 0), (0, self.padded - self.dim)))
+
+    def train(self, sample: np.ndarray):
+        sample = np.ascontiguousarray(sample, dtype=np.float32)
+        self.coarse = kmeans(sample, self.nlist)
+        self.nlist = len(self.coarse)
+        # Codebooks only need a few thousand residuals per centroid to settle.
+        pq_sample = sample[:PQ_TRAIN_SIZE]
+        residuals = self._pad(pq_sample - self.coarse[_assign(pq_sample, self.coarse)])
+        self.codebooks = np.stack([
+            kmeans(residuals[:, j * self.sub:(j + 1) * self.sub], 256, iterations=8, seed=j + 1)
+            for j in range(self.m)
+        ])
+        self._ids = [[] for _ in range(self.nlist)]
+        self._codes = [[] for _ in range(self.nlist)]
+
+    def add(self, x: np.ndarray, ids: np.ndarray):
+        x = np.asarray(x, dtype=np.float32)
+        lists = _assign(x, self.coarse)
+        residuals = self._pad(x - self.coarse[lists])
+        codes = np.empty((len(x), self.m), dtype=np.uint8)
+        for j in range(self.m):
+            codes[:, j] = _assign(residuals[:, j * self.sub:(j + 1) * self.sub], self.codebooks[j])
+        order = np.argsort(lists, kind="stable")
+        bounds = np.searchsorted(lists[order], np.arange(self.nlist + 1))
+        for lst in range(self.nlist):
+            rows = order[bounds[lst]:bounds[lst + 1]]
+            if len(rows):
+                self._ids[lst].append(ids[rows])
+                self._codes[lst].append(codes[rows])
+
+    def _list(self, lst: int) -> Tuple[np.ndarray, np.ndarray]:
+        # Consolidate appended batches lazily, on the first query that touches the list.
+        if len(self._ids[lst]) > 1:
+            self._ids[lst] = [np.concatenate(self._ids[lst])]
+            self._codes[lst] = [np.concatenate(self._codes[lst])]
+        if not self._ids[lst]:
+            return np.empty(0, dtype=np.int64), np.empty((0, self.m), dtype=np.uint8)
+        return self._ids[lst][0], self._codes[lst][0]
+
+    def search(self, q: np.ndarray, k: int, mask: Optional[np.ndarray] = None) -> np.ndarray:
+        """Candidate row ids ordered by approximate distance, only rows where `mask` is set."""
+        coarse_d = ((self.coarse - q) ** 2).sum(1)
+        probes = _top_k(coarse_d, min(self.nprobe, self.nlist))
+        found_ids, found_d = [], []
+        for lst in probes:
+            ids, codes = self._list(int(lst))
+            if mask is not None and len(ids):
+                keep = mask[ids]
+                ids, codes = ids[keep], codes[keep]
+            if not len(ids):
+                continue
+            residual = self._pad((q - self.coarse[lst])[None, :])[0].reshape(self.m, self.sub)
+            table = ((self.codebooks - residual[:, None, :]) ** 2).sum(2)
+            found_ids.append(ids)
+            found_d.append(table[np.arange(self.m), codes].sum(1))
+        if not found_ids:
+            return np.empty(0, dtype=np.int64)
+        ids = np.concatenate(found_ids)
+        return ids[_top_k(np.concatenate(found_d), k)]
+
+    def nbytes(self) -> int:
+        return sum(c.nbytes for lists in self._codes for c in lists) + \
+            sum(i.nbytes for lists in self._ids for i in lists)
+
+
+class CaseIndex:
+    """Append-only, memory-mapped case store with exact or IVF-PQ top-k search.
+
+    Row ids are also kept per scope (see `case_scope`), so a scoped search
+    ranks only the rows it may return rather than filtering a global top-k.
+    """
+
+    def __init__(self, directory: str = DEFAULT_DIR, dim: int = VECTOR_DIM,
+                 ivf_threshold: int = IVF_THRESHOLD):
+        self.directory = directory
+        self.dim = dim
+        self.ivf_threshold = ivf_threshold
+        # Upload rows carry session keys, image ids and conditions: owner-only, like the SQLite cache.
+        self.vectors_path = shared_cache.secure_path(os.path.join(directory, "vectors.f32"))
+        self.meta_path = shared_cache.secure_path(os.path.join(directory, "cases.jsonl"))
+        self._lock_path = shared_cache.secure_path(os.path.join(directory, ".lock"))
+        self._lock = threading.RLock()
+        self._vectors = np.empty((0, dim), dtype=np.float32)
+        self._norms = np.empty(0, dtype=np.float32)
+        self._meta: List[Dict] = []
+        self._meta_offset = 0
+        self._scope_rows: Dict[str, List[int]] = {}
+        self._scope_arrays: Dict[str, np.ndarray] = {}
+        self._ivf: Optional[IVFPQ] = None
+        self._ivf_rows = 0
+
+    @contextmanager
+    def _file_lock(self):
+        """Serialise appends across worker processes."""
+        with open(self._lock_path, "a") as lock_file:
+            try:
+                import fcntl
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            except ImportError:
+                pass
+            yield
+
+    def _rows_on_disk(self) -> int:
+        try:
+            return os.path.getsize(self.vectors_path) // (4 * self.dim)
+        except OSError:
+            return 0
+
+    def _refresh(self):
+        """Map rows other workers appended since the last look."""
+        with self._lock:
+            if os.path.exists(self.meta_path):
+                with open(self.meta_path, "rb") as f:
+                    f.seek(self._meta_offset)
+                    for line in f:
+                        if not line.endswith(b"\n"):
+                            break
+                        meta = json.loads(line)
+                        scope = case_scope(meta)
+                        if scope is not None:
+                            self._scope_rows.setdefault(scope, []).append(len(self._meta))
+                            self._scope_arrays.pop(scope, None)
+                        self._meta.append(meta)
+                        self._meta_offset += len(line)
+            rows = min(self._rows_on_disk(), len(self._meta))
+            if rows == len(self._vectors):
+                return
+            old = len(self._vectors)
+            self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(rows, self.dim))
+            new_norms = np.einsum("ij,ij->i", self._vectors[old:], self._vectors[old:])
+            self._norms = np.concatenate([self._norms, new_norms])
+            if self._ivf is not None and rows > self._ivf_rows:
+                self._ivf.add(self._vectors[self._ivf_rows:rows], np.arange(self._ivf_rows, rows))
+                self._ivf_rows = rows
+
+    def __len__(self) -> int:
+        self._refresh()
+        return len(self._vectors)
+
+    def add_many(self, vectors: np.ndarray, metas: List[Dict],
+                 only_if_empty: bool = False) -> List[int]:
+        """Append cases; returns their row ids (empty if `only_if_empty` and rows exist)."""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        with self._lock, self._file_lock():
+            start = self._rows_on_disk()
+            if only_if_empty and start:
+                return []
+            # Vectors first: readers only expose rows that also have metadata.
+            with open(self.vectors_path, "ab") as f:
+                f.write(vectors.tobytes())
+            with open(self.meta_path, "a", encoding="utf-8") as f:
+                for meta in metas:
+                    f.write(json.dumps(meta, separators=(",", ":")) + "\n")
+        self._refresh()
+        return list(range(start, start + len(vectors)))
+
+    def add(self, vector: np.ndarray, meta: Dict) -> int:
+        return self.add_many(vector[None, :], [meta])[0]
+
+    def build_ivf(self, nlist: Optional[int] = None, m: int = 12, nprobe: Optional[int] = None,
+                  train_size: int = 50_000):
+        """Train the IVF-PQ index on a sample of the stored vectors and index every row."""
+        self._refresh()
+        with self._lock:
+            n = len(self._vectors)
+            nlist = nlist or int(min(4096, max(16, 4 * np.sqrt(n))))
+            # Probing a fixed share of the lists keeps recall steady as the list count grows.
+            nprobe = nprobe or max(8, nlist // 64)
+            rng = np.random.default_rng(0)
+            sample_rows = np.sort(rng.choice(n, min(n, train_size), replace=False))
+            ivf = IVFPQ(self.dim, nlist, m=m, nprobe=nprobe)
+            ivf.train(np.asarray(self._vectors[sample_rows]))
+            for start in range(0, n, SCAN_CHUNK):
+                stop = min(n, start + SCAN_CHUNK)
+                ivf.add(self._vectors[start:stop], np.arange(start, stop))
+            self._ivf, self._ivf_rows = ivf, n
+
+    def _exact(self, q: np.ndarray, k: int, rows: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        if rows is not None:
+            d = _sq_distances(self._vectors[rows], self._norms[rows], q)
+            order = _top_k(d, k)
+            return rows[order], d[order]
+        best_rows, best_d = [], []
+        for start in range(0, len(self._vectors), SCAN_CHUNK):
+            block = self._vectors[start:start + SCAN_CHUNK]
+            d = _sq_distances(block, self._norms[start:start + len(block)], q)
+            top = _top_k(d, k)
+            best_rows.append(top + start)
+            best_d.append(d[top])
+        rows = np.concatenate(best_rows)
+        d = np.concatenate(best_d)
+        order = _top_k(d, k)
+        return rows[order], d[order]
+
+    def _rows_in(self, scopes: Iterable[str]) -> np.ndarray:
+        """Sorted row ids of every case in the given scopes."""
+        with self._lock:
+            arrays = []
+            for scope in set(scopes):
+                if scope not in self._scope_rows:
+                    continue
+                array = self._scope_arrays.get(scope)
+                if array is None:
+                    array = self._scope_arrays[scope] = np.asarray(self._scope_rows[scope], dtype=np.int64)
+                arrays.append(array)
+        if not arrays:
+            return np.empty(0, dtype=np.int64)
+        rows = np.sort(np.concatenate(arrays))
+        # Metadata can run ahead of the mapped vectors while another worker appends.
+        return rows[:np.searchsorted(rows, len(self._vectors))]
+
+    def search(self, vector: np.ndarray, k: int = 5, scopes: Optional[Iterable[str]] = None,
+               exact: Optional[bool] = None) -> List[Tuple[float, Dict]]:
+        """Nearest cases as (distance, metadata), optionally only those in `scopes`."""
+        self._refresh()
+        if not len(self._vectors):
+            return []
+        q = np.asarray(vector, dtype=np.float32)
+        rows = self._rows_in(scopes) if scopes is not None else None
+        if rows is not None and not len(rows):
+            return []
+        if exact is None:
+            # A small scope is cheaper to scan exactly than to probe.
+            exact = len(self._vectors) < self.ivf_threshold or (rows is not None and len(rows) <= SCAN_CHUNK)
+        if not exact and self._ivf is None:
+            self.build_ivf()
+        if exact:
+            rows, d = self._exact(q, k, rows)
+        else:
+            mask = None
+            if rows is not None:
+                mask = np.zeros(len(self._vectors), dtype=bool)
+                mask[rows] = True
+            # Re-rank the PQ shortlist (already restricted to the scope) with exact distances.
+            rows, d = self._exact(q, k, self._ivf.search(q, k * 4, mask))
+        return [(float(max(0.0, dist)), self._meta[int(row)]) for row, dist in zip(rows, d)]
+
+
+def _reference_labels() -> Dict[str, Dict]:
+    labels = {}
+    with open(METADATA_PATH, newline="") as f:
+        for row in csv.DictReader(f):
+            labels[row["image_id"]] = row
+    return labels
+
+
+def seed_reference_cases(index: CaseIndex) -> int:
+    """Add the bundled, labelled sample images as reference cases (once per index)."""
+    from image_ingest import ImageAsset
+    from disease_tables import disease_mapping
+
+    if len(index) or not os.path.isdir(SAMPLE_DIR):
+        return 0
+    labels = _reference_labels()
+    vectors, metas = [], []
+    for name in sorted(os.listdir(SAMPLE_DIR)):
+        image_id, ext = os.path.splitext(name)
+        label = labels.get(image_id)
+        if label is None or ext.lower() not in (".jpg", ".jpeg", ".png"):
+            continue
+        with open(os.path.join(SAMPLE_DIR, name), "rb") as f:
+            features = extract_image_features(ImageAsset(data=f.read()))
+        vectors.append(feature_vector(features))
+        metas.append({
+            "source": "reference",
+            "case_id": image_id,
+            "file": name,
+            "condition": label["dx"],
+            "name": disease_mapping.get(label["dx"], label["dx"]),
+            "confirmed_by": label["dx_type"],
+            "localization": label["localization"],
+        })
+    if not vectors:
+        return 0
+    return len(index.add_many(np.stack(vectors), metas, only_if_empty=True))
+
+
+_index: Optional[CaseIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_index() -> CaseIndex:
+    """Return the case index shared by every session in this process, seeding it on first use."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = CaseIndex()
+            seed_reference_cases(_index)
+        return _index
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seed", action="store_true", help="add the bundled reference images")
+    parser.add_argument("--dir", default=DEFAULT_DIR, help="index directory")
+    args = parser.parse_args()
+    index = CaseIndex(args.dir)
+    if args.seed:
+        started = time.perf_counter()
+        added = seed_reference_cases(index)
+        print(f"Added {added} reference cases in {time.perf_counter() - started:.1f}s")
+    print(f"{len(index)} cases in {args.dir}")
+
+
+if __name__ == "__main__":
+    main()
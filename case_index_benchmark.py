@@ -0,0 +1,103 @@
+"""Query latency benchmark for the similar-case index.
+
+Builds throwaway indexes of synthetic clustered feature vectors and reports
+insert throughput, exact-scan and IVF-PQ query latency, IVF-PQ recall@k
+against the exact results, and memory per representation.
+
+    python case_index_benchmark.py --sizes 10000,100000,1000000
+"""
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+from typing import Dict, List
+
+import numpy as np
+
+from case_index import VECTOR_DIM, CaseIndex
+
+
+_PROJECTION_SEED = 7
+
+
+def _synthetic(n: int, dim: int, rng: np.random.Generator, clusters: int = 64, latent: int = 8) -> np.ndarray:
+    """Clustered points on a low-dimensional subspace, like correlated colour features."""
+    projection = np.random.default_rng(_PROJECTION_SEED).normal(0.0, 1.0, (latent, dim)).astype(np.float32)
+    centres = np.random.default_rng(_PROJECTION_SEED + 1).normal(0.0, 1.0, (clusters, latent)).astype(np.float32)
+    points = centres[rng.integers(0, clusters, n)] + rng.normal(0.0, 0.3, (n, latent)).astype(np.float32)
+    return points @ projection + rng.normal(0.0, 0.02, (n, dim)).astype(np.float32)
+
+
+def _latency(samples: List[float]) -> Dict:
+    ordered = sorted(samples)
+    return {
+        "p50_ms": round(statistics.median(ordered) * 1000, 3),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))] * 1000, 3),
+    }
+
+
+def run_benchmark(size: int, queries: int = 50, k: int = 10, batch: int = 10000) -> Dict:
+    rng = np.random.default_rng(size)
+    directory = tempfile.mkdtemp(prefix="case_index_bench_")
+    try:
+        index = CaseIndex(directory, ivf_threshold=size + 1)
+        started = time.perf_counter()
+        for start in range(0, size, batch):
+            block = _synthetic(min(batch, size - start), VECTOR_DIM, rng)
+            index.add_many(block, [{"row": start + i} for i in range(len(block))])
+        insert_s = time.perf_counter() - started
+
+        probes = _synthetic(queries, VECTOR_DIM, rng)
+        exact_times, exact_results = [], []
+        for q in probes:
+            t = time.perf_counter()
+            exact_results.append({m["row"] for _, m in index.search(q, k, exact=True)})
+            exact_times.append(time.perf_counter() - t)
+
+        t = time.perf_counter()
+        index.build_ivf()
+        build_s = time.perf_counter() - t
+        ivf_times, hits = [], 0
+        for q, truth in zip(probes, exact_results):
+            t = time.perf_counter()
+            found = {m["row"] for _, m in index.search(q, k, exact=False)}
+            ivf_times.append(time.perf_counter() - t)
+            hits += len(found & truth)
+
+        return {
+            "vectors": size,
+            "insert_per_s": round(size / insert_s),
+            "exact": _latency(exact_times),
+            "ivf_pq": dict(_latency(ivf_times), build_s=round(build_s, 2)),
+            f"ivf_pq_recall_at_{k}": round(hits / (k * queries), 3),
+            "vectors_mb": round(size * VECTOR_DIM * 4 / 1e6, 1),
+            "pq_codes_mb": round(index._ivf.nbytes() / 1e6, 1),
+        }
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="10000,100000", help="comma-separated index sizes")
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--json", action="store_true", help="print the raw JSON report")
+    args = parser.parse_args()
+
+    reports = [run_benchmark(int(size), args.queries, args.k) for size in args.sizes.split(",")]
+    if args.json:
+        print(json.dumps(reports, indent=2))
+        return
+    for r in reports:
+        print(f"\n{r['vectors']:,} vectors ({r['vectors_mb']} MB float32, {r['pq_codes_mb']} MB PQ codes+ids)")
+        print(f"  inserts        {r['insert_per_s']:>12,} / s")
+        print(f"  exact scan     p50 {r['exact']['p50_ms']:>9.3f} ms   p95 {r['exact']['p95_ms']:>9.3f} ms")
+        print(f"  IVF-PQ         p50 {r['ivf_pq']['p50_ms']:>9.3f} ms   p95 {r['ivf_pq']['p95_ms']:>9.3f} ms"
+              f"   (build {r['ivf_pq']['build_s']} s, recall@{args.k} {r[f'ivf_pq_recall_at_{args.k}']})")
+
+
+if __name__ == "__main__":
+    main()
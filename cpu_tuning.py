@@ -0,0 +1,229 @@
+"""CPU budget detection and consistent thread/pool sizing.
+
+NumPy's BLAS, torch's intra-op pool, the image worker processes and the
+analysis threads each default to "all cores", so several of them together
+oversubscribe the CPU, and inside a container "all cores" is often the host's
+count rather than the cgroup quota. `plan()` derives every size from one
+number, the CPUs this process may actually use, and `configure()` applies it
+before NumPy or torch create their thread pools.
+
+Modules read their defaults from `plan()`; explicit SKIN_* variables still win.
+`python cpu_tuning.py --benchmark --write` times the image pipeline under each
+process x thread split and saves the fastest for `plan()` to use.
+"""
+import os
+import sys
+import json
+import math
+import time
+import argparse
+import tempfile
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import instrumentation
+
+TUNING_PATH = os.environ.get("SKIN_TUNING_PATH", os.path.join(tempfile.gettempdir(), "skin_cpu_tuning.json"))
+# Image worker processes beyond this only add memory; decoding is rarely the bottleneck past it.
+MAX_IMAGE_WORKERS = 8
+_BLAS_VARIABLES = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS",
+                   "BLIS_NUM_THREADS", "VECLIB_MAXIMUM_THREADS", "NUMEXPR_NUM_THREADS")
+
+_configured: Optional[Dict] = None
+_configure_lock = threading.Lock()
+
+
+def cgroup_quota() -> Optional[float]:
+    """CPU quota of this process's cgroup in cores, or None when unlimited or unknown."""
+    candidates = [("/sys/fs/cgroup/cpu.max", None)]
+    # cgroup v1 keeps quota and period in separate files.
+    for base in ("/sys/fs/cgroup/cpu", "/sys/fs/cgroup/cpu,cpuacct"):
+        candidates.append((os.path.join(base, "cpu.cfs_quota_us"), os.path.join(base, "cpu.cfs_period_us")))
+    for quota_path, period_path in candidates:
+        try:
+            with open(quota_path) as f:
+                fields = f.read().split()
+            if period_path is None:
+                quota, period = fields[0], fields[1]
+            else:
+                with open(period_path) as f:
+                    quota, period = fields[0], f.read().strip()
+        except (OSError, IndexError):
+            continue
+        if quota in ("max", "-1"):
+            return None
+        return int(quota) / int(period)
+    return None
+
+
+def available_cpus() -> int:
+    """CPUs this process may use: affinity mask, capped by the cgroup quota (rounded up)."""
+    override = os.environ.get("SKIN_CPUS")
+    if override:
+        return max(1, int(override))
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    quota = cgroup_quota()
+    if quota is not None:
+        cpus = min(cpus, max(1, math.ceil(quota)))
+    return max(1, cpus)
+
+
+def _saved_tuning(cpus: int) -> Dict:
+    try:
+        with open(TUNING_PATH) as f:
+            saved = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    # A benchmark from a differently sized host or container does not apply.
+    return saved if saved.get("cpus") == cpus else {}
+
+
+def plan(cpus: Optional[int] = None) -> Dict[str, int]:
+    """Thread and pool sizes that together fit in `cpus` cores.
+
+    Parallelism comes from processes: one image worker per spare core, each
+    with a single BLAS/OpenMP thread, since our arrays are small enough that
+    extra threads only contend. Analysis threads only wait on the workers, so
+    there is one per worker. Batch tools (packing, evaluation) use one process
+    per core; a torch process that is alone on the host may use every core.
+    """
+    cpus = cpus or available_cpus()
+    saved = _saved_tuning(cpus)
+    image_workers = saved.get("image_workers", min(MAX_IMAGE_WORKERS, max(1, cpus - 1)))
+    return {
+        "cpus": cpus,
+        "image_workers": image_workers,
+        "analysis_threads": image_workers,
+        "blas_threads": saved.get("blas_threads", 1),
+        "batch_workers": cpus,
+        "torch_threads": cpus,
+    }
+
+
+def thread_environment(threads: int) -> Dict[str, str]:
+    return {name: str(threads) for name in _BLAS_VARIABLES}
+
+
+def configure(threads: Optional[int] = None) -> Dict:
+    """Cap BLAS/OpenMP/torch threads for this process (once; later calls return the first result).
+
+    Environment variables only take effect if set before NumPy/torch load
+    their thread pools, so call this before importing them; spawned worker
+    processes inherit them. If NumPy was already imported, threadpoolctl
+    (when installed) applies the limit at runtime instead. Variables the
+    operator already set are left alone.
+    """
+    global _configured
+    with _configure_lock:
+        if _configured is not None:
+            return _configured
+        sizes = plan()
+        threads = threads or sizes["blas_threads"]
+        applied = []
+        for name, value in thread_environment(threads).items():
+            if name not in os.environ:
+                os.environ[name] = value
+                applied.append(name)
+        runtime = False
+        if "numpy" in sys.modules:
+            try:
+                from threadpoolctl import threadpool_limits
+                threadpool_limits(threads)
+                runtime = True
+            except ImportError:
+                pass
+        if "torch" in sys.modules:
+            sys.modules["torch"].set_num_threads(threads)
+            runtime = True
+        _configured = dict(sizes, threads=threads, env_applied=applied, runtime_applied=runtime)
+        return _configured
+
+
+def collect_metrics():
+    if _configured is None:
+        return []
+    lines = [
+        "# HELP skin_cpu_budget CPUs available to this process after affinity and cgroup quota.",
+        "# TYPE skin_cpu_budget gauge",
+        f"skin_cpu_budget {_configured['cpus']}",
+        "# HELP skin_cpu_plan Thread and pool sizes chosen by cpu_tuning.",
+        "# TYPE skin_cpu_plan gauge",
+    ]
+    for key in ("image_workers", "analysis_threads", "blas_threads", "batch_workers"):
+        lines.append(f'skin_cpu_plan{{setting="{key}"}} {_configured[key]}')
+    return lines
+
+
+instrumentation.register_collector(collect_metrics)
+
+
+_BENCH_WORKLOAD = """
+import glob, json, sys, time
+from skin_disease_model import predict_disease_from_image
+paths = sorted(glob.glob({pattern!r}))[:{images}]
+blobs = [open(p, "rb").read() for p in paths]
+predict_disease_from_image(blobs[0])
+start = time.perf_counter()
+for blob in blobs:
+    predict_disease_from_image(blob)
+print(json.dumps({{"images": len(blobs), "seconds": time.perf_counter() - start}}))
+"""
+
+
+def _candidates(cpus: int) -> List[Tuple[int, int]]:
+    splits = set()
+    for processes in range(1, cpus + 1):
+        for threads in {1, max(1, cpus // processes)}:
+            splits.add((processes, threads))
+    return sorted(splits)
+
+
+def benchmark(images: int = 30) -> Dict:
+    """Images/s of the image pipeline for every processes x BLAS-threads split that fits."""
+    import subprocess
+    root = os.path.dirname(os.path.abspath(__file__))
+    pattern = os.path.join(root, "Data", "Sample_Skin_Disease_Images", "*.jpg")
+    cpus = available_cpus()
+    code = _BENCH_WORKLOAD.format(pattern=pattern, images=images)
+    results = []
+    for processes, threads in _candidates(cpus):
+        env = dict(os.environ, **thread_environment(threads))
+        started = time.perf_counter()
+        procs = [subprocess.Popen([sys.executable, "-c", code], cwd=root, env=env,
+                                  stdout=subprocess.PIPE, text=True) for _ in range(processes)]
+        outputs = [json.loads(p.communicate()[0].strip().splitlines()[-1]) for p in procs]
+        total = sum(o["images"] for o in outputs)
+        slowest = max(o["seconds"] for o in outputs)
+        results.append({"processes": processes, "threads": threads,
+                        "images_per_s": round(total / slowest, 2),
+                        "wall_s": round(time.perf_counter() - started, 2)})
+    best = max(results, key=lambda r: r["images_per_s"])
+    return {"cpus": cpus, "quota": cgroup_quota(), "results": results,
+            "best": {"image_workers": best["processes"], "blas_threads": best["threads"]}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--benchmark", action="store_true", help="time every process x thread split")
+    parser.add_argument("--images", type=int, default=30, help="images per process in the benchmark")
+    parser.add_argument("--write", action="store_true", help=f"save the best split to {TUNING_PATH}")
+    args = parser.parse_args()
+
+    if not args.benchmark:
+        print(json.dumps(dict(plan(), quota=cgroup_quota()), indent=2))
+        return
+    report = benchmark(args.images)
+    for r in report["results"]:
+        print(f"  {r['processes']:>2} processes x {r['threads']:>2} threads  {r['images_per_s']:>8.2f} images/s")
+    print(f"best: {report['best']}")
+    if args.write:
+        with open(TUNING_PATH, "w") as f:
+            json.dump(dict(report["best"], cpus=report["cpus"], measured_at=time.time()), f)
+        print(f"saved to {TUNING_PATH}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+from types import MappingProxyType
+
+# Static lookup tables shared by the app and the image model. They are built
+# once per process on first import (Streamlit reruns re-execute app.py but not
+# imported modules) and frozen so no session can mutate them.
+
+_disease_keywords = {
+    "akiec": [
+        "scaly", "rough", "dry patch", "crust", "crusty", "sun damaged",
+        "pink patch", "red patch", "sandpaper", "photo damage", "thin plate",
+        "precancer", "precancerous"
+    ],
+    "bcc": [
+        "pearly", "translucent", "shiny bump", "rolled edges", "rolled border",
+        "bleeds", "bleeding", "sore that doesn't heal", "open sore",
+        "small bump", "pink bump", "waxy", "ulcer", "rodent ulcer",
+        "visible blood vessels", "telangiectasia"
+    ],
+    "bkl": [
+        "stuck on", "warty", "wart like", "seborrheic", "brown spot", "flat brown",
+        "age spot", "sun spot", "liver spot", "rough spot", "well defined",
+        "light brown", "dark brown", "keratosis", "non cancerous growth"
+    ],
+    "df": [
+        "firm bump", "hard bump", "dimple", "dimple sign",
+        "small nodule", "brown nodule", "round bump",
+        "insect bite like", "itchy nodule", "smooth dome",
+        "fibrous bump"
+    ],
+    "mel": [
+        "irregular", "asymmetry", "uneven border", "changing", "evolving",
+        "multiple colors", "dark brown", "black patch", "bleeds", "enlarging",
+        "growing quickly", "itchy mole", "new mole", "abnormal mole",
+        "abcde", "color variation", "spreading", "large spot"
+    ],
+    "nv": [
+        "mole", "brown mole", "flat mole", "raised mole", "uniform color",
+        "symmetrical mole", "birthmark", "benign mole", "tan spot",
+        "small brown spot", "regular borders", "smooth edges", 
+        "harmless mole"
+    ],
+    "vasc": [
+        "red spot", "purple spot", "blood spot", "cherry", "angioma",
+        "bright red bump", "bleeds easily", "hemorrhage", "red papule",
+        "angiokeratoma", "vascular lesion", "blue spot", "red nodule",
+        "pyogenic granuloma"
+    ]
+}
+
+_disease_names = {
+    "akiec": "Actinic Keratosis (Pre-cancerous)",
+    "bcc": "Basal Cell Carcinoma",
+    "bkl": "Benign Keratosis",
+    "df": "Dermatofibroma",
+    "mel": "Melanoma",
+    "nv": "Melanocytic Nevus (Mole)",
+    "vasc": "Vascular Lesion",
+    "unknown": "Unknown - Please consult a dermatologist"
+}
+
+_disease_treatments = {
+    "akiec": {
+        "severity": "High - Pre-cancerous",
+        "treatments": [
+            "Topical creams: Imiquimod, 5-fluorouracil (5-FU)",
+            "Cryotherapy (freezing with liquid nitrogen)",
+            "Photodynamic therapy (PDT)",
+            "Chemical peels",
+            "Surgical excision for advanced cases",
+            "Sun protection and preventive measures"
+        ],
+        "urgent": True
+    },
+    "bcc": {
+        "severity": "High - Skin Cancer",
+        "treatments": [
+            "Mohs micrographic surgery (most effective)",
+            "Surgical excision",
+            "Curettage and electrodesiccation",
+            "Cryotherapy",
+            "Radiation therapy",
+            "Topical imiquimod or 5-FU for small lesions"
+        ],
+        "urgent": True
+    },
+    "bkl": {
+        "severity": "Low - Benign",
+        "treatments": [
+            "Observation (no treatment needed if not bothersome)",
+            "Cryotherapy (freezing)",
+            "Surgical removal for cosmetic reasons",
+            "Laser treatment",
+            "Chemical peels",
+            "Topical tretinoin may help"
+        ],
+        "urgent": False
+    },
+    "df": {
+        "severity": "Low - Benign",
+        "treatments": [
+            "Observation (usually no treatment needed)",
+            "Surgical excision for cosmetic concerns",
+            "Cryotherapy",
+            "Laser treatment",
+            "Intralesional steroid injections"
+        ],
+        "urgent": False
+    },
+    "mel": {
+        "severity": "Critical - Melanoma",
+        "treatments": [
+            "URGENT: Surgical excision with wide margins",
+            "Sentinel lymph node biopsy",
+            "Immunotherapy (pembrolizumab, nivolumab)",
+            "Targeted therapy for BRAF mutations",
+            "Chemotherapy if advanced",
+            "Radiation therapy for metastatic disease"
+        ],
+        "urgent": True
+    },
+    "nv": {
+        "severity": "Low - Benign",
+        "treatments": [
+            "Observation (no treatment needed)",
+            "Surgical removal for cosmetic reasons",
+            "Laser treatment",
+            "Cryotherapy",
+            "Dermabrasion"
+        ],
+        "urgent": False
+    },
+    "vasc": {
+        "severity": "Low to Moderate",
+        "treatments": [
+            "Observation for small lesions",
+            "Laser therapy (most effective)",
+            "Cryotherapy",
+            "Sclerotherapy (injection)",
+            "Surgical removal",
+            "Topical treatments"
+        ],
+        "urgent": False
+    },
+    "unknown": {
+        "severity": "Unknown",
+        "treatments": [
+            "Consult a dermatologist for proper diagnosis",
+            "Provide detailed description and photos",
+            "Professional medical evaluation recommended"
+        ],
+        "urgent": False
+    }
+}
+
+condition_colors = MappingProxyType({
+    "mel": "#ff4b4b",
+    "bcc": "#ffa500",
+    "akiec": "#ffa500",
+    "bkl": "#4CAF50",
+    "df": "#4CAF50",
+    "nv": "#4CAF50",
+    "vasc": "#2196F3"
+})
+
+disease_keywords = MappingProxyType({
+    disease: tuple(keywords) for disease, keywords in _disease_keywords.items()
+})
+
+disease_names = MappingProxyType(_disease_names)
+
+disease_treatments = MappingProxyType({
+    condition: MappingProxyType(dict(info, treatments=tuple(info["treatments"])))
+    for condition, info in _disease_treatments.items()
+})
+
+# Image model labels: every known condition, without the "unknown" fallback.
+disease_mapping = MappingProxyType({
+    condition: name for condition, name in _disease_names.items() if condition != "unknown"
+})
+
+del _disease_keywords, _disease_names, _disease_treatments
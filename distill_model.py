@@ -0,0 +1,327 @@
+"""Distil the ResNet50 teacher into a small student for CPU serving.
+
+The teacher's logits are computed once per packed split and stored next to
+the shards as a memory-mapped `.npy`, so student epochs never run the teacher.
+The student (MobileNetV3, ResNet18 or the ~70k-parameter TinyCNN) trains at
+a reduced input side on a mix of the teacher's temperature-softened
+distribution and the true labels. Student augmentation is limited to flips
+and mild colour jitter, which leave the lesion and hence the cached teacher
+targets valid.
+
+The output has the same format as train_model.py's, so `torch:<path>` in
+evaluate_models.py, `model_weights.py export` and `SKIN_IMAGE_MODEL` (which
+routes `get_image_based_analysis` to it) all accept a student unchanged.
+`pareto` evaluates several models on one core and marks the ones no other
+model beats on both balanced accuracy and images/s.
+
+    python distill_model.py logits --teacher models/skin_classifier.pt
+    python distill_model.py train --teacher models/skin_classifier.pt --arch mobilenet_v3_small --side 160
+    python distill_model.py pareto --images <labelled dir> --models heuristic,torch:models/skin_classifier.pt,torch:models/skin_student.pt
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch.utils.data import DataLoader
+from torchvision.transforms import v2
+
+import evaluate_models
+from ham_dataset import DEFAULT_DIR, PackedDataset
+from model_weights import load_torch_model
+from train_model import (
+    IMAGENET_MEAN, IMAGENET_STD, MODEL_PATH, EpochSampler, Normalise, StepMeter,
+    available_cores, build_model, default_workers, eval_transform, evaluate, save_checkpoint, to_uint8_tensor,
+)
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+STUDENT_PATH = os.path.join(ROOT, "models", "skin_student.pt")
+STUDENT_ARCHITECTURES = ("mobilenet_v3_small", "tiny_cnn", "mobilenet_v3_large", "resnet18")
+STUDENT_SIDE = 160
+# Softening temperature and weight of the teacher term (the rest is cross-entropy on labels).
+TEMPERATURE = 4.0
+ALPHA = 0.7
+
+
+def logits_path(data_dir: str, teacher: str, split: str) -> str:
+    name = os.path.splitext(os.path.basename(teacher))[0]
+    return os.path.join(data_dir, f"teacher_{name}_{split}.npy")
+
+
+@torch.inference_mode()
+def teacher_logits(teacher: str, data_dir: str = DEFAULT_DIR, split: str = "train",
+                   batch_size: int = 64, refresh: bool = False) -> np.ndarray:
+    """Teacher logits for every item of `split`, in dataset order (cached; read-only mapping)."""
+    path = logits_path(data_dir, teacher, split)
+    if not refresh and os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(teacher):
+        return np.load(path, mmap_mode="r")
+
+    model, meta, _ = load_torch_model(teacher)
+    model = model.to(memory_format=torch.channels_last)
+    normalise = Normalise(meta["mean"], meta["std"])
+    dataset = PackedDataset(data_dir, split)
+    if list(meta["classes"]) != dataset.classes:
+        raise ValueError(f"teacher classes {meta['classes']} do not match the dataset's {dataset.classes}")
+    resize = v2.Resize((meta["input_side"], meta["input_side"]), antialias=True)
+
+    tmp = f"{path}.tmp.npy"
+    out = np.lib.format.open_memmap(tmp, mode="w+", dtype=np.float32, shape=(len(dataset), len(dataset.classes)))
+    started = time.perf_counter()
+    for start in range(0, len(dataset), batch_size):
+        stop = min(len(dataset), start + batch_size)
+        images, _ = dataset.batch(range(start, stop))
+        batch = resize(torch.from_numpy(images).permute(0, 3, 1, 2))
+        out[start:stop] = model(normalise(batch)).numpy()
+    out.flush()
+    del out
+    os.replace(tmp, path)
+    print(json.dumps({"teacher_logits": path, "items": len(dataset),
+                      "seconds": round(time.perf_counter() - started, 1)}), file=sys.stderr)
+    return np.load(path, mmap_mode="r")
+
+
+class DistillationSet:
+    """PackedDataset items with the teacher's logits attached: `(image, label, logits)`."""
+
+    def __init__(self, dataset: PackedDataset, logits_file: str):
+        self.dataset = dataset
+        self.logits_file = logits_file
+        self.labels = dataset.labels
+        self._logits: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return len(self.dataset)
+
+    def __getitem__(self, i: int):
+        if self._logits is None:
+            self._logits = np.load(self.logits_file, mmap_mode="r")
+        image, label = self.dataset[i]
+        return image, label, torch.from_numpy(np.array(self._logits[i]))
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["_logits"] = None
+        return state
+
+
+def student_transform(side: int = STUDENT_SIDE):
+    """Resize first (everything after runs on the small image), then label-preserving augmentation."""
+    return v2.Compose([
+        to_uint8_tensor,
+        v2.Resize((side, side), antialias=True),
+        v2.RandomHorizontalFlip(),
+        v2.RandomVerticalFlip(),
+        v2.ColorJitter(brightness=0.1, contrast=0.1, saturation=0.1),
+    ])
+
+
+def distillation_loss(student: torch.Tensor, teacher: torch.Tensor, labels: torch.Tensor,
+                      temperature: float = TEMPERATURE, alpha: float = ALPHA) -> torch.Tensor:
+    """`alpha` * T^2 * KL(teacher_T || student_T) + (1 - `alpha`) * cross-entropy on the labels.
+
+    The T^2 factor keeps the soft term's gradients on the same scale as the
+    hard term's whatever the temperature.
+    """
+    soft = F.kl_div(F.log_softmax(student / temperature, dim=1), F.log_softmax(teacher / temperature, dim=1),
+                    reduction="batchmean", log_target=True) * temperature ** 2
+    return alpha * soft + (1 - alpha) * F.cross_entropy(student, labels)
+
+
+def train_student(args) -> Dict:
+    cores = available_cores()
+    workers = default_workers(cores) if args.workers is None else args.workers
+    threads = args.threads or max(1, cores - workers)
+    torch.set_num_threads(threads)
+    torch.set_flush_denormal(True)
+    torch.manual_seed(args.seed)
+
+    teacher_logits(args.teacher, args.data, "train")
+    train_set = DistillationSet(PackedDataset(args.data, "train", transform=student_transform(args.side)),
+                                logits_path(args.data, args.teacher, "train"))
+    test_set = PackedDataset(args.data, "test", transform=eval_transform(args.side))
+    classes = train_set.dataset.classes
+    sampler = EpochSampler(train_set.labels, args.seed)
+    loader_options = dict(num_workers=workers, persistent_workers=workers > 0, pin_memory=False)
+    train_loader = DataLoader(train_set, batch_size=args.batch_size, sampler=sampler, drop_last=True,
+                              **loader_options)
+    test_loader = DataLoader(test_set, batch_size=args.batch_size * 2, shuffle=False, **loader_options)
+
+    model = build_model(args.arch, len(classes), pretrained=not args.no_pretrained)
+    model = model.to(memory_format=torch.channels_last)
+    normalise = Normalise()
+    optimizer = torch.optim.AdamW(model.parameters(), lr=args.lr, weight_decay=1e-4)
+    scheduler = torch.optim.lr_scheduler.CosineAnnealingLR(optimizer, T_max=args.epochs)
+
+    start_epoch = 0
+    checkpoint_path = f"{args.out}.ckpt"
+    if args.resume and os.path.exists(checkpoint_path):
+        state = torch.load(checkpoint_path, map_location="cpu")
+        model.load_state_dict(state["model"])
+        optimizer.load_state_dict(state["optimizer"])
+        scheduler.load_state_dict(state["scheduler"])
+        start_epoch = state["epoch"]
+        print(f"Resumed from {checkpoint_path}: epoch {start_epoch + 1}", file=sys.stderr)
+
+    history: List[Dict] = []
+    meter = StepMeter()
+    for epoch in range(start_epoch, args.epochs):
+        sampler.set_epoch(epoch)
+        model.train()
+        running_loss, batches = 0.0, 0
+        waited = time.perf_counter()
+        for step, (images, labels, targets) in enumerate(train_loader, start=1):
+            fetched = time.perf_counter()
+            loss = distillation_loss(model(normalise(images)), targets, labels, args.temperature, args.alpha)
+            optimizer.zero_grad(set_to_none=True)
+            loss.backward()
+            optimizer.step()
+            meter.record(len(labels), fetched - waited, time.perf_counter() - fetched)
+            running_loss += loss.item()
+            batches += 1
+            if step % args.log_every == 0:
+                print(json.dumps(dict(meter.summary(), epoch=epoch + 1, step=step,
+                                      loss=round(running_loss / batches, 4))))
+                meter.reset()
+            waited = time.perf_counter()
+        scheduler.step()
+
+        metrics = evaluate(model, normalise, test_loader, len(classes))
+        summary = dict(epoch=epoch + 1, loss=round(running_loss / max(1, batches), 4), **metrics)
+        history.append(summary)
+        print(json.dumps(summary))
+        save_checkpoint(checkpoint_path, {"model": model.state_dict(), "optimizer": optimizer.state_dict(),
+                                          "scheduler": scheduler.state_dict(), "epoch": epoch + 1})
+
+    save_checkpoint(args.out, {
+        "model": model.state_dict(),
+        "arch": args.arch,
+        "classes": classes,
+        "input_side": args.side,
+        "mean": IMAGENET_MEAN,
+        "std": IMAGENET_STD,
+        "teacher": args.teacher,
+        "distillation": {"temperature": args.temperature, "alpha": args.alpha},
+    })
+    parameters = sum(p.numel() for p in model.parameters())
+    return {"history": history, "model": args.out, "parameters": parameters, "workers": workers, "threads": threads}
+
+
+def pareto_front(rows: Sequence[Dict], speed: str = "images_per_core_s",
+                 quality: str = "balanced_accuracy") -> List[bool]:
+    """True for rows that no other row matches or beats on both axes (and beats on one)."""
+    front = []
+    for row in rows:
+        dominated = any(
+            other[speed] >= row[speed] and other[quality] >= row[quality]
+            and (other[speed] > row[speed] or other[quality] > row[quality])
+            for other in rows
+        )
+        front.append(not dominated)
+    return front
+
+
+def pareto_report(images: str, specs: Sequence[str], metadata: Optional[str] = None,
+                  limit: Optional[int] = None, baseline: Optional[str] = None) -> Dict:
+    """Single-core latency against accuracy for each predictor, with the Pareto front marked.
+
+    One worker process runs each predictor on one thread, so images/s per core
+    is simply the inverse of its median per-image latency (decode included).
+    """
+    report = evaluate_models.evaluate(images, specs, workers=1, metadata=metadata, limit=limit)
+    rows = []
+    for spec, result in report["predictors"].items():
+        p50 = result["latency_ms"]["p50"] or float("nan")
+        row = {
+            "model": spec,
+            "balanced_accuracy": result["balanced_accuracy"],
+            "accuracy": result["accuracy"],
+            "mel_recall": result["recall"].get("mel"),
+            "latency_p50_ms": result["latency_ms"]["p50"],
+            "latency_p95_ms": result["latency_ms"]["p95"],
+            "images_per_core_s": round(1000.0 / p50, 2),
+        }
+        if spec.startswith("torch:"):
+            path = spec.partition(":")[2]
+            row["file_mb"] = round(os.path.getsize(path) / 2 ** 20, 2)
+        rows.append(row)
+    reference = next((r for r in rows if r["model"] == baseline), None)
+    for row, on_front in zip(rows, pareto_front(rows)):
+        row["pareto"] = on_front
+        if reference:
+            row["speedup"] = round(row["images_per_core_s"] / reference["images_per_core_s"], 2)
+            row["balanced_accuracy_delta"] = round(row["balanced_accuracy"] - reference["balanced_accuracy"], 4)
+    rows.sort(key=lambda r: r["images_per_core_s"])
+    return {"images": images, "count": report["predictors"][specs[0]]["images"], "baseline": baseline,
+            "rows": rows, "details": report["predictors"]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    logits = sub.add_parser("logits", help="cache the teacher's logits for a packed split")
+    logits.add_argument("--teacher", default=MODEL_PATH)
+    logits.add_argument("--data", default=DEFAULT_DIR)
+    logits.add_argument("--split", default="train")
+    logits.add_argument("--refresh", action="store_true", help="recompute even if the cache is newer")
+
+    train = sub.add_parser("train", help="train a student against the cached teacher logits")
+    train.add_argument("--teacher", default=MODEL_PATH)
+    train.add_argument("--data", default=DEFAULT_DIR)
+    train.add_argument("--arch", choices=STUDENT_ARCHITECTURES, default="mobilenet_v3_small")
+    train.add_argument("--side", type=int, default=STUDENT_SIDE, help="student input side in pixels")
+    train.add_argument("--no-pretrained", action="store_true")
+    train.add_argument("--epochs", type=int, default=30)
+    train.add_argument("--batch-size", type=int, default=64)
+    train.add_argument("--lr", type=float, default=1e-3)
+    train.add_argument("--temperature", type=float, default=TEMPERATURE)
+    train.add_argument("--alpha", type=float, default=ALPHA, help="weight of the teacher term")
+    train.add_argument("--workers", type=int, default=None)
+    train.add_argument("--threads", type=int, default=None)
+    train.add_argument("--log-every", type=int, default=20, help="batches between throughput lines")
+    train.add_argument("--resume", action="store_true", help="continue from <out>.ckpt if present")
+    train.add_argument("--seed", type=int, default=42)
+    train.add_argument("--out", default=STUDENT_PATH)
+
+    pareto = sub.add_parser("pareto", help="latency vs accuracy of several predictors on one core")
+    pareto.add_argument("--images", required=True, help="class-per-folder tree, or a flat folder with --metadata")
+    pareto.add_argument("--metadata", default=None)
+    pareto.add_argument("--models", required=True, help="comma-separated predictor specs (see evaluate_models.py)")
+    pareto.add_argument("--baseline", default=None, help="spec the speedups are relative to (default: first torch model)")
+    pareto.add_argument("--limit", type=int, default=None)
+    pareto.add_argument("--report", default=None, help="write the JSON report here")
+    pareto.add_argument("--json", action="store_true", help="print the raw JSON report")
+    args = parser.parse_args()
+
+    if args.command == "logits":
+        table = teacher_logits(args.teacher, args.data, args.split, refresh=args.refresh)
+        print(json.dumps({"path": logits_path(args.data, args.teacher, args.split), "shape": list(table.shape)}))
+    elif args.command == "train":
+        result = train_student(args)
+        print(json.dumps({k: v for k, v in result.items() if k != "history"}))
+    else:
+        specs = args.models.split(",")
+        baseline = args.baseline or next((s for s in specs if s.startswith("torch:")), specs[0])
+        report = pareto_report(args.images, specs, args.metadata, args.limit, baseline)
+        if args.report:
+            with open(args.report, "w") as f:
+                json.dump(report, f, indent=2)
+        if args.json:
+            print(json.dumps(report, indent=2))
+            return
+        print(f"{report['count']} images, one core; * = Pareto-optimal, speedup vs {baseline}")
+        print(f"  {'model':<44} {'bal acc':>8} {'mel rec':>8} {'p50 ms':>8} {'img/s/core':>11} {'speedup':>8}")
+        for row in report["rows"]:
+            mark = "*" if row["pareto"] else " "
+            print(f"{mark} {row['model']:<44} {row['balanced_accuracy']:>8.4f} "
+                  f"{'-' if row['mel_recall'] is None else row['mel_recall']:>8} "
+                  f"{row['latency_p50_ms']:>8.2f} {row['images_per_core_s']:>11.2f} {row.get('speedup', '-'):>8}")
+
+
+if __name__ == "__main__":
+    main()
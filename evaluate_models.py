@@ -0,0 +1,318 @@
+"""Offline evaluation of image predictors over a labelled image set.
+
+Runs one or more predictors over the same images in a process pool and
+reports, per predictor and side by side: accuracy, balanced accuracy,
+per-class recall and precision (melanoma sensitivity first), the confusion
+matrix, a reliability curve with expected calibration error, and per-image
+latency and throughput. The JSON report can be kept as a baseline; a later
+run given `--baseline` fails when any class's recall drops by more than the
+tolerance, so speedups cannot quietly cost sensitivity.
+
+Labels come from an ImageFolder-style tree (`<root>/<label>/*.jpg`) or, for a
+flat folder, from the HAM10000 metadata CSV.
+
+    python evaluate_models.py --images Data/Sample_Skin_Disease_Images \\
+        --predictor heuristic --predictor torch:models/skin_classifier.weights --report eval.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import importlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import cpu_tuning
+from disease_tables import disease_mapping
+from ham_dataset import METADATA_CSV, read_metadata
+
+CLASSES = tuple(disease_mapping)
+# Recall of these classes is reported first and gated hardest.
+CRITICAL_CLASSES = ("mel", "bcc", "akiec")
+CALIBRATION_BINS = 10
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+
+# A predictor takes encoded image bytes and returns (class index, per-class probabilities or None).
+Predictor = Callable[[bytes], Tuple[int, Optional[np.ndarray], float]]
+
+
+def heuristic_predictor() -> Predictor:
+    """The app's feature-based `predict_disease_from_image`."""
+    from skin_disease_model import predict_disease_from_image
+
+    def predict(data: bytes):
+        result = predict_disease_from_image(data)
+        condition = result.get("condition", "unknown")
+        index = CLASSES.index(condition) if condition in CLASSES else -1
+        return index, None, float(result.get("confidence", 0.0))
+    return predict
+
+
+def torch_classifier(path: str):
+    """`(classify, meta, stats)` for a train_model.py / distill_model.py checkpoint on one CPU thread.
+
+    `classify` takes (H, W, 3) uint8 pixels, resizes them to the model's input
+    side if needed, and returns probabilities in CLASSES order.
+    """
+    import torch
+    from PIL import Image
+    from model_weights import load_torch_model
+    from train_model import Normalise
+
+    model, meta, stats = load_torch_model(path)
+    normalise = Normalise(meta["mean"], meta["std"])
+    side = meta["input_side"]
+    # Map the checkpoint's class order onto CLASSES.
+    order = np.array([CLASSES.index(c) for c in meta["classes"]])
+    torch.set_num_threads(1)
+
+    @torch.inference_mode()
+    def classify(pixels: np.ndarray) -> np.ndarray:
+        if pixels.shape[:2] != (side, side):
+            pixels = np.asarray(Image.fromarray(pixels).resize((side, side), Image.BILINEAR))
+        batch = torch.from_numpy(np.array(pixels, copy=True)).permute(2, 0, 1).unsqueeze(0)
+        probs = torch.softmax(model(normalise(batch)), dim=1)[0].numpy()
+        aligned = np.zeros(len(CLASSES), dtype=np.float64)
+        aligned[order] = probs
+        return aligned
+    return classify, meta, stats
+
+
+def torch_predictor(path: str) -> Predictor:
+    """A train_model.py checkpoint (`.pt`) or its mappable export (`.weights`), on CPU."""
+    import io
+    from PIL import Image
+
+    classify, meta, stats = torch_classifier(path)
+    side = meta["input_side"]
+
+    def predict(data: bytes):
+        with Image.open(io.BytesIO(data)) as img:
+            # JPEG decodes at a reduced scale straight away when the model input is small.
+            img.draft("RGB", (side, side))
+            pixels = np.asarray(img.convert("RGB").resize((side, side), Image.BILINEAR))
+        aligned = classify(pixels)
+        return int(aligned.argmax()), aligned, float(aligned.max())
+    predict.memory = stats
+    return predict
+
+
+def load_predictor(spec: str) -> Predictor:
+    """`heuristic`, `torch:<checkpoint>` or `<module>:<factory>` returning a predictor."""
+    if spec == "heuristic":
+        return heuristic_predictor()
+    kind, _, arg = spec.partition(":")
+    if kind == "torch":
+        return torch_predictor(arg)
+    return getattr(importlib.import_module(kind), arg)()
+
+
+def labelled_images(root: str, metadata: Optional[str] = None) -> List[Tuple[str, int]]:
+    """(path, class index) pairs from a class-per-folder tree or a flat folder plus metadata."""
+    pairs = []
+    subdirs = [d for d in sorted(os.listdir(root)) if d in CLASSES and os.path.isdir(os.path.join(root, d))]
+    if subdirs:
+        for label in subdirs:
+            for name in sorted(os.listdir(os.path.join(root, label))):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    pairs.append((os.path.join(root, label, name), CLASSES.index(label)))
+        return pairs
+    labels = {row["image_id"]: row["dx"] for row in read_metadata(metadata or METADATA_CSV)}
+    for name in sorted(os.listdir(root)):
+        stem, ext = os.path.splitext(name)
+        if ext.lower() in IMAGE_EXTENSIONS and labels.get(stem) in CLASSES:
+            pairs.append((os.path.join(root, name), CLASSES.index(labels[stem])))
+    return pairs
+
+
+_predictor: Optional[Predictor] = None
+
+
+def _init_worker(spec: str):
+    global _predictor
+    _predictor = load_predictor(spec)
+
+
+def _loader_memory(_=None) -> Optional[Dict]:
+    return getattr(_predictor, "memory", None)
+
+
+def _predict_chunk(paths: Sequence[str]) -> List[Tuple[int, Optional[List[float]], float, float]]:
+    out = []
+    for path in paths:
+        with open(path, "rb") as f:
+            data = f.read()
+        started = time.perf_counter()
+        index, probs, confidence = _predictor(data)
+        out.append((index, None if probs is None else probs.tolist(), confidence, time.perf_counter() - started))
+    return out
+
+
+def run_predictor(spec: str, paths: Sequence[str], workers: int, chunk: int = 8) -> Dict:
+    """Predictions, probabilities, confidences and latencies for every path, in order."""
+    chunks = [paths[i:i + chunk] for i in range(0, len(paths), chunk)]
+    started = time.perf_counter()
+    if workers <= 1:
+        _init_worker(spec)
+        results = [_predict_chunk(c) for c in chunks]
+        memory = _loader_memory()
+    else:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_init_worker, initargs=(spec,)) as pool:
+            results = list(pool.map(_predict_chunk, chunks))
+            memory = pool.submit(_loader_memory).result()
+    wall_s = time.perf_counter() - started
+    rows = [r for block in results for r in block]
+    probs = [r[1] for r in rows]
+    return {
+        "predicted": np.array([r[0] for r in rows], dtype=np.int64),
+        "probabilities": np.array(probs, dtype=np.float64) if probs and probs[0] is not None else None,
+        "confidence": np.array([r[2] for r in rows], dtype=np.float64),
+        "latency_s": np.array([r[3] for r in rows], dtype=np.float64),
+        "wall_s": wall_s,
+        "memory": memory,
+    }
+
+
+def confusion_matrix(truth: np.ndarray, predicted: np.ndarray, classes: int) -> np.ndarray:
+    """Rows are true classes; a prediction of -1 (unknown) goes to an extra last column."""
+    column = np.where(predicted < 0, classes, predicted)
+    return np.bincount(truth * (classes + 1) + column, minlength=classes * (classes + 1)).reshape(classes, classes + 1)
+
+
+def calibration(correct: np.ndarray, confidence: np.ndarray, bins: int = CALIBRATION_BINS) -> Dict:
+    """Reliability curve over equal-width confidence bins and expected calibration error."""
+    which = np.minimum((np.clip(confidence, 0, 1) * bins).astype(np.int64), bins - 1)
+    count = np.bincount(which, minlength=bins)
+    conf_sum = np.bincount(which, weights=confidence, minlength=bins)
+    hit_sum = np.bincount(which, weights=correct.astype(np.float64), minlength=bins)
+    filled = count > 0
+    mean_conf = np.where(filled, conf_sum / np.maximum(count, 1), np.nan)
+    accuracy = np.where(filled, hit_sum / np.maximum(count, 1), np.nan)
+    ece = float(np.nansum(np.abs(accuracy - mean_conf) * count) / max(1, count.sum()))
+    return {
+        "bins": [
+            {"upper": round((b + 1) / bins, 2), "count": int(count[b]),
+             "confidence": None if not filled[b] else round(float(mean_conf[b]), 4),
+             "accuracy": None if not filled[b] else round(float(accuracy[b]), 4)}
+            for b in range(bins)
+        ],
+        "ece": round(ece, 4),
+    }
+
+
+def summarise(truth: np.ndarray, run: Dict) -> Dict:
+    k = len(CLASSES)
+    predicted = run["predicted"]
+    matrix = confusion_matrix(truth, predicted, k)
+    support = matrix.sum(axis=1)
+    hits = matrix[np.arange(k), np.arange(k)]
+    recall = np.where(support > 0, hits / np.maximum(support, 1), np.nan)
+    predicted_count = matrix[:, :k].sum(axis=0)
+    precision = np.where(predicted_count > 0, hits / np.maximum(predicted_count, 1), np.nan)
+    correct = predicted == truth
+    latency = run["latency_s"]
+    report = {
+        "images": int(len(truth)),
+        "accuracy": round(float(correct.mean()) if len(truth) else 0.0, 4),
+        "balanced_accuracy": round(float(np.nanmean(recall)) if np.any(support) else 0.0, 4),
+        "recall": {c: None if np.isnan(r) else round(float(r), 4) for c, r in zip(CLASSES, recall)},
+        "precision": {c: None if np.isnan(p) else round(float(p), 4) for c, p in zip(CLASSES, precision)},
+        "support": {c: int(s) for c, s in zip(CLASSES, support)},
+        "critical_recall": {c: None if np.isnan(recall[CLASSES.index(c)]) else round(float(recall[CLASSES.index(c)]), 4)
+                            for c in CRITICAL_CLASSES},
+        "unknown_predictions": int((predicted < 0).sum()),
+        "confusion": {"labels": list(CLASSES) + ["unknown"], "matrix": matrix.tolist()},
+        "calibration": calibration(correct, run["confidence"]),
+        "latency_ms": {
+            "p50": round(float(np.percentile(latency, 50)) * 1000, 3) if len(latency) else None,
+            "p95": round(float(np.percentile(latency, 95)) * 1000, 3) if len(latency) else None,
+        },
+        "throughput_per_s": round(len(truth) / max(run["wall_s"], 1e-9), 2),
+    }
+    if run["memory"]:
+        # What loading the predictor's weights cost one worker (see model_weights).
+        report["loader_memory"] = run["memory"]
+    if run["probabilities"] is not None:
+        # Multi-class Brier score, only for predictors that return a distribution.
+        onehot = np.eye(k)[truth]
+        report["brier"] = round(float(((run["probabilities"] - onehot) ** 2).sum(axis=1).mean()), 4)
+    return report
+
+
+def regressions(report: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Per-class recall drops larger than `tolerance` against a baseline report."""
+    problems = []
+    for name, current in report["predictors"].items():
+        before = baseline.get("predictors", {}).get(name)
+        if not before:
+            continue
+        for cls, old in before["recall"].items():
+            new = current["recall"].get(cls)
+            if old is not None and new is not None and new < old - tolerance:
+                problems.append(f"{name}: {cls} recall {old:.3f} -> {new:.3f}")
+    return problems
+
+
+def evaluate(images: str, predictors: Sequence[str], workers: int, metadata: Optional[str] = None,
+             limit: Optional[int] = None) -> Dict:
+    pairs = labelled_images(images, metadata)[:limit]
+    paths = [p for p, _ in pairs]
+    truth = np.array([label for _, label in pairs], dtype=np.int64)
+    report = {"images": images, "classes": list(CLASSES), "workers": workers, "predictors": {}}
+    for spec in predictors:
+        report["predictors"][spec] = summarise(truth, run_predictor(spec, paths, workers))
+    return report
+
+
+def _print_table(report: Dict):
+    names = list(report["predictors"])
+    rows = [("accuracy", lambda r: r["accuracy"]), ("balanced accuracy", lambda r: r["balanced_accuracy"])]
+    rows += [(f"recall {c}", lambda r, c=c: r["recall"][c]) for c in CRITICAL_CLASSES]
+    rows += [(f"recall {c}", lambda r, c=c: r["recall"][c]) for c in CLASSES if c not in CRITICAL_CLASSES]
+    rows += [("ECE", lambda r: r["calibration"]["ece"]), ("latency p50 ms", lambda r: r["latency_ms"]["p50"]),
+             ("latency p95 ms", lambda r: r["latency_ms"]["p95"]), ("images/s", lambda r: r["throughput_per_s"])]
+    width = max(12, *(len(n) for n in names))
+    print(f"{'':<20}" + "".join(f"{n:>{width + 2}}" for n in names))
+    for label, get in rows:
+        cells = []
+        for n in names:
+            value = get(report["predictors"][n])
+            cells.append(f"{'-' if value is None else value:>{width + 2}}")
+        print(f"{label:<20}" + "".join(cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--images", required=True, help="class-per-folder tree, or a flat folder with --metadata")
+    parser.add_argument("--metadata", default=None, help="HAM10000 metadata CSV for flat folders")
+    parser.add_argument("--predictor", action="append", default=None,
+                        help="heuristic, torch:<checkpoint> or module:factory (repeatable)")
+    parser.add_argument("--workers", type=int, default=cpu_tuning.plan()["batch_workers"])
+    parser.add_argument("--limit", type=int, default=None, help="evaluate only the first N images")
+    parser.add_argument("--report", default=None, help="write the JSON report here")
+    parser.add_argument("--baseline", default=None, help="earlier report to compare per-class recall against")
+    parser.add_argument("--tolerance", type=float, default=0.02, help="allowed recall drop before failing")
+    args = parser.parse_args()
+    # Spawned workers inherit the one-thread BLAS environment instead of each claiming every core.
+    cpu_tuning.configure()
+
+    report = evaluate(args.images, args.predictor or ["heuristic"], args.workers, args.metadata, args.limit)
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+    _print_table(report)
+    if args.baseline:
+        with open(args.baseline) as f:
+            problems = regressions(report, json.load(f), args.tolerance)
+        if problems:
+            print("Recall regressions:\n  " + "\n  ".join(problems), file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""CPU budget check for the image feature pipeline.
+
+Runs `predict_disease_from_image` over the sample images (already decoded, so
+only feature work is timed) and reports per-image CPU time of the whole call
+and of the ABCD stage alone, plus batched ABCD throughput. Exits non-zero when
+a p95 exceeds its budget, so it can gate changes to the feature code.
+
+    python feature_benchmark.py --budget-ms 50 --abcd-budget-ms 10
+"""
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import statistics
+from typing import Dict, List
+
+from abcd_features import abcd_features, abcd_from_segmentations
+from image_ingest import ImageAsset
+from lesion_segmentation import segment_lesion
+from skin_disease_model import predict_disease_from_image
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+SAMPLE_GLOB = os.path.join(ROOT, "Data", "Sample_Skin_Disease_Images", "*.jpg")
+
+
+def _cpu_ms(samples: List[float]) -> Dict:
+    ordered = sorted(samples)
+    return {
+        "p50_ms": round(statistics.median(ordered) * 1000, 3),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))] * 1000, 3),
+    }
+
+
+def run_benchmark(paths: List[str], repeats: int = 3) -> Dict:
+    assets = [ImageAsset(data=open(path, "rb").read()) for path in paths]
+    for asset in assets:
+        asset.pixels  # decode up front; decoding has its own budget in the worker
+    segmentations = [s for s in (segment_lesion(a.pixels) for a in assets) if s["segmented"]]
+
+    predict_times, abcd_times = [], []
+    for _ in range(repeats):
+        for asset in assets:
+            started = time.process_time()
+            predict_disease_from_image(asset)
+            predict_times.append(time.process_time() - started)
+        for seg in segmentations:
+            started = time.process_time()
+            abcd_features(seg["thumbnail_mask"], seg["thumbnail"])
+            abcd_times.append(time.process_time() - started)
+
+    started = time.process_time()
+    for _ in range(repeats):
+        abcd_from_segmentations(segmentations)
+    batch_s = (time.process_time() - started) / repeats
+
+    return {
+        "images": len(assets),
+        "segmented": len(segmentations),
+        "predict": _cpu_ms(predict_times),
+        "abcd": _cpu_ms(abcd_times),
+        "abcd_batch_per_image_ms": round(batch_s / max(1, len(segmentations)) * 1000, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--budget-ms", type=float, default=50.0,
+                        help="p95 CPU budget per predict_disease_from_image call")
+    parser.add_argument("--abcd-budget-ms", type=float, default=10.0,
+                        help="p95 CPU budget for the ABCD features of one lesion")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--json", action="store_true", help="print the raw JSON report")
+    args = parser.parse_args()
+
+    report = run_benchmark(sorted(glob.glob(SAMPLE_GLOB)), args.repeats)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"{report['images']} images, {report['segmented']} segmented")
+        print(f"  predict_disease_from_image  p50 {report['predict']['p50_ms']:>8.3f} ms   "
+              f"p95 {report['predict']['p95_ms']:>8.3f} ms CPU   (budget {args.budget_ms} ms)")
+        print(f"  ABCD features               p50 {report['abcd']['p50_ms']:>8.3f} ms   "
+              f"p95 {report['abcd']['p95_ms']:>8.3f} ms CPU   (budget {args.abcd_budget_ms} ms)")
+        print(f"  ABCD batched                {report['abcd_batch_per_image_ms']:>8.3f} ms CPU per image")
+
+    over = []
+    if report["predict"]["p95_ms"] > args.budget_ms:
+        over.append("predict_disease_from_image")
+    if report["abcd"]["p95_ms"] > args.abcd_budget_ms:
+        over.append("ABCD features")
+    if over:
+        print(f"Over CPU budget: {', '.join(over)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,349 @@
+import io
+import os
+import time
+import socket
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Dict, Iterator, List, Optional
+
+import instrumentation
+import shared_cache
+from instrumentation import span
+from image_ingest import ImageAsset, asset_for_message, has_image
+
+# Points the SDK at another endpoint, e.g. the offline stand-in in gemini_stub_server.py.
+BASE_URL = os.environ.get("SKIN_GEMINI_BASE_URL") or None
+# Opt-in: uploads leave a copy of each image in the key's Gemini project for up to 48 hours.
+FILE_REFERENCES = os.environ.get("SKIN_GEMINI_FILE_REFS", "0") == "1"
+# Below this an upload's extra round trips cost more than sending the bytes inline.
+FILE_REFERENCE_MIN_BYTES = 8 * 1024
+# Gemini deletes uploads after 48 hours; stop using a reference well before that.
+FILE_EXPIRY_MARGIN = 3600
+DEFAULT_FILE_LIFETIME = 48 * 3600
+# A failed upload is not retried for this long; those images go inline meanwhile.
+FILE_FAILURE_TTL = 600
+UPLOAD_TIMEOUT = 30.0
+UPLOAD_THREADS = 4
+
+_upload_lock = threading.Lock()
+_upload_pool: Optional[ThreadPoolExecutor] = None
+_uploads: Dict[str, object] = {}
+_file_counts = {"inline": 0, "reference": 0, "uploads": 0, "upload_errors": 0, "uploaded_bytes": 0,
+                "stale_retries": 0}
+
+
+def get_gemini_client(api_key: str):
+    # Deferred so sessions without an API key never pay for importing the SDK.
+    from google import genai
+    from google.genai import types
+    # The hook hands each streaming response to its StreamHandle, so it can be aborted.
+    options = types.HttpOptions(base_url=BASE_URL, client_args={"event_hooks": {"response": [_attach_response]}})
+    return genai.Client(api_key=api_key, http_options=options)
+
+
+class StreamHandle:
+    """Lets another thread abort a streaming request, even while it waits for the first token.
+
+    Closing shuts down the response's socket, which wakes a read blocked in
+    the SDK; a request whose headers have not arrived yet is shut down as
+    soon as they do.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._response = None
+        self.closed = False
+
+    def attach(self, response):
+        with self._lock:
+            self._response = response
+            closed = self.closed
+        if closed:
+            self._shutdown(response)
+
+    def detach(self):
+        # A finished response's connection goes back to the pool and must not be shut down later.
+        with self._lock:
+            self._response = None
+
+    def close(self):
+        with self._lock:
+            self.closed = True
+            response = self._response
+        if response is not None:
+            self._shutdown(response)
+
+    @staticmethod
+    def _shutdown(response):
+        if getattr(response, "is_closed", False):
+            return
+        stream = getattr(response, "extensions", {}).get("network_stream")
+        sock = stream.get_extra_info("socket") if stream is not None else None
+        try:
+            if sock is not None:
+                sock.shutdown(socket.SHUT_RDWR)
+            else:
+                response.close()
+        except Exception:
+            pass
+
+
+_stream_local = threading.local()
+
+
+def _attach_response(response):
+    handle = getattr(_stream_local, "handle", None)
+    if handle is not None:
+        handle.attach(response)
+
+
+def _count_files(name: str, amount: int = 1):
+    with _upload_lock:
+        _file_counts[name] += amount
+
+
+class FileReferences:
+    """Upload-once Gemini file references for the images sent with one API key.
+
+    References live in the shared cache under the API key and the image's
+    content digest, so every worker and every later turn reuses one upload
+    until it nears Gemini's expiry. Images without a reference are uploaded
+    in parallel (concurrent requests for the same image share one upload);
+    anything not uploaded in time, or whose upload failed, goes inline.
+    """
+
+    def __init__(self, client, api_key: str):
+        self.client = client
+        # Uploaded files belong to the key's project, and stand-in servers have their own.
+        self.scope = hashlib.sha256(f"{BASE_URL}|{api_key}".encode()).hexdigest()[:16]
+        self.used: List[str] = []
+
+    @staticmethod
+    def _cache():
+        return shared_cache.get_cache("gemini_files", ttl=DEFAULT_FILE_LIFETIME)
+
+    def _key(self, digest: str) -> str:
+        return f"{self.scope}:{digest}"
+
+    def _cached(self, asset: ImageAsset) -> Optional[Dict]:
+        """The cached reference or failure marker, unless the reference is close to expiry."""
+        entry = self._cache().get(self._key(asset.digest))
+        if entry and not entry.get("failed") and entry["expires_at"] - FILE_EXPIRY_MARGIN < time.time():
+            return None
+        return entry
+
+    def _upload(self, key: str, asset: ImageAsset) -> Optional[Dict]:
+        from google.genai import types
+        try:
+            with span("gemini_file_upload"):
+                uploaded = self.client.files.upload(file=io.BytesIO(asset.raw_bytes),
+                                                    config=types.UploadFileConfig(mime_type=asset.mime))
+            expires_at = (uploaded.expiration_time.timestamp() if uploaded.expiration_time
+                          else time.time() + DEFAULT_FILE_LIFETIME)
+            entry = {"uri": uploaded.uri, "mime": uploaded.mime_type or asset.mime, "expires_at": expires_at}
+            self._cache().set(key, entry, ttl=max(1.0, expires_at - FILE_EXPIRY_MARGIN - time.time()))
+            _count_files("uploads")
+            _count_files("uploaded_bytes", len(asset.raw_bytes))
+            return entry
+        except Exception:
+            self._cache().set(key, {"failed": True}, ttl=FILE_FAILURE_TTL)
+            _count_files("upload_errors")
+            return None
+        finally:
+            with _upload_lock:
+                _uploads.pop(key, None)
+
+    def _submit(self, asset: ImageAsset):
+        global _upload_pool
+        key = self._key(asset.digest)
+        with _upload_lock:
+            future = _uploads.get(key)
+            if future is None:
+                if _upload_pool is None:
+                    _upload_pool = ThreadPoolExecutor(UPLOAD_THREADS, thread_name_prefix="gemini-upload")
+                future = _uploads[key] = _upload_pool.submit(self._upload, key, asset)
+        return future
+
+    def resolve(self, assets: List[ImageAsset], timeout: float = UPLOAD_TIMEOUT) -> Dict[str, Dict]:
+        """Digest -> file reference for every asset that has (or now gets) one."""
+        found: Dict[str, Dict] = {}
+        pending = {}
+        for asset in assets:
+            if len(asset.raw_bytes) < FILE_REFERENCE_MIN_BYTES:
+                continue
+            entry = self._cached(asset)
+            if entry is None:
+                pending[asset.digest] = self._submit(asset)
+            elif not entry.get("failed"):
+                found[asset.digest] = entry
+        if pending:
+            wait(list(pending.values()), timeout=timeout)
+            for digest, future in pending.items():
+                entry = future.result() if future.done() else None
+                if entry is not None:
+                    found[digest] = entry
+        self.used.extend(found)
+        return found
+
+    def forget_used(self):
+        """Drop the references this request used, after the server rejected one of them."""
+        for digest in self.used:
+            self._cache().delete(self._key(digest))
+        self.used = []
+
+
+def build_request(messages: List[Dict], model: str, temperature: float, max_tokens: int,
+                  files: Optional[FileReferences] = None):
+    """Convert chat messages into Gemini contents and a generation config.
+
+    With `files`, images go as file references where one exists or can be
+    uploaded now, so a request's size stops growing with the image count.
+    """
+    from google.genai import types
+    with span("gemini_request_build", model=model):
+        system_text = None
+        api_messages = []
+        sent_images = set()
+        turns = []
+
+        for m in messages:
+            if m["role"] == "system":
+                system_text = m["content"]
+                continue
+
+            role = "user" if m["role"] == "user" else "model"
+            asset = None
+            duplicate = False
+            duplicate_id = m.get("duplicate_of", {}).get("image_id")
+            if has_image(m) and m["role"] == "user" and duplicate_id in sent_images:
+                duplicate = True
+            elif has_image(m) and m["role"] == "user":
+                # Shared asset: earlier images are base64-decoded once per process, not every turn.
+                asset = asset_for_message(m)
+                sent_images.add(asset.digest)
+            turns.append((role, m["content"], asset, duplicate))
+
+        references = files.resolve([t[2] for t in turns if t[2] is not None]) if files is not None else {}
+
+        for role, text, asset, duplicate in turns:
+            parts = [types.Part(text=text)]
+            if duplicate:
+                # The model already has the earlier copy in this conversation.
+                parts.append(types.Part(text="[Image omitted: near-duplicate of an image sent earlier in this conversation]"))
+            elif asset is not None and asset.digest in references:
+                ref = references[asset.digest]
+                parts.append(types.Part(file_data=types.FileData(file_uri=ref["uri"], mime_type=ref["mime"])))
+                _count_files("reference")
+            elif asset is not None:
+                parts.append(types.Part(inline_data=types.Blob(mime_type=asset.mime, data=asset.raw_bytes)))
+                _count_files("inline")
+
+            api_messages.append(types.Content(role=role, parts=parts))
+
+        config_dict = {
+            "temperature": temperature,
+            "max_output_tokens": max_tokens,
+        }
+        if system_text:
+            config_dict["system_instruction"] = system_text
+        return api_messages, types.GenerateContentConfig(**config_dict)
+
+
+def _file_references(client, api_key: Optional[str]) -> Optional[FileReferences]:
+    return FileReferences(client, api_key) if api_key and FILE_REFERENCES else None
+
+
+# Gemini answers 400/403/404 for a file that was deleted, expired early or belongs to another project.
+_FILE_ERROR_PHRASES = ("not exist", "expired", "not found", "permission", "not accessible")
+
+
+def _rejected_reference(error: Exception, files: Optional[FileReferences]) -> bool:
+    """True only when the server refused one of this request's file references."""
+    if files is None or not files.used or getattr(error, "code", None) not in (400, 403, 404):
+        return False
+    message = (getattr(error, "message", None) or str(error)).lower()
+    return "file" in message and any(phrase in message for phrase in _FILE_ERROR_PHRASES)
+
+
+def stream_chat(client, messages: List[Dict], model: str, temperature: float, max_tokens: int,
+                api_key: Optional[str] = None, handle: Optional[StreamHandle] = None) -> Iterator[str]:
+    """Stream response text, letting API errors propagate to the caller.
+
+    With `api_key`, images are sent as upload-once file references. If the
+    server rejects a reference before any text arrives, the request is
+    repeated once with those images inline. `handle.close()` from another
+    thread aborts the request.
+    """
+    files = _file_references(client, api_key)
+    started = False
+    try:
+        for text in _stream(client, messages, model, temperature, max_tokens, files, handle):
+            started = True
+            yield text
+    except Exception as e:
+        if started or not _rejected_reference(e, files) or (handle is not None and handle.closed):
+            raise
+        files.forget_used()
+        _count_files("stale_retries")
+        yield from _stream(client, messages, model, temperature, max_tokens, None, handle)
+
+
+def _stream(client, messages: List[Dict], model: str, temperature: float, max_tokens: int,
+            files: Optional[FileReferences], handle: Optional[StreamHandle] = None) -> Iterator[str]:
+    contents, config = build_request(messages, model, temperature, max_tokens, files)
+    if handle is not None and handle.closed:
+        return
+
+    request_started = time.perf_counter()
+    _stream_local.handle = handle
+    try:
+        response = client.models.generate_content_stream(
+            model=model,
+            contents=contents,
+            config=config,
+        )
+
+        first_token_at = None
+        for chunk in response:
+            if chunk.text:
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                    instrumentation.observe("gemini_ttft", first_token_at - request_started, model=model)
+                yield chunk.text
+        if first_token_at is not None:
+            instrumentation.observe("gemini_streaming", time.perf_counter() - first_token_at, model=model)
+    finally:
+        _stream_local.handle = None
+        if handle is not None:
+            handle.detach()
+
+
+def file_stats() -> Dict:
+    with _upload_lock:
+        return dict(_file_counts, uploads_in_flight=len(_uploads))
+
+
+def _prometheus_lines() -> List[str]:
+    s = file_stats()
+    if not s["inline"] and not s["reference"]:
+        return []
+    return [
+        "# HELP skin_gemini_image_parts_total Images sent to Gemini, inline or as file references.",
+        "# TYPE skin_gemini_image_parts_total counter",
+        f'skin_gemini_image_parts_total{{how="inline"}} {s["inline"]}',
+        f'skin_gemini_image_parts_total{{how="reference"}} {s["reference"]}',
+        "# HELP skin_gemini_file_uploads_total Image uploads to the Gemini Files API.",
+        "# TYPE skin_gemini_file_uploads_total counter",
+        f'skin_gemini_file_uploads_total{{outcome="ok"}} {s["uploads"]}',
+        f'skin_gemini_file_uploads_total{{outcome="error"}} {s["upload_errors"]}',
+        "# HELP skin_gemini_uploaded_bytes_total Image bytes uploaded to the Gemini Files API.",
+        "# TYPE skin_gemini_uploaded_bytes_total counter",
+        f"skin_gemini_uploaded_bytes_total {s['uploaded_bytes']}",
+        "# HELP skin_gemini_stale_reference_retries_total Requests repeated inline after a file reference was rejected.",
+        "# TYPE skin_gemini_stale_reference_retries_total counter",
+        f"skin_gemini_stale_reference_retries_total {s['stale_retries']}",
+    ]
+
+
+instrumentation.register_collector(_prometheus_lines)
@@ -0,0 +1,351 @@
+"""Local stand-in for the Gemini API, for testing the LLM path offline.
+
+Speaks the subset of the REST protocol the google-genai SDK uses here:
+resumable file uploads (`files.upload`), `generateContent` and
+`streamGenerateContent` (SSE). Replies are canned text; what matters is the
+bookkeeping: every generate request records its body size, how many images
+arrived inline versus as file references, and how long it took, and
+`GET /stats` returns that log. `--bandwidth-mbps` delays request bodies as a
+client link of that speed would, so payload size shows up as latency.
+
+Point the app at it with SKIN_GEMINI_BASE_URL=http://127.0.0.1:<port>; any
+API key is accepted. File references unknown to the server (never uploaded,
+or past `--file-ttl`) fail the request with 400, like expired Gemini files.
+`--benchmark` replays a chat that adds one sample image per turn through
+gemini_backend, once inline and once with file references, and prints each
+turn's request size and latency.
+"""
+import re
+import json
+import time
+import uuid
+import base64
+import hashlib
+import argparse
+import threading
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+# Gemini keeps uploaded files for 48 hours.
+DEFAULT_FILE_TTL = 48 * 3600
+REPLY = ("This is a canned reply from the local Gemini stand-in. It does not look at the images, "
+         "but it counts how they arrived.")
+
+_GENERATE = re.compile(r"^/[^/]+/models/([^/:]+):(generateContent|streamGenerateContent)$")
+_UPLOAD_SESSION = re.compile(r"^/upload-session/([0-9a-f]+)$")
+_FILE = re.compile(r"^/[^/]+/(files/[0-9a-z]+)$")
+
+
+def _rfc3339(ts: float) -> str:
+    return datetime.fromtimestamp(ts, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+class StubState:
+    """Uploaded files and the request log, shared by every handler thread."""
+
+    def __init__(self, file_ttl: float = DEFAULT_FILE_TTL, bandwidth: Optional[float] = None,
+                 ttft: float = 0.05, tokens_per_s: float = 200.0):
+        self.file_ttl = file_ttl
+        self.bandwidth = bandwidth
+        self.ttft = ttft
+        self.tokens_per_s = tokens_per_s
+        self.lock = threading.Lock()
+        self.files: Dict[str, Dict] = {}
+        self.uploads: Dict[str, Dict] = {}
+        self.requests: List[Dict] = []
+
+    def reset(self):
+        with self.lock:
+            self.files.clear()
+            self.uploads.clear()
+            self.requests.clear()
+
+    def live_file(self, uri_or_name: str) -> Optional[Dict]:
+        name = "files/" + uri_or_name.rstrip("/").rsplit("/", 1)[-1]
+        with self.lock:
+            entry = self.files.get(name)
+        if entry is None or entry["expires_at"] < time.time():
+            return None
+        return entry
+
+    def stats(self) -> Dict:
+        with self.lock:
+            requests = list(self.requests)
+            files = len(self.files)
+            uploaded = sum(f["size"] for f in self.files.values())
+        return {"requests": requests, "files": files, "uploaded_bytes": uploaded}
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state: StubState = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _body(self) -> bytes:
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        if self.state.bandwidth:
+            time.sleep(len(body) / self.state.bandwidth)
+        return body
+
+    def _send_json(self, status: int, payload: Dict, headers: Optional[Dict] = None):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _error(self, status: int, message: str):
+        self._send_json(status, {"error": {"code": status, "message": message,
+                                           "status": "INVALID_ARGUMENT" if status == 400 else "NOT_FOUND"}})
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == "/stats":
+            return self._send_json(200, self.state.stats())
+        match = _FILE.match(path)
+        if match:
+            entry = self.state.live_file(match.group(1))
+            if entry is None:
+                return self._error(404, f"File {match.group(1)} not found")
+            return self._send_json(200, entry["resource"])
+        self._error(404, f"No route for GET {path}")
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        if path == "/reset":
+            self._body()
+            self.state.reset()
+            return self._send_json(200, {})
+        if path.endswith("/files") and self.headers.get("X-Goog-Upload-Protocol") == "resumable":
+            return self._start_upload()
+        match = _UPLOAD_SESSION.match(path)
+        if match:
+            return self._upload_chunk(match.group(1))
+        match = _GENERATE.match(path)
+        if match:
+            return self._generate(match.group(1), stream=match.group(2) == "streamGenerateContent")
+        self._body()
+        self._error(404, f"No route for POST {path}")
+
+    # -- files ----------------------------------------------------------------
+
+    def _start_upload(self):
+        meta = json.loads(self._body() or b"{}").get("file", {})
+        session = uuid.uuid4().hex
+        mime = self.headers.get("X-Goog-Upload-Header-Content-Type") or meta.get("mimeType", "application/octet-stream")
+        with self.state.lock:
+            self.state.uploads[session] = {"mime": mime, "data": bytearray(), "display_name": meta.get("displayName")}
+        host = self.headers.get("Host", "127.0.0.1")
+        self._send_json(200, {}, {"X-Goog-Upload-URL": f"http://{host}/upload-session/{session}",
+                                  "X-Goog-Upload-Status": "active"})
+
+    def _upload_chunk(self, session: str):
+        body = self._body()
+        command = self.headers.get("X-Goog-Upload-Command", "")
+        with self.state.lock:
+            upload = self.state.uploads.get(session)
+            if upload is not None:
+                upload["data"] += body
+        if upload is None:
+            return self._error(404, "Unknown upload session")
+        if "finalize" not in command:
+            return self._send_json(200, {}, {"X-Goog-Upload-Status": "active"})
+
+        data = bytes(upload["data"])
+        file_id = uuid.uuid4().hex[:12]
+        now = time.time()
+        host = self.headers.get("Host", "127.0.0.1")
+        resource = {
+            "name": f"files/{file_id}",
+            "displayName": upload["display_name"],
+            "mimeType": upload["mime"],
+            "sizeBytes": str(len(data)),
+            "createTime": _rfc3339(now),
+            "updateTime": _rfc3339(now),
+            "expirationTime": _rfc3339(now + self.state.file_ttl),
+            "sha256Hash": base64.b64encode(hashlib.sha256(data).hexdigest().encode()).decode(),
+            "uri": f"http://{host}/v1beta/files/{file_id}",
+            "state": "ACTIVE",
+            "source": "UPLOADED",
+        }
+        with self.state.lock:
+            del self.state.uploads[session]
+            self.state.files[resource["name"]] = {"resource": resource, "size": len(data),
+                                                  "expires_at": now + self.state.file_ttl}
+        self._send_json(200, {"file": resource}, {"X-Goog-Upload-Status": "final"})
+
+    # -- generation -----------------------------------------------------------
+
+    def _generate(self, model: str, stream: bool):
+        started = time.perf_counter()
+        body = self._body()
+        request = json.loads(body or b"{}")
+        inline_parts = inline_bytes = file_parts = 0
+        missing = []
+        for content in request.get("contents", []):
+            for part in content.get("parts", []):
+                # The SDK sends nested fields in either case style depending on version.
+                inline = part.get("inlineData") or part.get("inline_data")
+                reference = part.get("fileData") or part.get("file_data")
+                if inline is not None:
+                    inline_parts += 1
+                    # Decoded size; the SDK may send URL-safe base64 without padding.
+                    inline_bytes += len(inline.get("data", "").rstrip("=")) * 3 // 4
+                elif reference is not None:
+                    file_parts += 1
+                    uri = reference.get("fileUri") or reference.get("file_uri", "")
+                    if self.state.live_file(uri) is None:
+                        missing.append(uri)
+        record = {"model": model, "stream": stream, "body_bytes": len(body), "inline_images": inline_parts,
+                  "inline_image_bytes": inline_bytes, "file_references": file_parts, "missing_files": len(missing)}
+        if missing:
+            record["status"] = 400
+            self._log(record, started)
+            return self._error(400, f"File {missing[0]} does not exist or has expired.")
+
+        words = REPLY.split()
+        if not stream:
+            time.sleep(self.state.ttft)
+            record["status"] = 200
+            self._log(record, started)
+            return self._send_json(200, self._candidate(" ".join(words), finish=True))
+
+        # Event-stream headers go out before the first token is ready.
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        self.wfile.flush()
+        time.sleep(self.state.ttft)
+        try:
+            for i, word in enumerate(words):
+                last = i == len(words) - 1
+                event = f"data: {json.dumps(self._candidate(word + ('' if last else ' '), finish=last))}\r\n\r\n".encode()
+                self.wfile.write(f"{len(event):x}\r\n".encode() + event + b"\r\n")
+                self.wfile.flush()
+                if not last:
+                    time.sleep(1.0 / self.state.tokens_per_s)
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            record["status"] = 499
+            self.close_connection = True
+            return self._log(record, started)
+        record["status"] = 200
+        self._log(record, started)
+
+    def _candidate(self, text: str, finish: bool) -> Dict:
+        candidate = {"content": {"parts": [{"text": text}], "role": "model"}, "index": 0}
+        if finish:
+            candidate["finishReason"] = "STOP"
+        return {"candidates": [candidate], "modelVersion": "stub"}
+
+    def _log(self, record: Dict, started: float):
+        record["seconds"] = round(time.perf_counter() - started, 4)
+        with self.state.lock:
+            self.state.requests.append(record)
+
+
+def serve(port: int = 0, host: str = "127.0.0.1", **options) -> Tuple[ThreadingHTTPServer, str]:
+    """Start the stand-in on a daemon thread; returns the server and its base URL."""
+    state = StubState(**options)
+    handler = type("StubHandler", (Handler,), {"state": state})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.state = state
+    threading.Thread(target=server.serve_forever, name="gemini-stub", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def benchmark(turns: int = 5, bandwidth_mbps: float = 20.0, ttft: float = 0.05) -> Dict:
+    """Per-turn request size and latency of a chat gaining one image per turn, inline vs references."""
+    import os
+    import glob
+    import tempfile
+    server, url = serve(bandwidth=bandwidth_mbps * 1e6 / 8 if bandwidth_mbps else None, ttft=ttft)
+    # gemini_backend and shared_cache read these at import, so set them first.
+    os.environ["SKIN_GEMINI_BASE_URL"] = url
+    os.environ["SKIN_GEMINI_FILE_REFS"] = "1"
+    os.environ["SKIN_CACHE_PATH"] = os.path.join(tempfile.mkdtemp(prefix="gemini_stub_"), "cache.sqlite3")
+    import gemini_backend
+    from image_ingest import ingest_image
+
+    root = os.path.dirname(os.path.abspath(__file__))
+    paths = sorted(glob.glob(os.path.join(root, "Data", "Sample_Skin_Disease_Images", "*.jpg")))[:turns]
+    assets = []
+    for path in paths:
+        with open(path, "rb") as f:
+            assets.append(ingest_image(f.read()))
+
+    report = {"bandwidth_mbps": bandwidth_mbps, "ttft_s": ttft}
+    for mode in ("inline", "reference"):
+        server.state.reset()
+        client = gemini_backend.get_gemini_client("benchmark")
+        api_key = "benchmark" if mode == "reference" else None
+        messages = [{"role": "system", "content": "You are a helpful assistant."}]
+        rows = []
+        uploaded_before = 0
+        for turn, asset in enumerate(assets, 1):
+            messages.append({"role": "user", "content": f"What is in image {turn}?",
+                             "image_data": asset.b64, "image_mime": asset.mime})
+            started = time.perf_counter()
+            reply = "".join(gemini_backend.stream_chat(client, messages, "gemini-2.5-flash", 0.7, 256, api_key))
+            seconds = time.perf_counter() - started
+            messages.append({"role": "assistant", "content": reply})
+            stats = server.state.stats()
+            request = stats["requests"][-1]
+            rows.append({"turn": turn, "request_kb": round(request["body_bytes"] / 1024, 1),
+                         "uploaded_kb": round((stats["uploaded_bytes"] - uploaded_before) / 1024, 1),
+                         "inline_images": request["inline_images"], "file_references": request["file_references"],
+                         "seconds": round(seconds, 3)})
+            uploaded_before = stats["uploaded_bytes"]
+        report[mode] = rows
+    server.shutdown()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--file-ttl", type=float, default=DEFAULT_FILE_TTL, help="seconds uploaded files stay valid")
+    parser.add_argument("--bandwidth-mbps", type=float, default=0.0,
+                        help="simulated client upload speed in Mbit/s (0: unlimited; the benchmark defaults to 20)")
+    parser.add_argument("--ttft", type=float, default=0.05, help="seconds before the first chunk")
+    parser.add_argument("--benchmark", action="store_true", help="compare inline images with file references")
+    parser.add_argument("--turns", type=int, default=5, help="images (one per turn) in the benchmark chat")
+    parser.add_argument("--json", action="store_true", help="print the benchmark report as JSON")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        report = benchmark(args.turns, args.bandwidth_mbps or 20.0, args.ttft)
+        if args.json:
+            print(json.dumps(report, indent=2))
+            return
+        print(f"{report['bandwidth_mbps']:g} Mbit/s uplink, {report['ttft_s']:g}s to first token")
+        for mode in ("inline", "reference"):
+            print(f"\n{mode}:")
+            print("  turn  request KB  uploaded KB  inline  refs  seconds")
+            for r in report[mode]:
+                print(f"  {r['turn']:>4}  {r['request_kb']:>10.1f}  {r['uploaded_kb']:>11.1f}  {r['inline_images']:>6}"
+                      f"  {r['file_references']:>4}  {r['seconds']:>7.3f}")
+        return
+
+    bandwidth = args.bandwidth_mbps * 1e6 / 8 if args.bandwidth_mbps else None
+    server, url = serve(args.port, args.host, file_ttl=args.file_ttl, bandwidth=bandwidth, ttft=args.ttft)
+    print(f"Gemini stand-in listening on {url} (set SKIN_GEMINI_BASE_URL={url})")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
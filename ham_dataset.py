@@ -0,0 +1,327 @@
+"""Packed, memory-mapped HAM10000 images for training and evaluation.
+
+The notebook copied every JPEG three times (merge, per-label folders,
+train/test split) and re-decoded all of them through `ImageFolder` every
+epoch. Packing reads the metadata CSV once, decodes each image once at the
+training resolution (JPEG DCT scaling does most of the downscale), and writes
+uint8 arrays into fixed-size `.npy` shards plus one structured index of
+image id, lesion id, label, split, shard and row. `PackedDataset` maps the
+shards read-only, so items are views into the page cache with no decode and
+no copy.
+
+    python ham_dataset.py --images /data/HAM10000_images_part_1 /data/HAM10000_images_part_2
+"""
+import os
+import csv
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import cpu_tuning
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+METADATA_CSV = os.path.join(ROOT, "Data", "HAM10000_metadata.csv")
+SAMPLE_DIR = os.path.join(ROOT, "Data", "Sample_Skin_Disease_Images")
+DEFAULT_DIR = os.environ.get("SKIN_DATASET_DIR", os.path.join(tempfile.gettempdir(), "ham_packed"))
+# Training input size of the notebook's ResNet; stored square like its Resize((224, 224)).
+SIDE = 224
+SHARD_SIZE = 1024
+TEST_FRACTION = 0.2
+SPLITS = ("train", "test")
+FORMAT_VERSION = 1
+
+INDEX_DTYPE = np.dtype([
+    ("image_id", "U16"), ("lesion_id", "U16"), ("label", "u1"),
+    ("split", "u1"), ("shard", "u2"), ("row", "u4"),
+])
+
+
+def read_metadata(path: str = METADATA_CSV) -> List[Dict[str, str]]:
+    with open(path, newline="") as f:
+        return list(csv.DictReader(f))
+
+
+def find_images(directories: Iterable[str]) -> Dict[str, str]:
+    """image_id -> path for every .jpg under the given directories (one scandir each)."""
+    found = {}
+    for directory in directories:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                stem, ext = os.path.splitext(entry.name)
+                if ext.lower() in (".jpg", ".jpeg") and entry.is_file():
+                    found[stem] = entry.path
+    return found
+
+
+def split_by_lesion(rows: Sequence[Dict[str, str]], test_fraction: float = TEST_FRACTION,
+                    seed: int = 42) -> np.ndarray:
+    """0 (train) / 1 (test) per row, stratified by label and grouped by lesion.
+
+    HAM10000 has several photos of many lesions; splitting per image (as the
+    notebook did) puts the same lesion on both sides and inflates test scores.
+    """
+    rng = np.random.default_rng(seed)
+    split = np.zeros(len(rows), dtype=np.uint8)
+    by_label: Dict[str, Dict[str, List[int]]] = {}
+    for i, row in enumerate(rows):
+        by_label.setdefault(row["dx"], {}).setdefault(row["lesion_id"], []).append(i)
+    for label in sorted(by_label):
+        lesions = by_label[label]
+        order = sorted(lesions)
+        rng.shuffle(order)
+        target = test_fraction * sum(len(v) for v in lesions.values())
+        taken = 0
+        for lesion in order:
+            if taken >= target:
+                break
+            split[lesions[lesion]] = 1
+            taken += len(lesions[lesion])
+    return split
+
+
+def load_resized(path: str, side: int = SIDE) -> np.ndarray:
+    """Decode a JPEG straight to a (side, side, 3) uint8 array."""
+    from PIL import Image
+    with Image.open(path) as img:
+        # Lets libjpeg decode at 1/2, 1/4 or 1/8 scale instead of full size.
+        img.draft("RGB", (side, side))
+        img = img.convert("RGB")
+        return np.asarray(img.resize((side, side), Image.BILINEAR), dtype=np.uint8)
+
+
+def _load_chunk(paths: List[str], side: int) -> np.ndarray:
+    return np.stack([load_resized(p, side) for p in paths]) if paths else np.zeros((0, side, side, 3), np.uint8)
+
+
+def pack_dataset(image_dirs: Sequence[str], out_dir: str = DEFAULT_DIR, metadata: str = METADATA_CSV,
+                 side: int = SIDE, shard_size: int = SHARD_SIZE, workers: Optional[int] = None,
+                 test_fraction: float = TEST_FRACTION, seed: int = 42) -> Dict:
+    """Decode every image listed in the metadata once and write the packed dataset.
+
+    Rows whose image is missing are skipped. The result is written to a
+    temporary directory and swapped in, so readers never see a half-written
+    pack. Returns the manifest.
+    """
+    started = time.perf_counter()
+    rows = read_metadata(metadata)
+    images = find_images(image_dirs)
+    keep = [i for i, row in enumerate(rows) if row["image_id"] in images]
+    classes = sorted({row["dx"] for row in rows})
+    # Split only the rows that are packed, so the test fraction holds for a partial download.
+    split = split_by_lesion([rows[i] for i in keep], test_fraction, seed)
+
+    # Class-contiguous order is avoided: rows are written in metadata order so a
+    # shard is a representative slice, and training shuffles indices anyway.
+    index = np.zeros(len(keep), dtype=INDEX_DTYPE)
+    for n, i in enumerate(keep):
+        index[n] = (rows[i]["image_id"], rows[i]["lesion_id"], classes.index(rows[i]["dx"]),
+                    split[n], n // shard_size, n % shard_size)
+
+    staging = out_dir.rstrip("/") + ".tmp"
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    workers = workers or cpu_tuning.plan()["batch_workers"]
+    shard_files = []
+    chunk = 64
+    # A single worker decodes in-process; spawning would only add start-up time.
+    pool = (ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            if workers > 1 else None)
+    mapper = pool.map if pool else map
+    try:
+        for shard, start in enumerate(range(0, len(keep), shard_size)):
+            ids = index["image_id"][start:start + shard_size]
+            name = f"images-{shard:05d}.npy"
+            shard_files.append(name)
+            out = np.lib.format.open_memmap(os.path.join(staging, name), mode="w+",
+                                            dtype=np.uint8, shape=(len(ids), side, side, 3))
+            paths = [images[i] for i in ids]
+            chunks = [paths[k:k + chunk] for k in range(0, len(paths), chunk)]
+            for k, block in enumerate(mapper(_load_chunk, chunks, [side] * len(chunks))):
+                out[k * chunk:k * chunk + len(block)] = block
+            out.flush()
+            del out
+    finally:
+        if pool:
+            pool.shutdown()
+
+    np.save(os.path.join(staging, "index.npy"), index)
+    manifest = {
+        "format": FORMAT_VERSION,
+        "side": side,
+        "classes": classes,
+        "splits": list(SPLITS),
+        "shards": shard_files,
+        "shard_size": shard_size,
+        "count": int(len(index)),
+        "skipped": len(rows) - len(keep),
+        "pack_s": round(time.perf_counter() - started, 2),
+    }
+    with open(os.path.join(staging, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    swap_in(staging, out_dir)
+    return manifest
+
+
+def swap_in(staging: str, out_dir: str):
+    """Replace `out_dir` with `staging`, so readers see the old pack or the new one, never a mix.
+
+    The old pack is renamed aside and the new one renamed into place before
+    anything is deleted; if the second rename fails the old pack is put back.
+    """
+    retired = out_dir.rstrip("/") + ".old"
+    shutil.rmtree(retired, ignore_errors=True)
+    had_previous = os.path.exists(out_dir)
+    if had_previous:
+        os.replace(out_dir, retired)
+    try:
+        os.replace(staging, out_dir)
+    except OSError:
+        if had_previous:
+            os.replace(retired, out_dir)
+        raise
+    # Readers that mapped the old shards keep their pages until they close them.
+    shutil.rmtree(retired, ignore_errors=True)
+
+
+class PackedDataset:
+    """Read-only view of one split of a packed dataset.
+
+    `dataset[i]` returns `(image, label)` where `image` is a (side, side, 3)
+    uint8 view into the memory-mapped shard. Shards are mapped lazily, so
+    DataLoader worker processes each map their own copy after forking.
+    Works anywhere a map-style dataset is expected (`__len__`/`__getitem__`).
+    """
+
+    def __init__(self, directory: str = DEFAULT_DIR, split: Optional[str] = "train", transform=None):
+        self.directory = directory
+        with open(os.path.join(directory, "manifest.json")) as f:
+            self.manifest = json.load(f)
+        if self.manifest.get("format") != FORMAT_VERSION:
+            raise ValueError(f"{directory} was packed with format {self.manifest.get('format')}, "
+                             f"expected {FORMAT_VERSION}; re-run the packer")
+        index = np.load(os.path.join(directory, "index.npy"))
+        if split is not None:
+            index = index[index["split"] == SPLITS.index(split)]
+        self.index = index
+        self.classes: List[str] = self.manifest["classes"]
+        self.labels = index["label"].astype(np.int64)
+        self.transform = transform
+        self._shards: Optional[List[np.ndarray]] = None
+
+    def _mapped(self) -> List[np.ndarray]:
+        if self._shards is None:
+            self._shards = [np.load(os.path.join(self.directory, name), mmap_mode="r")
+                            for name in self.manifest["shards"]]
+        return self._shards
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __getitem__(self, i: int) -> Tuple[np.ndarray, int]:
+        entry = self.index[i]
+        image = self._mapped()[entry["shard"]][entry["row"]]
+        if self.transform is not None:
+            image = self.transform(image)
+        return image, int(self.labels[i])
+
+    def batch(self, indices: Sequence[int]) -> Tuple[np.ndarray, np.ndarray]:
+        """Gather several items into one (n, side, side, 3) array (this one copies)."""
+        indices = np.asarray(indices)
+        entries = self.index[indices]
+        shards = self._mapped()
+        out = np.empty((len(indices), self.manifest["side"], self.manifest["side"], 3), dtype=np.uint8)
+        for shard in np.unique(entries["shard"]):
+            hit = entries["shard"] == shard
+            out[hit] = shards[shard][entries["row"][hit]]
+        return out, self.labels[indices]
+
+    def class_counts(self) -> np.ndarray:
+        return np.bincount(self.labels, minlength=len(self.classes))
+
+    def __getstate__(self):
+        # Pickled into DataLoader workers: send the index, not mapped pages.
+        state = dict(self.__dict__)
+        state["_shards"] = None
+        return state
+
+
+def _disk_bytes(paths: Iterable[str]) -> int:
+    return sum(os.path.getsize(p) for p in paths)
+
+
+def benchmark(image_dirs: Sequence[str], out_dir: str, side: int = SIDE, workers: Optional[int] = None) -> Dict:
+    """Compare the notebook's copy-then-decode pipeline with the packed format."""
+    images = find_images(image_dirs)
+    ids = {row["image_id"] for row in read_metadata()} & set(images)
+    paths = [images[i] for i in sorted(ids)]
+
+    # Notebook: three shutil.copy passes, then a full JPEG decode + resize per epoch.
+    scratch = out_dir.rstrip("/") + ".copies"
+    shutil.rmtree(scratch, ignore_errors=True)
+    started = time.perf_counter()
+    for copy in range(3):
+        target = os.path.join(scratch, str(copy))
+        os.makedirs(target)
+        for p in paths:
+            shutil.copy(p, target)
+    copy_s = time.perf_counter() - started
+    copy_bytes = _disk_bytes(os.path.join(scratch, str(c), os.path.basename(p)) for c in range(3) for p in paths)
+    shutil.rmtree(scratch, ignore_errors=True)
+    from PIL import Image
+    started = time.perf_counter()
+    for p in paths:
+        with Image.open(p) as img:
+            img.convert("RGB").resize((side, side), Image.BILINEAR)
+    jpeg_epoch_s = time.perf_counter() - started
+
+    manifest = pack_dataset(image_dirs, out_dir, side=side, workers=workers)
+    packed_bytes = _disk_bytes(os.path.join(out_dir, n) for n in manifest["shards"] + ["index.npy"])
+    dataset = PackedDataset(out_dir, split=None)
+    started = time.perf_counter()
+    checksum = 0
+    for i in range(len(dataset)):
+        image, _ = dataset[i]
+        # Touch every byte so the timing includes the actual page reads.
+        checksum += int(image[::8, ::8].sum())
+    packed_epoch_s = time.perf_counter() - started
+
+    n = max(1, len(paths))
+    return {
+        "images": len(paths),
+        "prepare_s": {"notebook_copies": round(copy_s, 3), "packed": manifest["pack_s"]},
+        "disk_mb": {"notebook_copies": round(copy_bytes / 1e6, 2), "packed": round(packed_bytes / 1e6, 2),
+                    "source_jpegs": round(_disk_bytes(paths) / 1e6, 2)},
+        "epoch_read_ms_per_image": {"jpeg_decode": round(jpeg_epoch_s / n * 1000, 3),
+                                    "packed": round(packed_epoch_s / n * 1000, 4)},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--images", nargs="+", default=[SAMPLE_DIR], help="folders holding the HAM10000 JPEGs")
+    parser.add_argument("--out", default=DEFAULT_DIR)
+    parser.add_argument("--side", type=int, default=SIDE)
+    parser.add_argument("--shard-size", type=int, default=SHARD_SIZE)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--benchmark", action="store_true",
+                        help="also time the notebook's copy/decode pipeline on the same images")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        print(json.dumps(benchmark(args.images, args.out, args.side, args.workers), indent=2))
+        return
+    manifest = pack_dataset(args.images, args.out, side=args.side, shard_size=args.shard_size,
+                            workers=args.workers)
+    print(f"Packed {manifest['count']} images ({manifest['skipped']} listed but not found) "
+          f"into {len(manifest['shards'])} shards in {manifest['pack_s']} s -> {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+import shared_cache
+
+# Hamming distance (out of 64 bits) within which both the pHash and the dHash
+# of two uploads must agree for them to count as the same image. Re-encoding,
+# downscaling and exposure changes of the bundled samples stay within 6 bits;
+# the closest pair of distinct samples is 10 pHash bits apart.
+DUPLICATE_DISTANCE = int(os.environ.get("SKIN_DUPLICATE_DISTANCE", "6"))
+HASH_RETENTION = 30 * 24 * 3600
+# Scopes (users) whose BK-trees stay in memory; others are rebuilt from the store on their next lookup.
+MAX_TREES = int(os.environ.get("SKIN_DUPLICATE_TREES", "1024"))
+
+_PHASH_SIZE = 32
+_PHASH_LOW = 8
+
+
+def _luminance(img_array: np.ndarray) -> np.ndarray:
+    rgb = img_array[:, :, :3].astype(np.float32)
+    return rgb @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+
+def _area_resize(gray: np.ndarray, height: int, width: int) -> np.ndarray:
+    """Box-filter downscale by summing row and column bands (no PIL round trip)."""
+    rows = np.linspace(0, gray.shape[0], height + 1).astype(int)[:-1]
+    cols = np.linspace(0, gray.shape[1], width + 1).astype(int)[:-1]
+    summed = np.add.reduceat(np.add.reduceat(gray, rows, axis=0), cols, axis=1)
+    counts = np.outer(np.diff(np.append(rows, gray.shape[0])), np.diff(np.append(cols, gray.shape[1])))
+    return summed / counts
+
+
+def _bits_to_int(bits: np.ndarray) -> int:
+    return int.from_bytes(np.packbits(bits.ravel().astype(np.uint8)).tobytes(), "big")
+
+
+def _dct_matrix(n: int) -> np.ndarray:
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    matrix = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    matrix[0] /= np.sqrt(2.0)
+    return matrix.astype(np.float32)
+
+
+_DCT = _dct_matrix(_PHASH_SIZE)
+
+
+def dhash(img_array: np.ndarray) -> int:
+    """64-bit difference hash: whether each cell of a 9x8 thumbnail is brighter than its neighbour."""
+    small = _area_resize(_luminance(img_array), 8, 9)
+    return _bits_to_int(small[:, 1:] > small[:, :-1])
+
+
+def phash(img_array: np.ndarray) -> int:
+    """64-bit DCT hash: low-frequency coefficients of a 32x32 thumbnail against their median."""
+    small = _area_resize(_luminance(img_array), _PHASH_SIZE, _PHASH_SIZE)
+    low = (_DCT @ small @ _DCT.T)[:_PHASH_LOW, :_PHASH_LOW]
+    # The DC term only carries overall brightness, so it is left out of the median.
+    return _bits_to_int(low > np.median(low.ravel()[1:]))
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+class BKTree:
+    """Burkhard-Keller tree over 64-bit hashes for sub-linear Hamming radius search."""
+
+    def __init__(self):
+        self._root: Optional[list] = None
+        self.size = 0
+
+    def add(self, value: int, item):
+        node = [value, [item], {}]
+        self.size += 1
+        if self._root is None:
+            self._root = node
+            return
+        current = self._root
+        while True:
+            distance = hamming(value, current[0])
+            if distance == 0:
+                current[1].append(item)
+                return
+            child = current[2].get(distance)
+            if child is None:
+                current[2][distance] = node
+                return
+            current = child
+
+    def search(self, value: int, radius: int) -> List[Tuple[int, object]]:
+        """All (distance, item) pairs within `radius`, nearest first."""
+        if self._root is None:
+            return []
+        found = []
+        stack = [self._root]
+        while stack:
+            node_value, items, children = stack.pop()
+            distance = hamming(value, node_value)
+            if distance <= radius:
+                found.extend((distance, item) for item in items)
+            # Triangle inequality: only subtrees at distance d +/- radius can match.
+            for edge, child in children.items():
+                if distance - radius <= edge <= distance + radius:
+                    stack.append(child)
+        found.sort(key=lambda pair: pair[0])
+        return found
+
+
+class HashStore:
+    """Perceptual hashes of past uploads, kept in the shared SQLite file."""
+
+    def __init__(self, path: str = shared_cache.DEFAULT_PATH):
+        self.path = shared_cache.secure_path(path)
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS image_hashes ("
+                " seq INTEGER PRIMARY KEY AUTOINCREMENT, scope TEXT NOT NULL, conversation_id TEXT,"
+                " image_key TEXT NOT NULL, image_id TEXT NOT NULL,"
+                " phash TEXT NOT NULL, dhash TEXT NOT NULL, analysis TEXT, created_at REAL NOT NULL)"
+            )
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(image_hashes)")}
+            if "session_key" in columns:
+                conn.execute("ALTER TABLE image_hashes RENAME COLUMN session_key TO scope")
+            if "conversation_id" not in columns:
+                conn.execute("ALTER TABLE image_hashes ADD COLUMN conversation_id TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS image_hashes_scope ON image_hashes (scope, seq)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def add(self, entry: Dict):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO image_hashes (scope, conversation_id, image_key, image_id, phash, dhash, analysis,"
+                " created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (entry["scope"], entry["conversation_id"], entry["image_key"], entry["image_id"],
+                 entry["phash"], entry["dhash"], json.dumps(entry["analysis"]), entry["created_at"])
+            )
+
+    def since(self, seq: int, scope: Optional[str] = None, until: Optional[int] = None) -> List[Tuple[int, Dict]]:
+        """(seq, entry) rows after `seq`, optionally for one scope and up to `until`."""
+        query = ("SELECT seq, scope, conversation_id, image_key, image_id, phash, dhash, analysis, created_at"
+                 " FROM image_hashes WHERE seq > ?")
+        params: List = [seq]
+        if scope is not None:
+            query += " AND scope = ?"
+            params.append(scope)
+        if until is not None:
+            query += " AND seq <= ?"
+            params.append(until)
+        rows = self._connect().execute(query + " ORDER BY seq", params).fetchall()
+        columns = ("scope", "conversation_id", "image_key", "image_id", "phash", "dhash", "analysis", "created_at")
+        entries = []
+        for row in rows:
+            entry = dict(zip(columns, row[1:]))
+            entry["analysis"] = json.loads(entry["analysis"]) if entry["analysis"] else None
+            entries.append((row[0], entry))
+        return entries
+
+    def purge(self, older_than: float = HASH_RETENTION) -> int:
+        with self._connect() as conn:
+            return conn.execute(
+                "DELETE FROM image_hashes WHERE created_at < ?", (time.time() - older_than,)
+            ).rowcount
+
+
+class DuplicateIndex:
+    """BK-trees over upload pHashes, one per scope (a user's uploads), kept in sync with the shared store.
+
+    Each lookup first pulls rows other workers have added since the last sync,
+    so every process sees the whole history without rebuilding its trees.
+    Only the `max_trees` most recently used scopes are held in memory; an
+    evicted scope's tree is rebuilt from the store when it is next looked up.
+    """
+
+    def __init__(self, store: HashStore, max_distance: int = DUPLICATE_DISTANCE, max_trees: int = MAX_TREES):
+        self.store = store
+        self.max_distance = max_distance
+        self.max_trees = max_trees
+        self._lock = threading.Lock()
+        self._trees: "OrderedDict[str, BKTree]" = OrderedDict()
+        self._seq = 0
+
+    def _sync(self):
+        for seq, entry in self.store.since(self._seq):
+            tree = self._trees.get(entry["scope"])
+            # Scopes not in memory pick the row up when their tree is next loaded.
+            if tree is not None:
+                tree.add(int(entry["phash"], 16), entry)
+            self._seq = seq
+
+    def _tree(self, scope: str) -> BKTree:
+        tree = self._trees.get(scope)
+        if tree is None:
+            tree = self._trees[scope] = BKTree()
+            for _, entry in self.store.since(0, scope=scope, until=self._seq):
+                tree.add(int(entry["phash"], 16), entry)
+            while len(self._trees) > self.max_trees:
+                self._trees.popitem(last=False)
+        self._trees.move_to_end(scope)
+        return tree
+
+    def find(self, scope: str, hashes: Dict[str, str]) -> Optional[Tuple[int, Dict]]:
+        """Closest earlier upload in this scope whose pHash and dHash both match, if any."""
+        target_p = int(hashes["phash"], 16)
+        target_d = int(hashes["dhash"], 16)
+        with self._lock:
+            self._sync()
+            candidates = self._tree(scope).search(target_p, self.max_distance)
+        for distance, entry in candidates:
+            if hamming(target_d, int(entry["dhash"], 16)) <= self.max_distance:
+                return distance, entry
+        return None
+
+    def add(self, scope: str, image_key: str, image_id: str, hashes: Dict[str, str],
+            analysis: Optional[List], conversation_id: Optional[str] = None):
+        self.store.add({
+            "scope": scope,
+            "conversation_id": conversation_id,
+            "image_key": image_key,
+            "image_id": image_id,
+            "phash": hashes["phash"],
+            "dhash": hashes["dhash"],
+            "analysis": analysis,
+            "created_at": time.time(),
+        })
+
+
+_index: Optional[DuplicateIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_index() -> DuplicateIndex:
+    """Return the near-duplicate index shared by every session in this process."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            store = HashStore()
+            store.purge()
+            _index = DuplicateIndex(store)
+        return _index
@@ -0,0 +1,304 @@
+import io
+import os
+import base64
+import struct
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from instrumentation import span
+
+MAX_LONG_EDGE = int(os.environ.get("SKIN_IMAGE_MAX_EDGE", "1024"))
+OUTPUT_FORMAT = os.environ.get("SKIN_IMAGE_FORMAT", "JPEG").upper()
+OUTPUT_QUALITY = int(os.environ.get("SKIN_IMAGE_QUALITY", "85"))
+REGISTRY_SIZE = int(os.environ.get("SKIN_IMAGE_REGISTRY_SIZE", "64"))
+MAX_UPLOAD_BYTES = int(os.environ.get("SKIN_IMAGE_MAX_BYTES", str(20 * 1024 * 1024)))
+MAX_PIXELS = int(os.environ.get("SKIN_IMAGE_MAX_PIXELS", str(40_000_000)))
+
+_MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+
+
+class ImageError(Exception):
+    """Base class for uploads that were rejected or could not be decoded."""
+
+
+class UnsupportedImageError(ImageError):
+    """The upload is not a PNG, JPEG, GIF or WebP image."""
+
+
+class ImageTooLargeError(ImageError):
+    """The upload exceeds the byte, pixel or memory limits."""
+
+
+class ImageDecodeError(ImageError):
+    """The image header was acceptable but the data could not be decoded."""
+
+
+class ImageTimeoutError(ImageError):
+    """Decoding took longer than the allowed time."""
+
+
+def _jpeg_size(data: bytes) -> Optional[Tuple[int, int]]:
+    i = 2
+    while i + 9 < len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:
+            i += 1
+            continue
+        if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:
+            i += 2
+            continue
+        if marker in (0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF):
+            height, width = struct.unpack(">HH", data[i + 5:i + 9])
+            return width, height
+        i += 2 + struct.unpack(">H", data[i + 2:i + 4])[0]
+    return None
+
+
+def read_image_header(data: bytes) -> Tuple[str, int, int]:
+    """Return (format, width, height) from the header alone, without a decoder."""
+    size = None
+    if data[:8] == b"\x89PNG\r\n\x1a\n" and data[12:16] == b"IHDR":
+        fmt, size = "PNG", struct.unpack(">II", data[16:24])
+    elif data[:3] == b"\xff\xd8\xff":
+        fmt, size = "JPEG", _jpeg_size(data)
+    elif data[:6] in (b"GIF87a", b"GIF89a"):
+        fmt, size = "GIF", struct.unpack("<HH", data[6:10])
+    elif data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        fmt, chunk = "WEBP", data[12:16]
+        if chunk == b"VP8 " and len(data) >= 30:
+            w, h = struct.unpack("<HH", data[26:30])
+            size = (w & 0x3FFF, h & 0x3FFF)
+        elif chunk == b"VP8L" and len(data) >= 25:
+            bits = int.from_bytes(data[21:25], "little")
+            size = ((bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1)
+        elif chunk == b"VP8X" and len(data) >= 30:
+            size = (int.from_bytes(data[24:27], "little") + 1, int.from_bytes(data[27:30], "little") + 1)
+    else:
+        raise UnsupportedImageError("Upload is not a PNG, JPEG, GIF or WebP image")
+    if size is None:
+        raise ImageDecodeError(f"Could not read the {fmt} image header")
+    return fmt, size[0], size[1]
+
+
+def check_upload(data: bytes, max_bytes: int = MAX_UPLOAD_BYTES,
+                 max_pixels: int = MAX_PIXELS) -> Tuple[str, int, int]:
+    """Reject oversized or unsupported uploads before any decoder touches them."""
+    if len(data) > max_bytes:
+        raise ImageTooLargeError(
+            f"Image is {len(data) / 1_000_000:.1f} MB; the limit is {max_bytes / 1_000_000:.0f} MB"
+        )
+    fmt, width, height = read_image_header(data)
+    if width <= 0 or height <= 0:
+        raise ImageDecodeError("Image header reports an empty image")
+    if width * height > max_pixels:
+        raise ImageTooLargeError(
+            f"Image is {width}x{height} ({width * height / 1e6:.0f} MP); the limit is {max_pixels / 1e6:.0f} MP"
+        )
+    return fmt, width, height
+
+
+@contextmanager
+def decoding_errors():
+    """Translate decoder failures into ImageError subclasses."""
+    from PIL import Image, UnidentifiedImageError
+    try:
+        yield
+    except ImageError:
+        raise
+    except (Image.DecompressionBombError, Image.DecompressionBombWarning) as e:
+        raise ImageTooLargeError(str(e)) from e
+    except MemoryError as e:
+        raise ImageTooLargeError("Decoding the image needed more memory than allowed") from e
+    except UnidentifiedImageError as e:
+        raise UnsupportedImageError("Upload is not a recognised image format") from e
+    except (OSError, ValueError, SyntaxError, struct.error) as e:
+        raise ImageDecodeError(f"Image could not be decoded: {e}") from e
+
+
+class ImageAsset:
+    """One image shared by the analysis, preview and LLM paths.
+
+    Holds whichever representation it was created from and derives the others
+    (raw bytes, decoded pixels, base64 text, data URI, digest) lazily, each at
+    most once. Decoded pixels are read-only so every consumer can share them
+    without defensive copies.
+    """
+
+    def __init__(self, data: Optional[bytes] = None, mime: str = "image/jpeg",
+                 pixels: Optional[np.ndarray] = None, b64: Optional[str] = None):
+        if data is None and b64 is None:
+            raise ValueError("ImageAsset needs raw bytes or base64 text")
+        self.mime = mime
+        self._data = data
+        self._b64 = b64
+        self._pixels = None
+        self._digest: Optional[str] = None
+        self._lock = threading.Lock()
+        self.ingest_stats: Optional[Dict] = None
+        self.hashes: Optional[Dict] = None
+        self.vector: Optional[np.ndarray] = None
+        self.lesion: Optional[Dict] = None
+        if pixels is not None:
+            self._set_pixels(pixels)
+
+    def _set_pixels(self, pixels: np.ndarray):
+        pixels.flags.writeable = False
+        self._pixels = pixels
+
+    @property
+    def raw_bytes(self) -> bytes:
+        """Encoded image bytes (the object itself, never a copy)."""
+        if self._data is None:
+            with self._lock:
+                if self._data is None:
+                    self._data = base64.b64decode(self._b64)
+        return self._data
+
+    @property
+    def raw(self) -> memoryview:
+        """Zero-copy read-only view of the encoded bytes."""
+        return memoryview(self.raw_bytes)
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.raw_bytes)
+
+    @property
+    def b64(self) -> str:
+        if self._b64 is None:
+            with self._lock:
+                if self._b64 is None:
+                    self._b64 = base64.b64encode(self.raw).decode("ascii")
+        return self._b64
+
+    @property
+    def data_uri(self) -> str:
+        return f"data:{self.mime};base64,{self.b64}"
+
+    @property
+    def digest(self) -> str:
+        if self._digest is None:
+            self._digest = hashlib.sha256(self.raw).hexdigest()
+        return self._digest
+
+    @property
+    def pixels(self) -> np.ndarray:
+        """Decoded RGB uint8 array."""
+        if self._pixels is None:
+            with self._lock:
+                if self._pixels is None:
+                    from PIL import Image
+                    with span("image_decode"), decoding_errors():
+                        # BytesIO shares a bytes buffer rather than copying it.
+                        img = Image.open(io.BytesIO(self.raw_bytes)).convert("RGB")
+                        self._set_pixels(np.asarray(img))
+        return self._pixels
+
+    @property
+    def size(self) -> tuple:
+        return self.pixels.shape[1], self.pixels.shape[0]
+
+
+_registry_lock = threading.Lock()
+_registry: "OrderedDict[str, ImageAsset]" = OrderedDict()
+
+
+def register_asset(asset: ImageAsset) -> str:
+    """Keep an asset in the per-process LRU so later turns reuse its decoded forms."""
+    key = asset.digest
+    with _registry_lock:
+        _registry[key] = asset
+        _registry.move_to_end(key)
+        while len(_registry) > REGISTRY_SIZE:
+            _registry.popitem(last=False)
+    return key
+
+
+def has_image(message: Dict) -> bool:
+    """True for image messages, whether the payload is inline or spilled to disk."""
+    return "image_data" in message or "image_spilled" in message
+
+
+def asset_for_message(message: Dict) -> ImageAsset:
+    """Return the shared asset for an image message, rebuilding it from base64 only once.
+
+    Payloads spilled by session_memory are read back from disk; an expired one
+    raises ImageDecodeError.
+    """
+    image_id = message.get("image_id")
+    if image_id:
+        with _registry_lock:
+            asset = _registry.get(image_id)
+            if asset is not None:
+                _registry.move_to_end(image_id)
+                return asset
+    b64 = message.get("image_data")
+    if b64 is None:
+        import session_memory
+        try:
+            b64 = session_memory.load_image(message["image_spilled"])
+        except FileNotFoundError:
+            raise ImageDecodeError("This image has expired from the session spill directory") from None
+    asset = ImageAsset(b64=b64, mime=message.get("image_mime", "image/png"))
+    register_asset(asset)
+    if image_id is None:
+        message["image_id"] = asset.digest
+    return asset
+
+
+def ingest_image(raw: bytes, max_long_edge: int = MAX_LONG_EDGE,
+                 output_format: str = OUTPUT_FORMAT, quality: int = OUTPUT_QUALITY) -> ImageAsset:
+    """Decode an upload once, fix orientation, cap its long edge and re-encode it compactly."""
+    from PIL import Image, ImageOps
+
+    check_upload(raw)
+    with span("image_ingest"), decoding_errors():
+        img = Image.open(io.BytesIO(raw))
+        original_format = img.format or "UNKNOWN"
+        original_size = img.size
+        # Lets the JPEG decoder scale by 1/2..1/8 while decoding instead of
+        # materialising the full-resolution frame first.
+        img.draft("RGB", (max_long_edge, max_long_edge))
+        img = ImageOps.exif_transpose(img).convert("RGB")
+        if max(img.size) > max_long_edge:
+            img.thumbnail((max_long_edge, max_long_edge), Image.LANCZOS)
+
+        out = io.BytesIO()
+        # Saving without exif/icc arguments drops all metadata from the upload.
+        img.save(out, format=output_format, quality=quality, optimize=True)
+        asset = ImageAsset(
+            data=out.getvalue(),
+            mime=_MIME_TYPES.get(output_format, "image/jpeg"),
+            pixels=np.asarray(img),
+        )
+        asset.ingest_stats = {
+            "original_bytes": len(raw),
+            "stored_bytes": asset.nbytes,
+            "original_size": list(original_size),
+            "stored_size": list(asset.size),
+            "original_format": original_format,
+            "stored_format": output_format,
+        }
+        register_asset(asset)
+        return asset
+
+
+def describe_savings(stats: Dict) -> str:
+    """One-line summary such as '3.1 MB PNG 4000x3000 -> 142 KB JPEG 1024x768 (-95%)'."""
+    def fmt_bytes(n: int) -> str:
+        return f"{n / 1_000_000:.1f} MB" if n >= 1_000_000 else f"{max(1, round(n / 1000))} KB"
+
+    saved = 1 - stats["stored_bytes"] / stats["original_bytes"] if stats["original_bytes"] else 0.0
+    ow, oh = stats["original_size"]
+    sw, sh = stats["stored_size"]
+    return (
+        f"{fmt_bytes(stats['original_bytes'])} {stats['original_format']} {ow}x{oh} -> "
+        f"{fmt_bytes(stats['stored_bytes'])} {stats['stored_format']} {sw}x{sh} ({-saved:+.0%})"
+    )
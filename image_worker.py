@@ -0,0 +1,244 @@
+import os
+import signal
+import weakref
+import threading
+import warnings
+import multiprocessing
+from concurrent.futures import CancelledError, ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional, Tuple
+
+import instrumentation
+import cpu_tuning
+from instrumentation import span
+from image_ingest import (
+    MAX_PIXELS, ImageAsset, ImageDecodeError, ImageError, ImageTimeoutError, ImageTooLargeError,
+    check_upload, ingest_image, register_asset,
+)
+
+# 0 runs decoding in the calling process (header checks and typed errors still apply).
+WORKERS = int(os.environ.get("SKIN_IMAGE_WORKERS") or cpu_tuning.plan()["image_workers"])
+WORKER_MEMORY_MB = int(os.environ.get("SKIN_IMAGE_WORKER_MEMORY_MB", "1024"))
+TIMEOUT = float(os.environ.get("SKIN_IMAGE_TIMEOUT", "10"))
+# Recycling workers bounds heap fragmentation left behind by large decodes.
+TASKS_PER_WORKER = 50
+# Extra time the parent allows for IPC and worker start-up before giving up.
+PARENT_GRACE = 5.0
+# Times a job caught up in another job's pool teardown is resubmitted.
+REQUEUE_LIMIT = 3
+
+
+def _init_worker(memory_mb: int, max_pixels: int):
+    """Apply the resource limits inside a freshly spawned worker."""
+    from PIL import Image
+    try:
+        import resource
+        limit = memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (ImportError, ValueError, OSError):
+        pass
+    # Anything over the cap raises instead of warning, even if the header lied.
+    Image.MAX_IMAGE_PIXELS = max_pixels
+    warnings.simplefilter("error", Image.DecompressionBombWarning)
+
+
+def _on_alarm(signum, frame):
+    raise ImageTimeoutError("Decoding the image took too long")
+
+
+def _decode(data: bytes, score: bool) -> Dict:
+    """Normalise the upload, hash it and optionally run the image model on its pixels."""
+    from skin_disease_model import extract_image_features, get_image_based_analysis
+    from case_index import feature_vector
+    asset = ingest_image(data)
+    result = {"data": asset.raw_bytes, "mime": asset.mime, "stats": asset.ingest_stats}
+    features = extract_image_features(asset)
+    if score:
+        result["analysis"] = list(get_image_based_analysis(asset, features))
+    result["hashes"] = {"phash": features["phash"], "dhash": features["dhash"]}
+    result["vector"] = feature_vector(features)
+    result["lesion"] = {
+        "bbox": list(features["lesion_bbox"]),
+        "area_fraction": round(features["lesion_area"], 4),
+        "segmented": features["segmented"],
+        "abcd": features["abcd"],
+    }
+    return result
+
+
+def _decode_and_score(data: bytes, score: bool, timeout: float) -> Dict:
+    """Worker entry point: `_decode` under a wall-clock alarm."""
+    previous = signal.signal(signal.SIGALRM, _on_alarm)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return _decode(data, score)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+class ImageWorkerPool:
+    """Decodes and scores uploads in spawned subprocesses with memory and time caps.
+
+    A hung or crashed worker is killed and the pool rebuilt, so one hostile
+    upload costs its own request and nothing else: jobs that were queued or
+    running beside it are resubmitted to the new pool, and after a crash,
+    whose culprit is unknown, each of them is retried once in a worker of
+    its own.
+    """
+
+    def __init__(self, workers: int = WORKERS, memory_mb: int = WORKER_MEMORY_MB,
+                 timeout: float = TIMEOUT, max_pixels: int = MAX_PIXELS, task=_decode_and_score):
+        self.workers = workers
+        self.memory_mb = memory_mb
+        self.timeout = timeout
+        self.max_pixels = max_pixels
+        # Runs in the worker as task(data, score, timeout); must be importable by spawned processes.
+        self.task = task
+        self._lock = threading.Lock()
+        self._pool: Optional[ProcessPoolExecutor] = None
+        # Pools torn down because one of their jobs hung; every other job in them is innocent.
+        self._killed: "weakref.WeakSet[ProcessPoolExecutor]" = weakref.WeakSet()
+        self._outcomes: Dict[str, int] = {}
+        self._retries: Dict[str, int] = {}
+
+    def _new_executor(self, workers: int) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self.memory_mb, self.max_pixels),
+            max_tasks_per_child=TASKS_PER_WORKER,
+        )
+
+    def _executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = self._new_executor(self.workers)
+            return self._pool
+
+    def _discard(self, pool: ProcessPoolExecutor, hung: bool = False):
+        """Kill every worker of a pool that hung or broke and start fresh next time."""
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+            if hung:
+                self._killed.add(pool)
+        for process in list((getattr(pool, "_processes", None) or {}).values()):
+            process.kill()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def _count(self, outcome: str):
+        with self._lock:
+            self._outcomes[outcome] = self._outcomes.get(outcome, 0) + 1
+
+    def _count_retry(self, reason: str):
+        with self._lock:
+            self._retries[reason] = self._retries.get(reason, 0) + 1
+
+    def _run(self, data: bytes, score: bool) -> Dict:
+        if self.workers <= 0:
+            return _decode(data, score)
+        for _ in range(REQUEUE_LIMIT):
+            pool = self._executor()
+            future = pool.submit(self.task, data, score, self.timeout)
+            try:
+                return future.result(timeout=self.timeout + PARENT_GRACE)
+            except FutureTimeout as e:
+                self._discard(pool, hung=True)
+                raise ImageTimeoutError("Decoding the image took too long") from e
+            except CancelledError:
+                # Still queued when its pool was torn down, so it cannot be the culprit.
+                self._count_retry("requeued")
+            except BrokenProcessPool:
+                self._discard(pool)
+                with self._lock:
+                    innocent = pool in self._killed
+                if not innocent:
+                    self._count_retry("isolated")
+                    return self._run_isolated(data, score)
+                self._count_retry("requeued")
+        raise ImageDecodeError("The image workers kept restarting; try again")
+
+    def _run_isolated(self, data: bytes, score: bool) -> Dict:
+        """Retry a job from a crashed pool alone, so a second crash can only be its own."""
+        pool = self._new_executor(1)
+        try:
+            return pool.submit(self.task, data, score, self.timeout).result(timeout=self.timeout + PARENT_GRACE)
+        except FutureTimeout as e:
+            raise ImageTimeoutError("Decoding the image took too long") from e
+        except BrokenProcessPool as e:
+            raise ImageTooLargeError("The image worker ran out of resources while decoding") from e
+        finally:
+            for process in list((getattr(pool, "_processes", None) or {}).values()):
+                process.kill()
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def process(self, data: bytes, score: bool = True) -> Tuple[ImageAsset, Optional[List]]:
+        """Return the normalised asset and, if requested, [condition, confidence, name]."""
+        try:
+            check_upload(data, max_pixels=self.max_pixels)
+            with span("image_worker", scored=score):
+                try:
+                    result = self._run(data, score)
+                except ImageError:
+                    raise
+                except Exception as e:
+                    raise ImageDecodeError(f"Image could not be processed: {e}") from e
+        except ImageError as e:
+            self._count(type(e).__name__)
+            raise
+        self._count("ok")
+        asset = ImageAsset(data=result["data"], mime=result["mime"])
+        asset.ingest_stats = result["stats"]
+        asset.hashes = result.get("hashes")
+        asset.vector = result.get("vector")
+        asset.lesion = result.get("lesion")
+        register_asset(asset)
+        return asset, result.get("analysis")
+
+    def outcomes(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._outcomes)
+
+    def retries(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._retries)
+
+
+_pool: Optional[ImageWorkerPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ImageWorkerPool:
+    """Return the worker pool shared by every session in this process."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ImageWorkerPool()
+        return _pool
+
+
+def process_upload(data: bytes, score: bool = True) -> Tuple[ImageAsset, Optional[List]]:
+    return get_pool().process(data, score=score)
+
+
+def _prometheus_lines() -> List[str]:
+    if _pool is None:
+        return []
+    lines = [
+        "# HELP skin_image_jobs_total Image uploads processed, by outcome.",
+        "# TYPE skin_image_jobs_total counter",
+    ]
+    for outcome, count in sorted(_pool.outcomes().items()):
+        lines.append(f'skin_image_jobs_total{{outcome="{outcome}"}} {count}')
+    lines += [
+        "# HELP skin_image_job_retries_total Jobs rerun after another job hung or crashed their worker pool.",
+        "# TYPE skin_image_job_retries_total counter",
+    ]
+    for reason, count in sorted(_pool.retries().items()):
+        lines.append(f'skin_image_job_retries_total{{reason="{reason}"}} {count}')
+    return lines
+
+
+instrumentation.register_collector(_prometheus_lines)
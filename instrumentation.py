@@ -0,0 +1,224 @@
+import os
+import json
+import math
+import time
+import bisect
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Latency buckets in seconds, shared by every stage histogram.
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+    0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0
+)
+
+METRIC_NAME = "skin_stage_duration_seconds"
+
+_lock = threading.Lock()
+_histograms: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], "Histogram"] = {}
+_enabled = os.environ.get("SKIN_METRICS", "") not in ("", "0", "false")
+_trace_path: Optional[str] = os.environ.get("SKIN_TRACE_PATH") or None
+_trace_file = None
+_collectors: List[Callable[[], List[str]]] = []
+
+
+def percentile(ordered, q: float) -> float:
+    """Nearest-rank percentile of a sorted, non-empty sequence.
+
+    The smallest sample with at least a fraction `q` of the samples at or
+    below it; `int(q * n)` would pick one rank too high.
+    """
+    return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+
+class Histogram:
+    """Fixed-bucket latency histogram in Prometheus layout."""
+
+    __slots__ = ("buckets", "counts", "total", "count")
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Estimate a quantile as the upper bound of the bucket that holds it."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.buckets, self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return self.buckets[-1]
+
+
+class _NullSpan:
+    """Shared no-op span handed out while instrumentation is disabled."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Span:
+    """Times a block and records it on exit."""
+
+    __slots__ = ("name", "labels", "start")
+
+    def __init__(self, name: str, labels: Dict[str, str]):
+        self.name = name
+        self.labels = labels
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        labels = self.labels
+        if exc_type is not None:
+            labels = dict(labels, error=exc_type.__name__)
+        _record(self.name, time.perf_counter() - self.start, labels)
+        return False
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def enable(trace_path: Optional[str] = None):
+    """Turn instrumentation on, optionally tracing every span to a JSONL file."""
+    global _enabled, _trace_path
+    with _lock:
+        _enabled = True
+        if trace_path:
+            _close_trace()
+            _trace_path = trace_path
+
+
+def disable():
+    global _enabled
+    with _lock:
+        _enabled = False
+        _close_trace()
+
+
+def reset():
+    """Drop all recorded histograms."""
+    with _lock:
+        _histograms.clear()
+
+
+def span(name: str, **labels):
+    """Context manager timing one stage; free when instrumentation is off."""
+    if not _enabled:
+        return _NULL_SPAN
+    return Span(name, labels)
+
+
+def observe(name: str, seconds: float, **labels):
+    """Record a duration that was measured by the caller."""
+    if _enabled:
+        _record(name, seconds, labels)
+
+
+def _close_trace():
+    global _trace_file
+    if _trace_file is not None:
+        _trace_file.close()
+        _trace_file = None
+
+
+def _record(name: str, seconds: float, labels: Dict[str, str]):
+    global _trace_file
+    key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+    with _lock:
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = Histogram()
+        hist.observe(seconds)
+        if _trace_path:
+            if _trace_file is None:
+                _trace_file = open(_trace_path, "a", buffering=1, encoding="utf-8")
+            _trace_file.write(json.dumps({
+                "ts": time.time(),
+                "stage": name,
+                "duration_ms": round(seconds * 1000, 3),
+                "labels": labels,
+                "pid": os.getpid(),
+                "thread": threading.current_thread().name,
+            }, default=str) + "\n")
+
+
+def snapshot() -> Dict[str, Dict]:
+    """Summarise every stage as count, total and p50/p95 estimates."""
+    with _lock:
+        items = list(_histograms.items())
+    summary = {}
+    for (name, labels), hist in items:
+        key = name + "".join(f",{k}={v}" for k, v in labels)
+        summary[key] = {
+            "count": hist.count,
+            "total_s": hist.total,
+            "p50_s": hist.quantile(0.5),
+            "p95_s": hist.quantile(0.95),
+        }
+    return summary
+
+
+def register_collector(collector: Callable[[], List[str]]):
+    """Add a callable whose Prometheus lines are appended to every export."""
+    _collectors.append(collector)
+
+
+def _format_labels(pairs) -> str:
+    body = ",".join(
+        '{}="{}"'.format(k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in pairs
+    )
+    return "{" + body + "}"
+
+
+def render_prometheus() -> str:
+    """Render all stage histograms in the Prometheus text exposition format."""
+    with _lock:
+        items = sorted(_histograms.items())
+        lines = [
+            f"# HELP {METRIC_NAME} Wall-clock time spent per pipeline stage.",
+            f"# TYPE {METRIC_NAME} histogram",
+        ]
+        for (name, labels), hist in items:
+            base = (("stage", name),) + labels
+            cumulative = 0
+            for bound, n in zip(hist.buckets, hist.counts):
+                cumulative += n
+                lines.append(f"{METRIC_NAME}_bucket{_format_labels(base + (('le', repr(bound)),))} {cumulative}")
+            lines.append(f"{METRIC_NAME}_bucket{_format_labels(base + (('le', '+Inf'),))} {hist.count}")
+            lines.append(f"{METRIC_NAME}_sum{_format_labels(base)} {hist.total!r}")
+            lines.append(f"{METRIC_NAME}_count{_format_labels(base)} {hist.count}")
+    for collector in list(_collectors):
+        lines.extend(collector())
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(path: str):
+    """Atomically write the metrics to a file for a node_exporter textfile collector."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(render_prometheus())
+    os.replace(tmp_path, path)
@@ -0,0 +1,126 @@
+import os
+from typing import Dict
+
+import numpy as np
+
+# Segmentation runs on a thumbnail whose long side is at most this many pixels.
+SEGMENT_SIDE = int(os.environ.get("SKIN_SEGMENT_SIDE", "128"))
+# Masks outside this share of the frame are treated as failed segmentations.
+MIN_AREA = 0.01
+MAX_AREA = 0.9
+
+
+def _block_mean(img_array: np.ndarray, step: int) -> np.ndarray:
+    h = img_array.shape[0] // step * step
+    w = img_array.shape[1] // step * step
+    blocks = img_array[:h, :w, :3].reshape(h // step, step, w // step, step, 3)
+    return blocks.mean(axis=(1, 3), dtype=np.float32)
+
+
+def otsu_threshold(values: np.ndarray) -> float:
+    """Threshold maximising between-class variance of a 256-bin histogram."""
+    hist = np.bincount(np.clip(values, 0, 255).astype(np.uint8).ravel(), minlength=256).astype(np.float64)
+    levels = np.arange(256)
+    weight_low = np.cumsum(hist)
+    weight_high = weight_low[-1] - weight_low
+    sum_low = np.cumsum(hist * levels)
+    mean_low = sum_low / np.maximum(weight_low, 1)
+    mean_high = (sum_low[-1] - sum_low) / np.maximum(weight_high, 1)
+    between = weight_low * weight_high * (mean_low - mean_high) ** 2
+    return float(np.argmax(between))
+
+
+def _shifted(mask: np.ndarray, fill: bool):
+    padded = np.pad(mask, 1, constant_values=fill)
+    h, w = mask.shape
+    for dy in range(3):
+        for dx in range(3):
+            yield padded[dy:dy + h, dx:dx + w]
+
+
+def dilate(mask: np.ndarray) -> np.ndarray:
+    out = np.zeros_like(mask)
+    for view in _shifted(mask, False):
+        out |= view
+    return out
+
+
+def erode(mask: np.ndarray) -> np.ndarray:
+    out = np.ones_like(mask)
+    for view in _shifted(mask, True):
+        out &= view
+    return out
+
+
+def _central_component(mask: np.ndarray) -> np.ndarray:
+    """Geodesic reconstruction from the central third: keeps the blob under the lens.
+
+    Dermoscopy vignettes and hair leave dark regions at the edges that Otsu
+    also selects; growing from the centre drops anything not connected to it.
+    """
+    h, w = mask.shape
+    seed = np.zeros_like(mask)
+    seed[h // 3:2 * h // 3, w // 3:2 * w // 3] = mask[h // 3:2 * h // 3, w // 3:2 * w // 3]
+    if not seed.any():
+        return mask
+    while True:
+        grown = dilate(seed) & mask
+        if np.array_equal(grown, seed):
+            return seed
+        seed = grown
+
+
+def segment_lesion(img_array: np.ndarray, side: int = SEGMENT_SIDE) -> Dict:
+    """Lesion mask and bounding box for an RGB uint8 image.
+
+    Returns `bbox` (x0, y0, x1, y1) in full-resolution pixels, the boolean
+    `mask` cropped to that box, the lesion's `area_fraction` of the frame, and
+    `segmented`, which is False when the whole frame is used as a fallback.
+    The downsampled `thumbnail` (float32 RGB) and its `thumbnail_mask` are
+    included for shape features that do not need full resolution.
+    """
+    height, width = img_array.shape[:2]
+    step = max(1, -(-max(height, width) // side))
+    small = _block_mean(img_array, step) if step > 1 else img_array[:, :, :3].astype(np.float32)
+    luminance = small @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+    # Lesions are darker than the surrounding skin.
+    mask = luminance < otsu_threshold(luminance)
+    mask = dilate(erode(mask))
+    mask = erode(dilate(mask))
+    mask = _central_component(mask)
+
+    area = float(mask.mean()) if mask.size else 0.0
+    if not MIN_AREA <= area <= MAX_AREA:
+        return {
+            "bbox": (0, 0, width, height),
+            "mask": np.ones((height, width), dtype=bool),
+            "area_fraction": 1.0,
+            "segmented": False,
+            "thumbnail": small,
+            "thumbnail_mask": np.ones(mask.shape, dtype=bool),
+        }
+
+    rows = np.flatnonzero(mask.any(axis=1))
+    cols = np.flatnonzero(mask.any(axis=0))
+    y0, y1 = rows[0], rows[-1] + 1
+    x0, x1 = cols[0], cols[-1] + 1
+    # Nearest-neighbour upsampling of the thumbnail mask inside the box only.
+    crop = np.repeat(np.repeat(mask[y0:y1, x0:x1], step, axis=0), step, axis=1)
+    bbox = (int(x0 * step), int(y0 * step), int(min(width, x1 * step)), int(min(height, y1 * step)))
+    crop = crop[:bbox[3] - bbox[1], :bbox[2] - bbox[0]]
+    return {
+        "bbox": bbox,
+        "mask": crop,
+        "area_fraction": area,
+        "segmented": True,
+        "thumbnail": small,
+        "thumbnail_mask": mask,
+    }
+
+
+def lesion_pixels(img_array: np.ndarray, segmentation: Dict) -> np.ndarray:
+    """(N, 3) array of the RGB values inside the lesion mask."""
+    x0, y0, x1, y1 = segmentation["bbox"]
+    return img_array[y0:y1, x0:x1, :3][segmentation["mask"]]
+
@@ -0,0 +1,226 @@
+import os
+import time
+import bisect
+import hashlib
+import itertools
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+import instrumentation
+
+MAX_CONCURRENCY = int(os.environ.get("SKIN_LLM_MAX_CONCURRENCY", "4"))
+REQUESTS_PER_MINUTE = float(os.environ.get("SKIN_LLM_RPM", "60"))
+BURST = int(os.environ.get("SKIN_LLM_BURST", "10"))
+
+URGENT = 0
+NORMAL = 1
+
+
+def _key_for(api_key: str) -> str:
+    """Rate limits are tracked per key without keeping the key itself around."""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+
+class TokenBucket:
+    """Classic token bucket; callers must hold the scheduler lock."""
+
+    def __init__(self, rate_per_s: float, capacity: float):
+        self.rate = rate_per_s
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def available(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= 1.0
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1.0
+
+    def time_until_token(self, now: float) -> float:
+        self._refill(now)
+        if self.tokens >= 1.0:
+            return 0.0
+        return (1.0 - self.tokens) / self.rate if self.rate > 0 else float("inf")
+
+
+class Ticket:
+    """One queued LLM call."""
+
+    __slots__ = ("priority", "seq", "key", "enqueued_at", "granted_at")
+
+    def __init__(self, priority: int, seq: int, key: str):
+        self.priority = priority
+        self.seq = seq
+        self.key = key
+        self.enqueued_at = time.monotonic()
+        self.granted_at: Optional[float] = None
+
+    def __lt__(self, other: "Ticket") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+    @property
+    def waited(self) -> float:
+        end = self.granted_at if self.granted_at is not None else time.monotonic()
+        return end - self.enqueued_at
+
+
+class LLMScheduler:
+    """Process-wide admission control for LLM calls.
+
+    Calls wait in a priority queue (urgent before normal, FIFO within a
+    priority) until a concurrency slot is free and the caller's API key has a
+    rate-limit token.
+    """
+
+    def __init__(self, max_concurrency: int = MAX_CONCURRENCY,
+                 requests_per_minute: float = REQUESTS_PER_MINUTE, burst: int = BURST):
+        self.max_concurrency = max_concurrency
+        self.rate_per_s = requests_per_minute / 60.0
+        self.burst = burst
+        self._cond = threading.Condition()
+        self._waiting: List[Ticket] = []
+        self._active = 0
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._seq = itertools.count()
+        self._recent_waits: deque = deque(maxlen=200)
+
+    def _bucket(self, key: str) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.rate_per_s, self.burst)
+        return bucket
+
+    def _next_eligible(self, now: float) -> Tuple[Optional[Ticket], Optional[float]]:
+        """First waiting ticket allowed to run, or how long until that could change."""
+        if self._active >= self.max_concurrency:
+            return None, None
+        retry_in = None
+        for ticket in self._waiting:
+            bucket = self._bucket(ticket.key)
+            if bucket.available(now):
+                return ticket, None
+            delay = bucket.time_until_token(now)
+            retry_in = delay if retry_in is None else min(retry_in, delay)
+        return None, retry_in
+
+    def acquire(self, api_key: str, urgent: bool = False,
+                on_wait: Optional[Callable[[int, int, float], None]] = None,
+                poll_interval: float = 0.5) -> Ticket:
+        """Block until the call may run; `on_wait(position, depth, waited_s)` reports progress."""
+        key = _key_for(api_key)
+        with self._cond:
+            ticket = Ticket(URGENT if urgent else NORMAL, next(self._seq), key)
+            bisect.insort(self._waiting, ticket)
+        try:
+            while True:
+                with self._cond:
+                    now = time.monotonic()
+                    eligible, retry_in = self._next_eligible(now)
+                    if eligible is ticket:
+                        self._waiting.remove(ticket)
+                        self._bucket(key).take(now)
+                        self._active += 1
+                        ticket.granted_at = now
+                        break
+                    timeout = poll_interval if retry_in is None else min(poll_interval, retry_in)
+                    self._cond.wait(timeout=timeout)
+                    position = self._waiting.index(ticket) + 1
+                    depth = len(self._waiting)
+                if on_wait is not None:
+                    on_wait(position, depth, ticket.waited)
+        except BaseException:
+            with self._cond:
+                if ticket in self._waiting:
+                    self._waiting.remove(ticket)
+                self._cond.notify_all()
+            raise
+        self._recent_waits.append(ticket.waited)
+        instrumentation.observe(
+            "llm_queue_wait", ticket.waited, priority="urgent" if urgent else "normal"
+        )
+        return ticket
+
+    def try_acquire(self, api_key: str, urgent: bool = False) -> Optional[Ticket]:
+        """Grant a slot only if it is free right now and nobody is queued (used for hedges)."""
+        key = _key_for(api_key)
+        with self._cond:
+            now = time.monotonic()
+            if self._waiting or self._active >= self.max_concurrency:
+                return None
+            bucket = self._bucket(key)
+            if not bucket.available(now):
+                return None
+            ticket = Ticket(URGENT if urgent else NORMAL, next(self._seq), key)
+            bucket.take(now)
+            self._active += 1
+            ticket.granted_at = now
+            return ticket
+
+    def release(self, ticket: Ticket):
+        with self._cond:
+            if ticket.granted_at is not None:
+                self._active -= 1
+                ticket.granted_at = None
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, api_key: str, urgent: bool = False,
+             on_wait: Optional[Callable[[int, int, float], None]] = None):
+        ticket = self.acquire(api_key, urgent=urgent, on_wait=on_wait)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def stats(self) -> Dict:
+        with self._cond:
+            waiting = list(self._waiting)
+            active = self._active
+        waits = sorted(self._recent_waits)
+        return {
+            "waiting": len(waiting),
+            "urgent_waiting": sum(1 for t in waiting if t.priority == URGENT),
+            "active": active,
+            "max_concurrency": self.max_concurrency,
+            "p50_wait_s": instrumentation.percentile(waits, 0.5) if waits else 0.0,
+            "p95_wait_s": instrumentation.percentile(waits, 0.95) if waits else 0.0,
+        }
+
+
+_scheduler: Optional[LLMScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> LLMScheduler:
+    """Return the scheduler shared by every session in this process."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = LLMScheduler()
+        return _scheduler
+
+
+def _prometheus_lines() -> List[str]:
+    if _scheduler is None:
+        return []
+    stats = _scheduler.stats()
+    return [
+        "# HELP skin_llm_queue_depth LLM calls waiting for a slot.",
+        "# TYPE skin_llm_queue_depth gauge",
+        f'skin_llm_queue_depth{{priority="urgent"}} {stats["urgent_waiting"]}',
+        f'skin_llm_queue_depth{{priority="normal"}} {stats["waiting"] - stats["urgent_waiting"]}',
+        "# HELP skin_llm_active_calls LLM calls currently running.",
+        "# TYPE skin_llm_active_calls gauge",
+        f"skin_llm_active_calls {stats['active']}",
+    ]
+
+
+instrumentation.register_collector(_prometheus_lines)
@@ -0,0 +1,436 @@
+"""Concurrent-session load test for app.py with a local stand-in for Gemini.
+
+Each simulated user is a Streamlit AppTest session driven from its own thread,
+so all of them share this process's caches, queues and worker pools exactly as
+browser sessions share one `streamlit run` process. Users send symptom
+descriptions and images, open Edit / Regen / Delete on their messages, start
+and switch conversations; Gemini is replaced by `FakeGeminiClient`, which
+streams canned text with a fixed time to first token and token rate, so the
+numbers measure the app rather than the network.
+
+For each concurrency level the report gives per-action and overall script-run
+latency percentiles, completed actions per second, and memory growth per
+session (PSS from /proc, plus the pickled size of each session's state). The
+throughput ceiling is the level after which adding sessions stops adding
+throughput, or where p95 latency of script runs that do not wait for the model
+(plain reruns, new/switch conversation, opening the editor) passes
+`--p95-budget-ms`.
+
+Each user enters its own API key so the per-key request rate limit does not
+mask the app's own limits; the process-wide model concurrency still applies.
+
+    python load_test.py --sessions 1,2,4,8 --actions 20
+"""
+import os
+import gc
+import sys
+import json
+import time
+import pickle
+import random
+import argparse
+import tempfile
+import threading
+import traceback
+from typing import Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+APP_PATH = os.path.join(ROOT, "app.py")
+SAMPLE_DIR = os.path.join(ROOT, "Data", "Sample_Skin_Disease_Images")
+
+DESCRIPTIONS = [
+    "I have an itchy red rash with dry scaly patches on my elbows",
+    "There is a dark mole on my back that has changed shape and sometimes bleeds",
+    "Small pimples and blackheads on my forehead and chin",
+    "A pearly bump on my nose that does not heal",
+    "Rough crusty spots on my scalp after years in the sun",
+    "Red itchy welts that come and go after eating",
+    "Can you explain what SPF means on sunscreen?",
+    "My skin is not itchy but there is a flat brown spot on my cheek",
+]
+REPLY_WORDS = ("Based on your description this could be a common skin condition; keep the area clean, "
+               "avoid scratching, use a gentle moisturiser and see a dermatologist if it changes, "
+               "bleeds or does not improve within two weeks.").split()
+
+# Relative frequency of each simulated action.
+ACTION_WEIGHTS = {
+    "send_text": 35,
+    "send_image": 10,
+    "edit": 10,
+    "regen": 10,
+    "delete": 5,
+    "new_chat": 5,
+    "switch": 10,
+    "rerun": 15,
+}
+# Script runs that never wait for the model or an image analysis; their latency is what
+# users feel as UI lag. Replies stream in the background, so sending does not wait either.
+INTERACTIVE_ACTIONS = ("rerun", "new_chat", "switch", "edit_open", "send_text", "edit_save", "regen", "delete")
+
+
+class _Chunk:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class FakeGeminiClient:
+    """Stands in for `genai.Client`: streams canned words after a fixed time to first token."""
+
+    def __init__(self, ttft: float = 0.4, tokens_per_s: float = 50.0, words: int = 60):
+        self.models = self
+        self.ttft = ttft
+        self.tokens_per_s = tokens_per_s
+        self.words = words
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _count(self):
+        with self._lock:
+            self.calls += 1
+
+    def generate_content_stream(self, model, contents, config):
+        self._count()
+        return self._stream()
+
+    def _stream(self):
+        time.sleep(self.ttft)
+        for i in range(self.words):
+            if i:
+                time.sleep(1.0 / self.tokens_per_s)
+            yield _Chunk(REPLY_WORDS[i % len(REPLY_WORDS)] + " ")
+
+    def generate_content(self, model, contents, config):
+        self._count()
+        time.sleep(self.ttft + self.words / self.tokens_per_s)
+        return _Chunk(" ".join(REPLY_WORDS[i % len(REPLY_WORDS)] for i in range(self.words)))
+
+
+def install_fake_llm(client: FakeGeminiClient):
+    """Make app.py's `get_gemini_client` return `client` (the script re-imports it every run)."""
+    import gemini_backend
+    gemini_backend.get_gemini_client = lambda api_key: client
+
+
+def allow_concurrent_sessions():
+    """Let several AppTests run at once, as sessions do under `streamlit run`.
+
+    AppTest installs a mock Runtime for each script run and clears it when the
+    run ends, which pulls it out from under sessions still running in other
+    threads; fall back to the most recent one instead. Each run also compiles
+    app.py into a fresh script cache, and concurrent `ast.parse` calls trip a
+    CPython 3.11 bug; the server compiles once into a shared cache, so do that.
+    """
+    from streamlit.runtime.runtime import Runtime
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    shared_cache = ScriptCache()
+    get_bytecode = ScriptCache.get_bytecode
+    ScriptCache.get_bytecode = lambda self, script_path: get_bytecode(shared_cache, script_path)
+
+    original = Runtime.instance.__func__
+    latest = {}
+
+    def instance(cls):
+        if cls._instance is not None:
+            latest["runtime"] = cls._instance
+            return cls._instance
+        return latest["runtime"] if "runtime" in latest else original(cls)
+
+    Runtime.instance = classmethod(instance)
+    Runtime.exists = classmethod(lambda cls: cls._instance is not None or "runtime" in latest)
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    from instrumentation import percentile
+    if not values:
+        return {"n": 0}
+    ordered = sorted(values)
+
+    def pick(q):
+        return round(percentile(ordered, q) * 1000, 1)
+
+    return {"n": len(ordered), "p50_ms": pick(0.5), "p95_ms": pick(0.95),
+            "p99_ms": pick(0.99), "max_ms": round(ordered[-1] * 1000, 1)}
+
+
+class SimulatedUser:
+    """One browser session: a fixed random script of actions against its own AppTest."""
+
+    def __init__(self, number: int, images: List[bytes], seed: int, timeout: float):
+        from streamlit.testing.v1 import AppTest
+        self.number = number
+        self.images = images
+        self.rng = random.Random(seed)
+        self.timeout = timeout
+        self.app = AppTest.from_file(APP_PATH, default_timeout=timeout)
+        self.samples: List[tuple] = []
+        self.errors: List[str] = []
+
+    # -- helpers -------------------------------------------------------------
+
+    def _run(self, action: str):
+        started = time.perf_counter()
+        self.app.run()
+        self.samples.append((action, time.perf_counter() - started))
+        for exc in self.app.exception:
+            self.errors.append(f"{action}: {exc.value}")
+
+    def _button(self, label: Optional[str] = None, key: Optional[str] = None):
+        if key is not None:
+            return self.app.button(key=key)
+        return next(b for b in self.app.button if b.label == label)
+
+    def _messages(self) -> List[Dict]:
+        state = self.app.session_state
+        return state["conversations"][state["current_conversation_id"]]["messages"]
+
+    def _indices(self, role: str) -> List[int]:
+        return [i for i, m in enumerate(self._messages()) if m["role"] == role]
+
+    def _await_reply(self, action: str):
+        """Replies stream on a background thread; the page reruns until one is committed."""
+        started = time.perf_counter()
+        while any("stream_id" in m for m in self._messages()):
+            if time.perf_counter() - started > self.timeout:
+                self.errors.append(f"{action}: reply did not finish")
+                break
+            time.sleep(0.2)
+            self._run("poll")
+        self.samples.append(("reply_ready", time.perf_counter() - started))
+
+    # -- actions -------------------------------------------------------------
+
+    def open(self):
+        self._run("open")
+        api_key = next(t for t in self.app.text_input if t.label == "Google AI API Key")
+        api_key.input(f"load-test-{self.number}")
+        self._run("rerun")
+
+    def send_text(self):
+        next(t for t in self.app.text_area if t.label == "Message").input(self.rng.choice(DESCRIPTIONS))
+        self._button("Send").click()
+        self._run("send_text")
+        self._await_reply("send_text")
+
+    def send_image(self):
+        blob = self.rng.choice(self.images)
+        self.app.file_uploader[0].upload("lesion.jpg", blob, "image/jpeg")
+        next(t for t in self.app.text_area if t.label == "Message").input("What is this spot?")
+        self._button("Send").click()
+        self._run("send_image")
+        # The next message must not carry the same upload again.
+        self.app.file_uploader[0].set_value(None)
+        # The page polls once a second until the background analysis lands.
+        started = time.perf_counter()
+        while any("image_job" in m for m in self._messages()):
+            if time.perf_counter() - started > self.timeout:
+                self.errors.append("send_image: analysis did not finish")
+                break
+            time.sleep(0.2)
+            self._run("poll")
+        self.samples.append(("image_ready", time.perf_counter() - started))
+        self._await_reply("send_image")
+
+    def edit(self):
+        users = self._indices("user")
+        if not users:
+            return self.send_text()
+        idx = self.rng.choice(users)
+        self._button(key=f"edit_btn_{idx}").click()
+        self._run("edit_open")
+        self.app.text_area(key=f"edit_{idx}").input(self.rng.choice(DESCRIPTIONS))
+        self._button(key=f"regen_{idx}").click()
+        self._run("edit_save")
+        self._await_reply("edit_save")
+
+    def regen(self):
+        replies = self._indices("assistant")
+        if not replies:
+            return self.send_text()
+        self._button(key=f"regen_btn_{replies[-1]}").click()
+        self._run("regen")
+        self._await_reply("regen")
+
+    def delete(self):
+        visible = [i for i, m in enumerate(self._messages()) if m["role"] != "system"]
+        if not visible:
+            return self.send_text()
+        self._button(key=f"del_btn_{visible[-1]}").click()
+        self._run("delete")
+
+    def new_chat(self):
+        self._button("New Chat").click()
+        self._run("new_chat")
+
+    def switch(self):
+        state = self.app.session_state
+        others = [c for c in state["conversations"] if c != state["current_conversation_id"]]
+        if not others:
+            return self.new_chat()
+        self._button(key=f"conv_{self.rng.choice(others)}").click()
+        self._run("switch")
+
+    def rerun(self):
+        self._run("rerun")
+
+    def warm_up(self):
+        self.open()
+        for action in ACTION_WEIGHTS:
+            getattr(self, action)()
+
+    def play(self, actions: int, think: float):
+        try:
+            self.open()
+            names, weights = zip(*ACTION_WEIGHTS.items())
+            for _ in range(actions):
+                getattr(self, self.rng.choices(names, weights)[0])()
+                if think:
+                    time.sleep(self.rng.uniform(0.5, 1.5) * think)
+        except Exception as e:
+            self.errors.append(f"{type(e).__name__}: {e}")
+            traceback.print_exc()
+
+    def state_bytes(self) -> int:
+        return len(pickle.dumps(self.app.session_state["conversations"]))
+
+
+def _memory_mb() -> Dict[str, float]:
+    from model_weights import memory_usage
+    gc.collect()
+    return memory_usage()
+
+
+def run_level(sessions: int, actions: int, images: List[bytes], think: float, timeout: float,
+              seed: int) -> Dict:
+    """Run `sessions` users concurrently and keep them alive while memory is measured."""
+    before = _memory_mb()
+    users = [SimulatedUser(n, images, seed + n, timeout) for n in range(sessions)]
+    threads = [threading.Thread(target=u.play, args=(actions, think), daemon=True) for u in users]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - started
+    after = _memory_mb()
+
+    samples = [s for u in users for s in u.samples]
+    by_action: Dict[str, List[float]] = {}
+    for action, seconds in samples:
+        by_action.setdefault(action, []).append(seconds)
+    runs = [seconds for action, seconds in samples if action not in ("image_ready", "reply_ready")]
+    report = {
+        "sessions": sessions,
+        "wall_s": round(wall, 2),
+        "actions_per_s": round(sessions * actions / wall, 2),
+        "script_runs_per_s": round(len(runs) / wall, 2),
+        "latency": percentiles(runs),
+        "interactive_latency": percentiles([s for a, s in samples if a in INTERACTIVE_ACTIONS]),
+        "by_action": {action: percentiles(values) for action, values in sorted(by_action.items())},
+        "memory_per_session_mb": {
+            key: round((after[key] - before.get(key, 0.0)) / sessions, 2)
+            for key in ("rss_mb", "pss_mb") if key in after
+        },
+        "state_kb_per_session": round(sum(u.state_bytes() for u in users) / sessions / 1024, 1),
+        "errors": [f"session {u.number}: {e}" for u in users for e in u.errors][:20],
+    }
+    del users
+    gc.collect()
+    return report
+
+
+def ceiling(levels: List[Dict], p95_budget_ms: float, min_gain: float = 0.1) -> Dict:
+    """Highest level that still added throughput (by `min_gain`) within the interactive latency budget."""
+    best = levels[0]
+    for level in levels[1:]:
+        if level["interactive_latency"].get("p95_ms", 0) > p95_budget_ms:
+            break
+        if level["actions_per_s"] < best["actions_per_s"] * (1 + min_gain):
+            break
+        best = level
+    return {"sessions": best["sessions"], "actions_per_s": best["actions_per_s"],
+            "interactive_p95_ms": best["interactive_latency"].get("p95_ms")}
+
+
+def prepare_environment(workdir: str):
+    """Point caches and indexes at a scratch directory so the load test leaves no trace."""
+    os.environ.setdefault("SKIN_CACHE_PATH", os.path.join(workdir, "cache.sqlite3"))
+    os.environ.setdefault("SKIN_CASE_INDEX_DIR", os.path.join(workdir, "case_index"))
+    os.environ.pop("GEMINI_API_KEY", None)
+
+
+def run_load_test(levels: List[int], actions: int, think: float = 0.0, ttft: float = 0.4,
+                  tokens_per_s: float = 50.0, timeout: float = 60.0, p95_budget_ms: float = 1000.0,
+                  seed: int = 0) -> Dict:
+    client = FakeGeminiClient(ttft, tokens_per_s)
+    install_fake_llm(client)
+    allow_concurrent_sessions()
+    names = sorted(f for f in os.listdir(SAMPLE_DIR) if f.endswith(".jpg"))[:20]
+    images = [open(os.path.join(SAMPLE_DIR, name), "rb").read() for name in names]
+
+    # One session first, so imports, model tables and worker start-up are not
+    # charged to the first level.
+    warmup = SimulatedUser(-1, images, seed - 1, timeout)
+    warmup.warm_up()
+    del warmup
+
+    # User n follows the same script at every level, so levels differ only in concurrency.
+    results = [run_level(n, actions, images, think, timeout, seed) for n in levels]
+    return {
+        "actions_per_session": actions,
+        "think_s": think,
+        "fake_llm": {"ttft_s": ttft, "tokens_per_s": tokens_per_s, "words": client.words,
+                     "calls": client.calls},
+        "levels": results,
+        "ceiling": ceiling(results, p95_budget_ms),
+        "p95_budget_ms": p95_budget_ms,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", default="1,2,4,8", help="comma-separated concurrency levels")
+    parser.add_argument("--actions", type=int, default=20, help="actions per simulated session")
+    parser.add_argument("--think-ms", type=float, default=0.0, help="mean pause between a user's actions")
+    parser.add_argument("--ttft-ms", type=float, default=400.0, help="fake LLM time to first token")
+    parser.add_argument("--tokens-per-s", type=float, default=50.0, help="fake LLM streaming rate")
+    parser.add_argument("--timeout", type=float, default=60.0, help="per script run and per image analysis")
+    parser.add_argument("--p95-budget-ms", type=float, default=1000.0,
+                        help="p95 latency of runs that do not wait for the model, allowed at the ceiling")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print the raw JSON report")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="skin_load_test_")
+    prepare_environment(workdir)
+    sys.path.insert(0, ROOT)
+    levels = [int(n) for n in args.sessions.split(",")]
+    report = run_load_test(levels, args.actions, args.think_ms / 1000, args.ttft_ms / 1000,
+                           args.tokens_per_s, args.timeout, args.p95_budget_ms, args.seed)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print(f"Load test: {args.actions} actions per session, fake LLM "
+          f"{args.ttft_ms:.0f} ms TTFT at {args.tokens_per_s:.0f} tokens/s")
+    print(f"{'sessions':>8} {'actions/s':>10} {'runs/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} "
+          f"{'UI p95 ms':>10} {'PSS MB/sess':>12} {'state KB':>9} {'errors':>7}")
+    for level in report["levels"]:
+        lat = level["latency"]
+        print(f"{level['sessions']:>8} {level['actions_per_s']:>10.2f} {level['script_runs_per_s']:>8.2f} "
+              f"{lat.get('p50_ms', 0):>9.1f} {lat.get('p95_ms', 0):>9.1f} {lat.get('p99_ms', 0):>9.1f} "
+              f"{level['interactive_latency'].get('p95_ms', 0):>10.1f} {level['memory_per_session_mb'].get('pss_mb', 0):>12.2f} {level['state_kb_per_session']:>9.1f} "
+              f"{len(level['errors']):>7}")
+    top = report["levels"][-1]
+    print("\nper action at the highest level (p50 / p95 ms):")
+    for action, stats in top["by_action"].items():
+        print(f"  {action:<12} n={stats['n']:<5} {stats.get('p50_ms', 0):>8.1f} / {stats.get('p95_ms', 0):>8.1f}")
+    c = report["ceiling"]
+    print(f"\nthroughput ceiling: {c['actions_per_s']:.2f} actions/s at {c['sessions']} sessions "
+          f"(interactive p95 {c['interactive_p95_ms']} ms, budget {report['p95_budget_ms']:.0f} ms)")
+    for level in report["levels"]:
+        for error in level["errors"]:
+            print(f"  error ({level['sessions']} sessions) {error}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+import os
+import time
+import queue
+import threading
+from collections import deque
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import instrumentation
+import llm_scheduler
+from gemini_backend import StreamHandle, stream_chat
+
+AUTO_MODEL = "auto"
+FAST_MODEL = "gemini-2.5-flash"
+STRONG_MODEL = "gemini-2.5-pro"
+
+# Hedge once time-to-first-token passes this percentile of the model's recent
+# history; until enough samples exist a fixed delay is used instead.
+HEDGE_PERCENTILE = float(os.environ.get("SKIN_HEDGE_PERCENTILE", "0.9"))
+HEDGE_DEFAULT_AFTER = float(os.environ.get("SKIN_HEDGE_AFTER", "3.0"))
+HEDGE_MIN_AFTER = 0.5
+HEDGE_MIN_SAMPLES = 8
+
+
+class RoutingError(Exception):
+    """Raised when every attempt (primary, hedge and fallback) failed."""
+
+
+class LatencyStats:
+    """Rolling per-model latency samples used to tune hedge thresholds."""
+
+    def __init__(self, window: int = 200):
+        self.window = window
+        self._lock = threading.Lock()
+        self._samples: Dict[Tuple[str, str], deque] = {}
+        self._failures: Dict[str, int] = {}
+
+    def record(self, model: str, metric: str, seconds: float):
+        with self._lock:
+            samples = self._samples.get((model, metric))
+            if samples is None:
+                samples = self._samples[(model, metric)] = deque(maxlen=self.window)
+            samples.append(seconds)
+
+    def record_failure(self, model: str):
+        with self._lock:
+            self._failures[model] = self._failures.get(model, 0) + 1
+
+    def percentile(self, model: str, metric: str, q: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples.get((model, metric), ()))
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        return instrumentation.percentile(samples, q)
+
+    def summary(self) -> Dict[str, Dict]:
+        with self._lock:
+            keys = list(self._samples)
+            failures = dict(self._failures)
+        summary: Dict[str, Dict] = {}
+        for model, metric in keys:
+            with self._lock:
+                samples = sorted(self._samples[(model, metric)])
+            entry = summary.setdefault(model, {"failures": failures.get(model, 0)})
+            entry[f"{metric}_n"] = len(samples)
+            entry[f"{metric}_p50_s"] = instrumentation.percentile(samples, 0.5)
+            entry[f"{metric}_p90_s"] = instrumentation.percentile(samples, 0.9)
+        return summary
+
+
+class _Attempt:
+    """One streaming request running on a worker thread."""
+
+    def __init__(self, kind: str, model: str, events: "queue.Queue",
+                 ticket: Optional[llm_scheduler.Ticket] = None):
+        self.kind = kind
+        self.model = model
+        self.events = events
+        self.ticket = ticket
+        self.cancelled = threading.Event()
+        self.handle = StreamHandle()
+        self.started_at = time.perf_counter()
+
+    def cancel(self):
+        """Abort the request, even one still waiting for its first token, and free its slot now."""
+        if self.cancelled.is_set():
+            return
+        self.cancelled.set()
+        self.handle.close()
+        if self.ticket is not None:
+            llm_scheduler.get_scheduler().release(self.ticket)
+
+    def start(self, client, messages: List[Dict], temperature: float, max_tokens: int, api_key: str):
+        threading.Thread(
+            target=self._run, args=(client, messages, temperature, max_tokens, api_key),
+            name=f"llm-{self.kind}-{self.model}", daemon=True
+        ).start()
+
+    def _run(self, client, messages, temperature, max_tokens, api_key):
+        chunks = None
+        try:
+            chunks = stream_chat(client, messages, self.model, temperature, max_tokens, api_key, self.handle)
+            for chunk in chunks:
+                if self.cancelled.is_set():
+                    return
+                self.events.put((self, "chunk", chunk))
+            self.events.put((self, "done", None))
+        except Exception as e:
+            if not self.cancelled.is_set():
+                self.events.put((self, "error", e))
+        finally:
+            if chunks is not None:
+                chunks.close()
+            if self.ticket is not None:
+                llm_scheduler.get_scheduler().release(self.ticket)
+
+
+class RoutedStream:
+    """Iterator over the winning attempt's text, with routing details for display."""
+
+    def __init__(self, router: "ModelRouter", client, messages: List[Dict], model: str,
+                 temperature: float, max_tokens: int, api_key: str, urgent: bool, hedge: bool):
+        self.router = router
+        self.client = client
+        self.messages = messages
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        self.api_key = api_key
+        self.urgent = urgent
+        self.hedge = hedge
+        self.primary_model, self.fallback_model = router.plan(model, urgent)
+        self.model: Optional[str] = None
+        self.hedged = False
+        self.escalated = False
+
+    def _launch(self, kind: str, model: str, events, attempts: List[_Attempt],
+                ticket: Optional[llm_scheduler.Ticket] = None) -> _Attempt:
+        attempt = _Attempt(kind, model, events, ticket)
+        attempts.append(attempt)
+        attempt.start(self.client, self.messages, self.temperature, self.max_tokens, self.api_key)
+        return attempt
+
+    def __iter__(self) -> Iterator[str]:
+        events: "queue.Queue" = queue.Queue()
+        attempts: List[_Attempt] = []
+        failed = set()
+        winner: Optional[_Attempt] = None
+        errors = []
+        self._launch("primary", self.primary_model, events, attempts)
+        hedge_at = time.perf_counter() + self.router.hedge_after(self.primary_model) if self.hedge else None
+
+        try:
+            while True:
+                timeout = None
+                if winner is None and hedge_at is not None:
+                    timeout = max(0.0, hedge_at - time.perf_counter())
+                try:
+                    attempt, kind, payload = events.get(timeout=timeout)
+                except queue.Empty:
+                    hedge_at = None
+                    ticket = llm_scheduler.get_scheduler().try_acquire(self.api_key, urgent=self.urgent)
+                    if ticket is not None:
+                        self.hedged = True
+                        self._launch("hedge", self.primary_model, events, attempts, ticket)
+                    continue
+
+                if winner is None:
+                    if kind == "chunk":
+                        winner = attempt
+                        self.model = attempt.model
+                        ttft = time.perf_counter() - attempt.started_at
+                        self.router.stats.record(attempt.model, "ttft", ttft)
+                        instrumentation.observe("llm_route_ttft", ttft, model=attempt.model, attempt=attempt.kind)
+                        for other in attempts:
+                            if other is not attempt:
+                                other.cancel()
+                    else:
+                        failed.add(attempt)
+                        self.router.stats.record_failure(attempt.model)
+                        errors.append(payload if kind == "error" else RoutingError(f"{attempt.model} returned no text"))
+                        if len(failed) < len(attempts):
+                            continue
+                        if self.escalated or self.fallback_model is None:
+                            raise RoutingError("; ".join(str(e) for e in errors))
+                        # Escalate (or fall back) once instead of retrying the same model.
+                        self.escalated = True
+                        hedge_at = None
+                        self._launch("fallback", self.fallback_model, events, attempts)
+                        continue
+
+                if attempt is not winner:
+                    continue
+                if kind == "chunk":
+                    yield payload
+                elif kind == "done":
+                    self.router.stats.record(attempt.model, "total", time.perf_counter() - attempt.started_at)
+                    return
+                else:
+                    raise payload
+        finally:
+            for attempt in attempts:
+                attempt.cancel()
+
+
+class ModelRouter:
+    """Fast-first model cascade with hedged requests and one-step escalation."""
+
+    def __init__(self, fast_model: str = FAST_MODEL, strong_model: str = STRONG_MODEL):
+        self.fast_model = fast_model
+        self.strong_model = strong_model
+        self.stats = LatencyStats()
+
+    def plan(self, model: str, urgent: bool) -> Tuple[str, Optional[str]]:
+        """Pick (primary, fallback) models for a request.
+
+        Only "auto" cascades; a model chosen explicitly is the only one used.
+        """
+        if model != AUTO_MODEL:
+            return model, None
+        # Urgent findings go straight to the stronger model; everything else
+        # starts fast and only escalates if the fast model fails.
+        primary = self.strong_model if urgent else self.fast_model
+        fallback = self.strong_model if primary == self.fast_model else self.fast_model
+        return primary, fallback
+
+    def hedge_after(self, model: str) -> float:
+        threshold = self.stats.percentile(model, "ttft", HEDGE_PERCENTILE)
+        if threshold is None:
+            threshold = HEDGE_DEFAULT_AFTER
+        return max(HEDGE_MIN_AFTER, threshold)
+
+    def stream(self, client, messages: List[Dict], model: str, temperature: float, max_tokens: int,
+               api_key: str, urgent: bool = False, hedge: bool = True) -> RoutedStream:
+        return RoutedStream(self, client, messages, model, temperature, max_tokens, api_key, urgent, hedge)
+
+
+_router: Optional[ModelRouter] = None
+_router_lock = threading.Lock()
+
+
+def get_router() -> ModelRouter:
+    """Return the router shared by every session, so latency history accumulates."""
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = ModelRouter()
+        return _router
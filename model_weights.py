@@ -0,0 +1,259 @@
+"""Memory-mapped model weights shared by every process on a host.
+
+`torch.load` copies a checkpoint into each process's private heap, so N app
+workers or scanners hold N copies of a ~100 MB ResNet50. The flat format here
+stores each tensor as raw little-endian bytes at an aligned offset behind a
+JSON header; loading maps the file and hands out array views, so the weights
+live once in the page cache and every process maps the same physical pages.
+Mapping before forking shares them too.
+
+The loader measures what a load actually cost the process (RSS, PSS and
+private bytes from /proc), so the saving is visible rather than assumed.
+
+    python model_weights.py export models/skin_classifier.pt models/skin_classifier.weights
+    python model_weights.py measure models/skin_classifier.weights --processes 4
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import multiprocessing
+from typing import Dict, Optional
+
+import numpy as np
+
+MAGIC = b"SKINWTS1"
+# Tensor data starts on a page boundary and each tensor on a cache line.
+PAGE = 4096
+ALIGN = 64
+
+
+def require_torch():
+    """Import torch, or explain that the torch paths need the `train` extra."""
+    try:
+        import torch
+        import torchvision  # noqa: F401  (build_model's architectures)
+    except ImportError as e:
+        raise ImportError(f"torch checkpoints need the train extra (pip install '.[train]'): {e}") from e
+    return torch
+
+
+def memory_usage() -> Dict[str, float]:
+    """RSS, PSS, shared and private memory of this process in MB.
+
+    PSS splits shared pages between the processes mapping them, so summing
+    PSS across workers gives the host's real footprint.
+    """
+    fields = {"Rss": "rss_mb", "Pss": "pss_mb", "Shared_Clean": "shared_mb",
+              "Private_Clean": "private_clean_mb", "Private_Dirty": "private_mb"}
+    usage = {}
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                key, _, rest = line.partition(":")
+                if key in fields:
+                    usage[fields[key]] = round(int(rest.split()[0]) / 1024, 2)
+    except OSError:
+        import resource
+        usage["rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 2)
+    return usage
+
+
+def _delta(before: Dict[str, float], after: Dict[str, float]) -> Dict[str, float]:
+    return {key: round(after[key] - before.get(key, 0.0), 2) for key in after}
+
+
+def save_weights(path: str, tensors: Dict[str, np.ndarray], meta: Optional[Dict] = None):
+    """Write arrays to the flat format (via a temporary file, then renamed)."""
+    entries, offset = [], 0
+    for name, array in tensors.items():
+        array = np.asarray(array, order="C")
+        offset = -(-offset // ALIGN) * ALIGN
+        entries.append({"name": name, "dtype": array.dtype.newbyteorder("<").str,
+                        "shape": list(array.shape), "offset": offset})
+        offset += array.nbytes
+    header = json.dumps({"tensors": entries, "meta": meta or {}, "nbytes": offset}).encode()
+    data_start = -(-(len(MAGIC) + 8 + len(header)) // PAGE) * PAGE
+
+    tmp = f"{path}.tmp"
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(tmp, "wb") as f:
+        f.write(MAGIC + len(header).to_bytes(8, "little") + header)
+        for entry, array in zip(entries, tensors.values()):
+            f.seek(data_start + entry["offset"])
+            f.write(np.asarray(array, dtype=entry["dtype"], order="C").tobytes())
+        f.truncate(data_start + offset)
+        # Dirty page-cache pages are charged to whoever maps them first as
+        # private memory; flushing makes them clean and shareable straight away.
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class MappedWeights:
+    """Read-only tensors mapped from a weights file.
+
+    `tensors` maps names to numpy views into the shared mapping; `meta` is the
+    dictionary stored at export time; `memory` is what mapping and touching
+    every page changed in this process's RSS/PSS/private memory.
+    """
+
+    def __init__(self, path: str, copy_on_write: bool = False, touch: bool = True):
+        self.path = path
+        before = memory_usage()
+        started = time.perf_counter()
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a weights file")
+            header_len = int.from_bytes(f.read(8), "little")
+            header = json.loads(f.read(header_len))
+        data_start = -(-(len(MAGIC) + 8 + header_len) // PAGE) * PAGE
+        # "c" maps MAP_PRIVATE: writable views (torch wants them) whose pages stay
+        # shared with the page cache unless something actually writes to them.
+        self._map = np.memmap(path, dtype=np.uint8, mode="c" if copy_on_write else "r",
+                              offset=data_start, shape=(header["nbytes"],))
+        self.meta: Dict = header["meta"]
+        self.tensors: Dict[str, np.ndarray] = {}
+        for entry in header["tensors"]:
+            dtype = np.dtype(entry["dtype"])
+            count = int(np.prod(entry["shape"], dtype=np.int64))
+            view = self._map[entry["offset"]:entry["offset"] + count * dtype.itemsize]
+            self.tensors[entry["name"]] = view.view(dtype).reshape(entry["shape"])
+        if touch:
+            self.touch()
+        self.load_s = round(time.perf_counter() - started, 4)
+        self.memory = _delta(before, memory_usage())
+
+    @property
+    def nbytes(self) -> int:
+        return int(self._map.size)
+
+    def touch(self):
+        """Fault every page in (one byte per page), as a first forward pass would."""
+        int(self._map[::PAGE].sum())
+
+    def torch_state_dict(self):
+        """Tensors sharing the mapped memory; load with `model.load_state_dict(sd, assign=True)`."""
+        torch = require_torch()
+        return {name: torch.from_numpy(array) for name, array in self.tensors.items()}
+
+    def stats(self) -> Dict:
+        return {"path": self.path, "mapped_mb": round(self.nbytes / 2 ** 20, 2),
+                "load_s": self.load_s, "load_delta": self.memory, "process": memory_usage()}
+
+
+_mapped: Dict[str, MappedWeights] = {}
+_mapped_lock = threading.Lock()
+
+
+def get_weights(path: str, copy_on_write: bool = False) -> MappedWeights:
+    """Map `path` once per process; call before forking workers to share the mapping."""
+    key = os.path.abspath(path)
+    with _mapped_lock:
+        weights = _mapped.get(key)
+        if weights is None:
+            weights = _mapped[key] = MappedWeights(path, copy_on_write=copy_on_write)
+        return weights
+
+
+def export_checkpoint(checkpoint: str, out: str) -> Dict:
+    """Convert a train_model.py checkpoint (torch pickle) to the mappable format."""
+    torch = require_torch()
+    state = torch.load(checkpoint, map_location="cpu")
+    tensors = {name: t.detach().contiguous().numpy() for name, t in state["model"].items()}
+    meta = {key: state[key] for key in ("arch", "classes", "input_side", "mean", "std") if key in state}
+    save_weights(out, tensors, meta)
+    return {"tensors": len(tensors), "mb": round(sum(a.nbytes for a in tensors.values()) / 2 ** 20, 2)}
+
+
+def load_torch_model(path: str):
+    """Inference model from a `.weights` file (shared mapping) or a `.pt` checkpoint (private copy).
+
+    Returns `(model, meta, stats)`; `stats["load_delta"]` is what the load
+    added to this process's RSS/PSS/private memory, for either path.
+    """
+    torch = require_torch()
+    from train_model import build_model
+    before = memory_usage()
+    shared = path.endswith(".weights")
+    if shared:
+        weights = get_weights(path, copy_on_write=True)
+        meta, state = weights.meta, weights.torch_state_dict()
+    else:
+        meta = torch.load(path, map_location="cpu")
+        state = meta["model"]
+    # Build on the meta device so no throwaway random weights are allocated,
+    # then adopt the loaded tensors as the parameters themselves.
+    with torch.device("meta"):
+        model = build_model(meta["arch"], len(meta["classes"]), pretrained=False)
+    model.load_state_dict(state, assign=True)
+    model.eval().requires_grad_(False)
+    stats = {"path": path, "shared": shared, "load_delta": _delta(before, memory_usage())}
+    return model, meta, stats
+
+
+def _measure_child(path: str, mode: str, ready, release, results):
+    if mode == "mmap":
+        weights = MappedWeights(path)
+        checksum = sum(float(a.ravel()[0]) for a in weights.tensors.values() if a.size)
+    else:
+        # What torch.load does: read the whole file into private memory.
+        before = memory_usage()
+        with open(path, "rb") as f:
+            blob = bytearray(f.read())
+        checksum = float(len(blob))
+        weights = None
+    # Hold the memory until every process has loaded, so PSS reflects sharing.
+    ready.release()
+    release.wait()
+    usage = memory_usage()
+    results.put({"mode": mode, "pid": os.getpid(), "checksum": checksum,
+                 "load_delta": weights.memory if weights else _delta(before, usage), "process": usage})
+
+
+def measure(path: str, processes: int = 4) -> Dict:
+    """Per-process and total memory for N processes loading privately vs mapping the file."""
+    ctx = multiprocessing.get_context("spawn")
+    report = {"file_mb": round(os.path.getsize(path) / 2 ** 20, 2), "processes": processes}
+    for mode in ("private", "mmap"):
+        ready, release, results = ctx.Semaphore(0), ctx.Event(), ctx.Queue()
+        children = [ctx.Process(target=_measure_child, args=(path, mode, ready, release, results))
+                    for _ in range(processes)]
+        for child in children:
+            child.start()
+        for _ in children:
+            ready.acquire()
+        release.set()
+        rows = [results.get() for _ in children]
+        for child in children:
+            child.join()
+        report[mode] = {
+            "load_rss_mb": round(float(np.mean([r["load_delta"].get("rss_mb", 0) for r in rows])), 2),
+            "load_private_mb": round(float(np.mean([r["load_delta"].get("private_mb", 0) for r in rows])), 2),
+            "pss_mb": round(float(np.mean([r["process"].get("pss_mb", 0) for r in rows])), 2),
+            "total_pss_mb": round(sum(r["process"].get("pss_mb", 0) for r in rows), 2),
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    export = sub.add_parser("export", help="convert a train_model.py checkpoint")
+    export.add_argument("checkpoint")
+    export.add_argument("out")
+    meas = sub.add_parser("measure", help="compare private loads with shared mappings")
+    meas.add_argument("weights")
+    meas.add_argument("--processes", type=int, default=4)
+    args = parser.parse_args()
+
+    if args.command == "export":
+        print(json.dumps(export_checkpoint(args.checkpoint, args.out)))
+    else:
+        print(json.dumps(measure(args.weights, args.processes), indent=2))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
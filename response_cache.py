@@ -0,0 +1,70 @@
+import os
+import json
+import hashlib
+from typing import Dict, Iterator, List, Optional
+
+import shared_cache
+from image_ingest import asset_for_message, has_image
+
+RESPONSE_TTL = float(os.environ.get("SKIN_RESPONSE_CACHE_TTL", "3600"))
+RESPONSE_CACHE_SIZE = int(os.environ.get("SKIN_RESPONSE_CACHE_SIZE", "512"))
+# Off by default: answers then live only in this process's LRU. When enabled
+# they are also written to the shared SQLite file and survive restarts.
+PERSIST = os.environ.get("SKIN_RESPONSE_CACHE_PERSIST", "") in ("1", "true", "yes")
+REPLAY_CHUNK_CHARS = 64
+
+
+def get_response_cache() -> shared_cache.SharedCache:
+    return shared_cache.get_cache(
+        "llm_responses", ttl=RESPONSE_TTL, l1_size=RESPONSE_CACHE_SIZE, persist=PERSIST
+    )
+
+
+def should_cache(temperature: float, opt_in: bool) -> bool:
+    """Only deterministic requests are cached unless the user opts in."""
+    return opt_in or temperature == 0
+
+
+def _normalise_message(message: Dict) -> Dict:
+    content = message.get("content", "").replace("\r\n", "\n").strip()
+    normalised = {"role": message["role"], "content": content}
+    if has_image(message):
+        normalised["image"] = asset_for_message(message).digest
+    return normalised
+
+
+def make_key(model: str, messages: List[Dict], temperature: float, max_tokens: int) -> str:
+    """Canonical hash of everything that determines the model's answer."""
+    system_prompt = next((m["content"] for m in messages if m["role"] == "system"), "")
+    history = [_normalise_message(m) for m in messages if m["role"] != "system"]
+    payload = json.dumps({
+        "model": model,
+        "system": system_prompt.strip(),
+        "temperature": round(float(temperature), 4),
+        "max_tokens": int(max_tokens),
+        "history": history,
+    }, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def lookup(key: str) -> Optional[Dict]:
+    return get_response_cache().get(key)
+
+
+def store(key: str, text: str, model: Optional[str]):
+    get_response_cache().set(key, {"text": text, "model": model})
+
+
+class ReplayStream:
+    """Feeds a cached answer through the same chunk loop as a live stream."""
+
+    cached = True
+
+    def __init__(self, entry: Dict, chunk_chars: int = REPLAY_CHUNK_CHARS):
+        self.text = entry["text"]
+        self.model = entry.get("model")
+        self.chunk_chars = chunk_chars
+
+    def __iter__(self) -> Iterator[str]:
+        for start in range(0, len(self.text), self.chunk_chars):
+            yield self.text[start:start + self.chunk_chars]
@@ -0,0 +1,312 @@
+"""Assistant replies generated off the script thread, in a buffer that outlives the run.
+
+`start()` runs the model call (scheduler slot, response cache, routing) on a
+background thread and returns a stream id; the assistant message holds that
+id until the reply is complete. Text is written to a row in the shared
+SQLite file as it arrives, so a rerun, a reconnect or another worker on the
+host reattaches to the same generation by reading the row instead of
+sending a new request. Once the stream has finished, the app copies the
+whole reply into its message in one step and saves the conversation.
+"""
+import os
+import time
+import uuid
+import sqlite3
+import threading
+from typing import Dict, List, Optional
+
+import instrumentation
+import llm_scheduler
+import model_router
+import response_cache
+import shared_cache
+
+# Partial text is written to the row at most this often.
+FLUSH_INTERVAL = 0.25
+# Finished streams are kept this long so a session that comes back late can still commit its reply.
+STREAM_RETENTION = 24 * 3600
+PURGE_INTERVAL = 3600
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+
+
+class StreamCancelled(Exception):
+    """Raised inside a stream's thread once its row was cancelled."""
+
+
+class StreamStore:
+    """Stream table in the shared SQLite file, so partial replies survive reruns and reconnects."""
+
+    def __init__(self, path: str = shared_cache.DEFAULT_PATH):
+        self.path = shared_cache.secure_path(path)
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS streams ("
+                " id TEXT PRIMARY KEY, session_key TEXT, status TEXT NOT NULL,"
+                " text TEXT NOT NULL DEFAULT '', model TEXT, cached INTEGER NOT NULL DEFAULT 0,"
+                " error TEXT, queue_position INTEGER, queue_depth INTEGER, queue_waited REAL,"
+                " owner_pid INTEGER, created_at REAL NOT NULL, updated_at REAL, finished_at REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS streams_status ON streams (status)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def create(self, stream_id: str, session_key: Optional[str]):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO streams (id, session_key, status, owner_pid, created_at, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (stream_id, session_key, QUEUED, os.getpid(), now, now)
+            )
+
+    def queued(self, stream_id: str, position: int, depth: int, waited: float) -> bool:
+        """Record the scheduler queue position; False once the stream was cancelled."""
+        with self._connect() as conn:
+            return conn.execute(
+                "UPDATE streams SET queue_position = ?, queue_depth = ?, queue_waited = ?, updated_at = ?"
+                " WHERE id = ? AND status = ?",
+                (position, depth, waited, time.time(), stream_id, QUEUED)
+            ).rowcount > 0
+
+    def begin(self, stream_id: str) -> bool:
+        with self._connect() as conn:
+            return conn.execute(
+                "UPDATE streams SET status = ?, updated_at = ? WHERE id = ? AND status = ?",
+                (RUNNING, time.time(), stream_id, QUEUED)
+            ).rowcount > 0
+
+    def append(self, stream_id: str, text: str, model: Optional[str]) -> bool:
+        """Store the text so far; False once the stream was cancelled."""
+        with self._connect() as conn:
+            return conn.execute(
+                "UPDATE streams SET text = ?, model = ?, updated_at = ? WHERE id = ? AND status = ?",
+                (text, model, time.time(), stream_id, RUNNING)
+            ).rowcount > 0
+
+    def finish(self, stream_id: str, status: str, text: str, model: Optional[str] = None,
+               cached: bool = False, error: Optional[str] = None) -> bool:
+        """Record the outcome unless the stream was cancelled first."""
+        now = time.time()
+        with self._connect() as conn:
+            return conn.execute(
+                "UPDATE streams SET status = ?, text = ?, model = ?, cached = ?, error = ?,"
+                " updated_at = ?, finished_at = ? WHERE id = ? AND status IN (?, ?)",
+                (status, text, model, int(cached), error, now, now, stream_id, QUEUED, RUNNING)
+            ).rowcount > 0
+
+    def cancel(self, stream_id: str) -> bool:
+        now = time.time()
+        with self._connect() as conn:
+            return conn.execute(
+                "UPDATE streams SET status = ?, updated_at = ?, finished_at = ?"
+                " WHERE id = ? AND status IN (?, ?)",
+                (CANCELLED, now, now, stream_id, QUEUED, RUNNING)
+            ).rowcount > 0
+
+    def get(self, stream_id: str) -> Optional[Dict]:
+        row = self._connect().execute(
+            "SELECT status, text, model, cached, error, queue_position, queue_depth, queue_waited,"
+            " owner_pid, created_at, updated_at FROM streams WHERE id = ?", (stream_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {
+            "status": row[0], "text": row[1], "model": row[2], "cached": bool(row[3]), "error": row[4],
+            "queue_position": row[5], "queue_depth": row[6], "queue_waited": row[7],
+            "owner_pid": row[8], "created_at": row[9], "updated_at": row[10],
+        }
+
+    def fail_orphans(self, stream_id: Optional[str] = None) -> int:
+        """Fail unfinished streams whose generating process has died, keeping their partial text."""
+        query = "SELECT id, owner_pid FROM streams WHERE status IN (?, ?)"
+        params = [QUEUED, RUNNING]
+        if stream_id is not None:
+            query += " AND id = ?"
+            params.append(stream_id)
+        failed = 0
+        for orphan_id, pid in self._connect().execute(query, params).fetchall():
+            if pid == os.getpid() or shared_cache.pid_alive(pid):
+                continue
+            # A model call cannot be resumed from another process; the text so far is kept.
+            failed += self.finish(orphan_id, FAILED, self.get(orphan_id)["text"],
+                                  error="the worker generating this reply stopped")
+        return failed
+
+    def purge_finished(self, older_than: float = STREAM_RETENTION) -> int:
+        with self._connect() as conn:
+            return conn.execute(
+                "DELETE FROM streams WHERE status IN (?, ?, ?) AND finished_at < ?",
+                (*FINISHED, time.time() - older_than)
+            ).rowcount
+
+    def counts(self) -> Dict[str, int]:
+        rows = self._connect().execute("SELECT status, COUNT(*) FROM streams GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+
+class ResponseStreams:
+    """Runs each reply on its own thread and writes its progress to the stream table.
+
+    A cancelled stream stops at its next flush and closes the model stream,
+    so the rest of the reply is neither generated nor paid for.
+    """
+
+    def __init__(self, store: StreamStore):
+        self.store = store
+        self._lock = threading.Lock()
+        self._running = 0
+        self._outcomes: Dict[str, int] = {}
+        self._last_purge = 0.0
+
+    def start(self, session_key: Optional[str], client, messages: List[Dict], model: str,
+              temperature: float, max_tokens: int, api_key: str, urgent: bool = False,
+              hedge: bool = True, cache_key: Optional[str] = None) -> str:
+        stream_id = uuid.uuid4().hex
+        self.store.create(stream_id, session_key)
+        # Copies, since session_memory may spill the session's own messages while this runs.
+        messages = [dict(m) for m in messages]
+        threading.Thread(
+            target=self._run,
+            args=(stream_id, client, messages, model, temperature, max_tokens, api_key, urgent, hedge, cache_key),
+            name=f"response-stream-{stream_id[:8]}", daemon=True
+        ).start()
+        self._maybe_purge()
+        return stream_id
+
+    def cancel(self, stream_id: str) -> bool:
+        cancelled = self.store.cancel(stream_id)
+        if cancelled:
+            self._count(CANCELLED)
+        return cancelled
+
+    def status(self, stream_id: str) -> Optional[Dict]:
+        stream = self.store.get(stream_id)
+        if stream is not None and stream["status"] not in FINISHED and stream["owner_pid"] != os.getpid():
+            if self.store.fail_orphans(stream_id):
+                stream = self.store.get(stream_id)
+        return stream
+
+    def _count(self, outcome: str):
+        with self._lock:
+            self._outcomes[outcome] = self._outcomes.get(outcome, 0) + 1
+
+    def _maybe_purge(self):
+        with self._lock:
+            if time.time() - self._last_purge < PURGE_INTERVAL:
+                return
+            self._last_purge = time.time()
+        self.store.purge_finished()
+
+    def _run(self, stream_id, client, messages, model, temperature, max_tokens, api_key, urgent, hedge,
+             cache_key):
+        scheduler = llm_scheduler.get_scheduler()
+        ticket = None
+        chunks = None
+        text = ""
+        stream = None
+        started = time.perf_counter()
+
+        def on_wait(position: int, depth: int, waited: float):
+            if not self.store.queued(stream_id, position, depth, waited):
+                raise StreamCancelled()
+
+        with self._lock:
+            self._running += 1
+        try:
+            cached_entry = response_cache.lookup(cache_key) if cache_key is not None else None
+            if cached_entry is not None:
+                stream = response_cache.ReplayStream(cached_entry)
+            else:
+                ticket = scheduler.acquire(api_key, urgent=urgent, on_wait=on_wait)
+                # The router handles hedging and escalation, so a failure here has
+                # already been retried on another model.
+                stream = model_router.get_router().stream(
+                    client, messages, model, temperature, max_tokens, api_key=api_key, urgent=urgent, hedge=hedge
+                )
+            if not self.store.begin(stream_id):
+                raise StreamCancelled()
+            chunks = iter(stream)
+            flushed_at = time.monotonic()
+            for chunk in chunks:
+                text += chunk
+                if time.monotonic() - flushed_at >= FLUSH_INTERVAL:
+                    if not self.store.append(stream_id, text, stream.model):
+                        raise StreamCancelled()
+                    flushed_at = time.monotonic()
+            cached = cached_entry is not None
+            if self.store.finish(stream_id, DONE, text.strip(), stream.model, cached=cached):
+                self._count(DONE)
+                instrumentation.observe("response_stream", time.perf_counter() - started,
+                                        source="cache" if cached else "model")
+                if cache_key is not None and not cached and text.strip():
+                    response_cache.store(cache_key, text, stream.model)
+        except StreamCancelled:
+            pass
+        except Exception as e:
+            if self.store.finish(stream_id, FAILED, text.strip(), stream.model if stream is not None else None,
+                                 error=str(e)[:100]):
+                self._count(FAILED)
+        finally:
+            if chunks is not None and hasattr(chunks, "close"):
+                chunks.close()
+            if ticket is not None:
+                scheduler.release(ticket)
+            with self._lock:
+                self._running -= 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"running": self._running, "outcomes": dict(self._outcomes)}
+
+
+_streams: Optional[ResponseStreams] = None
+_streams_lock = threading.Lock()
+
+
+def get_streams() -> ResponseStreams:
+    """Return the stream runner shared by every session in this process."""
+    global _streams
+    with _streams_lock:
+        if _streams is None:
+            _streams = ResponseStreams(StreamStore())
+            _streams.store.fail_orphans()
+        return _streams
+
+
+def _prometheus_lines() -> List[str]:
+    if _streams is None:
+        return []
+    stats = _streams.stats()
+    lines = [
+        "# HELP skin_response_streams Reply streams in the shared stream table, by status.",
+        "# TYPE skin_response_streams gauge",
+    ]
+    for status, count in sorted(_streams.store.counts().items()):
+        lines.append(f'skin_response_streams{{status="{status}"}} {count}')
+    lines += [
+        "# HELP skin_response_streams_running Reply streams generating in this process.",
+        "# TYPE skin_response_streams_running gauge",
+        f"skin_response_streams_running {stats['running']}",
+        "# HELP skin_response_stream_outcomes_total Reply stream outcomes in this process.",
+        "# TYPE skin_response_stream_outcomes_total counter",
+    ]
+    for outcome, count in sorted(stats["outcomes"].items()):
+        lines.append(f'skin_response_stream_outcomes_total{{outcome="{outcome}"}} {count}')
+    return lines
+
+
+instrumentation.register_collector(_prometheus_lines)
@@ -0,0 +1,301 @@
+"""Per-session memory accounting, caps and spill-to-disk for conversations.
+
+Every image message carries its base64 payload in `st.session_state`, so a
+long session grows without bound. `enforce()` runs once per script run: it
+measures each conversation, spills cold conversations (idle past
+COLD_AFTER, or least recently used once the session is over its cap) and
+then the current conversation's older image payloads to local disk, until
+the session and the current conversation are back under their caps.
+
+Spilled image messages keep `image_id` and gain `image_spilled`; their payload
+lives once per host in a content-addressed file and `image_ingest` reloads it
+on demand. A spilled conversation keeps its title and a text-only search
+string in the sidebar and is loaded back by `ensure_loaded()` when selected.
+Like the shared cache, the directory should be shared by every worker on the
+host so any of them can rehydrate a session.
+"""
+import os
+import json
+import time
+import hashlib
+import threading
+from typing import Dict, List
+
+import instrumentation
+import shared_cache
+
+SPILL_DIR = os.environ.get("SKIN_SPILL_DIR", os.path.join(shared_cache.APP_DIR, "spill"))
+SESSION_MAX_BYTES = int(float(os.environ.get("SKIN_SESSION_MAX_MB", "32")) * 2 ** 20)
+CONVERSATION_MAX_BYTES = int(float(os.environ.get("SKIN_CONVERSATION_MAX_MB", "16")) * 2 ** 20)
+COLD_AFTER = float(os.environ.get("SKIN_COLD_CONVERSATION_S", "900"))
+# The newest images of the open conversation stay in memory; the next turn sends them.
+KEEP_RECENT_IMAGES = 2
+# Spilled images are shared between sessions, so they expire by age rather than on delete.
+SPILL_TTL = 14 * 24 * 3600
+PRUNE_INTERVAL = 3600
+# Sessions not seen for this long drop out of the process-wide totals.
+SESSION_STATS_TTL = 3600
+
+_stats_lock = threading.Lock()
+_sessions: Dict[str, Dict] = {}
+_counters = {"spilled_conversations": 0, "spilled_images": 0, "rehydrated_conversations": 0,
+             "rehydrated_images": 0, "spilled_bytes": 0}
+_last_prune = 0.0
+
+
+def _count(name: str, amount: int = 1):
+    with _stats_lock:
+        _counters[name] += amount
+
+
+def message_bytes(message: Dict) -> int:
+    """Approximate in-memory size: string lengths, plus serialised size of nested fields."""
+    size = 0
+    for value in message.values():
+        if isinstance(value, str):
+            size += len(value)
+        elif value is not None:
+            size += len(json.dumps(value, default=str))
+    return size
+
+
+def conversation_usage(conversation: Dict) -> Dict:
+    messages = conversation.get("messages", [])
+    return {
+        "bytes": sum(message_bytes(m) for m in messages),
+        "messages": len(messages),
+        "images": sum(1 for m in messages if "image_data" in m or "image_spilled" in m),
+        "images_on_disk": sum(1 for m in messages if "image_spilled" in m),
+        "spilled": bool(conversation.get("spilled")),
+    }
+
+
+def session_usage(conversations: Dict[str, Dict]) -> Dict:
+    per_conversation = {cid: conversation_usage(conv) for cid, conv in conversations.items()}
+    return {
+        "bytes": sum(u["bytes"] for u in per_conversation.values()),
+        "conversations": per_conversation,
+        "spilled_conversations": sum(1 for u in per_conversation.values() if u["spilled"]),
+        "session_cap": SESSION_MAX_BYTES,
+        "conversation_cap": CONVERSATION_MAX_BYTES,
+    }
+
+
+# -- disk store ---------------------------------------------------------------
+
+def _write(path: str, data: str):
+    # Spilled conversations are private to their session, so only the app's user may read them.
+    os.makedirs(SPILL_DIR, mode=0o700, exist_ok=True)
+    os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(os.open(tmp, os.O_CREAT | os.O_WRONLY | os.O_TRUNC, 0o600), "w") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _image_path(image_id: str) -> str:
+    return os.path.join(SPILL_DIR, "images", image_id[:2], f"{image_id}.b64")
+
+
+def _conversation_path(session_key: str, conv_id: str) -> str:
+    # Session keys come from the URL, so they are hashed rather than used as path components.
+    owner = hashlib.sha256(session_key.encode()).hexdigest()[:32]
+    return os.path.join(SPILL_DIR, "conversations", owner, f"{conv_id}.json")
+
+
+def load_image(image_id: str) -> str:
+    """Base64 payload of a spilled image; raises FileNotFoundError once it has expired."""
+    path = _image_path(image_id)
+    with open(path) as f:
+        data = f.read()
+    # Reading counts as use, so images of live conversations are not pruned.
+    os.utime(path)
+    _count("rehydrated_images")
+    return data
+
+
+def spill_image(message: Dict) -> int:
+    """Move one message's payload to disk; returns the bytes freed."""
+    from image_ingest import asset_for_message
+    data = message.get("image_data")
+    if data is None:
+        return 0
+    image_id = message.get("image_id") or asset_for_message(message).digest
+    path = _image_path(image_id)
+    if os.path.exists(path):
+        os.utime(path)
+    else:
+        _write(path, data)
+        _count("spilled_bytes", len(data))
+    message["image_spilled"] = message["image_id"] = image_id
+    del message["image_data"]
+    _count("spilled_images")
+    return len(data)
+
+
+def spill_conversation(session_key: str, conversation: Dict) -> int:
+    """Write a conversation's messages to disk and leave a sidebar stub; returns the bytes freed."""
+    messages = conversation["messages"]
+    freed = sum(message_bytes(m) for m in messages)
+    for m in messages:
+        spill_image(m)
+    payload = json.dumps(messages)
+    _write(_conversation_path(session_key, conversation["id"]), payload)
+    _count("spilled_bytes", len(payload))
+    conversation["search_text"] = " ".join(m.get("content", "") for m in messages if m["role"] != "system")
+    conversation["messages"] = []
+    conversation["spilled"] = True
+    _count("spilled_conversations")
+    return freed
+
+
+def ensure_loaded(session_key: str, conversation: Dict) -> bool:
+    """Mark a conversation as in use, loading it back if it was spilled; True if it was."""
+    conversation["last_active"] = time.time()
+    if not conversation.get("spilled"):
+        return False
+    path = _conversation_path(session_key, conversation["id"])
+    try:
+        with open(path) as f:
+            conversation["messages"] = json.load(f)
+    except FileNotFoundError:
+        conversation["messages"] = [{"role": "system", "content": "You are a helpful assistant."},
+                                    {"role": "assistant", "content": "This conversation expired from disk."}]
+    conversation.pop("spilled", None)
+    conversation.pop("search_text", None)
+    _count("rehydrated_conversations")
+    # Memory is authoritative again once the caller saves the session.
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+    return True
+
+
+def discard(session_key: str, conv_id: str):
+    """Forget a deleted conversation's spill file."""
+    try:
+        os.remove(_conversation_path(session_key, conv_id))
+    except OSError:
+        pass
+
+
+def prune(max_age: float = SPILL_TTL) -> int:
+    """Delete spill files unused for `max_age` seconds; returns how many went."""
+    cutoff = time.time() - max_age
+    removed = 0
+    for root, _, files in os.walk(SPILL_DIR):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    removed += 1
+            except OSError:
+                pass
+    return removed
+
+
+def _maybe_prune():
+    global _last_prune
+    with _stats_lock:
+        if time.time() - _last_prune < PRUNE_INTERVAL:
+            return
+        _last_prune = time.time()
+    prune()
+
+
+# -- policy -------------------------------------------------------------------
+
+def enforce(session_key: str, conversations: Dict[str, Dict], current_id: str) -> Dict:
+    """Spill until the session and its open conversation fit their caps; returns the usage.
+
+    `usage["changed"]` is True when anything moved to disk (the caller saves).
+    Conversations with analyses or replies still running stay in memory.
+    """
+    now = time.time()
+    usage = session_usage(conversations)
+    total = usage["bytes"]
+    changed = False
+
+    def busy(conv: Dict) -> bool:
+        return any("image_job" in m or "stream_id" in m for m in conv.get("messages", []))
+
+    candidates = sorted(
+        (conv for cid, conv in conversations.items()
+         if cid != current_id and not conv.get("spilled") and conv.get("messages") and not busy(conv)),
+        key=lambda conv: conv.get("last_active", 0.0),
+    )
+    for conv in candidates:
+        if now - conv.get("last_active", 0.0) < COLD_AFTER and total <= SESSION_MAX_BYTES:
+            break
+        total -= spill_conversation(session_key, conv)
+        changed = True
+
+    current = conversations.get(current_id)
+    if current is not None:
+        current_bytes = sum(message_bytes(m) for m in current["messages"])
+        with_images = [m for m in current["messages"] if "image_data" in m and "image_job" not in m]
+        for m in with_images[:max(0, len(with_images) - KEEP_RECENT_IMAGES)]:
+            if total <= SESSION_MAX_BYTES and current_bytes <= CONVERSATION_MAX_BYTES:
+                break
+            freed = spill_image(m)
+            total -= freed
+            current_bytes -= freed
+            changed = True
+
+    if changed:
+        usage = session_usage(conversations)
+    usage["changed"] = changed
+    usage["over_cap"] = usage["bytes"] > SESSION_MAX_BYTES
+    with _stats_lock:
+        _sessions[session_key] = {"bytes": usage["bytes"], "seen": now}
+        for key in [k for k, v in _sessions.items() if now - v["seen"] > SESSION_STATS_TTL]:
+            del _sessions[key]
+    _maybe_prune()
+    return usage
+
+
+def format_bytes(size: int) -> str:
+    if size < 1024:
+        return f"{size} B"
+    if size < 2 ** 20:
+        return f"{size / 1024:.1f} KB"
+    return f"{size / 2 ** 20:.1f} MB"
+
+
+def stats() -> Dict:
+    with _stats_lock:
+        sizes = [s["bytes"] for s in _sessions.values()]
+        counters = dict(_counters)
+    return dict(counters, sessions=len(sizes), total_bytes=sum(sizes), max_bytes=max(sizes, default=0))
+
+
+def _prometheus_lines() -> List[str]:
+    s = stats()
+    if not s["sessions"] and not s["spilled_images"]:
+        return []
+    lines = [
+        "# HELP skin_session_memory_bytes In-memory conversation state of sessions seen in the last hour.",
+        "# TYPE skin_session_memory_bytes gauge",
+        f'skin_session_memory_bytes{{stat="total"}} {s["total_bytes"]}',
+        f'skin_session_memory_bytes{{stat="max"}} {s["max_bytes"]}',
+        "# HELP skin_sessions_tracked Sessions seen in the last hour.",
+        "# TYPE skin_sessions_tracked gauge",
+        f"skin_sessions_tracked {s['sessions']}",
+        "# HELP skin_session_spills_total Conversations and image payloads moved to disk.",
+        "# TYPE skin_session_spills_total counter",
+        f'skin_session_spills_total{{kind="conversation"}} {s["spilled_conversations"]}',
+        f'skin_session_spills_total{{kind="image"}} {s["spilled_images"]}',
+        "# HELP skin_session_rehydrations_total Conversations and image payloads read back from disk.",
+        "# TYPE skin_session_rehydrations_total counter",
+        f'skin_session_rehydrations_total{{kind="conversation"}} {s["rehydrated_conversations"]}',
+        f'skin_session_rehydrations_total{{kind="image"}} {s["rehydrated_images"]}',
+        "# HELP skin_session_spilled_bytes_total Bytes written to the spill directory.",
+        "# TYPE skin_session_spilled_bytes_total counter",
+        f"skin_session_spilled_bytes_total {s['spilled_bytes']}",
+    ]
+    return lines
+
+
+instrumentation.register_collector(_prometheus_lines)
@@ -0,0 +1,85 @@
+"""Signed, expiring session tokens for the `?sid=` URL parameter.
+
+The token is `key.issued.signature`: the session key travels in plain text
+(it also names the session's cache rows, spill files and case-index scope),
+but only a signed, unexpired token restores the session, so a copied or
+leaked link stops working once the token expires, and a guessed or edited
+token is rejected. When a reverse proxy sets
+an HttpOnly per-browser cookie (named by SKIN_SESSION_COOKIE), tokens are
+also bound to it, so the link is useless in any other browser.
+
+The signing secret comes from SKIN_SESSION_SECRET, or is generated once into
+the private app directory so every worker on the host shares it.
+"""
+import os
+import hmac
+import time
+import hashlib
+import secrets
+import threading
+from typing import Optional
+
+import shared_cache
+
+TOKEN_TTL = float(os.environ.get("SKIN_SESSION_TOKEN_TTL_H", "12")) * 3600
+# Tokens older than this are reissued on the next run, so an open tab keeps a fresh link.
+REFRESH_AFTER = min(3600.0, TOKEN_TTL / 2)
+BROWSER_COOKIE = os.environ.get("SKIN_SESSION_COOKIE", "")
+SECRET_PATH = os.path.join(shared_cache.APP_DIR, "session_secret")
+
+_secret: Optional[bytes] = None
+_secret_lock = threading.Lock()
+
+
+def _load_secret() -> bytes:
+    configured = os.environ.get("SKIN_SESSION_SECRET")
+    if configured:
+        return configured.encode()
+    os.makedirs(os.path.dirname(SECRET_PATH), mode=0o700, exist_ok=True)
+    try:
+        fd = os.open(SECRET_PATH, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o600)
+    except FileExistsError:
+        # Another worker created it; wait for its write to land.
+        for _ in range(50):
+            with open(SECRET_PATH, "rb") as f:
+                secret = f.read()
+            if secret:
+                return secret
+            time.sleep(0.02)
+        raise RuntimeError(f"session secret {SECRET_PATH} is empty")
+    secret = secrets.token_hex(32).encode()
+    with os.fdopen(fd, "wb") as f:
+        f.write(secret)
+    return secret
+
+
+def get_secret() -> bytes:
+    global _secret
+    with _secret_lock:
+        if _secret is None:
+            _secret = _load_secret()
+        return _secret
+
+
+def _signature(session_key: str, issued: int, browser: str) -> str:
+    message = f"{session_key}.{issued}.{browser}".encode()
+    return hmac.new(get_secret(), message, hashlib.sha256).hexdigest()[:32]
+
+
+def issue(session_key: str, browser: str = "", now: Optional[float] = None) -> str:
+    issued = int(time.time() if now is None else now)
+    return f"{session_key}.{issued}.{_signature(session_key, issued, browser)}"
+
+
+def verify(token: Optional[str], browser: str = "", now: Optional[float] = None) -> Optional[str]:
+    """Return the session key if the token is authentic, unexpired and bound to this browser."""
+    parts = (token or "").split(".")
+    if len(parts) != 3 or not parts[1].isdigit():
+        return None
+    session_key, issued, signature = parts[0], int(parts[1]), parts[2]
+    if not hmac.compare_digest(signature, _signature(session_key, issued, browser)):
+        return None
+    age = (time.time() if now is None else now) - issued
+    if age < -60 or age > TOKEN_TTL:
+        return None
+    return session_key
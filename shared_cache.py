@@ -0,0 +1,276 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+import instrumentation
+
+# Private per-user directory for the app's state (cache, jobs, conversations,
+# session secret), rather than the world-readable system temp directory.
+APP_DIR = os.environ.get(
+    "SKIN_DATA_DIR",
+    os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+                 "skin_analyzer")
+)
+# One SQLite file per host is shared by every Streamlit worker process. WAL mode
+# lets readers proceed while another worker writes, so no external service is
+# needed for the second cache tier.
+DEFAULT_PATH = os.environ.get("SKIN_CACHE_PATH", os.path.join(APP_DIR, "cache.sqlite3"))
+STATS_FLUSH_INTERVAL = 5.0
+
+_MISSING = object()
+
+
+def secure_path(path: str) -> str:
+    """Create `path` (and its directory) readable by the app's user only.
+
+    SQLite gives its -wal and -shm files the database file's mode, so creating
+    the file 0600 before the first connect covers them too.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    fd = os.open(path, os.O_CREAT | os.O_RDWR, 0o600)
+    try:
+        if os.fstat(fd).st_uid == os.getuid():
+            os.fchmod(fd, 0o600)
+    finally:
+        os.close(fd)
+    return path
+
+
+def pid_alive(pid: Optional[int]) -> bool:
+    """Whether a process with this pid still runs on this host (owners of jobs and streams)."""
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class SQLiteBackend:
+    """Cross-process key/value store with per-entry expiry and per-worker stats."""
+
+    def __init__(self, path: str = DEFAULT_PATH):
+        self.path = secure_path(path)
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL,"
+                " expires_at REAL NOT NULL, PRIMARY KEY (namespace, key))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS stats ("
+                " pid INTEGER NOT NULL, namespace TEXT NOT NULL,"
+                " l1_hits INTEGER NOT NULL DEFAULT 0, l2_hits INTEGER NOT NULL DEFAULT 0,"
+                " misses INTEGER NOT NULL DEFAULT 0, sets INTEGER NOT NULL DEFAULT 0,"
+                " updated_at REAL NOT NULL, PRIMARY KEY (pid, namespace))"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, namespace: str, key: str):
+        row = self._connect().execute(
+            "SELECT value, expires_at FROM entries WHERE namespace = ? AND key = ?",
+            (namespace, key)
+        ).fetchone()
+        if row is None or row[1] < time.time():
+            return _MISSING, 0.0
+        return json.loads(row[0]), row[1]
+
+    def set(self, namespace: str, key: str, value: Any, expires_at: float):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (namespace, key, json.dumps(value), expires_at)
+            )
+
+    def delete(self, namespace: str, key: str):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def purge_expired(self) -> int:
+        with self._connect() as conn:
+            return conn.execute("DELETE FROM entries WHERE expires_at < ?", (time.time(),)).rowcount
+
+    def add_stats(self, namespace: str, l1_hits: int, l2_hits: int, misses: int, sets: int):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO stats (pid, namespace, l1_hits, l2_hits, misses, sets, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT (pid, namespace) DO UPDATE SET"
+                " l1_hits = l1_hits + excluded.l1_hits, l2_hits = l2_hits + excluded.l2_hits,"
+                " misses = misses + excluded.misses, sets = sets + excluded.sets,"
+                " updated_at = excluded.updated_at",
+                (os.getpid(), namespace, l1_hits, l2_hits, misses, sets, time.time())
+            )
+
+    def worker_stats(self) -> List[Dict]:
+        rows = self._connect().execute(
+            "SELECT pid, namespace, l1_hits, l2_hits, misses, sets, updated_at FROM stats"
+            " ORDER BY namespace, pid"
+        ).fetchall()
+        columns = ("pid", "namespace", "l1_hits", "l2_hits", "misses", "sets", "updated_at")
+        return [dict(zip(columns, row)) for row in rows]
+
+
+class SharedCache:
+    """Two-tier cache: a per-process LRU (L1) in front of the shared SQLite tier (L2).
+
+    With `persist=False` entries live only in the L1; hit/miss counters are
+    still written to the shared stats table.
+    """
+
+    def __init__(self, namespace: str, backend: SQLiteBackend, ttl: float,
+                 l1_size: int = 256, l1_ttl: Optional[float] = None, persist: bool = True):
+        self.namespace = namespace
+        self.backend = backend
+        self.persist = persist
+        self.ttl = ttl
+        self.l1_size = l1_size
+        self.l1_ttl = ttl if l1_ttl is None else min(ttl, l1_ttl)
+        self._l1: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._pending = {"l1_hits": 0, "l2_hits": 0, "misses": 0, "sets": 0}
+        self._last_flush = time.monotonic()
+
+    def _count(self, field: str):
+        with self._lock:
+            self._pending[field] += 1
+            due = time.monotonic() - self._last_flush >= STATS_FLUSH_INTERVAL
+        if due:
+            self.flush_stats()
+
+    def flush_stats(self):
+        """Push locally counted hits and misses to the shared stats table."""
+        with self._lock:
+            pending, self._pending = self._pending, dict.fromkeys(self._pending, 0)
+            self._last_flush = time.monotonic()
+        if any(pending.values()):
+            self.backend.add_stats(self.namespace, **pending)
+
+    def _l1_put(self, key: str, value: Any, expires_at: float):
+        if self.l1_size <= 0:
+            return
+        with self._lock:
+            self._l1[key] = (min(expires_at, time.time() + self.l1_ttl), value)
+            self._l1.move_to_end(key)
+            while len(self._l1) > self.l1_size:
+                self._l1.popitem(last=False)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._l1.get(key)
+            if entry is not None and entry[0] < time.time():
+                del self._l1[key]
+                entry = None
+            if entry is not None:
+                self._l1.move_to_end(key)
+        if entry is not None:
+            self._count("l1_hits")
+            return entry[1]
+        if not self.persist:
+            self._count("misses")
+            return default
+        value, expires_at = self.backend.get(self.namespace, key)
+        if value is _MISSING:
+            self._count("misses")
+            return default
+        self._l1_put(key, value, expires_at)
+        self._count("l2_hits")
+        return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        if self.persist:
+            self.backend.set(self.namespace, key, value, expires_at)
+        self._l1_put(key, value, expires_at)
+        self._count("sets")
+
+    def delete(self, key: str):
+        with self._lock:
+            self._l1.pop(key, None)
+        if self.persist:
+            self.backend.delete(self.namespace, key)
+
+    def get_or_compute(self, key: str, compute: Callable[[], Any]) -> Any:
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = compute()
+            self.set(key, value)
+        return value
+
+
+_registry_lock = threading.Lock()
+_backends: Dict[str, SQLiteBackend] = {}
+_caches: Dict[str, SharedCache] = {}
+
+
+def get_cache(namespace: str, ttl: float, l1_size: int = 256, l1_ttl: Optional[float] = None,
+              path: str = DEFAULT_PATH, persist: bool = True) -> SharedCache:
+    """Return the process-wide cache for a namespace, creating it on first use."""
+    with _registry_lock:
+        cache = _caches.get(namespace)
+        if cache is None:
+            backend = _backends.get(path)
+            if backend is None:
+                backend = _backends[path] = SQLiteBackend(path)
+                backend.purge_expired()
+            cache = _caches[namespace] = SharedCache(namespace, backend, ttl, l1_size, l1_ttl, persist)
+        return cache
+
+
+def cluster_stats(path: str = DEFAULT_PATH) -> Dict[str, Dict]:
+    """Hit rates per namespace summed over every worker sharing the cache file."""
+    for cache in list(_caches.values()):
+        if cache.backend.path == path:
+            cache.flush_stats()
+    backend = _backends.get(path) or SQLiteBackend(path)
+    summary: Dict[str, Dict] = {}
+    for row in backend.worker_stats():
+        ns = summary.setdefault(row["namespace"], {
+            "workers": 0, "l1_hits": 0, "l2_hits": 0, "misses": 0, "sets": 0
+        })
+        ns["workers"] += 1
+        for field in ("l1_hits", "l2_hits", "misses", "sets"):
+            ns[field] += row[field]
+    for ns in summary.values():
+        lookups = ns["l1_hits"] + ns["l2_hits"] + ns["misses"]
+        ns["hit_rate"] = (ns["l1_hits"] + ns["l2_hits"]) / lookups if lookups else 0.0
+    return summary
+
+
+def _prometheus_lines() -> List[str]:
+    if not _caches:
+        return []
+    lines = [
+        "# HELP skin_cache_lookups_total Shared cache lookups by tier and worker.",
+        "# TYPE skin_cache_lookups_total counter",
+    ]
+    for cache in list(_caches.values()):
+        cache.flush_stats()
+    for path in list(_backends):
+        for row in _backends[path].worker_stats():
+            for result in ("l1_hits", "l2_hits", "misses"):
+                lines.append(
+                    f'skin_cache_lookups_total{{namespace="{row["namespace"]}",'
+                    f'pid="{row["pid"]}",result="{result}"}} {row[result]}'
+                )
+    return lines
+
+
+instrumentation.register_collector(_prometheus_lines)
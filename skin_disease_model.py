@@ -1,53 +1,112 @@
+import os
+import hashlib
+import threading
 import numpy as np
-from PIL import Image
-import io
-from typing import Dict, Tuple
+from typing import Dict, Optional, Tuple, Union
+from instrumentation import span
+from disease_tables import disease_mapping
+from image_ingest import ImageAsset, ImageDecodeError, ImageError
+from image_hashing import dhash, phash
+from lesion_segmentation import lesion_pixels, segment_lesion
+from abcd_features import ABCD_MALIGNANT, ABCD_SUSPICIOUS, abcd_features
 
-disease_mapping = {
-    "akiec": "Actinic Keratosis (Pre-cancerous)",
-    "bcc": "Basal Cell Carcinoma",
-    "bkl": "Benign Keratosis",
-    "df": "Dermatofibroma",
-    "mel": "Melanoma",
-    "nv": "Melanocytic Nevus (Mole)",
-    "vasc": "Vascular Lesion"
-}
+ImageInput = Union[bytes, np.ndarray, ImageAsset]
 
-def extract_image_features(image_bytes: bytes) -> Dict:
-    """Extract color and texture features from image for disease detection."""
+HIST_BINS = 4
+# Bumped whenever feature semantics change, so caches and indexes built from
+# older features are not mixed with new ones.
+FEATURE_VERSION = 3
+# Trained CNN checkpoint (train_model.py or distill_model.py; `.pt` or `.weights`)
+# that answers get_image_based_analysis instead of the colour heuristics.
+IMAGE_MODEL_PATH = os.environ.get("SKIN_IMAGE_MODEL", "")
+
+_image_model = None
+_image_model_lock = threading.Lock()
+
+def extract_image_features(image: ImageInput) -> Dict:
+    """Extract color and texture features from image for disease detection.
+
+    Accepts encoded bytes, an ImageAsset (decoded at most once and shared with
+    the preview and LLM paths) or an already decoded RGB uint8 array.
+    Raises an ImageError subclass when the image cannot be analysed.
+    """
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        image = ImageAsset(data=bytes(image))
+    img_array = image.pixels if isinstance(image, ImageAsset) else np.asarray(image)
+    if img_array.ndim != 3 or img_array.shape[2] < 3 or img_array.size == 0:
+        raise ImageDecodeError(f"Expected an RGB image array, got shape {img_array.shape}")
+    
     try:
-        img = Image.open(io.BytesIO(image_bytes)).convert('RGB')
-        img_array = np.array(img)
-        
-        r, g, b = img_array[:,:,0], img_array[:,:,1], img_array[:,:,2]
-        
-        avg_r = np.mean(r)
-        avg_g = np.mean(g)
-        avg_b = np.mean(b)
-        
-        std_r = np.std(r)
-        std_g = np.std(g)
-        std_b = np.std(b)
-        
-        has_red = avg_r > avg_g and avg_r > avg_b
-        has_brown = avg_r > avg_g and avg_g > avg_b
-        has_purple = avg_r > avg_b and avg_b > avg_g
-        
-        variance = np.var(img_array)
-        
-        return {
-            "avg_r": avg_r, "avg_g": avg_g, "avg_b": avg_b,
-            "std_r": std_r, "std_g": std_g, "std_b": std_b,
-            "has_red": has_red, "has_brown": has_brown, "has_purple": has_purple,
-            "variance": variance
-        }
+        with span("lesion_segmentation"):
+            segmentation = segment_lesion(img_array)
+        with span("feature_extraction"):
+            # Only lesion pixels: healthy skin and background no longer dilute the statistics.
+            pixels = lesion_pixels(img_array, segmentation)
+            features = _color_features(pixels)
+            features["color_hist"] = color_histogram(pixels)
+            features["lesion_bbox"] = segmentation["bbox"]
+            features["lesion_area"] = segmentation["area_fraction"]
+            features["segmented"] = segmentation["segmented"]
+        with span("abcd_features"):
+            # Shape proxies are meaningless for the whole-frame fallback mask.
+            features["abcd"] = (
+                abcd_features(segmentation["thumbnail_mask"], segmentation["thumbnail"])
+                if segmentation["segmented"] else None
+            )
+        with span("perceptual_hash"):
+            # Hex strings keep the hashes JSON-safe for caches and the job table.
+            features["phash"] = f"{phash(img_array):016x}"
+            features["dhash"] = f"{dhash(img_array):016x}"
+        return features
+    except ImageError:
+        raise
     except Exception as e:
-        return {}
+        raise ImageDecodeError(f"Feature extraction failed: {e}") from e
 
-def predict_disease_from_image(image_bytes: bytes) -> Dict:
-    """Predict skin disease from image using feature analysis."""
-    features = extract_image_features(image_bytes)
+def _color_features(pixels: np.ndarray) -> Dict:
+    """Compute channel statistics over RGB values (an image or an (N, 3) pixel list)."""
+    r, g, b = pixels[..., 0], pixels[..., 1], pixels[..., 2]
+    
+    avg_r = np.mean(r)
+    avg_g = np.mean(g)
+    avg_b = np.mean(b)
+    
+    std_r = np.std(r)
+    std_g = np.std(g)
+    std_b = np.std(b)
     
+    has_red = avg_r > avg_g and avg_r > avg_b
+    has_brown = avg_r > avg_g and avg_g > avg_b
+    has_purple = avg_r > avg_b and avg_b > avg_g
+    
+    variance = np.var(pixels[..., :3])
+    
+    return {
+        "avg_r": avg_r, "avg_g": avg_g, "avg_b": avg_b,
+        "std_r": std_r, "std_g": std_g, "std_b": std_b,
+        "has_red": has_red, "has_brown": has_brown, "has_purple": has_purple,
+        "variance": variance
+    }
+
+def color_histogram(img_array: np.ndarray, bins: int = HIST_BINS) -> np.ndarray:
+    """Joint RGB histogram with `bins` levels per channel, normalised to sum to 1."""
+    shift = 8 - int(np.log2(bins))
+    q = (img_array[..., :3] >> shift).astype(np.intp)
+    cells = (q[..., 0] * bins + q[..., 1]) * bins + q[..., 2]
+    counts = np.bincount(cells.ravel(), minlength=bins ** 3).astype(np.float32)
+    return counts / max(1.0, counts.sum())
+
+def predict_disease_from_image(image: ImageInput) -> Dict:
+    """Predict skin disease from image using feature analysis."""
+    return predict_disease_from_features(extract_image_features(image))
+
+def predict_disease_from_features(features: Dict) -> Dict:
+    """Score features that were already extracted (e.g. also used for hashing or retrieval)."""
+    with span("image_scoring"):
+        return _score_features(features)
+
+def _score_features(features: Dict) -> Dict:
+    """Turn colour and ABCD features into heuristic per-disease scores."""
     if not features:
         return {
             "condition": "unknown",
@@ -78,6 +137,21 @@ def predict_disease_from_image(image_bytes: bytes) -> Dict:
         scores["akiec"] += 0.2
         scores["bcc"] += 0.15
     
+    abcd = features.get("abcd")
+    if abcd:
+        if abcd["abcd_score"] > ABCD_MALIGNANT:
+            scores["mel"] += 0.3
+            scores["akiec"] += 0.1
+        elif abcd["abcd_score"] >= ABCD_SUSPICIOUS:
+            scores["mel"] += 0.15
+            scores["bcc"] += 0.1
+            scores["bkl"] += 0.1
+        elif abcd["asymmetric_axes"] == 0 and abcd["colour_count"] <= 2:
+            # Symmetric, few colours: the typical benign naevus.
+            scores["nv"] += 0.2
+        if abcd["colour_count"] >= 4:
+            scores["mel"] += 0.1
+    
     best_match = max(scores, key=scores.get)
     confidence = max(0.0, min(1.0, scores[best_match] + 0.4))
     
@@ -85,12 +159,56 @@ def predict_disease_from_image(image_bytes: bytes) -> Dict:
         "condition": best_match,
         "name": disease_mapping.get(best_match, "Unknown"),
         "confidence": confidence,
-        "all_scores": scores
+        "all_scores": scores,
+        "phash": features.get("phash"),
+        "dhash": features.get("dhash")
     }
 
-def get_image_based_analysis(image_bytes: bytes) -> Tuple[str, float, str]:
-    """Get image-based disease prediction."""
-    result = predict_disease_from_image(image_bytes)
+def _trained_model():
+    global _image_model
+    with _image_model_lock:
+        if _image_model is None:
+            # Deferred so the app never imports torch unless a model is configured.
+            from evaluate_models import torch_classifier
+            _image_model = torch_classifier(IMAGE_MODEL_PATH)[0]
+        return _image_model
+
+def image_model_tag() -> str:
+    """Identifies what answers get_image_based_analysis, for cache keys.
+
+    The heuristics are versioned by FEATURE_VERSION; a trained model by its
+    path and the size and modification time of the file, so retraining or
+    swapping the checkpoint never serves analyses cached from the old one.
+    """
+    if not IMAGE_MODEL_PATH:
+        return f"heuristic_v{FEATURE_VERSION}"
+    path = os.path.abspath(IMAGE_MODEL_PATH)
+    try:
+        stat = os.stat(path)
+        version = f"{stat.st_size}:{stat.st_mtime_ns}"
+    except OSError:
+        version = "missing"
+    digest = hashlib.sha1(f"{path}:{version}".encode()).hexdigest()[:12]
+    return f"model_{digest}_v{FEATURE_VERSION}"
+
+def get_image_based_analysis(image: ImageInput, features: Optional[Dict] = None) -> Tuple[str, float, str]:
+    """Get image-based disease prediction (from the SKIN_IMAGE_MODEL network when set).
+
+    The single entry point for scoring an image; pass `features` when they
+    were already extracted so the heuristics do not recompute them.
+    """
+    if IMAGE_MODEL_PATH:
+        if isinstance(image, (bytes, bytearray, memoryview)):
+            image = ImageAsset(data=bytes(image))
+        pixels = image.pixels if isinstance(image, ImageAsset) else np.asarray(image)
+        with span("trained_model_inference"):
+            probs = _trained_model()(pixels)
+        condition = tuple(disease_mapping)[int(probs.argmax())]
+        return condition, float(probs.max()), disease_mapping[condition]
+    if features is not None:
+        result = predict_disease_from_features(features)
+    else:
+        result = predict_disease_from_image(image)
     condition = result.get("condition", "unknown")
     confidence = result.get("confidence", 0.0)
     name = result.get("name", "Unknown")
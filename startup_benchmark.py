@@ -0,0 +1,109 @@
+"""Cold-start benchmark for the Streamlit app and the image model.
+
+Every sample runs in a fresh interpreter so module caches do not hide import
+cost. Reports import time of `skin_disease_model`, first-paint latency of
+app.py (first full script run through Streamlit's AppTest), warm rerun
+latency, and whether the Gemini SDK was imported without an API key.
+
+    python startup_benchmark.py --runs 5
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+from typing import Dict, List
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+MODEL_IMPORT_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import skin_disease_model
+elapsed = time.perf_counter() - start
+print(json.dumps({"import_s": elapsed, "genai_loaded": "google.genai" in sys.modules}))
+"""
+
+APP_PAINT_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+framework_s = time.perf_counter() - start
+app = AppTest.from_file({app_path!r}, default_timeout=60)
+start = time.perf_counter()
+app.run()
+first_paint_s = time.perf_counter() - start
+start = time.perf_counter()
+app.run()
+rerun_s = time.perf_counter() - start
+print(json.dumps({{
+    "framework_import_s": framework_s,
+    "first_paint_s": first_paint_s,
+    "rerun_s": rerun_s,
+    "genai_loaded": "google.genai" in sys.modules,
+    "errors": [str(e.value) for e in app.exception],
+}}))
+"""
+
+
+def _run_probe(code: str) -> Dict:
+    env = dict(os.environ)
+    env.pop("GEMINI_API_KEY", None)
+    proc = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    )
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def _summarise(samples: List[Dict]) -> Dict:
+    summary = {}
+    for key, value in samples[0].items():
+        if isinstance(value, float):
+            values = [s[key] for s in samples]
+            summary[key] = {
+                "median_ms": round(statistics.median(values) * 1000, 2),
+                "min_ms": round(min(values) * 1000, 2),
+                "max_ms": round(max(values) * 1000, 2),
+            }
+        else:
+            summary[key] = value
+    return summary
+
+
+def run_benchmark(runs: int = 5) -> Dict:
+    model_samples = [_run_probe(MODEL_IMPORT_PROBE) for _ in range(runs)]
+    app_probe = APP_PAINT_PROBE.format(app_path=os.path.join(ROOT, "app.py"))
+    app_samples = [_run_probe(app_probe) for _ in range(runs)]
+    return {
+        "runs": runs,
+        "skin_disease_model": _summarise(model_samples),
+        "app": _summarise(app_samples),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per measurement")
+    parser.add_argument("--json", action="store_true", help="print the raw JSON report")
+    args = parser.parse_args()
+
+    report = run_benchmark(args.runs)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print(f"Startup benchmark ({report['runs']} fresh interpreters each)")
+    for target in ("skin_disease_model", "app"):
+        print(f"\n{target}")
+        for key, value in report[target].items():
+            if isinstance(value, dict):
+                print(f"  {key:<20} median {value['median_ms']:>9.2f} ms   "
+                      f"min {value['min_ms']:>9.2f} ms   max {value['max_ms']:>9.2f} ms")
+            else:
+                print(f"  {key:<20} {value}")
+
+
+if __name__ == "__main__":
+    main()
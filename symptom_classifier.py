@@ -0,0 +1,247 @@
+"""TF-IDF symptom classifier over a stemmed vocabulary seeded from `disease_keywords`.
+
+Descriptions and keyword phrases go through the same normalisation: lower
+case, a light suffix-stripping stemmer (so "bleeds" and "bleeding" meet at
+"bleed"), and negation marking, where the few words after "no", "not",
+"without", "doesn't" and friends get a `not_` prefix so "no bleeding" cannot
+match "bleeding". Features are unigrams and bigrams of the normalised tokens.
+
+A batch of descriptions becomes one CSR matrix (built with numpy, no scipy),
+and every class is scored with a single sparse-dense product against the
+L2-normalised TF-IDF class matrix.
+
+A description only gets a condition when it fully matches one of that
+condition's keyword phrases, reads as a skin complaint, and clears
+MIN_SIMILARITY; otherwise the result is `unknown`. It reads as one when it
+names the skin or a lesion (including clinical names such as "angioma"), or
+when it matches at least MIN_CONTEXT_PHRASES different keyword phrases, as a
+list of clinical signs does; a lone everyday phrase ("the border colour of my
+div", "the logo uses multiple colors") stays `unknown`.
+"""
+import re
+import threading
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from disease_tables import disease_keywords, disease_names
+
+_TOKEN = re.compile(r"[a-z]+(?:'[a-z]+)?")
+_CLAUSE_BREAK = re.compile(r"[.,;:!?()\n]| but | though ")
+NEGATIONS = frozenset({
+    "no", "not", "never", "none", "nor", "neither", "without", "denies", "deny",
+    "dont", "doesnt", "didnt", "isnt", "arent", "wasnt", "werent", "hasnt", "havent", "cant", "wont",
+})
+# How many tokens after a negation cue are marked as negated (within one clause).
+NEGATION_SCOPE = 3
+# Softmax temperature over cosine scores for the per-class probabilities.
+TEMPERATURE = 0.1
+# Cosine score below which a description is `unknown` even with a matched phrase.
+MIN_SIMILARITY = 0.15
+# Naming one of these puts a description in a skin context.
+SKIN_CONTEXT = frozenset({
+    "skin", "mole", "spot", "freckle", "mark", "birthmark", "lesion", "rash", "bump", "lump", "patch",
+    "growth", "nodule", "papule", "sore", "ulcer", "wart", "scab", "blemish", "pimple", "keratosis",
+    "angioma", "angiokeratoma", "granuloma", "telangiectasia", "nevus", "naevus", "lentigo",
+    "melanoma", "carcinoma", "dermatofibroma",
+})
+# Matching this many different keyword phrases is a skin context too.
+MIN_CONTEXT_PHRASES = 2
+
+# Ordered longest first; the stem must keep at least three letters.
+_SUFFIXES = ("ational", "ization", "fulness", "iveness", "ously", "ments", "ement", "ness", "ment",
+             "ing", "ies", "ied", "ed", "es", "ly", "s")
+# "scaly" keeps its stem ("scal"), "quickly" does not need to.
+_MIN_STEM = {"ly": 4}
+_SPELLING = {"colour": "color", "colours": "colors", "coloured": "colored", "grey": "gray"}
+
+
+@lru_cache(maxsize=65536)
+def stem(word: str) -> str:
+    """Light suffix stripping: enough to merge plural and verb forms of symptom words."""
+    word = _SPELLING.get(word, word)
+    if len(word) <= 3 or word.endswith(("ss", "us", "is")):
+        return word
+    for suffix in _SUFFIXES:
+        if not word.endswith(suffix) or len(word) - len(suffix) < _MIN_STEM.get(suffix, 3):
+            continue
+        # "bleed" and "need" are not past tenses.
+        if suffix == "ed" and word.endswith("eed"):
+            continue
+        word = word[:-len(suffix)]
+        if suffix in ("ies", "ied"):
+            word += "y"
+        # "bleeding" -> "bleed" but "rubbed" -> "rub".
+        elif word[-1] == word[-2] and word[-1] not in "aeioulsz":
+            word = word[:-1]
+        break
+    # "itchy" -> "itch", "crusty" -> "crust".
+    if len(word) > 4 and word.endswith("y") and word[-2] not in "aeiou":
+        word = word[:-1]
+    # "edge" and "edges" both end up as "edg".
+    if len(word) > 3 and word.endswith("e") and not word.endswith("ee"):
+        word = word[:-1]
+    return word
+
+
+def normalise(text: str) -> List[str]:
+    """Stemmed tokens with negated ones prefixed by `not_`."""
+    tokens = []
+    for clause in _CLAUSE_BREAK.split(f" {text.lower()} "):
+        negated = 0
+        for raw in _TOKEN.findall(clause):
+            word = raw.replace("'", "")
+            if word in NEGATIONS:
+                negated = NEGATION_SCOPE
+                continue
+            token = stem(word)
+            if negated:
+                token = "not_" + token
+                negated -= 1
+            tokens.append(token)
+    return tokens
+
+
+def ngrams(tokens: Sequence[str]) -> List[str]:
+    return list(tokens) + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+
+
+def _spmm(indptr: np.ndarray, indices: np.ndarray, data: np.ndarray, dense: np.ndarray) -> np.ndarray:
+    """CSR (n x V) times dense (V x C) with whole-array operations."""
+    n = len(indptr) - 1
+    out = np.zeros((n, dense.shape[1]), dtype=np.float32)
+    if len(indices) == 0:
+        return out
+    products = data[:, None] * dense[indices]
+    starts = indptr[:-1]
+    nonempty = starts < indptr[1:]
+    # reduceat sums each run between consecutive starts; empty rows have no run.
+    out[nonempty] = np.add.reduceat(products, starts[nonempty], axis=0)
+    return out
+
+
+class SymptomClassifier:
+    """Scores free-text symptom descriptions against per-condition keyword lists."""
+
+    def __init__(self, keywords=disease_keywords, names=disease_names):
+        self.classes = list(keywords)
+        self.names = names
+        self.vocabulary: Dict[str, int] = {}
+        phrase_features = []
+        for condition in self.classes:
+            for phrase in keywords[condition]:
+                features = ngrams(normalise(phrase))
+                for feature in features:
+                    self.vocabulary.setdefault(feature, len(self.vocabulary))
+                phrase_features.append((condition, phrase, features))
+
+        size = len(self.vocabulary)
+        counts = np.zeros((size, len(self.classes)), dtype=np.float32)
+        # Keyword incidence: which features each phrase needs to count as matched.
+        self.phrases: List[Tuple[int, str]] = []
+        # "bleeds" and "bleeding" normalise alike and count as one phrase.
+        self._phrase_keys: List[Tuple[str, ...]] = []
+        incidence = np.zeros((size, len(phrase_features)), dtype=np.float32)
+        for j, (condition, phrase, features) in enumerate(phrase_features):
+            column = self.classes.index(condition)
+            for feature in features:
+                counts[self.vocabulary[feature], column] += 1
+                incidence[self.vocabulary[feature], j] = 1
+            self.phrases.append((column, phrase))
+            self._phrase_keys.append(tuple(normalise(phrase)))
+        self._phrase_sizes = incidence.sum(axis=0)
+        self._incidence = incidence
+        self._context = frozenset(stem(word) for word in SKIN_CONTEXT)
+
+        # Each condition's keyword list is one document for the IDF.
+        df = (counts > 0).sum(axis=1)
+        self.idf = (np.log((1 + len(self.classes)) / (1 + df)) + 1).astype(np.float32)
+        weights = (1 + np.log(np.maximum(counts, 1))) * (counts > 0) * self.idf[:, None]
+        self.class_matrix = weights / np.maximum(np.linalg.norm(weights, axis=0), 1e-9)
+
+    def vectorise(self, texts: Iterable[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """CSR arrays (indptr, indices, tf-idf data) of L2-normalised description vectors."""
+        indptr, indices, data = [0], [], []
+        for text in texts:
+            row: Dict[int, int] = {}
+            for feature in ngrams(normalise(text)):
+                column = self.vocabulary.get(feature)
+                if column is not None:
+                    row[column] = row.get(column, 0) + 1
+            indices.extend(row)
+            data.extend(row.values())
+            indptr.append(len(indices))
+        indptr = np.array(indptr, dtype=np.intp)
+        indices = np.array(indices, dtype=np.intp)
+        tf = np.array(data, dtype=np.float32)
+        values = (1 + np.log(np.maximum(tf, 1))) * self.idf[indices]
+        rows = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+        norms = np.sqrt(np.bincount(rows, weights=values ** 2, minlength=len(indptr) - 1))
+        values = values / np.maximum(norms[rows], 1e-9)
+        return indptr, indices, values.astype(np.float32)
+
+    def score_batch(self, texts: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """(n, classes) cosine scores and (n, phrases) matched-keyword flags."""
+        indptr, indices, values = self.vectorise(texts)
+        scores = _spmm(indptr, indices, values, self.class_matrix)
+        present = _spmm(indptr, indices, np.ones_like(values), self._incidence)
+        return scores, present >= self._phrase_sizes
+
+    def _in_context(self, text: str, phrase_ids: np.ndarray) -> bool:
+        if len({self._phrase_keys[j] for j in phrase_ids}) >= MIN_CONTEXT_PHRASES:
+            return True
+        return bool(self._context.intersection(t.replace("not_", "", 1) for t in normalise(text)))
+
+    def classify(self, texts: Sequence[str]) -> List[Dict]:
+        """`match_disease_from_text`-shaped results plus per-class `probabilities`."""
+        scores, matched = self.score_batch(texts)
+        logits = scores / TEMPERATURE
+        probabilities = np.exp(logits - logits.max(axis=1, keepdims=True))
+        probabilities /= probabilities.sum(axis=1, keepdims=True)
+        scores_list = scores.round(4).tolist()
+        probability_list = probabilities.round(4).tolist()
+        results = []
+        for i, text in enumerate(texts):
+            all_scores = dict(zip(self.classes, scores_list[i]))
+            probs = dict(zip(self.classes, probability_list[i]))
+            phrase_ids = np.flatnonzero(matched[i])
+            # Only conditions with a fully matched phrase are candidates, and only in a skin context.
+            eligible = np.zeros(len(self.classes), dtype=bool)
+            if self._in_context(text, phrase_ids):
+                eligible[[self.phrases[j][0] for j in phrase_ids]] = True
+            candidates = np.where(eligible, scores[i], 0)
+            best = int(candidates.argmax())
+            if candidates[best] < MIN_SIMILARITY:
+                results.append({
+                    "condition": "unknown",
+                    "name": self.names["unknown"],
+                    "score": 0,
+                    "matched_keywords": [],
+                    "all_scores": all_scores,
+                    "probabilities": probs,
+                })
+                continue
+            condition = self.classes[best]
+            results.append({
+                "condition": condition,
+                "name": self.names[condition],
+                "score": all_scores[condition],
+                "matched_keywords": [self.phrases[j][1] for j in phrase_ids if self.phrases[j][0] == best],
+                "all_scores": all_scores,
+                "probabilities": probs,
+            })
+        return results
+
+
+_classifier: Optional[SymptomClassifier] = None
+_classifier_lock = threading.Lock()
+
+
+def get_classifier() -> SymptomClassifier:
+    """Return the classifier shared by every session in this process."""
+    global _classifier
+    with _classifier_lock:
+        if _classifier is None:
+            _classifier = SymptomClassifier()
+        return _classifier
@@ -0,0 +1,61 @@
+"""Shared test setup: import the flat modules from the repo root and keep every
+cache, index and spill directory in a scratch directory.
+
+Modules read their SKIN_* paths at import time, so these are set before any
+test module imports them.
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SCRATCH = tempfile.mkdtemp(prefix="skin_tests_")
+os.environ["SKIN_DATA_DIR"] = os.path.join(SCRATCH, "data")
+os.environ["SKIN_CACHE_PATH"] = os.path.join(SCRATCH, "cache.sqlite3")
+os.environ["SKIN_CASE_INDEX_DIR"] = os.path.join(SCRATCH, "case_index")
+os.environ["SKIN_SPILL_DIR"] = os.path.join(SCRATCH, "spill")
+os.environ["SKIN_DATASET_DIR"] = os.path.join(SCRATCH, "ham_packed")
+os.environ["SKIN_TUNING_PATH"] = os.path.join(SCRATCH, "cpu_tuning.json")
+os.environ.pop("SKIN_IMAGE_MODEL", None)
+os.environ.pop("GEMINI_API_KEY", None)
+os.environ.pop("SKIN_SESSION_SECRET", None)
+os.environ.pop("SKIN_SESSION_COOKIE", None)
+os.environ.pop("SKIN_GEMINI_FILE_REFS", None)
+os.environ.pop("SKIN_GEMINI_BASE_URL", None)
+
+SAMPLE_DIR = os.path.join(ROOT, "Data", "Sample_Skin_Disease_Images")
+
+
+@pytest.fixture
+def metrics():
+    """Instrumentation switched on with empty histograms, and off again afterwards."""
+    import instrumentation
+    instrumentation.reset()
+    instrumentation.enable()
+    yield instrumentation
+    instrumentation.disable()
+    instrumentation.reset()
+
+
+@pytest.fixture
+def sample_bytes():
+    """Raw JPEG bytes of the first few bundled sample images."""
+    names = sorted(f for f in os.listdir(SAMPLE_DIR) if f.endswith(".jpg"))[:6]
+    blobs = []
+    for name in names:
+        with open(os.path.join(SAMPLE_DIR, name), "rb") as f:
+            blobs.append(f.read())
+    return blobs
+
+
+@pytest.fixture(scope="session")
+def packed_samples():
+    """The bundled samples packed at 32x32 into small shards; returns the pack directory."""
+    import ham_dataset
+    out_dir = os.path.join(SCRATCH, "packed_samples")
+    ham_dataset.pack_dataset([SAMPLE_DIR], out_dir, side=32, shard_size=16, workers=1)
+    return out_dir
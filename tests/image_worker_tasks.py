@@ -0,0 +1,22 @@
+"""Worker tasks for the image worker tests; a module of its own so spawned workers can import it."""
+import os
+import signal
+import time
+
+import image_worker
+
+
+def crash_on_marker(data: bytes, score: bool, timeout: float):
+    if data.endswith(b"CRASH"):
+        os._exit(1)
+    return image_worker._decode_and_score(data, score, timeout)
+
+
+def hang_on_marker(data: bytes, score: bool, timeout: float):
+    if data.endswith(b"HANG"):
+        # Ignores the in-worker alarm, so only the parent's kill ends it.
+        signal.signal(signal.SIGALRM, signal.SIG_IGN)
+        time.sleep(600)
+    if data.endswith(b"SLOW"):
+        time.sleep(2.5)
+    return image_worker._decode_and_score(data, score, timeout)
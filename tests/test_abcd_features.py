@@ -0,0 +1,57 @@
+import numpy as np
+
+import abcd_features
+
+
+def disc(size=64, radius=20, centre=None):
+    yy, xx = np.mgrid[0:size, 0:size]
+    cx, cy = centre or (size / 2, size / 2)
+    return (xx - cx) ** 2 + (yy - cy) ** 2 <= radius ** 2
+
+
+def paint(mask, inside, outside=(225, 190, 170)):
+    img = np.empty(mask.shape + (3,), dtype=np.float32)
+    img[:] = outside
+    img[mask] = inside
+    return img
+
+
+def test_disc_is_symmetric_and_compact():
+    mask = disc()
+    result = abcd_features.abcd_features(mask, paint(mask, abcd_features.PALETTE[3]))
+    assert result["asymmetric_axes"] == 0
+    assert result["border_compactness"] < 1.5
+    assert result["colour_count"] == 1
+    assert result["eccentricity"] < 0.2
+
+
+def test_l_shaped_lesion_is_asymmetric():
+    yy, xx = np.mgrid[0:64, 0:64]
+    mask = ((xx >= 10) & (xx < 54) & (yy >= 40) & (yy < 54)) | ((xx >= 10) & (xx < 24) & (yy >= 10) & (yy < 54))
+    result = abcd_features.abcd_features(mask, paint(mask, abcd_features.PALETTE[3]))
+    assert result["asymmetric_axes"] >= 1
+    assert result["border_compactness"] > 1.5
+
+
+def test_colours_are_counted_against_the_palette():
+    mask = disc()
+    img = paint(mask, abcd_features.PALETTE[3])
+    img[:32][mask[:32]] = abcd_features.PALETTE[5]
+    result = abcd_features.abcd_features(mask, img)
+    assert result["colour_count"] == 2
+
+
+def test_batch_matches_single_lesions():
+    small, large = disc(size=48, radius=10), disc(size=64, radius=28)
+    segs = [
+        {"thumbnail_mask": small, "thumbnail": paint(small, abcd_features.PALETTE[2])},
+        {"thumbnail_mask": large, "thumbnail": paint(large, abcd_features.PALETTE[4])},
+    ]
+    batch = abcd_features.abcd_from_segmentations(segs)
+    for seg, result in zip(segs, batch):
+        single = abcd_features.abcd_features(seg["thumbnail_mask"], seg["thumbnail"])
+        assert result["colour_count"] == single["colour_count"]
+        assert abs(result["diameter"] - single["diameter"]) < 1e-6
+        assert abs(result["abcd_score"] - single["abcd_score"]) < 1e-4
+    assert batch[1]["diameter"] > batch[0]["diameter"]
+    assert abcd_features.abcd_from_segmentations([]) == []
@@ -0,0 +1,117 @@
+import subprocess
+import sys
+import time
+
+import pytest
+
+import analysis_jobs
+from image_ingest import ImageTimeoutError, UnsupportedImageError
+
+
+@pytest.fixture
+def store(tmp_path):
+    return analysis_jobs.JobStore(str(tmp_path / "jobs.sqlite3"))
+
+
+def wait_finished(queue, job_id, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        job = queue.status(job_id)
+        if job["status"] in analysis_jobs.FINISHED or time.monotonic() > deadline:
+            return job
+        time.sleep(0.01)
+
+
+def flaky_analysis(failures):
+    calls = []
+
+    def analyse(payload, image_key, session_key, conversation_id=None):
+        calls.append(image_key)
+        if len(calls) <= len(failures):
+            raise failures[len(calls) - 1]
+        return {"analysis": ["nv", 0.8, "Melanocytic Nevi"]}
+
+    return analyse, calls
+
+
+def test_transient_failures_are_retried(store, monkeypatch):
+    monkeypatch.setattr(analysis_jobs, "RETRY_BACKOFF", 0.01)
+    queue = analysis_jobs.AnalysisQueue(store, threads=1, max_attempts=3)
+    analyse, calls = flaky_analysis([ImageTimeoutError("slow"), RuntimeError("worker died")])
+    monkeypatch.setattr(queue, "_analyse", analyse)
+    job = wait_finished(queue, queue.submit(b"img", "key-1"))
+    assert job["status"] == analysis_jobs.DONE
+    assert job["attempts"] == 3 and len(calls) == 3
+    assert job["result"]["analysis"][0] == "nv"
+    assert queue.stats()["outcomes"] == {"retried": 2, "done": 1}
+
+
+def test_rejected_images_fail_without_retry(store, monkeypatch):
+    queue = analysis_jobs.AnalysisQueue(store, threads=1)
+    analyse, calls = flaky_analysis([UnsupportedImageError("not an image")])
+    monkeypatch.setattr(queue, "_analyse", analyse)
+    job = wait_finished(queue, queue.submit(b"img", "key-2"))
+    assert job["status"] == analysis_jobs.FAILED and job["attempts"] == 1
+    assert job["error"] == "not an image"
+
+
+def test_retries_stop_at_max_attempts(store, monkeypatch):
+    monkeypatch.setattr(analysis_jobs, "RETRY_BACKOFF", 0.01)
+    queue = analysis_jobs.AnalysisQueue(store, threads=1, max_attempts=2)
+    analyse, calls = flaky_analysis([RuntimeError("boom")] * 5)
+    monkeypatch.setattr(queue, "_analyse", analyse)
+    job = wait_finished(queue, queue.submit(b"img", "key-3"))
+    assert job["status"] == analysis_jobs.FAILED and len(calls) == 2
+
+
+def dead_pid() -> int:
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+def test_jobs_of_a_dead_worker_are_adopted(store):
+    store.create("orphan", "session", "key", b"img")
+    store.create("alive", "session", "key", b"img")
+    store.claim("orphan")
+    with store._connect() as conn:
+        conn.execute("UPDATE jobs SET owner_pid = ? WHERE id = ?", (dead_pid(), "orphan"))
+        conn.execute("UPDATE jobs SET owner_pid = ? WHERE id = ?", (1, "alive"))
+    assert store.adopt_orphans() == ["orphan"]
+    assert store.get("orphan")["status"] == analysis_jobs.QUEUED
+    # Adopted jobs run again from their stored payload.
+    assert store.claim("orphan")[0] == b"img"
+    assert store.adopt_orphans() == []
+
+
+def test_cancelled_job_keeps_its_status(store):
+    store.create("job", None, "key", b"img")
+    store.claim("job")
+    assert store.cancel("job")
+    assert not store.finish("job", analysis_jobs.DONE, result={"analysis": None})
+    assert store.get("job")["status"] == analysis_jobs.CANCELLED
+
+
+def test_polling_adopts_a_job_whose_worker_died(store, monkeypatch):
+    queue = analysis_jobs.AnalysisQueue(store, threads=1)
+    analyse, calls = flaky_analysis([])
+    monkeypatch.setattr(queue, "_analyse", analyse)
+    # Another worker took the job and died mid-analysis, after this queue started.
+    store.create("orphan", "session", "key-4", b"img")
+    store.claim("orphan")
+    with store._connect() as conn:
+        conn.execute("UPDATE jobs SET owner_pid = ? WHERE id = ?", (dead_pid(), "orphan"))
+
+    job = wait_finished(queue, "orphan")
+    assert job["status"] == analysis_jobs.DONE and calls == ["key-4"]
+    assert job["owner_pid"] == analysis_jobs.os.getpid()
+    assert queue.stats()["outcomes"] == {"adopted": 1, "done": 1}
+
+
+def test_polling_leaves_live_workers_jobs_alone(store):
+    queue = analysis_jobs.AnalysisQueue(store, threads=1)
+    store.create("elsewhere", "session", "key-5", b"img")
+    with store._connect() as conn:
+        conn.execute("UPDATE jobs SET owner_pid = ? WHERE id = ?", (1, "elsewhere"))
+    assert queue.status("elsewhere")["status"] == analysis_jobs.QUEUED
+    assert queue.stats()["outcomes"] == {}
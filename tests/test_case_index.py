@@ -0,0 +1,63 @@
+import os
+import stat
+
+import numpy as np
+import pytest
+
+import case_index
+
+DIM = 8
+
+
+@pytest.fixture
+def index(tmp_path):
+    return case_index.CaseIndex(str(tmp_path / "cases"), dim=DIM)
+
+
+def add_cases(index, vectors, **meta):
+    index.add_many(vectors, [dict(meta, row=i) for i in range(len(vectors))])
+
+
+def test_scoped_search_is_not_crowded_out_by_foreign_cases(index):
+    rng = np.random.default_rng(0)
+    query = np.zeros(DIM, dtype=np.float32)
+    # Thousands of other users' uploads sit right next to the query...
+    add_cases(index, rng.normal(0, 0.01, (5000, DIM)), source="upload", session_key="someone-else")
+    # ...while this user's own cases and the references are further away.
+    add_cases(index, rng.normal(0, 1.0, (30, DIM)) + 3, source="upload", session_key="me")
+    add_cases(index, rng.normal(0, 1.0, (20, DIM)) + 3, source="reference")
+    results = index.search(query, 5, scopes=[case_index.REFERENCE_SCOPE, "me"])
+    assert len(results) == 5
+    assert all(m["source"] == "reference" or m["session_key"] == "me" for _, m in results)
+    # Exactly the scope's own top 5.
+    own = [(float(((v - query) ** 2).sum()), i) for i, v in enumerate(index._vectors) if i >= 5000]
+    assert [round(d, 4) for d, _ in results] == [round(d, 4) for d, _ in sorted(own)[:5]]
+
+
+def test_unknown_scope_finds_nothing(index):
+    add_cases(index, np.ones((3, DIM)), source="upload", session_key="me")
+    assert index.search(np.ones(DIM), 3, scopes=["stranger"]) == []
+    assert len(index.search(np.ones(DIM), 3)) == 3
+
+
+def test_ivf_search_masks_candidates_before_ranking(index):
+    rng = np.random.default_rng(1)
+    add_cases(index, rng.normal(0, 0.05, (3000, DIM)), source="upload", session_key="crowd")
+    add_cases(index, rng.normal(0, 1.0, (200, DIM)), source="upload", session_key="me")
+    index.build_ivf(nlist=16, m=4, nprobe=16)
+    results = index.search(np.zeros(DIM), 10, scopes=["me"], exact=False)
+    assert len(results) == 10
+    assert all(m["session_key"] == "me" for _, m in results)
+
+
+def test_other_workers_appends_are_scoped_too(index, tmp_path):
+    other = case_index.CaseIndex(index.directory, dim=DIM)
+    add_cases(other, np.ones((2, DIM)), source="upload", session_key="me")
+    assert len(index.search(np.ones(DIM), 5, scopes=["me"])) == 2
+
+
+def test_index_files_are_owner_only(index):
+    add_cases(index, np.ones((1, DIM), dtype=np.float32), source="upload", session_key="alice")
+    assert stat.S_IMODE(os.stat(index.directory).st_mode) == 0o700
+    for path in (index.vectors_path, index.meta_path):
+        assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
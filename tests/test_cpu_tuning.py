@@ -0,0 +1,58 @@
+import json
+
+import pytest
+
+import cpu_tuning
+
+
+@pytest.fixture
+def tuning_file(tmp_path, monkeypatch):
+    path = tmp_path / "tuning.json"
+    monkeypatch.setattr(cpu_tuning, "TUNING_PATH", str(path))
+    return path
+
+
+@pytest.mark.parametrize("cpus, workers", [(1, 1), (2, 1), (4, 3), (16, cpu_tuning.MAX_IMAGE_WORKERS)])
+def test_plan_leaves_a_core_for_the_app(tuning_file, cpus, workers):
+    sizes = cpu_tuning.plan(cpus)
+    assert sizes["image_workers"] == sizes["analysis_threads"] == workers
+    assert sizes["blas_threads"] == 1
+    assert sizes["batch_workers"] == sizes["torch_threads"] == cpus
+
+
+def test_saved_benchmark_applies_only_to_the_same_cpu_count(tuning_file):
+    tuning_file.write_text(json.dumps({"cpus": 4, "image_workers": 2, "blas_threads": 2}))
+    assert cpu_tuning.plan(4)["image_workers"] == 2 and cpu_tuning.plan(4)["blas_threads"] == 2
+    assert cpu_tuning.plan(8)["image_workers"] == 7 and cpu_tuning.plan(8)["blas_threads"] == 1
+    tuning_file.write_text("not json")
+    assert cpu_tuning.plan(4)["image_workers"] == 3
+
+
+def test_available_cpus_is_capped_by_quota(monkeypatch):
+    monkeypatch.delenv("SKIN_CPUS", raising=False)
+    monkeypatch.setattr(cpu_tuning.os, "sched_getaffinity", lambda pid: set(range(8)))
+    monkeypatch.setattr(cpu_tuning, "cgroup_quota", lambda: 2.5)
+    assert cpu_tuning.available_cpus() == 3
+    monkeypatch.setattr(cpu_tuning, "cgroup_quota", lambda: None)
+    assert cpu_tuning.available_cpus() == 8
+    monkeypatch.setenv("SKIN_CPUS", "2")
+    assert cpu_tuning.available_cpus() == 2
+
+
+def test_configure_keeps_operator_settings(monkeypatch, tuning_file):
+    for name in cpu_tuning._BLAS_VARIABLES:
+        monkeypatch.setenv(name, "6")
+    monkeypatch.delenv("OMP_NUM_THREADS")
+    monkeypatch.setattr(cpu_tuning, "_configured", None)
+    result = cpu_tuning.configure(threads=2)
+    assert result["threads"] == 2 and result["env_applied"] == ["OMP_NUM_THREADS"]
+    assert cpu_tuning.os.environ["OMP_NUM_THREADS"] == "2"
+    assert cpu_tuning.os.environ["MKL_NUM_THREADS"] == "6"
+    # Only the first call applies anything.
+    assert cpu_tuning.configure(threads=4) is result
+
+
+def test_benchmark_candidates_fit_the_budget():
+    splits = cpu_tuning._candidates(4)
+    assert (1, 4) in splits and (4, 1) in splits and (2, 2) in splits
+    assert all(processes * threads <= 4 for processes, threads in splits)
@@ -0,0 +1,63 @@
+import hashlib
+import os
+
+import numpy as np
+
+import evaluate_models
+from conftest import SAMPLE_DIR
+
+CLASSES = evaluate_models.CLASSES
+
+
+def constant_nv():
+    """`<module>:<factory>` predictor that always answers nv at 0.9 confidence."""
+    return lambda data: (CLASSES.index("nv"), None, 0.9)
+
+
+def oracle():
+    """Predictor that knows every sample's label, with a one-hot distribution."""
+    labels = {}
+    for path, label in evaluate_models.labelled_images(SAMPLE_DIR):
+        with open(path, "rb") as f:
+            labels[hashlib.sha1(f.read()).hexdigest()] = label
+
+    def predict(data):
+        probs = np.eye(len(CLASSES))[labels[hashlib.sha1(data).hexdigest()]]
+        return int(probs.argmax()), probs, 1.0
+    return predict
+
+
+def test_confusion_matrix_puts_unknown_last():
+    matrix = evaluate_models.confusion_matrix(np.array([0, 0, 1]), np.array([0, -1, 0]), 2)
+    assert matrix.tolist() == [[1, 0, 1], [1, 0, 0]]
+
+
+def test_calibration_error():
+    correct = np.array([1, 1, 0, 0], dtype=bool)
+    confidence = np.array([0.95, 0.95, 0.15, 0.15])
+    result = evaluate_models.calibration(correct, confidence)
+    assert result["ece"] == 0.1
+    assert result["bins"][9] == {"upper": 1.0, "count": 2, "confidence": 0.95, "accuracy": 1.0}
+
+
+def test_evaluate_reports_per_predictor():
+    module = os.path.splitext(os.path.basename(__file__))[0]
+    report = evaluate_models.evaluate(SAMPLE_DIR, [f"{module}:constant_nv", f"{module}:oracle"], workers=1)
+    truth = [label for _, label in evaluate_models.labelled_images(SAMPLE_DIR)]
+    nv_share = truth.count(CLASSES.index("nv")) / len(truth)
+
+    constant = report["predictors"][f"{module}:constant_nv"]
+    assert constant["images"] == len(truth) == 100
+    assert constant["accuracy"] == round(nv_share, 4)
+    assert constant["recall"]["nv"] == 1.0 and constant["critical_recall"]["mel"] == 0.0
+    assert constant["balanced_accuracy"] == round(1 / sum(1 for c in constant["support"].values() if c), 4)
+    assert "brier" not in constant
+
+    perfect = report["predictors"][f"{module}:oracle"]
+    assert perfect["accuracy"] == 1.0 and perfect["brier"] == 0.0 and perfect["calibration"]["ece"] == 0.0
+
+
+def test_regressions_flag_recall_drops_beyond_tolerance():
+    baseline = {"predictors": {"p": {"recall": {"mel": 0.8, "nv": 0.9, "df": None}}}}
+    report = {"predictors": {"p": {"recall": {"mel": 0.7, "nv": 0.89, "df": 0.5}}, "new": {"recall": {}}}}
+    assert evaluate_models.regressions(report, baseline, tolerance=0.02) == ["p: mel recall 0.800 -> 0.700"]
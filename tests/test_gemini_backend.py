@@ -0,0 +1,71 @@
+import pytest
+from google.genai import errors
+
+import gemini_backend
+import gemini_stub_server
+from image_ingest import ingest_image
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    server, url = gemini_stub_server.serve(ttft=0.0)
+    monkeypatch.setattr(gemini_backend, "BASE_URL", url)
+    yield server, gemini_backend.get_gemini_client("test-key")
+    server.shutdown()
+
+
+def _chat(sample_bytes, images):
+    messages = [{"role": "system", "content": "You are a helpful assistant."}]
+    for n, data in enumerate(sample_bytes[:images], 1):
+        asset = ingest_image(data)
+        messages.append({"role": "user", "content": f"What is in image {n}?",
+                         "image_data": asset.b64, "image_mime": asset.mime})
+    return messages
+
+
+def _error(code, message, status):
+    return errors.APIError(code, {"error": {"code": code, "message": message, "status": status}})
+
+
+def test_file_references_are_opt_in(stub, sample_bytes):
+    server, client = stub
+    assert gemini_backend.FILE_REFERENCES is False
+    assert "".join(gemini_backend.stream_chat(client, _chat(sample_bytes, 2), "gemini-2.5-flash", 0.7, 64,
+                                              api_key="test-key"))
+    request = server.state.stats()["requests"][-1]
+    assert request["inline_images"] == 2 and request["file_references"] == 0
+    assert server.state.stats()["files"] == 0
+
+
+def test_expired_reference_is_retried_inline(stub, sample_bytes, monkeypatch):
+    server, client = stub
+    monkeypatch.setattr(gemini_backend, "FILE_REFERENCES", True)
+    messages = _chat(sample_bytes, 2)
+    reply = "".join(gemini_backend.stream_chat(client, messages, "gemini-2.5-flash", 0.7, 64, api_key="test-key"))
+    assert reply and server.state.stats()["requests"][-1]["file_references"] == 2
+
+    # The server forgets its uploads, as when Gemini expires them early.
+    server.state.reset()
+    retries = gemini_backend.file_stats()["stale_retries"]
+    reply = "".join(gemini_backend.stream_chat(client, messages, "gemini-2.5-flash", 0.7, 64, api_key="test-key"))
+    requests = server.state.stats()["requests"]
+    assert reply and gemini_backend.file_stats()["stale_retries"] == retries + 1
+    assert requests[-2]["missing_files"] == 2 and requests[-1]["inline_images"] == 2
+
+
+def test_only_file_errors_count_as_rejected_references(stub):
+    _, client = stub
+    files = gemini_backend.FileReferences(client, "test-key")
+    expired = _error(400, "File files/abc does not exist or has expired.", "INVALID_ARGUMENT")
+    assert not gemini_backend._rejected_reference(expired, files)
+    files.used = ["digest"]
+    assert gemini_backend._rejected_reference(expired, files)
+    assert gemini_backend._rejected_reference(
+        _error(403, "You do not have permission to access the File abc or it may not exist.", "PERMISSION_DENIED"),
+        files)
+    assert not gemini_backend._rejected_reference(
+        _error(400, "Request contains an invalid argument.", "INVALID_ARGUMENT"), files)
+    assert not gemini_backend._rejected_reference(_error(403, "API key not valid.", "PERMISSION_DENIED"), files)
+    assert not gemini_backend._rejected_reference(
+        _error(404, "models/gemini-9 is not found for API version v1beta.", "NOT_FOUND"), files)
+    assert not gemini_backend._rejected_reference(_error(500, "File storage expired.", "INTERNAL"), files)
@@ -0,0 +1,74 @@
+import os
+
+import numpy as np
+
+import ham_dataset
+from conftest import SAMPLE_DIR
+
+
+def _rows(lesions_per_label=20, photos=3):
+    rows = []
+    for label in ("mel", "nv", "bkl"):
+        for lesion in range(lesions_per_label):
+            for photo in range(1 + lesion % photos):
+                rows.append({"dx": label, "lesion_id": f"{label}-{lesion}", "image_id": f"{label}-{lesion}-{photo}"})
+    return rows
+
+
+def test_split_keeps_each_lesion_on_one_side():
+    rows = _rows()
+    split = ham_dataset.split_by_lesion(rows, test_fraction=0.25, seed=1)
+    sides = {}
+    for row, side in zip(rows, split):
+        sides.setdefault(row["lesion_id"], set()).add(int(side))
+    assert all(len(s) == 1 for s in sides.values())
+    for label in ("mel", "nv", "bkl"):
+        in_label = np.array([row["dx"] == label for row in rows])
+        # Whole lesions are moved, so the fraction overshoots by at most one lesion.
+        assert 0.25 <= split[in_label].mean() <= 0.25 + 3 / in_label.sum()
+
+
+def test_split_is_deterministic_per_seed():
+    rows = _rows()
+    assert np.array_equal(ham_dataset.split_by_lesion(rows, seed=3), ham_dataset.split_by_lesion(rows, seed=3))
+    assert not np.array_equal(ham_dataset.split_by_lesion(rows, seed=3), ham_dataset.split_by_lesion(rows, seed=4))
+
+
+def test_pack_reads_back_decoded_images(packed_samples):
+    dataset = ham_dataset.PackedDataset(packed_samples, split=None)
+    assert len(dataset) == dataset.manifest["count"] == 100
+    assert len(dataset.manifest["shards"]) == 7
+    for i in (0, 17, 99):
+        image, label = dataset[i]
+        expected = ham_dataset.load_resized(os.path.join(SAMPLE_DIR, f"{dataset.index[i]['image_id']}.jpg"), 32)
+        assert np.array_equal(image, expected)
+        assert label == dataset.labels[i]
+    images, labels = dataset.batch([99, 0, 17])
+    assert np.array_equal(images[1], dataset[0][0]) and list(labels) == [dataset.labels[i] for i in (99, 0, 17)]
+
+
+def test_pack_splits_only_the_packed_rows(packed_samples):
+    train = ham_dataset.PackedDataset(packed_samples, split="train")
+    test = ham_dataset.PackedDataset(packed_samples, split="test")
+    assert len(train) + len(test) == 100
+    # Splitting the full metadata would leave almost none of a 100-image subset in test.
+    assert 15 <= len(test) <= 30
+    assert not set(train.index["lesion_id"]) & set(test.index["lesion_id"])
+
+
+def test_repack_swaps_directory(tmp_path):
+    out_dir = str(tmp_path / "pack")
+    names = sorted(os.listdir(SAMPLE_DIR))
+    first = tmp_path / "first"
+    first.mkdir()
+    for name in names[:4]:
+        os.symlink(os.path.join(SAMPLE_DIR, name), first / name)
+    ham_dataset.pack_dataset([str(first)], out_dir, side=16, workers=1)
+    old = ham_dataset.PackedDataset(out_dir, split=None)
+    old_image = np.array(old[0][0])
+
+    ham_dataset.pack_dataset([SAMPLE_DIR], out_dir, side=16, workers=1)
+    assert ham_dataset.PackedDataset(out_dir, split=None).manifest["count"] == 100
+    assert sorted(os.listdir(tmp_path)) == ["first", "pack"]
+    # A reader that mapped the old pack keeps reading it.
+    assert np.array_equal(old[0][0], old_image)
@@ -0,0 +1,42 @@
+import base64
+
+import pytest
+
+import image_ingest
+
+
+def test_each_representation_is_derived_once(sample_bytes):
+    asset = image_ingest.ImageAsset(data=sample_bytes[0], mime="image/jpeg")
+    assert asset.raw_bytes is sample_bytes[0]
+    assert asset.b64 is asset.b64
+    assert asset.pixels is asset.pixels
+    assert asset.data_uri.startswith("data:image/jpeg;base64,")
+    assert base64.b64decode(asset.b64) == sample_bytes[0]
+
+
+def test_pixels_are_shared_read_only(sample_bytes):
+    pixels = image_ingest.ImageAsset(data=sample_bytes[0]).pixels
+    with pytest.raises(ValueError):
+        pixels[0, 0, 0] = 1
+
+
+def test_base64_and_raw_assets_agree(sample_bytes):
+    from_raw = image_ingest.ImageAsset(data=sample_bytes[1])
+    from_b64 = image_ingest.ImageAsset(b64=base64.b64encode(sample_bytes[1]).decode())
+    assert from_raw.digest == from_b64.digest
+    assert from_raw.raw_bytes == from_b64.raw_bytes
+
+
+def test_messages_reuse_the_registered_asset(sample_bytes):
+    message = {"role": "user", "content": "", "image_data": base64.b64encode(sample_bytes[2]).decode(),
+               "image_mime": "image/jpeg"}
+    first = image_ingest.asset_for_message(message)
+    assert message["image_id"] == first.digest
+    first.pixels
+    # A later turn (another copy of the message) gets the same decoded asset back.
+    assert image_ingest.asset_for_message(dict(message)) is first
+
+
+def test_asset_needs_a_payload():
+    with pytest.raises(ValueError):
+        image_ingest.ImageAsset()
@@ -0,0 +1,100 @@
+import io
+import os
+import sqlite3
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import analysis_jobs
+import image_hashing
+import image_worker
+from conftest import SAMPLE_DIR
+
+
+def read_sample(name: str) -> bytes:
+    with open(os.path.join(SAMPLE_DIR, name), "rb") as f:
+        return f.read()
+
+
+def hashes_of(data: bytes) -> dict:
+    pixels = np.asarray(Image.open(io.BytesIO(data)).convert("RGB"))
+    return {"phash": f"{image_hashing.phash(pixels):016x}", "dhash": f"{image_hashing.dhash(pixels):016x}"}
+
+
+def recompressed(data: bytes, quality: int = 50) -> bytes:
+    out = io.BytesIO()
+    Image.open(io.BytesIO(data)).save(out, format="JPEG", quality=quality)
+    return out.getvalue()
+
+
+@pytest.fixture
+def index(tmp_path):
+    return image_hashing.DuplicateIndex(image_hashing.HashStore(str(tmp_path / "hashes.sqlite3")))
+
+
+def test_recompressed_copy_is_a_duplicate(index):
+    original = read_sample("ISIC_0024313.jpg")
+    index.add("user", "key", "first", hashes_of(original), ["nv", 0.7, "Melanocytic Nevi"])
+    match = index.find("user", hashes_of(recompressed(original)))
+    assert match is not None and match[1]["image_id"] == "first"
+
+
+def test_closest_distinct_lesions_are_not_duplicates(index):
+    # The nearest pair of different lesions among the samples: 10 pHash bits apart.
+    first, second = hashes_of(read_sample("ISIC_0024313.jpg")), hashes_of(read_sample("ISIC_0024335.jpg"))
+    assert image_hashing.hamming(int(first["phash"], 16), int(second["phash"], 16)) == 10
+    index.add("user", "key", "first", first, None)
+    assert index.find("user", second) is None
+
+
+def test_matches_stay_within_their_scope(index):
+    original = read_sample("ISIC_0024313.jpg")
+    index.add("user", "key", "first", hashes_of(original), None, "c1")
+    assert index.find("user", hashes_of(original))[1]["conversation_id"] == "c1"
+    assert index.find("other", hashes_of(original)) is None
+
+
+def test_evicted_trees_are_reloaded_from_the_store(tmp_path):
+    index = image_hashing.DuplicateIndex(image_hashing.HashStore(str(tmp_path / "hashes.sqlite3")), max_trees=2)
+    samples = ["ISIC_0024313.jpg", "ISIC_0024326.jpg", "ISIC_0024335.jpg"]
+    for n, name in enumerate(samples):
+        index.add(f"user{n}", "key", name, hashes_of(read_sample(name)), None)
+        index.find(f"user{n}", hashes_of(read_sample(name)))
+    assert list(index._trees) == ["user1", "user2"]
+    # A second worker's upload for a loaded scope arrives through the sync.
+    other = image_hashing.DuplicateIndex(index.store)
+    other.add("user2", "key", "again", hashes_of(recompressed(read_sample(samples[0]))), None)
+    assert index.find("user2", hashes_of(read_sample(samples[0])))[1]["image_id"] == "again"
+    assert index.find("user0", hashes_of(read_sample(samples[0])))[1]["image_id"] == samples[0]
+    assert list(index._trees) == ["user2", "user0"]
+
+
+def test_legacy_session_key_column_is_renamed(tmp_path):
+    path = str(tmp_path / "hashes.sqlite3")
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE image_hashes (seq INTEGER PRIMARY KEY AUTOINCREMENT, session_key TEXT NOT NULL,"
+        " image_key TEXT NOT NULL, image_id TEXT NOT NULL, phash TEXT NOT NULL, dhash TEXT NOT NULL,"
+        " analysis TEXT, created_at REAL NOT NULL)"
+    )
+    conn.execute("INSERT INTO image_hashes VALUES (1, 'user', 'key', 'first', '0', '0', NULL, 0)")
+    conn.commit()
+    conn.close()
+    (_, entry), = image_hashing.HashStore(path).since(0)
+    assert entry["scope"] == "user" and entry["conversation_id"] is None
+
+
+def test_duplicate_reuses_the_earlier_analysis(monkeypatch):
+    monkeypatch.setattr(image_worker, "_pool", image_worker.ImageWorkerPool(workers=0))
+    monkeypatch.setattr(analysis_jobs, "SIMILAR_CASES", 0)
+    queue = analysis_jobs.AnalysisQueue(analysis_jobs.JobStore(), threads=0)
+    data = read_sample("ISIC_0024326.jpg")
+    image_hashing.get_index().add("session", "old", "earlier", hashes_of(data), ["mel", 0.99, "Melanoma"], "conv")
+    # Another conversation of the same user still finds the earlier upload.
+    result = queue._analyse(recompressed(data, 90), "new-key", "session", "another-conv")
+    assert result["duplicate_of"]["image_id"] == "earlier"
+    assert result["duplicate_of"]["conversation_id"] == "conv"
+    assert result["analysis"] == ["mel", 0.99, "Melanoma"]
+    stranger = queue._analyse(recompressed(data, 90), "new-key", "other-session", "conv")
+    assert "duplicate_of" not in stranger
@@ -0,0 +1,43 @@
+import io
+
+import numpy as np
+from PIL import Image
+
+import image_ingest
+
+
+def encode(img: Image.Image, fmt: str = "PNG", **options) -> bytes:
+    out = io.BytesIO()
+    img.save(out, format=fmt, **options)
+    return out.getvalue()
+
+
+def test_long_edge_is_capped_and_upload_reencoded():
+    raw = encode(Image.new("RGB", (3000, 1500), (200, 120, 90)))
+    asset = image_ingest.ingest_image(raw, max_long_edge=1024, output_format="JPEG")
+    assert asset.size == (1024, 512)
+    assert asset.mime == "image/jpeg"
+    assert asset.raw_bytes[:3] == b"\xff\xd8\xff"
+    stats = asset.ingest_stats
+    assert stats["original_size"] == [3000, 1500] and stats["stored_size"] == [1024, 512]
+    assert stats["original_format"] == "PNG" and stats["stored_format"] == "JPEG"
+    assert "->" in image_ingest.describe_savings(stats)
+
+
+def test_exif_orientation_is_applied_then_metadata_dropped():
+    exif = Image.Exif()
+    exif[0x0112] = 6  # rotate 90 degrees clockwise to display
+    exif[0x010F] = "PhoneMaker"
+    raw = encode(Image.new("RGB", (400, 200), (10, 200, 10)), "JPEG", exif=exif.tobytes())
+    asset = image_ingest.ingest_image(raw)
+    assert asset.size == (200, 400)
+    stored = Image.open(io.BytesIO(asset.raw_bytes))
+    assert not stored.getexif()
+
+
+def test_small_uploads_keep_their_size(sample_bytes):
+    asset = image_ingest.ingest_image(sample_bytes[0], max_long_edge=4096)
+    original = Image.open(io.BytesIO(sample_bytes[0]))
+    assert asset.size == original.size
+    assert asset.pixels.shape == (original.size[1], original.size[0], 3)
+    assert asset.pixels.dtype == np.uint8
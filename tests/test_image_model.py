@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+import image_worker
+import skin_disease_model
+from disease_tables import disease_mapping
+
+CLASSES = tuple(disease_mapping)
+
+
+@pytest.fixture
+def stub_model(tmp_path, monkeypatch):
+    """SKIN_IMAGE_MODEL pointed at a file, answered by a stub that always says melanoma."""
+    path = tmp_path / "student.weights"
+    path.write_bytes(b"v1")
+    seen = []
+
+    def classify(pixels):
+        seen.append(pixels.shape)
+        probs = np.full(len(CLASSES), 0.05)
+        probs[CLASSES.index("mel")] = 0.7
+        return probs
+
+    monkeypatch.setattr(skin_disease_model, "IMAGE_MODEL_PATH", str(path))
+    monkeypatch.setattr(skin_disease_model, "_image_model", classify)
+    return path, seen
+
+
+def test_worker_decode_uses_the_configured_model(stub_model, sample_bytes):
+    _, seen = stub_model
+    result = image_worker._decode(sample_bytes[0], True)
+    assert result["analysis"] == ["mel", 0.7, disease_mapping["mel"]]
+    assert len(seen) == 1 and seen[0][2] == 3
+    # Hashes, case vector and lesion data still come from the features.
+    assert result["hashes"]["phash"] and len(result["vector"])
+
+
+def test_entry_point_matches_worker(stub_model, sample_bytes):
+    assert skin_disease_model.get_image_based_analysis(sample_bytes[1]) == ("mel", 0.7, disease_mapping["mel"])
+
+
+def test_heuristics_reuse_extracted_features(sample_bytes):
+    features = skin_disease_model.extract_image_features(sample_bytes[2])
+    expected = skin_disease_model.predict_disease_from_features(features)
+    assert skin_disease_model.get_image_based_analysis(sample_bytes[2], features) == (
+        expected["condition"], expected["confidence"], expected["name"])
+    assert image_worker._decode(sample_bytes[2], True)["analysis"] == [
+        expected["condition"], expected["confidence"], expected["name"]]
+
+
+def test_cache_tag_follows_the_model_file(stub_model, monkeypatch):
+    path, _ = stub_model
+    tag = skin_disease_model.image_model_tag()
+    assert tag == skin_disease_model.image_model_tag() and tag.startswith("model_")
+    path.write_bytes(b"retrained")
+    assert skin_disease_model.image_model_tag() != tag
+    monkeypatch.setattr(skin_disease_model, "IMAGE_MODEL_PATH", "")
+    assert skin_disease_model.image_model_tag() == f"heuristic_v{skin_disease_model.FEATURE_VERSION}"
@@ -0,0 +1,59 @@
+import threading
+import time
+
+import pytest
+
+import image_worker
+from image_ingest import ImageError, ImageTimeoutError, UnsupportedImageError
+from image_worker_tasks import crash_on_marker, hang_on_marker
+
+
+def run_together(pool, uploads, stagger=0.0):
+    """Process uploads concurrently; returns each one's asset or exception, in order."""
+    results = [None] * len(uploads)
+
+    def run(i):
+        try:
+            results[i] = pool.process(uploads[i], score=False)[0]
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(len(uploads))]
+    for thread in threads:
+        thread.start()
+        time.sleep(stagger)
+    for thread in threads:
+        thread.join(120)
+    return results
+
+
+def test_header_checks_reject_before_any_worker():
+    pool = image_worker.ImageWorkerPool(workers=2)
+    with pytest.raises(UnsupportedImageError):
+        pool.process(b"not an image")
+    assert pool._pool is None
+
+
+def test_crashing_upload_fails_alone(sample_bytes):
+    pool = image_worker.ImageWorkerPool(workers=2, timeout=30, task=crash_on_marker)
+    uploads = [sample_bytes[0] + b"CRASH"] + sample_bytes[1:5]
+    results = run_together(pool, uploads)
+    assert isinstance(results[0], ImageError)
+    for result in results[1:]:
+        assert not isinstance(result, Exception), result
+        assert result.nbytes > 0
+    assert pool.outcomes()["ok"] == 4
+    assert pool.retries()["isolated"] >= 2
+
+
+def test_hanging_upload_fails_alone(sample_bytes, monkeypatch):
+    monkeypatch.setattr(image_worker, "PARENT_GRACE", 0.5)
+    pool = image_worker.ImageWorkerPool(workers=2, timeout=4, task=hang_on_marker)
+    # Warm the workers so start-up time does not count against the good uploads.
+    pool.process(sample_bytes[0], score=False)
+    # The slow upload is still running when the hung one's pool is killed at 4.5 s.
+    uploads = [sample_bytes[1] + b"HANG", sample_bytes[2] + b"SLOW"]
+    results = run_together(pool, uploads, stagger=3.0)
+    assert isinstance(results[0], ImageTimeoutError)
+    assert not isinstance(results[1], Exception), results[1]
+    assert pool.retries()["requeued"] == 1
@@ -0,0 +1,70 @@
+import json
+
+import instrumentation
+
+
+def test_span_is_free_when_disabled():
+    instrumentation.disable()
+    instrumentation.reset()
+    with instrumentation.span("stage"):
+        pass
+    assert instrumentation.snapshot() == {}
+
+
+def test_span_records_labels_and_errors(metrics):
+    with metrics.span("decode", model="a"):
+        pass
+    try:
+        with metrics.span("decode", model="a"):
+            raise ValueError("boom")
+    except ValueError:
+        pass
+    summary = metrics.snapshot()
+    assert summary["decode,model=a"]["count"] == 1
+    assert summary["decode,error=ValueError,model=a"]["count"] == 1
+
+
+def test_histogram_quantile_uses_bucket_bounds():
+    hist = instrumentation.Histogram((0.1, 1.0))
+    for value in (0.05, 0.05, 0.5, 5.0):
+        hist.observe(value)
+    assert hist.quantile(0.5) == 0.1
+    assert hist.quantile(0.75) == 1.0
+    assert hist.counts == [2, 1, 1]
+
+
+def test_prometheus_export_is_cumulative_and_escaped(metrics, tmp_path):
+    metrics.observe("llm", 0.2, model='gem"ini')
+    metrics.observe("llm", 3.0, model='gem"ini')
+    path = tmp_path / "metrics.prom"
+    metrics.write_prometheus(str(path))
+    text = path.read_text()
+    assert 'skin_stage_duration_seconds_bucket{stage="llm",model="gem\\"ini",le="0.25"} 1' in text
+    assert 'skin_stage_duration_seconds_bucket{stage="llm",model="gem\\"ini",le="+Inf"} 2' in text
+    assert 'skin_stage_duration_seconds_count{stage="llm",model="gem\\"ini"} 2' in text
+
+
+def test_trace_file_gets_one_json_line_per_span(tmp_path):
+    trace = tmp_path / "trace.jsonl"
+    instrumentation.reset()
+    instrumentation.enable(str(trace))
+    try:
+        with instrumentation.span("ingest", kind="jpeg"):
+            pass
+        instrumentation.observe("ttft", 0.5)
+    finally:
+        instrumentation.disable()
+        instrumentation.reset()
+        instrumentation._trace_path = None
+    records = [json.loads(line) for line in trace.read_text().splitlines()]
+    assert [r["stage"] for r in records] == ["ingest", "ttft"]
+    assert records[0]["labels"] == {"kind": "jpeg"}
+    assert records[1]["duration_ms"] == 500.0
+
+
+def test_percentile_is_nearest_rank():
+    ordered = list(range(1, 101))
+    assert [instrumentation.percentile(ordered, q) for q in (0.5, 0.9, 0.95, 0.99, 1.0)] == [50, 90, 95, 99, 100]
+    assert instrumentation.percentile([7, 9], 0.5) == 7
+    assert instrumentation.percentile([3], 0.95) == 3
+    assert instrumentation.percentile(list(range(1, 21)), 0.95) == 19
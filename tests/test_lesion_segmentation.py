@@ -0,0 +1,46 @@
+import numpy as np
+
+import lesion_segmentation
+
+SKIN = (225, 190, 170)
+LESION = (110, 70, 50)
+
+
+def synthetic(width=400, height=300, box=(150, 100, 250, 200)):
+    img = np.empty((height, width, 3), dtype=np.uint8)
+    img[:] = SKIN
+    yy, xx = np.mgrid[0:height, 0:width]
+    cx, cy = (box[0] + box[2]) / 2, (box[1] + box[3]) / 2
+    rx, ry = (box[2] - box[0]) / 2, (box[3] - box[1]) / 2
+    img[((xx - cx) / rx) ** 2 + ((yy - cy) / ry) ** 2 <= 1] = LESION
+    return img
+
+
+def test_dark_central_lesion_is_found():
+    seg = lesion_segmentation.segment_lesion(synthetic(), side=100)
+    assert seg["segmented"]
+    x0, y0, x1, y1 = seg["bbox"]
+    assert abs(x0 - 150) <= 8 and abs(x1 - 250) <= 8
+    assert abs(y0 - 100) <= 8 and abs(y1 - 200) <= 8
+    assert seg["mask"].shape == (y1 - y0, x1 - x0)
+    # An ellipse fills pi/4 of its box; the frame share follows from the box size.
+    assert abs(seg["area_fraction"] - np.pi / 4 * 100 * 100 / (400 * 300)) < 0.02
+
+
+def test_lesion_pixels_come_from_inside_the_mask():
+    img = synthetic()
+    pixels = lesion_segmentation.lesion_pixels(img, lesion_segmentation.segment_lesion(img, side=100))
+    assert pixels.shape[1] == 3
+    assert np.abs(pixels.mean(axis=0) - LESION).max() < 25
+
+
+def test_blank_frame_falls_back_to_the_whole_image():
+    img = np.full((120, 160, 3), 200, dtype=np.uint8)
+    seg = lesion_segmentation.segment_lesion(img)
+    assert not seg["segmented"]
+    assert seg["bbox"] == (0, 0, 160, 120) and seg["mask"].all()
+
+
+def test_otsu_splits_two_populations():
+    values = np.concatenate([np.full(500, 60.0), np.full(500, 200.0)])
+    assert 60 <= lesion_segmentation.otsu_threshold(values) < 200
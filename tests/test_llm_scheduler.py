@@ -0,0 +1,79 @@
+import threading
+import time
+
+import llm_scheduler
+
+
+def wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def queue_call(scheduler, name, granted, urgent=False, api_key="key"):
+    def run():
+        ticket = scheduler.acquire(api_key, urgent=urgent, poll_interval=0.01)
+        granted.append(name)
+        scheduler.release(ticket)
+
+    before = scheduler.stats()["waiting"]
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    wait_for(lambda: scheduler.stats()["waiting"] == before + 1)
+    return thread
+
+
+def test_urgent_calls_jump_the_queue_and_normal_calls_stay_fifo():
+    scheduler = llm_scheduler.LLMScheduler(max_concurrency=1, requests_per_minute=6000, burst=100)
+    holder = scheduler.acquire("key")
+    granted = []
+    threads = [
+        queue_call(scheduler, "normal-1", granted),
+        queue_call(scheduler, "normal-2", granted),
+        queue_call(scheduler, "urgent", granted, urgent=True),
+    ]
+    assert scheduler.stats()["urgent_waiting"] == 1
+    # Hedges never overtake queued calls.
+    assert scheduler.try_acquire("key") is None
+    scheduler.release(holder)
+    for thread in threads:
+        thread.join(5)
+    assert granted == ["urgent", "normal-1", "normal-2"]
+    assert scheduler.stats()["active"] == 0
+
+
+def test_rate_limited_key_does_not_block_other_keys():
+    scheduler = llm_scheduler.LLMScheduler(max_concurrency=4, requests_per_minute=0.6, burst=1)
+    scheduler.release(scheduler.acquire("busy"))
+    granted = []
+    blocked = queue_call(scheduler, "busy", granted, api_key="busy")
+    other = queue_call(scheduler, "other", granted, api_key="other")
+    other.join(5)
+    assert granted == ["other"]
+    assert blocked.is_alive()
+
+
+def test_on_wait_reports_queue_position():
+    scheduler = llm_scheduler.LLMScheduler(max_concurrency=1, requests_per_minute=6000, burst=100)
+    holder = scheduler.acquire("key")
+    positions = []
+
+    def waiter():
+        ticket = scheduler.acquire("key", on_wait=lambda pos, depth, waited: positions.append((pos, depth)),
+                                   poll_interval=0.01)
+        scheduler.release(ticket)
+
+    thread = threading.Thread(target=waiter, daemon=True)
+    thread.start()
+    wait_for(lambda: positions)
+    scheduler.release(holder)
+    thread.join(5)
+    assert positions[0] == (1, 1)
+
+
+def test_wait_percentiles_are_nearest_rank():
+    scheduler = llm_scheduler.LLMScheduler(max_concurrency=1)
+    scheduler._recent_waits.extend(float(w) for w in range(1, 21))
+    stats = scheduler.stats()
+    assert stats["p50_wait_s"] == 10.0 and stats["p95_wait_s"] == 19.0
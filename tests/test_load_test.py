@@ -0,0 +1,38 @@
+import time
+
+import load_test
+
+
+def test_percentiles_use_nearest_rank():
+    values = [ms / 1000 for ms in range(1, 101)]
+    assert load_test.percentiles(values[::-1]) == {"n": 100, "p50_ms": 50.0, "p95_ms": 95.0,
+                                                   "p99_ms": 99.0, "max_ms": 100.0}
+    assert load_test.percentiles([0.2]) == {"n": 1, "p50_ms": 200.0, "p95_ms": 200.0,
+                                            "p99_ms": 200.0, "max_ms": 200.0}
+    assert load_test.percentiles([]) == {"n": 0}
+
+
+def _level(sessions, actions_per_s, p95_ms):
+    return {"sessions": sessions, "actions_per_s": actions_per_s, "interactive_latency": {"p95_ms": p95_ms}}
+
+
+def test_ceiling_stops_when_throughput_flattens():
+    levels = [_level(1, 10, 100), _level(2, 19, 150), _level(4, 20, 200), _level(8, 40, 300)]
+    assert load_test.ceiling(levels, p95_budget_ms=1000) == {
+        "sessions": 2, "actions_per_s": 19, "interactive_p95_ms": 150}
+
+
+def test_ceiling_stops_at_the_latency_budget():
+    levels = [_level(1, 10, 100), _level(2, 19, 400), _level(4, 36, 1200)]
+    assert load_test.ceiling(levels, p95_budget_ms=1000)["sessions"] == 2
+    assert load_test.ceiling(levels, p95_budget_ms=300)["sessions"] == 1
+
+
+def test_fake_client_streams_after_ttft():
+    client = load_test.FakeGeminiClient(ttft=0.05, tokens_per_s=1000, words=5)
+    started = time.perf_counter()
+    chunks = client.models.generate_content_stream("model", [], None)
+    first = next(chunks)
+    assert time.perf_counter() - started >= 0.05
+    text = first.text + "".join(c.text for c in chunks)
+    assert text.split() == load_test.REPLY_WORDS[:5] and client.calls == 1
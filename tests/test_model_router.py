@@ -0,0 +1,90 @@
+import threading
+import time
+
+import pytest
+
+import llm_scheduler
+import model_router
+
+
+@pytest.fixture
+def quick_hedge(monkeypatch):
+    monkeypatch.setattr(model_router, "HEDGE_DEFAULT_AFTER", 0.05)
+    monkeypatch.setattr(model_router, "HEDGE_MIN_AFTER", 0.05)
+    monkeypatch.setattr(llm_scheduler, "_scheduler", llm_scheduler.LLMScheduler(4, 6000, 100))
+
+
+def test_only_auto_cascades():
+    router = model_router.ModelRouter()
+    assert router.plan(model_router.AUTO_MODEL, urgent=False) == (router.fast_model, router.strong_model)
+    assert router.plan(model_router.AUTO_MODEL, urgent=True) == (router.strong_model, router.fast_model)
+    assert router.plan(router.fast_model, urgent=True) == (router.fast_model, None)
+    assert router.plan("gemini-2.0-flash", urgent=False) == ("gemini-2.0-flash", None)
+
+
+def test_explicit_model_is_not_escalated(monkeypatch):
+    called = []
+
+    def failing(client, messages, model, temperature, max_tokens, api_key=None, handle=None):
+        called.append(model)
+        raise RuntimeError("quota")
+        yield
+
+    monkeypatch.setattr(model_router, "stream_chat", failing)
+    stream = model_router.ModelRouter().stream(None, [], model_router.FAST_MODEL, 0, 10, "key", hedge=False)
+    with pytest.raises(model_router.RoutingError):
+        list(stream)
+    assert called == [model_router.FAST_MODEL]
+
+
+def test_auto_escalates_once(monkeypatch):
+    called = []
+
+    def flaky(client, messages, model, temperature, max_tokens, api_key=None, handle=None):
+        called.append(model)
+        if model == model_router.FAST_MODEL:
+            raise RuntimeError("overloaded")
+        yield "ok"
+
+    monkeypatch.setattr(model_router, "stream_chat", flaky)
+    stream = model_router.ModelRouter().stream(None, [], model_router.AUTO_MODEL, 0, 10, "key", hedge=False)
+    assert "".join(stream) == "ok"
+    assert stream.escalated and stream.model == model_router.STRONG_MODEL
+    assert called == [model_router.FAST_MODEL, model_router.STRONG_MODEL]
+
+
+def test_losing_hedge_stuck_before_first_token_is_closed_and_frees_its_slot(monkeypatch, quick_hedge):
+    calls = []
+    loser_closed = threading.Event()
+
+    def fake(client, messages, model, temperature, max_tokens, api_key=None, handle=None):
+        calls.append(handle)
+        if len(calls) == 1:
+            time.sleep(0.2)
+            yield "primary"
+            return
+        # The hedge never produces a token; only closing its handle ends the request.
+        while not handle.closed:
+            time.sleep(0.005)
+        loser_closed.set()
+        raise ConnectionError("closed")
+
+    monkeypatch.setattr(model_router, "stream_chat", fake)
+    stream = model_router.ModelRouter().stream(None, [], model_router.FAST_MODEL, 0, 10, "key")
+    assert "".join(stream) == "primary"
+    assert stream.hedged
+    # The slot is released on cancel, not when the loser's thread gets around to it.
+    assert llm_scheduler.get_scheduler().stats()["active"] == 0
+    assert loser_closed.wait(2)
+
+
+def test_hedge_threshold_is_nearest_rank():
+    stats = model_router.LatencyStats()
+    for seconds in range(1, 11):
+        stats.record("m", "ttft", float(seconds))
+    assert stats.percentile("m", "ttft", 0.9) == 9.0
+    summary = stats.summary()["m"]
+    assert summary["ttft_p50_s"] == 5.0 and summary["ttft_p90_s"] == 9.0
+    stats.record("other", "ttft", 1.0)
+    # Too few samples to set a threshold.
+    assert stats.percentile("other", "ttft", 0.9) is None
@@ -0,0 +1,84 @@
+import importlib.util
+
+import numpy as np
+import pytest
+
+import model_weights
+
+
+def _tensors():
+    rng = np.random.default_rng(0)
+    return {
+        "conv.weight": rng.standard_normal((8, 3, 3, 3)).astype(np.float32),
+        "bn.num_batches_tracked": np.array(7, dtype=np.int64),
+        "fc.bias": rng.standard_normal(5).astype(np.float16),
+        "empty": np.zeros((0, 4), dtype=np.float32),
+        "strided": np.arange(24, dtype=np.float64).reshape(4, 6)[:, ::2],
+    }
+
+
+def test_round_trip_is_exact(tmp_path):
+    path = str(tmp_path / "model.weights")
+    tensors = _tensors()
+    meta = {"arch": "tiny_cnn", "classes": ["akiec", "bcc"], "input_side": 64}
+    model_weights.save_weights(path, tensors, meta)
+
+    mapped = model_weights.MappedWeights(path)
+    assert mapped.meta == meta
+    assert list(mapped.tensors) == list(tensors)
+    for name, array in tensors.items():
+        assert mapped.tensors[name].dtype == array.dtype
+        assert np.array_equal(mapped.tensors[name], array)
+    # Tensor data is page aligned in the file and cache-line aligned within it.
+    assert mapped._map.offset % model_weights.PAGE == 0
+
+
+def test_mapping_is_read_only_unless_copy_on_write(tmp_path):
+    path = str(tmp_path / "model.weights")
+    model_weights.save_weights(path, _tensors())
+    with pytest.raises(ValueError):
+        model_weights.MappedWeights(path).tensors["conv.weight"][0, 0, 0, 0] = 1
+
+    private = model_weights.MappedWeights(path, copy_on_write=True)
+    private.tensors["conv.weight"][0, 0, 0, 0] = 123
+    # Writes stay in this mapping; the file and other mappings are unchanged.
+    assert model_weights.MappedWeights(path).tensors["conv.weight"][0, 0, 0, 0] != 123
+
+
+def test_get_weights_maps_once_per_path(tmp_path):
+    path = str(tmp_path / "model.weights")
+    model_weights.save_weights(path, _tensors())
+    assert model_weights.get_weights(path) is model_weights.get_weights(str(tmp_path / "." / "model.weights"))
+
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / "model.pt"
+    path.write_bytes(b"not a weights file")
+    with pytest.raises(ValueError):
+        model_weights.MappedWeights(str(path))
+
+
+@pytest.mark.skipif(importlib.util.find_spec("torch") is not None, reason="torch is installed")
+def test_torch_paths_name_the_train_extra(tmp_path):
+    with pytest.raises(ImportError, match=r"\[train\]"):
+        model_weights.load_torch_model(str(tmp_path / "model.weights"))
+
+
+def test_export_round_trip(tmp_path):
+    torch = pytest.importorskip("torch")
+    pytest.importorskip("torchvision")
+    from train_model import build_model
+
+    model = build_model("tiny_cnn", 7, pretrained=False)
+    checkpoint = str(tmp_path / "model.pt")
+    torch.save({"model": model.state_dict(), "arch": "tiny_cnn", "classes": list("abcdefg"),
+                "input_side": 64, "mean": [0.5] * 3, "std": [0.25] * 3}, checkpoint)
+    model_weights.export_checkpoint(checkpoint, str(tmp_path / "model.weights"))
+
+    mapped = model_weights.MappedWeights(str(tmp_path / "model.weights"))
+    for name, tensor in model.state_dict().items():
+        assert np.array_equal(mapped.tensors[name], tensor.numpy())
+    loaded, meta, stats = model_weights.load_torch_model(str(tmp_path / "model.weights"))
+    assert stats["shared"] and meta["input_side"] == 64
+    x = torch.zeros(1, 3, 64, 64)
+    assert torch.equal(loaded(x), model.eval()(x))
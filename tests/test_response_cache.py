@@ -0,0 +1,51 @@
+import base64
+
+import response_cache
+
+HISTORY = [
+    {"role": "system", "content": "You are a helpful assistant. "},
+    {"role": "user", "content": "I have an itchy rash\r\n"},
+]
+
+
+def test_key_ignores_formatting_noise():
+    tidy = [{"role": "system", "content": "You are a helpful assistant."},
+            {"role": "user", "content": "I have an itchy rash"}]
+    assert response_cache.make_key("m", HISTORY, 0, 100) == response_cache.make_key("m", tidy, 0.0, 100)
+
+
+def test_key_changes_with_anything_that_changes_the_answer():
+    base = response_cache.make_key("m", HISTORY, 0, 100)
+    assert response_cache.make_key("other", HISTORY, 0, 100) != base
+    assert response_cache.make_key("m", HISTORY, 0.5, 100) != base
+    assert response_cache.make_key("m", HISTORY, 0, 200) != base
+    longer = HISTORY + [{"role": "assistant", "content": "Since when?"}]
+    assert response_cache.make_key("m", longer, 0, 100) != base
+
+
+def test_key_uses_image_content_not_encoding(sample_bytes):
+    b64 = base64.b64encode(sample_bytes[0]).decode()
+    first = HISTORY + [{"role": "user", "content": "", "image_data": b64, "image_mime": "image/jpeg"}]
+    same = HISTORY + [{"role": "user", "content": "", "image_data": b64, "image_mime": "image/jpeg"}]
+    other = HISTORY + [{"role": "user", "content": "", "image_data": base64.b64encode(sample_bytes[1]).decode(),
+                        "image_mime": "image/jpeg"}]
+    assert response_cache.make_key("m", first, 0, 100) == response_cache.make_key("m", same, 0, 100)
+    assert response_cache.make_key("m", first, 0, 100) != response_cache.make_key("m", other, 0, 100)
+
+
+def test_store_then_replay():
+    key = response_cache.make_key("m", HISTORY, 0, 100)
+    assert response_cache.lookup(key + "-missing") is None
+    text = "Keep the area clean and dry. " * 10
+    response_cache.store(key, text, "gemini-2.5-flash")
+    replay = response_cache.ReplayStream(response_cache.lookup(key), chunk_chars=16)
+    chunks = list(replay)
+    assert "".join(chunks) == text
+    assert max(len(c) for c in chunks) == 16
+    assert replay.model == "gemini-2.5-flash" and replay.cached
+
+
+def test_only_deterministic_requests_are_cached_by_default():
+    assert response_cache.should_cache(0, opt_in=False)
+    assert not response_cache.should_cache(0.7, opt_in=False)
+    assert response_cache.should_cache(0.7, opt_in=True)
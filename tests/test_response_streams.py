@@ -0,0 +1,119 @@
+import os
+import threading
+import time
+import uuid
+
+import pytest
+
+import model_router
+import response_streams
+from response_streams import CANCELLED, DONE, FAILED, ResponseStreams, StreamStore
+
+
+class FakeRouter:
+    """Stands in for the model router: yields words at a fixed pace and records closes."""
+
+    def __init__(self, words=20, delay=0.05):
+        self.words = words
+        self.delay = delay
+        self.calls = 0
+        self.closed = threading.Event()
+
+    def stream(self, client, messages, model, temperature, max_tokens, api_key, urgent=False, hedge=True):
+        self.calls += 1
+        router = self
+
+        class Stream:
+            model = "fake-model"
+
+            def __iter__(self):
+                try:
+                    for i in range(router.words):
+                        time.sleep(router.delay)
+                        yield f"w{i} "
+                finally:
+                    router.closed.set()
+        return Stream()
+
+
+@pytest.fixture
+def router(monkeypatch):
+    fake = FakeRouter()
+    monkeypatch.setattr(model_router, "get_router", lambda: fake)
+    return fake
+
+
+@pytest.fixture
+def store(tmp_path):
+    return StreamStore(str(tmp_path / "streams.sqlite3"))
+
+
+def _start(streams, cache_key=None):
+    return streams.start("session-1", None, [{"role": "user", "content": "hi"}], "gemini-2.5-flash",
+                         0.7, 64, "key-streams", cache_key=cache_key)
+
+
+def _wait(streams, stream_id, predicate, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        status = streams.status(stream_id)
+        if predicate(status):
+            return status
+        time.sleep(0.02)
+    raise AssertionError(f"stream {stream_id} stuck at {streams.status(stream_id)}")
+
+
+def test_rerun_reattaches_and_cache_replays(router, store):
+    streams = ResponseStreams(store)
+    cache_key = uuid.uuid4().hex
+    stream_id = _start(streams, cache_key)
+
+    # Another runner on the same file (a rerun, or another worker) sees the partial text.
+    other = ResponseStreams(StreamStore(store.path))
+    partial = _wait(other, stream_id, lambda s: s["text"])
+    assert partial["status"] == "running" and partial["model"] == "fake-model"
+    done = _wait(other, stream_id, lambda s: s["status"] == DONE)
+    assert done["text"] == " ".join(f"w{i}" for i in range(router.words))
+    assert not done["cached"] and len(done["text"]) > len(partial["text"])
+
+    replay = _start(streams, cache_key)
+    replayed = _wait(streams, replay, lambda s: s["status"] == DONE)
+    assert replayed["cached"] and replayed["text"] == done["text"] and router.calls == 1
+    assert streams.stats()["outcomes"] == {DONE: 2} and streams.stats()["running"] == 0
+
+
+def test_cancel_stops_generation(router, store):
+    router.words, router.delay = 200, 0.02
+    streams = ResponseStreams(store)
+    stream_id = _start(streams)
+    _wait(streams, stream_id, lambda s: s["text"])
+    assert streams.cancel(stream_id)
+    assert router.closed.wait(2.0)
+    status = streams.status(stream_id)
+    assert status["status"] == CANCELLED and len(status["text"].split()) < router.words
+    assert not streams.cancel(stream_id)
+    _wait(streams, stream_id, lambda s: streams.stats()["running"] == 0)
+    assert streams.stats()["outcomes"] == {CANCELLED: 1}
+
+
+def test_orphaned_stream_fails_with_its_text(store):
+    streams = ResponseStreams(store)
+    store.create("orphan", "session-1")
+    store.begin("orphan")
+    store.append("orphan", "partial reply", "fake-model")
+    with store._connect() as conn:
+        # A pid that cannot be running: above the kernel's pid_max.
+        conn.execute("UPDATE streams SET owner_pid = ? WHERE id = ?", (2 ** 22 + 1, "orphan"))
+    status = streams.status("orphan")
+    assert status["status"] == FAILED and status["text"] == "partial reply"
+    assert "stopped" in status["error"]
+
+
+def test_purge_keeps_recent_finished_streams(store):
+    store.create("old", None)
+    store.finish("old", DONE, "text")
+    store.create("live", None)
+    assert store.purge_finished(older_than=3600) == 0
+    assert store.purge_finished(older_than=-1) == 1
+    assert store.get("old") is None and store.get("live")["status"] == response_streams.QUEUED
+    assert os.path.exists(store.path)
@@ -0,0 +1,82 @@
+import os
+import stat
+import time
+
+import pytest
+
+import session_memory
+
+
+@pytest.fixture(autouse=True)
+def spill_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(session_memory, "SPILL_DIR", str(tmp_path / "spill"))
+    monkeypatch.setattr(session_memory, "_last_prune", time.time())
+    return tmp_path / "spill"
+
+
+def _image(n, size=1000, **extra):
+    return dict({"role": "user", "content": f"photo {n}", "image_id": f"{n:064x}", "image_data": "A" * size}, **extra)
+
+
+def _conversation(conv_id, messages, last_active):
+    return {"id": conv_id, "title": conv_id, "last_active": last_active,
+            "messages": [{"role": "system", "content": "You are a helpful assistant."}] + messages}
+
+
+def test_cold_conversations_spill_and_load_back(spill_dir):
+    old = time.time() - session_memory.COLD_AFTER - 1
+    messages = [_image(1), {"role": "assistant", "content": "Looks like a mole."}]
+    conversations = {"a": _conversation("a", [dict(m) for m in messages], old),
+                     "b": _conversation("b", [_image(2)], old)}
+    usage = session_memory.enforce("session-1", conversations, current_id="b")
+
+    cold = conversations["a"]
+    assert usage["changed"] and usage["spilled_conversations"] == 1
+    assert cold["spilled"] and cold["messages"] == [] and "Looks like a mole." in cold["search_text"]
+    assert "image_data" in conversations["b"]["messages"][1]
+    path = session_memory._conversation_path("session-1", "a")
+    assert "session-1" not in path and stat.S_IMODE(os.stat(path).st_mode) == 0o600
+
+    assert session_memory.ensure_loaded("session-1", cold)
+    assert not os.path.exists(path) and "spilled" not in cold
+    assert cold["messages"][2] == messages[1]
+    assert cold["messages"][1]["image_spilled"] == messages[0]["image_id"]
+    assert session_memory.load_image(messages[0]["image_id"]) == messages[0]["image_data"]
+
+
+def test_current_conversation_keeps_recent_images(monkeypatch):
+    monkeypatch.setattr(session_memory, "CONVERSATION_MAX_BYTES", 2500)
+    images = [_image(n) for n in range(5)] + [_image(5, image_job="job-1")]
+    conversations = {"c": _conversation("c", images, time.time())}
+    usage = session_memory.enforce("session-1", conversations, current_id="c")
+
+    assert usage["changed"] and usage["conversations"]["c"]["images_on_disk"] == 3
+    kept = [m["content"] for m in conversations["c"]["messages"] if "image_data" in m]
+    # The two most recent finished images stay, as does the one still being analysed.
+    assert kept == ["photo 3", "photo 4", "photo 5"]
+
+
+def test_busy_and_warm_conversations_stay_in_memory(monkeypatch):
+    old = time.time() - session_memory.COLD_AFTER - 1
+    conversations = {
+        "busy": _conversation("busy", [{"role": "assistant", "content": "", "stream_id": "s1"}], old),
+        "warm": _conversation("warm", [_image(1)], time.time()),
+        "now": _conversation("now", [], time.time()),
+    }
+    usage = session_memory.enforce("session-1", conversations, current_id="now")
+    assert not usage["changed"] and not usage["over_cap"]
+
+    # Over the session cap, the warm one goes, least recently used first; the busy one never does.
+    monkeypatch.setattr(session_memory, "SESSION_MAX_BYTES", 10)
+    usage = session_memory.enforce("session-1", conversations, current_id="now")
+    assert conversations["warm"].get("spilled") and not conversations["busy"].get("spilled")
+
+
+def test_expired_spill_files(spill_dir):
+    conversation = _conversation("gone", [_image(7)], 0.0)
+    session_memory.spill_conversation("session-2", conversation)
+    assert session_memory.prune(max_age=-1) == 2
+    with pytest.raises(FileNotFoundError):
+        session_memory.load_image(f"{7:064x}")
+    assert session_memory.ensure_loaded("session-2", conversation)
+    assert conversation["messages"][-1]["content"] == "This conversation expired from disk."
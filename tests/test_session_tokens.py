@@ -0,0 +1,29 @@
+import time
+
+import session_tokens
+
+
+def test_issued_token_verifies():
+    token = session_tokens.issue("abc123")
+    assert session_tokens.verify(token) == "abc123"
+
+
+def test_raw_or_tampered_tokens_are_rejected():
+    token = session_tokens.issue("abc123")
+    key, issued, signature = token.split(".")
+    assert session_tokens.verify("abc123") is None
+    assert session_tokens.verify(f"other.{issued}.{signature}") is None
+    assert session_tokens.verify(f"{key}.{int(issued) + 3600}.{signature}") is None
+    assert session_tokens.verify(None) is None
+
+
+def test_tokens_expire():
+    old = session_tokens.issue("abc123", now=time.time() - session_tokens.TOKEN_TTL - 1)
+    assert session_tokens.verify(old) is None
+
+
+def test_tokens_are_bound_to_the_browser_cookie():
+    token = session_tokens.issue("abc123", browser="cookie-a")
+    assert session_tokens.verify(token, browser="cookie-a") == "abc123"
+    assert session_tokens.verify(token, browser="cookie-b") is None
+    assert session_tokens.verify(token) is None
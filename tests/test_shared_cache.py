@@ -0,0 +1,55 @@
+import os
+import stat
+import time
+
+import shared_cache
+
+
+def make_cache(tmp_path, **options):
+    backend = shared_cache.SQLiteBackend(str(tmp_path / "cache.sqlite3"))
+    return shared_cache.SharedCache("test", backend, **options)
+
+
+def test_miss_then_hit_from_each_tier(tmp_path):
+    cache = make_cache(tmp_path, ttl=60)
+    assert cache.get("k", "default") == "default"
+    cache.set("k", {"v": 1})
+    assert cache.get("k") == {"v": 1}
+    # A second process sees only the shared tier.
+    other = shared_cache.SharedCache("test", cache.backend, ttl=60)
+    assert other.get("k") == {"v": 1}
+    cache.flush_stats()
+    other.flush_stats()
+    stats = {row["namespace"]: row for row in cache.backend.worker_stats()}["test"]
+    assert (stats["l1_hits"], stats["l2_hits"], stats["misses"], stats["sets"]) == (1, 1, 1, 1)
+
+
+def test_entries_expire_after_ttl(tmp_path):
+    cache = make_cache(tmp_path, ttl=60, l1_size=0)
+    cache.set("short", "v", ttl=0.05)
+    cache.set("long", "v")
+    time.sleep(0.1)
+    assert cache.get("short") is None
+    assert cache.get("long") == "v"
+    assert cache.backend.purge_expired() == 1
+
+
+def test_l1_is_bounded_and_falls_back_to_l2(tmp_path):
+    cache = make_cache(tmp_path, ttl=60, l1_size=2)
+    for key in "abc":
+        cache.set(key, key)
+    assert list(cache._l1) == ["b", "c"]
+    assert cache.get("a") == "a"
+    cache.delete("a")
+    assert cache.get("a") is None
+
+
+def test_database_is_private_to_the_app_user(tmp_path):
+    path = tmp_path / "private" / "cache.sqlite3"
+    shared_cache.SQLiteBackend(str(path)).set("ns", "k", "v", time.time() + 60)
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+    assert stat.S_IMODE(os.stat(path.parent).st_mode) == 0o700
+    for suffix in ("-wal", "-shm"):
+        sidecar = str(path) + suffix
+        if os.path.exists(sidecar):
+            assert stat.S_IMODE(os.stat(sidecar).st_mode) & 0o077 == 0
@@ -0,0 +1,32 @@
+import json
+import subprocess
+import sys
+from types import MappingProxyType
+
+import pytest
+
+from conftest import ROOT
+
+PROBE = """
+import json, sys
+import {module}
+print(json.dumps({{name: name in sys.modules for name in ("google.genai", "PIL.Image")}}))
+"""
+
+
+@pytest.mark.parametrize("module", ["skin_disease_model", "gemini_backend", "disease_tables"])
+def test_heavy_sdks_load_on_first_use_only(module):
+    # A fresh interpreter, so modules imported by other tests do not hide the cost.
+    out = subprocess.run([sys.executable, "-c", PROBE.format(module=module)], cwd=ROOT,
+                         capture_output=True, text=True, check=True).stdout
+    assert json.loads(out.strip().splitlines()[-1]) == {"google.genai": False, "PIL.Image": False}
+
+
+def test_static_tables_are_read_only_and_consistent():
+    import disease_tables
+    assert isinstance(disease_tables.disease_treatments, MappingProxyType)
+    with pytest.raises(TypeError):
+        disease_tables.disease_mapping["mel"] = "changed"
+    conditions = set(disease_tables.disease_mapping)
+    assert conditions <= set(disease_tables.disease_treatments)
+    assert conditions <= set(disease_tables.condition_colors)
@@ -0,0 +1,61 @@
+import pytest
+
+from symptom_classifier import SymptomClassifier, normalise
+
+
+@pytest.fixture(scope="module")
+def classifier():
+    return SymptomClassifier()
+
+
+@pytest.mark.parametrize("text", [
+    "The sun is out, what should I wear?",
+    "I changed the border color of my div",
+    "spots on my screen",
+    "The logo uses multiple colors",
+    "my nose bleeds",
+    "what's the weather tomorrow",
+])
+def test_non_medical_text_is_unknown(classifier, text):
+    result = classifier.classify([text])[0]
+    assert result["condition"] == "unknown"
+    assert result["matched_keywords"] == []
+
+
+@pytest.mark.parametrize("text, condition", [
+    ("rough scaly patch on my face from sun exposure", "akiec"),
+    ("shiny pearly bump that bleeds", "bcc"),
+    ("stuck-on waxy growth on my back", "bkl"),
+    ("firm bump on my leg that dimples when pinched", "df"),
+    ("new mole on my back that is growing quickly", "mel"),
+    ("bright red bump on my arm", "vasc"),
+    # Clinical descriptions that never say "skin" or "mole".
+    ("irregular, asymmetry, evolving, multiple colors", "mel"),
+    ("I think I have a cherry angioma", "vasc"),
+    ("pyogenic granuloma on my finger", "vasc"),
+    ("visible blood vessels and it bleeds", "bcc"),
+    ("scaly rough sandpaper feeling on my face", "akiec"),
+])
+def test_symptom_descriptions_are_classified(classifier, text, condition):
+    result = classifier.classify([text])[0]
+    assert result["condition"] == condition
+    assert result["matched_keywords"]
+
+
+def test_vague_skin_complaint_is_unknown(classifier):
+    # About the skin, but no condition's keywords to go on.
+    result = classifier.classify(["I have a small red bump on my arm"])[0]
+    assert result["condition"] == "unknown"
+
+
+def test_negated_keywords_do_not_match(classifier):
+    assert "not_bleed" in normalise("no bleeding at all")
+    result = classifier.classify(["a mole with no bleeding and no irregular border"])[0]
+    assert result["condition"] == "nv"
+    assert "bleeding" not in result["matched_keywords"]
+
+
+def test_batch_matches_single_results(classifier):
+    texts = ["spots on my screen", "shiny pearly bump that bleeds", "a brown spot"]
+    batch = classifier.classify(texts)
+    assert [r["condition"] for r in batch] == [classifier.classify([t])[0]["condition"] for t in texts]
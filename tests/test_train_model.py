@@ -0,0 +1,45 @@
+import argparse
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("torchvision")
+
+import torch  # noqa: E402
+
+import train_model  # noqa: E402
+
+
+def _args(data, out, **overrides):
+    args = dict(data=data, arch="tiny_cnn", no_pretrained=True, epochs=1, batch_size=8, accumulate=2,
+                lr=1e-3, balanced=False, workers=0, threads=1, prefetch=2, log_every=1, checkpoint_every=2,
+                checkpoint=None, resume=False, log=os.path.join(os.path.dirname(out), "train.log"),
+                seed=0, out=out)
+    args.update(overrides)
+    return argparse.Namespace(**args)
+
+
+def test_sampler_resume_skips_consumed_prefix():
+    labels = np.array([0, 1, 1, 2, 2, 2, 0, 1])
+    sampler = train_model.EpochSampler(labels, seed=5)
+    sampler.set_epoch(2)
+    full = list(sampler)
+    sampler.set_epoch(2, skip=3)
+    assert list(sampler) == full[3:] and len(sampler) == len(labels) - 3
+
+
+def test_one_epoch_on_packed_samples(packed_samples, tmp_path):
+    out = str(tmp_path / "model.pt")
+    result = train_model.train(_args(packed_samples, out))
+    assert len(result["history"]) == 1
+    summary = result["history"][0]
+    assert np.isfinite(summary["loss"])
+    saved = torch.load(out, map_location="cpu")
+    assert saved["arch"] == "tiny_cnn" and len(saved["classes"]) == 7
+    checkpoint = torch.load(f"{out}.ckpt", map_location="cpu")
+    assert checkpoint["epoch"] == 1 and checkpoint["samples_done"] == 0
+
+    # Resuming a finished run trains no further epochs.
+    assert train_model.train(_args(packed_samples, out, resume=True))["history"] == []
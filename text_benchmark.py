@@ -0,0 +1,106 @@
+"""Throughput benchmark for the symptom text classifier.
+
+Generates synthetic symptom descriptions from the keyword tables (with
+inflected forms, filler and negated distractors) and reports descriptions per
+second for the old per-keyword substring scan and for `SymptomClassifier` at
+several batch sizes, plus top-1 agreement with the generating condition.
+
+    python text_benchmark.py --count 20000 --batches 1,100,10000
+"""
+import json
+import time
+import random
+import argparse
+from typing import Dict, List, Tuple
+
+from disease_tables import disease_keywords
+from symptom_classifier import SymptomClassifier
+
+_FILLER = (
+    "I noticed this a few weeks ago", "on my left arm", "it is about the size of a pea",
+    "my doctor is away", "it appeared after summer", "on the back of my neck",
+)
+_INFLECT = {"bleeds": "bleeding", "bleeding": "bleeds", "scaly": "scales", "itchy mole": "itching mole",
+            "changing": "changes", "enlarging": "enlarged", "crusty": "crusts", "rolled edges": "rolled edge"}
+
+
+def _synthetic(count: int, rng: random.Random) -> List[Tuple[str, str]]:
+    conditions = list(disease_keywords)
+    samples = []
+    for _ in range(count):
+        condition = rng.choice(conditions)
+        words = [_INFLECT.get(k, k) if rng.random() < 0.5 else k
+                 for k in rng.sample(disease_keywords[condition], 2)]
+        other = rng.choice([c for c in conditions if c != condition])
+        parts = [f"I have a {words[0]}", f"the skin looks {words[1]}", rng.choice(_FILLER),
+                 f"no {rng.choice(disease_keywords[other])}"]
+        rng.shuffle(parts)
+        samples.append((condition, ", ".join(parts)))
+    return samples
+
+
+def _substring_baseline(text: str) -> str:
+    """The previous matcher: one `in` test per keyword."""
+    text = text.lower()
+    scores = {d: sum(k in text for k in keywords) for d, keywords in disease_keywords.items()}
+    best = max(scores, key=scores.get)
+    return best if scores[best] else "unknown"
+
+
+def run_benchmark(count: int, batch_sizes: List[int], seed: int = 0) -> Dict:
+    samples = _synthetic(count, random.Random(seed))
+    texts = [text for _, text in samples]
+    truth = [condition for condition, _ in samples]
+
+    started = time.perf_counter()
+    baseline = [_substring_baseline(text) for text in texts]
+    baseline_s = time.perf_counter() - started
+
+    started = time.perf_counter()
+    classifier = SymptomClassifier()
+    build_ms = (time.perf_counter() - started) * 1000
+
+    report = {
+        "descriptions": count,
+        "vocabulary": len(classifier.vocabulary),
+        "build_ms": round(build_ms, 2),
+        "substring": {
+            "per_s": round(count / baseline_s),
+            "accuracy": round(sum(p == t for p, t in zip(baseline, truth)) / count, 3),
+        },
+        "tfidf": {},
+    }
+    for size in batch_sizes:
+        predictions = []
+        started = time.perf_counter()
+        for start in range(0, count, size):
+            predictions.extend(r["condition"] for r in classifier.classify(texts[start:start + size]))
+        elapsed = time.perf_counter() - started
+        report["tfidf"][size] = {
+            "per_s": round(count / elapsed),
+            "accuracy": round(sum(p == t for p, t in zip(predictions, truth)) / count, 3),
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=20000, help="number of synthetic descriptions")
+    parser.add_argument("--batches", default="1,100,10000", help="comma-separated batch sizes")
+    parser.add_argument("--json", action="store_true", help="print the raw JSON report")
+    args = parser.parse_args()
+
+    report = run_benchmark(args.count, [int(b) for b in args.batches.split(",")])
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print(f"{report['descriptions']:,} descriptions, {report['vocabulary']} features "
+          f"(classifier built in {report['build_ms']} ms)")
+    print(f"  substring scan       {report['substring']['per_s']:>10,} / s   "
+          f"accuracy {report['substring']['accuracy']}")
+    for size, r in report["tfidf"].items():
+        print(f"  tf-idf batch {size:<7} {r['per_s']:>10,} / s   accuracy {r['accuracy']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,346 @@
+"""CPU training for the HAM10000 classifier on the packed dataset.
+
+Replaces the notebook's Colab/CUDA loop. Images come from `PackedDataset`
+memory maps (no JPEG decode per epoch), augmentation runs on uint8 tensors in
+the loader workers so batches cross the process boundary at a quarter of the
+float size, and normalisation happens once per batch in the training process.
+Gradient accumulation gives the notebook's effective batch size with smaller
+micro-batches, and checkpoints carry enough state (including the position in
+the epoch's shuffled order) to resume mid-epoch.
+
+Every `--log-every` steps a JSON line reports images/s and how much of the
+step was spent waiting for data, so loader starvation shows up immediately.
+
+    python ham_dataset.py --images <jpeg dirs>
+    python train_model.py --epochs 30 --batch-size 32 --accumulate 4 --resume
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from typing import Dict, Iterator, List
+
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader, Sampler
+from torchvision import models
+from torchvision.transforms import v2
+
+import instrumentation
+import cpu_tuning
+from ham_dataset import DEFAULT_DIR, PackedDataset
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+MODEL_PATH = os.environ.get("SKIN_MODEL_PATH", os.path.join(ROOT, "models", "skin_classifier.pt"))
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+INPUT_SIDE = 224
+ARCHITECTURES = ("resnet50", "resnet18", "mobilenet_v3_small", "mobilenet_v3_large", "tiny_cnn")
+
+
+def available_cores() -> int:
+    return cpu_tuning.available_cpus()
+
+
+def default_workers(cores: int) -> int:
+    """Loader workers for memory-mapped input.
+
+    With no decode left, a worker only gathers and augments uint8 tensors, so
+    a few are enough; every extra one takes a core away from the matmuls.
+    """
+    if cores <= 2:
+        return 0
+    return min(4, max(1, cores // 4))
+
+
+class TinyCNN(nn.Module):
+    """Depthwise-separable CNN of about 70k parameters, trained from scratch as a distillation student."""
+
+    def __init__(self, num_classes: int, widths=(24, 48, 96, 192)):
+        super().__init__()
+        layers = [nn.Conv2d(3, widths[0], 3, stride=2, padding=1, bias=False),
+                  nn.BatchNorm2d(widths[0]), nn.Hardswish()]
+        for c_in, c_out in zip(widths, widths[1:] + widths[-1:]):
+            layers += [nn.Conv2d(c_in, c_in, 3, stride=2, padding=1, groups=c_in, bias=False),
+                       nn.BatchNorm2d(c_in), nn.Hardswish(),
+                       nn.Conv2d(c_in, c_out, 1, bias=False), nn.BatchNorm2d(c_out), nn.Hardswish()]
+        self.features = nn.Sequential(*layers)
+        self.classifier = nn.Sequential(nn.AdaptiveAvgPool2d(1), nn.Flatten(), nn.Dropout(0.2),
+                                        nn.Linear(widths[-1], num_classes))
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        return self.classifier(self.features(x))
+
+
+def build_model(arch: str, num_classes: int, pretrained: bool = True) -> nn.Module:
+    """ImageNet backbone with its classifier head replaced for `num_classes` (or a fresh TinyCNN)."""
+    if arch == "tiny_cnn":
+        return TinyCNN(num_classes)
+    weights = "DEFAULT" if pretrained else None
+    model = getattr(models, arch)(weights=weights)
+    if arch.startswith("resnet"):
+        model.fc = nn.Linear(model.fc.in_features, num_classes)
+    else:
+        last = model.classifier[-1]
+        model.classifier[-1] = nn.Linear(last.in_features, num_classes)
+    return model
+
+
+def to_uint8_tensor(image: np.ndarray) -> torch.Tensor:
+    """(H, W, 3) uint8 array -> (3, H, W) uint8 tensor.
+
+    Memory-mapped items are read-only, so this is the one copy per sample.
+    """
+    return torch.from_numpy(np.array(image, copy=True)).permute(2, 0, 1)
+
+
+def train_transform(side: int = INPUT_SIDE):
+    """The notebook's augmentations, applied to uint8 tensors instead of PIL images."""
+    return v2.Compose([
+        to_uint8_tensor,
+        v2.RandomResizedCrop(side, scale=(0.8, 1.0), antialias=True),
+        v2.RandomHorizontalFlip(),
+        v2.RandomVerticalFlip(),
+        v2.RandomRotation(30),
+        v2.ColorJitter(brightness=0.3, contrast=0.3, saturation=0.3),
+        v2.RandomErasing(p=0.25, scale=(0.02, 0.2)),
+    ])
+
+
+def eval_transform(side: int = INPUT_SIDE):
+    return v2.Compose([to_uint8_tensor, v2.Resize((side, side), antialias=True)])
+
+
+class Normalise(nn.Module):
+    """uint8 NCHW batch -> float, ImageNet-normalised, channels-last (oneDNN's preferred layout)."""
+
+    def __init__(self, mean=IMAGENET_MEAN, std=IMAGENET_STD):
+        super().__init__()
+        self.register_buffer("scale", 1.0 / (255.0 * torch.tensor(std).view(1, 3, 1, 1)))
+        self.register_buffer("shift", (torch.tensor(mean) / torch.tensor(std)).view(1, 3, 1, 1))
+
+    def forward(self, images: torch.Tensor) -> torch.Tensor:
+        out = images.to(torch.float32, memory_format=torch.channels_last)
+        return out.mul_(self.scale).sub_(self.shift)
+
+
+class EpochSampler(Sampler):
+    """Shuffled (optionally class-balanced) order that is a pure function of (seed, epoch).
+
+    Resuming only needs the epoch and how many samples were already consumed;
+    the same permutation is regenerated and the consumed prefix skipped.
+    """
+
+    def __init__(self, labels: np.ndarray, seed: int, balanced: bool = False):
+        self.labels = labels
+        self.seed = seed
+        self.balanced = balanced
+        self.epoch = 0
+        self.skip = 0
+
+    def set_epoch(self, epoch: int, skip: int = 0):
+        self.epoch = epoch
+        self.skip = skip
+
+    def order(self) -> np.ndarray:
+        rng = np.random.default_rng((self.seed, self.epoch))
+        n = len(self.labels)
+        if not self.balanced:
+            return rng.permutation(n)
+        # Inverse-frequency sampling with replacement, like WeightedRandomSampler.
+        counts = np.bincount(self.labels)
+        weights = 1.0 / counts[self.labels]
+        return rng.choice(n, size=n, replace=True, p=weights / weights.sum())
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.order()[self.skip:].tolist())
+
+    def __len__(self) -> int:
+        return len(self.labels) - self.skip
+
+
+def save_checkpoint(path: str, state: Dict):
+    """Write via a temporary file so an interrupted save never clobbers the last good one."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = f"{path}.tmp"
+    torch.save(state, tmp)
+    os.replace(tmp, path)
+
+
+@torch.inference_mode()
+def evaluate(model: nn.Module, normalise: Normalise, loader: DataLoader, num_classes: int) -> Dict:
+    model.eval()
+    confusion = torch.zeros(num_classes, num_classes, dtype=torch.int64)
+    for images, labels in loader:
+        predicted = model(normalise(images)).argmax(dim=1)
+        confusion += torch.bincount(labels * num_classes + predicted,
+                                    minlength=num_classes ** 2).view(num_classes, num_classes)
+    recall = confusion.diag().double() / confusion.sum(dim=1).clamp(min=1).double()
+    return {
+        "accuracy": round(float(confusion.diag().sum() / confusion.sum().clamp(min=1)), 4),
+        "recall": [round(float(r), 4) for r in recall],
+    }
+
+
+class StepMeter:
+    """Images/s and data-wait share over a logging window."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.images = 0
+        self.wait_s = 0.0
+        self.compute_s = 0.0
+        self.started = time.perf_counter()
+
+    def record(self, images: int, wait_s: float, compute_s: float):
+        self.images += images
+        self.wait_s += wait_s
+        self.compute_s += compute_s
+        instrumentation.observe("train_data_wait", wait_s)
+        instrumentation.observe("train_compute", compute_s)
+
+    def summary(self) -> Dict:
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        return {
+            "images_per_s": round(self.images / elapsed, 2),
+            "data_wait_ms": round(self.wait_s * 1000, 1),
+            "data_wait_share": round(self.wait_s / elapsed, 3),
+            "compute_ms": round(self.compute_s * 1000, 1),
+        }
+
+
+def train(args) -> Dict:
+    cores = available_cores()
+    workers = default_workers(cores) if args.workers is None else args.workers
+    threads = args.threads or max(1, cores - workers)
+    torch.set_num_threads(threads)
+    torch.set_flush_denormal(True)
+    torch.manual_seed(args.seed)
+
+    train_set = PackedDataset(args.data, "train", transform=train_transform())
+    test_set = PackedDataset(args.data, "test", transform=eval_transform())
+    classes = train_set.classes
+    sampler = EpochSampler(train_set.labels, args.seed, balanced=args.balanced)
+    loader_options = dict(num_workers=workers, persistent_workers=workers > 0, pin_memory=False)
+    if workers:
+        loader_options["prefetch_factor"] = args.prefetch
+    # Micro-batches are what go through the model; `accumulate` of them make one optimiser step.
+    micro = args.batch_size // args.accumulate
+    train_loader = DataLoader(train_set, batch_size=micro, sampler=sampler, drop_last=True, **loader_options)
+    test_loader = DataLoader(test_set, batch_size=args.batch_size * 2, shuffle=False, **loader_options)
+
+    model = build_model(args.arch, len(classes), pretrained=not args.no_pretrained)
+    model = model.to(memory_format=torch.channels_last)
+    normalise = Normalise()
+    optimizer = torch.optim.Adam(model.parameters(), lr=args.lr)
+    criterion = nn.CrossEntropyLoss()
+
+    start_epoch, skip, global_step = 0, 0, 0
+    checkpoint_path = args.checkpoint or f"{args.out}.ckpt"
+    if args.resume and os.path.exists(checkpoint_path):
+        state = torch.load(checkpoint_path, map_location="cpu")
+        model.load_state_dict(state["model"])
+        optimizer.load_state_dict(state["optimizer"])
+        torch.set_rng_state(state["torch_rng"])
+        start_epoch, skip, global_step = state["epoch"], state["samples_done"], state["global_step"]
+        print(f"Resumed from {checkpoint_path}: epoch {start_epoch + 1}, {skip} samples in", file=sys.stderr)
+
+    def checkpoint(epoch: int, samples_done: int):
+        save_checkpoint(checkpoint_path, {
+            "model": model.state_dict(),
+            "optimizer": optimizer.state_dict(),
+            "torch_rng": torch.get_rng_state(),
+            "epoch": epoch,
+            "samples_done": samples_done,
+            "global_step": global_step,
+            "arch": args.arch,
+            "classes": classes,
+        })
+
+    log = open(args.log, "a", buffering=1) if args.log else None
+    history: List[Dict] = []
+    meter = StepMeter()
+    for epoch in range(start_epoch, args.epochs):
+        sampler.set_epoch(epoch, skip)
+        samples_done = skip
+        skip = 0
+        model.train()
+        optimizer.zero_grad(set_to_none=True)
+        running_loss, batches = 0.0, 0
+        waited = time.perf_counter()
+        for micro_step, (images, labels) in enumerate(train_loader, start=1):
+            fetched = time.perf_counter()
+            loss = criterion(model(normalise(images)), labels) / args.accumulate
+            loss.backward()
+            if micro_step % args.accumulate == 0:
+                optimizer.step()
+                optimizer.zero_grad(set_to_none=True)
+                global_step += 1
+            done = time.perf_counter()
+            meter.record(len(labels), fetched - waited, done - fetched)
+            running_loss += loss.item() * args.accumulate
+            batches += 1
+            samples_done += len(labels)
+
+            if micro_step % args.accumulate == 0 and global_step % args.log_every == 0:
+                line = dict(meter.summary(), epoch=epoch + 1, step=global_step,
+                            loss=round(running_loss / batches, 4))
+                print(json.dumps(line), file=log or sys.stdout)
+                meter.reset()
+            # Only checkpoint on optimiser-step boundaries, so no partial gradient is lost.
+            if micro_step % args.accumulate == 0 and args.checkpoint_every and global_step % args.checkpoint_every == 0:
+                checkpoint(epoch, samples_done)
+            waited = time.perf_counter()
+
+        metrics = evaluate(model, normalise, test_loader, len(classes))
+        summary = dict(epoch=epoch + 1, loss=round(running_loss / max(1, batches), 4), **metrics)
+        history.append(summary)
+        print(json.dumps(summary), file=log or sys.stdout)
+        checkpoint(epoch + 1, 0)
+
+    save_checkpoint(args.out, {
+        "model": model.state_dict(),
+        "arch": args.arch,
+        "classes": classes,
+        "input_side": INPUT_SIDE,
+        "mean": IMAGENET_MEAN,
+        "std": IMAGENET_STD,
+    })
+    if log:
+        log.close()
+    return {"history": history, "workers": workers, "threads": threads, "model": args.out}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--data", default=DEFAULT_DIR, help="packed dataset directory (ham_dataset.py)")
+    parser.add_argument("--arch", choices=ARCHITECTURES, default="resnet50")
+    parser.add_argument("--no-pretrained", action="store_true")
+    parser.add_argument("--epochs", type=int, default=30)
+    parser.add_argument("--batch-size", type=int, default=32, help="effective batch per optimiser step")
+    parser.add_argument("--accumulate", type=int, default=1, help="micro-batches per optimiser step")
+    parser.add_argument("--lr", type=float, default=1e-4)
+    parser.add_argument("--balanced", action="store_true", help="inverse-frequency class sampling")
+    parser.add_argument("--workers", type=int, default=None, help="loader processes (default: from core count)")
+    parser.add_argument("--threads", type=int, default=None, help="intra-op threads (default: cores - workers)")
+    parser.add_argument("--prefetch", type=int, default=4, help="batches prefetched per worker")
+    parser.add_argument("--log-every", type=int, default=10, help="optimiser steps between throughput lines")
+    parser.add_argument("--checkpoint-every", type=int, default=200, help="optimiser steps between checkpoints")
+    parser.add_argument("--checkpoint", default=None, help="checkpoint path (default: <out>.ckpt)")
+    parser.add_argument("--resume", action="store_true", help="continue from the checkpoint if present")
+    parser.add_argument("--log", default=None, help="append JSON log lines here instead of stdout")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", default=MODEL_PATH)
+    args = parser.parse_args()
+    if args.batch_size % args.accumulate:
+        parser.error("--batch-size must be a multiple of --accumulate")
+    result = train(args)
+    print(json.dumps({k: v for k, v in result.items() if k != "history"}))
+
+
+if __name__ == "__main__":
+    main()